@@ -19,10 +19,10 @@ setup(
                         'matplotlib>=3.1.3',
                         'sklearn',
                         'PTable>=0.9.2',
-                        'torch>=1.5.1',
-                        'torchaudio>=0.5.1',
+                        'torch>=2.0.0',
+                        'torchaudio>=2.0.1',
                         'pandas>=1.0.5',
-                        'torchvision>=0.7.0'
+                        'torchvision>=0.15.1'
                         ],
 
     #dependency_links = ['https://github.com/DmitryUlyanov/Multicore-TSNE/tarball/master#egg=package-1.0']
@@ -0,0 +1,123 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from elephant_utils.logging_service import Instrumentation, timed
+
+TEST_ALL = True
+#TEST_ALL = False
+
+class FakeSummaryWriter(object):
+    '''
+    Stands in for a tensorboard SummaryWriter,
+    remembering the scalars added.
+    '''
+    def __init__(self):
+        self.scalars = {}
+
+    def add_scalar(self, tag, value, step):
+        self.scalars[tag] = (value, step)
+
+class TestInstrumentation(unittest.TestCase):
+
+    #------------------------------------
+    # setUp
+    #-------------------
+
+    def setUp(self):
+        self.instrumentation = Instrumentation()
+        self.instrumentation.reset()
+        self.instrumentation.enable_tracing(False)
+
+    #------------------------------------
+    # tearDown
+    #-------------------
+
+    def tearDown(self):
+        self.instrumentation.reset()
+        self.instrumentation.enable_tracing(False)
+
+    #------------------------------------
+    # testNestedSpans
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testNestedSpans(self):
+
+        @timed('inner')
+        def inner():
+            return 42
+
+        self.assertIs(Instrumentation(), self.instrumentation)
+        with self.instrumentation.span('outer'):
+            for _i in range(3):
+                self.assertEqual(inner(), 42)
+        inner()
+
+        spans = self.instrumentation.summary()['spans']
+        self.assertEqual(spans['outer']['count'], 1)
+        self.assertEqual(spans['outer/inner']['count'], 3)
+        self.assertEqual(spans['inner']['count'], 1)
+        self.assertTrue(spans['outer']['total_secs'] >= spans['outer/inner']['total_secs'])
+        self.assertEqual(self.instrumentation.open_spans(), [])
+
+        # Spans close on exceptions:
+        with self.assertRaises(ValueError):
+            with self.instrumentation.span('failing'):
+                raise ValueError("Expected")
+        self.assertEqual(self.instrumentation.open_spans(), [])
+        self.assertEqual(self.instrumentation.summary()['spans']['failing']['count'], 1)
+
+    #------------------------------------
+    # testSaveTrace
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testSaveTrace(self):
+        self.instrumentation.enable_tracing(max_events=3)
+        with self.instrumentation.span('load', file='a.wav'):
+            self.instrumentation.count('frames', 10)
+        self.instrumentation.count('frames', 5)
+        with self.instrumentation.span('dropped'):
+            pass
+
+        with tempfile.TemporaryDirectory(prefix='trace_test') as tmp_dir:
+            trace_file = os.path.join(tmp_dir, 'trace.json')
+            self.instrumentation.save_trace(trace_file)
+            with open(trace_file, 'r') as fd:
+                trace = json.load(fd)
+
+        events = trace['traceEvents']
+        self.assertEqual([event['ph'] for event in events], ['C', 'X', 'C'])
+        self.assertEqual(events[1]['args'], {'file' : 'a.wav', 'path' : 'load'})
+        self.assertEqual(trace['otherData']['dropped_events'], 1)
+        self.assertEqual(trace['otherData']['summary']['counters'], {'frames' : 15})
+
+    #------------------------------------
+    # testWriteToTensorboard
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testWriteToTensorboard(self):
+        writer = FakeSummaryWriter()
+        with self.instrumentation.span('Train_epoch', memory=True):
+            with self.instrumentation.span('forward'):
+                pass
+        self.instrumentation.count('Train_samples', 32)
+        self.instrumentation.write_to_tensorboard(writer, 4, reset=True)
+
+        self.assertEqual(writer.scalars['instrumentation/calls/Train_epoch/forward'], (1, 4))
+        self.assertEqual(writer.scalars['instrumentation/counters/Train_samples'], (32, 4))
+        self.assertTrue(writer.scalars['instrumentation/memory/peak_rss_mb'][0] > 0)
+        # Reset for the next epoch:
+        self.assertEqual(self.instrumentation.summary()['spans'], {})
+
+# -------------------- Main --------------
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -6,6 +6,7 @@ Created on Jul 29, 2020
 import glob
 import os, sys
 import shutil
+import tempfile
 import unittest
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
@@ -298,6 +299,55 @@ class Test(unittest.TestCase):
                          'spectroB'
                          )
 
+    #------------------------------------
+    # testRechopChangedSpectrogram 
+    #-------------------
+
+    @unittest.skipIf(TEST_ALL != True, 'skipping temporarily')
+    def testRechopChangedSpectrogram(self):
+        tmp_dir_obj = tempfile.TemporaryDirectory(prefix='rechop_test')
+        in_dir = os.path.join(tmp_dir_obj.name, 'spectros')
+        os.mkdir(in_dir)
+        snippet_outdir = os.path.join(tmp_dir_obj.name, 'snippets')
+        catalog = os.path.join(tmp_dir_obj.name, 'catalog.sqlite')
+        
+        spectrogram = pd.DataFrame([[  1,  2,  3,  4,  5,  6,  7],
+                                    [ 10, 20, 30, 40, 50, 60, 70],
+                                    [100,200,300,400,500,600,700],
+                                    ], dtype=int,
+                                    columns=[0,2,4,6,8,10,12],
+                                    index=[10,30,50]
+                                    )
+        spectro_file = os.path.join(in_dir, 'spectroA_spectrogram.pickle')
+        spectrogram.to_pickle(spectro_file)
+        shutil.copyfile(self.label_file, os.path.join(in_dir, 'spectroA.txt'))
+
+        chopper = SpectrogramChopper(in_dir, snippet_outdir, catalog=catalog)
+        old_snippets = [row['snippet_filename'] for row in 
+                        chopper.dataset.db.execute('SELECT * FROM Samples')]
+        chopper.dataset.close()
+        self.assertTrue(len(old_snippets) > 0)
+        
+        # Unchanged spectrograms are not chopped again:
+        chopper = SpectrogramChopper(in_dir, snippet_outdir, catalog=catalog)
+        self.assertIsNone(chopper.dataset)
+
+        # A changed spectrogram replaces its earlier snippets:
+        changed_spectrogram = spectrogram * 10
+        changed_spectrogram[14] = [8, 80, 800]
+        changed_spectrogram.to_pickle(spectro_file)
+        chopper = SpectrogramChopper(in_dir, snippet_outdir, catalog=catalog)
+        rows = chopper.dataset.db.execute('SELECT * FROM Samples').fetchall()
+        chopper.dataset.close()
+        self.assertEqual(len(rows), len(old_snippets))
+        self.assertTrue(all(row['recording_site'] == 'spectroA' for row in rows))
+        self.assertTrue(all(os.path.exists(row['snippet_filename']) for row in rows))
+        # Sqlite may hand out the freed snippet ids again:
+        stale_snippets = set(old_snippets) - set(row['snippet_filename'] for row in rows)
+        self.assertFalse(any(os.path.exists(snippet) for snippet in stale_snippets))
+        
+        tmp_dir_obj.cleanup()
+
 # ----------------- Main --------------
 
 if __name__ == "__main__":
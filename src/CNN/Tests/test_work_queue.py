@@ -0,0 +1,227 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from elephant_utils.work_queue import WorkQueue
+
+TEST_ALL = True
+#TEST_ALL = False
+
+class TestWorkQueue(unittest.TestCase):
+
+    #------------------------------------
+    # setUp
+    #-------------------
+
+    def setUp(self):
+        self.tmp_dir_obj = tempfile.TemporaryDirectory(prefix='work_queue_test')
+        self.db_path = os.path.join(self.tmp_dir_obj.name, WorkQueue.QUEUE_FILE)
+        # Files of 1, 3, and 2 bytes:
+        self.files = []
+        for (name, size) in [('a.wav', 1), ('b.wav', 3), ('c.wav', 2)]:
+            path = os.path.join(self.tmp_dir_obj.name, name)
+            with open(path, 'wb') as fd:
+                fd.write(b'x' * size)
+            self.files.append(path)
+        (self.small, self.large, self.medium) = self.files
+
+    #------------------------------------
+    # tearDown
+    #-------------------
+
+    def tearDown(self):
+        self.tmp_dir_obj.cleanup()
+
+    #------------------------------------
+    # testLargestFirst
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testLargestFirst(self):
+        worker0 = WorkQueue(self.db_path, worker='w0')
+        worker1 = WorkQueue(self.db_path, worker='w1')
+        # All workers add all files:
+        worker0.add(self.files)
+        worker1.add(self.files)
+        self.assertEqual(worker0.remaining(), 3)
+
+        self.assertEqual(worker0.claim(), self.large)
+        self.assertEqual(worker1.claim(), self.medium)
+        worker1.done(self.medium)
+        self.assertEqual(worker1.claim(), self.small)
+        worker1.done(self.small)
+        self.assertIsNone(worker1.claim())
+        worker0.done(self.large)
+        self.assertEqual(worker0.remaining(), 0)
+
+        report = {stats['worker'] : stats for stats in worker0.throughput()}
+        self.assertEqual((report['w0']['files'], report['w0']['bytes']), (1, 3))
+        self.assertEqual((report['w1']['files'], report['w1']['bytes']), (2, 3))
+
+        # Re-adding changes nothing, unless a file changed:
+        worker0.add(self.files)
+        self.assertEqual(worker0.remaining(), 0)
+        with open(self.small, 'ab') as fd:
+            fd.write(b'y')
+        worker0.add(self.files)
+        self.assertEqual(list(worker0.claimed()), [self.small])
+        worker0.close()
+        worker1.close()
+
+    #------------------------------------
+    # testReclaimAndRetry
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testReclaimAndRetry(self):
+        crashed = WorkQueue(self.db_path, worker='crashed', lease_secs=0.2)
+        crashed.add(self.files)
+        self.assertEqual(crashed.claim(), self.large)
+        # The worker dies without renewing its lease:
+        crashed._stop_heartbeat()
+
+        survivor = WorkQueue(self.db_path, worker='survivor', lease_secs=0.2, max_attempts=2)
+        self.assertEqual(survivor.claim(), self.medium)
+        time.sleep(0.5)
+        # The survivor's renewed lease holds, while the
+        # crashed worker's claim is taken over:
+        newcomer = WorkQueue(self.db_path, worker='newcomer', lease_secs=0.2, max_attempts=2)
+        self.assertEqual(newcomer.claim(), self.large)
+        self.assertEqual(newcomer.num_reclaimed, 1)
+        survivor.done(self.medium)
+
+        # After max_attempts tries, failures are not retried:
+        newcomer.failed(self.large, 'boom')
+        self.assertEqual(newcomer.claim(), self.small)
+        newcomer.done(self.small)
+        self.assertIsNone(newcomer.claim())
+        for queue in [crashed, survivor, newcomer]:
+            queue.close()
+
+        # Breaking out of a loop releases the claim:
+        queue = WorkQueue(self.db_path, worker='w')
+        queue.add([self.medium])
+        queue.db.execute("UPDATE Tasks SET state = 'todo' WHERE path = ?", (self.medium,))
+        for path in queue.claimed():
+            break
+        self.assertEqual(path, self.medium)
+        self.assertEqual(queue.claim(), self.medium)
+        queue.close()
+
+    #------------------------------------
+    # testRepeatedCrashes
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testRepeatedCrashes(self):
+        # A file that kills each worker that claims it
+        # is given up after max_attempts claims:
+        for attempt in range(2):
+            crashed = WorkQueue(self.db_path, worker=f'crashed{attempt}',
+                                lease_secs=0.1, max_attempts=2)
+            crashed.add([self.large])
+            self.assertEqual(crashed.claim(), self.large)
+            crashed._stop_heartbeat()
+            crashed.close()
+            time.sleep(0.3)
+
+        queue = WorkQueue(self.db_path, worker='last', lease_secs=0.1, max_attempts=2)
+        self.assertIsNone(queue.claim())
+        (state, error) = queue.db.execute('SELECT state, error FROM Tasks WHERE path = ?',
+                                          (self.large,)).fetchone()
+        self.assertEqual(state, WorkQueue.FAILED)
+        self.assertIn('lease expired', error)
+        self.assertEqual(queue.remaining(), 0)
+        queue.close()
+
+    #------------------------------------
+    # testWaitForCrashedClaims
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testWaitForCrashedClaims(self):
+        crashed = WorkQueue(self.db_path, worker='crashed', lease_secs=0.2)
+        crashed.add(self.files)
+        self.assertEqual(crashed.claim(), self.large)
+        crashed._stop_heartbeat()
+
+        # The other worker's loop does not end while the
+        # crashed worker's claim is live, and takes the
+        # file over once the lease expired:
+        survivor = WorkQueue(self.db_path, worker='survivor', lease_secs=0.2, poll_secs=0.05)
+        processed = []
+        for path in survivor.claimed():
+            processed.append(path)
+            survivor.done(path)
+        self.assertEqual(processed, [self.medium, self.small, self.large])
+        self.assertEqual(survivor.remaining(), 0)
+        self.assertIsNone(survivor.others_lease_left())
+        for queue in [crashed, survivor]:
+            queue.close()
+
+    #------------------------------------
+    # testStaleClaimant
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testStaleClaimant(self):
+        slow = WorkQueue(self.db_path, worker='slow', lease_secs=0.1, max_attempts=3)
+        slow.add([self.large])
+        self.assertEqual(slow.claim(), self.large)
+        # Stalls long enough to lose its lease:
+        slow._stop_heartbeat()
+        time.sleep(0.3)
+
+        fast = WorkQueue(self.db_path, worker='fast', lease_secs=0.1, max_attempts=3)
+        self.assertEqual(fast.claim(), self.large)
+        self.assertTrue(fast.done(self.large))
+
+        # The stalled worker's late outcome is ignored:
+        self.assertFalse(slow.failed(self.large, 'late'))
+        self.assertFalse(slow.done(self.large))
+        (state, worker, error) = fast.db.execute('SELECT state, worker, error FROM Tasks WHERE path = ?',
+                                                 (self.large,)).fetchone()
+        self.assertEqual((state, worker, error), (WorkQueue.DONE, 'fast', None))
+        for queue in [slow, fast]:
+            queue.close()
+
+    #------------------------------------
+    # testParamsAndRetryFailed
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testParamsAndRetryFailed(self):
+        queue = WorkQueue(self.db_path, worker='w', max_attempts=1)
+        queue.add(self.files, params={'threshold_db' : -40})
+        for path in queue.claimed():
+            if path == self.large:
+                queue.failed(path, 'boom')
+            else:
+                queue.done(path)
+        self.assertEqual(queue.remaining(), 0)
+
+        # Same parameters: nothing to do, and the
+        # failure stays failed:
+        queue.add(self.files, params={'threshold_db' : -40})
+        self.assertEqual(queue.remaining(), 0)
+
+        # Failures are retried on request:
+        self.assertEqual(queue.retry_failed(), 1)
+        self.assertEqual(queue.claim(), self.large)
+        self.assertTrue(queue.done(self.large))
+        self.assertIsNone(queue.claim())
+
+        # Other parameters: all files are done again:
+        queue.add(self.files, params={'threshold_db' : -30})
+        self.assertEqual(queue.remaining(), 3)
+        queue.close()
+
+# -------------------- Main --------------
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -5,6 +5,7 @@ Created on Jul 28, 2020
 @author: paepcke
 '''
 import argparse
+import glob
 import math
 import os
 import sys
@@ -14,7 +15,9 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from spectrogram_dataset import SpectrogramDataset
 from DSP.dsp_utils import AudioType, FileFamily
-from elephant_utils.logging_service import LoggingService
+from DSP.recording_catalog import RecordingCatalog
+from elephant_utils.logging_service import Instrumentation, LoggingService
+from elephant_utils.work_queue import WorkQueue
 
 class SpectrogramChopper(object):
     '''
@@ -40,6 +43,10 @@ class SpectrogramChopper(object):
     The best method for invoking this file multiple
     times is to use launch_chopping.sh script.
     '''
+    
+    # Name under which chopped spectrograms are
+    # recorded in a RecordingCatalog:
+    CATALOG_STAGE = 'chop'
 
     #------------------------------------
     # Constructor
@@ -53,6 +60,8 @@ class SpectrogramChopper(object):
                  this_worker=0,
                  logfile=None,
                  test_snippet_width=-1,
+                 catalog=None,
+                 work_queue=False
                  ):
         '''
         
@@ -74,6 +83,21 @@ class SpectrogramChopper(object):
             set the snippet width to that value. Used by unittests
             to work with smaller dataframes
         @type test_snippet_width: int
+        @param catalog: if provided, path to a RecordingCatalog
+            Sqlite file. Only spectrograms that are new, or 
+            changed since they were chopped with the catalog
+            are then chopped, and their snippets are added to
+            this worker's existing sqlite db. Snippets of earlier
+            versions of changed spectrograms are removed first.
+            With more than one worker, each worker takes a share
+            of all catalogued spectrograms, and chops the new or
+            changed ones among them.
+        @type catalog: {None|str}
+        @param work_queue: if True, workers do not each take a 
+            fixed share of the spectrograms. Instead, all workers
+            repeatedly claim the largest remaining spectrogram
+            from a WorkQueue in snippet_outdir.
+        @type work_queue: bool
         '''
         '''
         Constructor
@@ -84,6 +108,7 @@ class SpectrogramChopper(object):
             
         self.log = LoggingService(logfile=logfile,
                                   msg_identifier=f"chop_spectrograms#{this_worker}")
+        self.catalog = None if catalog is None else RecordingCatalog(catalog)
         
         # Make sure the full path to the 
         # outdir exists:
@@ -103,20 +128,41 @@ class SpectrogramChopper(object):
         sqlite_db_path = os.path.join(snippet_outdir, sqlite_name)
 
         # If a db of this name is left over
-        # from earlier times, remove it:
-        if os.path.exists(sqlite_db_path):
+        # from earlier times, remove it. With a 
+        # catalog, the earlier snippets are kept:
+        if os.path.exists(sqlite_db_path) and self.catalog is None:
             os.remove(sqlite_db_path)
 
+        # Several workers sharing a catalog split all its
+        # spectrograms among them, rather than only those
+        # to do: that list shrinks as workers that started
+        # earlier mark their files done, and shares of 
+        # differing lists would overlap or leave gaps:
+        shared_catalog = self.catalog is not None and num_workers > 1 and not work_queue
+
         # Get a list of FileFamily instances. The
         # list includes all recursively found files:
-        file_families = self.get_files_todo_info(infiles)
+        file_families = self.get_files_todo_info(infiles, only_todo=not shared_catalog)
 
         # If this instance is one of several gnu parallel
         # workers, find which of the files this worker
         # is supposed to do:
         
-        if num_workers > 0:
+        self.queue = None
+        if work_queue:
+            # All workers add all spectrograms; each 
+            # then claims the largest one left:
+            my_file_families = file_families
+            self.queue = WorkQueue(os.path.join(snippet_outdir, WorkQueue.QUEUE_FILE),
+                                   worker=f"chop_spectrograms#{this_worker}")
+        elif num_workers > 0:
             my_file_families = self.select_my_infiles(file_families, num_workers, this_worker)
+            if shared_catalog:
+                # Only the new or changed files of this share:
+                my_file_families = self.catalog.todo(
+                    self.CATALOG_STAGE,
+                    [AudioType.SPECTRO, AudioType.LABEL],
+                    paths=[family.fullpath(family.file_type) for family in my_file_families])
         else:
             my_file_families = file_families
 
@@ -145,18 +191,118 @@ class SpectrogramChopper(object):
         if not os.path.exists(this_worker_snippet_outdir):
             os.makedirs(this_worker_snippet_outdir)
             
-        self.log.info(f"Todo (worker{this_worker}): {num_spectro_files} 24-hr spectrogram files")
-
         if test_snippet_width > -1:
             # Set the snippet width smaller for the unittests:
             SpectrogramDataset.SNIPPET_WIDTH = test_snippet_width
-            
-        self.dataset = SpectrogramDataset(
-                         dirs_or_spect_files=my_spectro_files,
+
+        if self.queue is not None:
+            # Spectrograms chopped into snippets of
+            # another width are chopped again:
+            self.queue.add(my_spectro_files,
+                           params={'snippet_width' : SpectrogramDataset.SNIPPET_WIDTH})
+            self.log.info(f"Todo (all workers): {self.queue.remaining()} 24-hr spectrogram files")
+            self.dataset = None
+            for spectro_file in self.queue.claimed():
+                try:
+                    # Each dataset adds the file's snippets
+                    # to this worker's sqlite db:
+                    self.dataset = self.chop([spectro_file],
+                                             sqlite_db_path,
+                                             recurse,
+                                             this_worker_snippet_outdir)
+                except Exception as e:
+                    self.log.err(f"Chopping failed for '{spectro_file}': {repr(e)}")
+                    self.queue.failed(spectro_file, repr(e))
+                    continue
+                self.queue.done(spectro_file)
+            if self.queue.num_reclaimed > 0:
+                self.log.info(f"Took over {self.queue.num_reclaimed} file(s) from crashed workers")
+            self.queue.log_throughput(self.log)
+            self.queue.close()
+            return
+
+        self.log.info(f"Todo (worker{this_worker}): {num_spectro_files} 24-hr spectrogram files")
+
+        self.dataset = self.chop(my_spectro_files,
+                                 sqlite_db_path,
+                                 recurse,
+                                 this_worker_snippet_outdir)
+
+    #------------------------------------
+    # chop 
+    #-------------------
+
+    def chop(self, spectro_files, sqlite_db_path, recurse, snippet_outdir):
+        '''
+        Chop the given 24-hr spectrograms into snippets
+        in snippet_outdir, and add the snippets to the
+        sqlite db.
+        
+        @param spectro_files: 24-hr spectrograms
+        @type spectro_files: [str]
+        @param sqlite_db_path: this worker's sqlite db
+        @type sqlite_db_path: str
+        @param recurse: whether or not so search for .pickle 
+            files recursively.
+        @type recurse: bool
+        @param snippet_outdir: this worker's snippet directory
+        @type snippet_outdir: str
+        @return: dataset of the snippets
+        @rtype: SpectrogramDataset
+        '''
+        if self.catalog is not None:
+            # Changed spectrograms were chopped before:
+            self.remove_old_snippets(spectro_files, os.path.dirname(sqlite_db_path))
+        dataset = SpectrogramDataset(
+                         dirs_or_spect_files=spectro_files,
                          sqlite_db_path=sqlite_db_path,
                          recurse=recurse,
-                         snippet_outdir=this_worker_snippet_outdir
+                         snippet_outdir=snippet_outdir
                          )
+        if self.catalog is not None:
+            self.catalog.mark_done(self.CATALOG_STAGE, spectro_files)
+        return dataset
+
+    #------------------------------------
+    # remove_old_snippets 
+    #-------------------
+
+    def remove_old_snippets(self, spectro_files, snippet_outdir):
+        '''
+        Remove the snippets that earlier runs chopped
+        from the given 24-hr spectrograms: both the
+        snippet files, and their rows in the sqlite dbs
+        of all workers in snippet_outdir. Used before
+        spectrograms that changed are chopped again,
+        so that their stale snippets do not remain 
+        next to the new ones.
+        
+        @param spectro_files: 24-hr spectrograms
+        @type spectro_files: [str]
+        @param snippet_outdir: directory with the workers'
+            sqlite dbs
+        @type snippet_outdir: str
+        '''
+        recordings = [FileFamily(spectro_file).file_root for spectro_file in spectro_files]
+        placeholders = ','.join('?' * len(recordings))
+        db_pattern = os.path.join(snippet_outdir, self.sqlite_name_by_worker('*'))
+        for sqlite_db_path in glob.glob(db_pattern):
+            db = SpectrogramDataset.get_db(sqlite_db_path)
+            try:
+                rows = db.execute(f'''SELECT snippet_filename FROM Samples
+                                       WHERE recording_site IN ({placeholders})''',
+                                  recordings).fetchall()
+                for row in rows:
+                    if row['snippet_filename'] is not None and \
+                            os.path.exists(row['snippet_filename']):
+                        os.remove(row['snippet_filename'])
+                db.execute(f'DELETE FROM Samples WHERE recording_site IN ({placeholders})',
+                           recordings)
+                db.commit()
+            finally:
+                db.close()
+            if len(rows) > 0:
+                self.log.info(f"Removed {len(rows)} old snippets listed in {sqlite_db_path}")
 
     #------------------------------------
     # sqlite_name_by_worker 
@@ -233,7 +379,7 @@ class SpectrogramChopper(object):
     # get_files_todo_info 
     #-------------------
 
-    def get_files_todo_info(self, infiles):
+    def get_files_todo_info(self, infiles, only_todo=True):
         '''
         Input: a possibly mixed list of .pickle, .txt, files,
         and directories. Returns a list of FileFamily instances
@@ -244,6 +390,9 @@ class SpectrogramChopper(object):
         
         @param infiles: list of files/directories
         @type infiles: [str]
+        @param only_todo: with a catalog, whether to only return
+            new or changed files, or all catalogued ones
+        @type only_todo: bool
         @return: list of file information FileFamily instances
         @rtype: [FileFamily]
         '''
@@ -252,7 +401,18 @@ class SpectrogramChopper(object):
         # family is is guaranteed the .wav version (foo.wav)
         # exists. None of the others, such as the label file
         # variant (foo.txt) need exist:
-        file_todos = self.collect_file_families(infiles)
+        if self.catalog is not None:
+            found = self.catalog.scan(infiles)
+            if only_todo:
+                # Only new or changed spectrograms:
+                file_todos = self.catalog.todo(self.CATALOG_STAGE,
+                                               [AudioType.SPECTRO, AudioType.LABEL],
+                                               paths=found)
+            else:
+                file_todos = self.catalog.families([AudioType.SPECTRO, AudioType.LABEL],
+                                                   paths=found)
+        else:
+            file_todos = self.collect_file_families(infiles)
         
         # Remove entries that only have a label file:
         # Strategy: search the list of file families from end to front,
@@ -343,15 +503,39 @@ if __name__ == '__main__':
                         default=0,
                         help="this worker's rank within num_workers started via gnu parallel"
                         );
+    parser.add_argument('--trace_file',
+                        default=None,
+                        help='save a JSON timing trace of this worker to this file'
+                        );
+    parser.add_argument('--catalog',
+                        default=None,
+                        help='recording catalog sqlite file; if given, only new or changed spectrograms are chopped'
+                        );
+    parser.add_argument('--work_queue',
+                        action='store_true',
+                        default=False,
+                        help='workers claim the largest remaining spectrogram from a queue in outdir,\n' +\
+                             'rather than each taking a fixed share'
+                        );
     parser.add_argument('infiles',
                         nargs='+',
                         help='Repeatable: spectrogram input files and directories')
 
     args = parser.parse_args();
     
+    if args.trace_file is not None:
+        Instrumentation().enable_tracing()
+    
     SpectrogramChopper(args.infiles,
         snippet_outdir=args.outdir,
         num_workers=args.num_workers,
         this_worker=args.this_worker,
-        logfile=args.logfile)
+        logfile=args.logfile,
+        catalog=args.catalog,
+        work_queue=args.work_queue)
+    
+    if args.trace_file is not None:
+        log = LoggingService()
+        log.log_timing_summary()
+        log.save_trace(args.trace_file)
     
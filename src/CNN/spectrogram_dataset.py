@@ -20,7 +20,8 @@ from torch.utils.data import Dataset
 from DSP.dsp_utils import AudioType
 from DSP.dsp_utils import DSPUtils
 from DSP.dsp_utils import FileFamily
-from elephant_utils.logging_service import LoggingService
+from DSP.dsp_utils import Spectrogram
+from elephant_utils.logging_service import Instrumentation, LoggingService, timed
 import numpy as np
 import pandas as pd
 
@@ -359,6 +360,7 @@ class SpectrogramDataset(Dataset):
     # chop_spectograms 
     #-------------------
     
+    @timed()
     def chop_spectograms(self, spectro_dict):
         '''
         Given a dict: {spectrogram_path : label_path},
@@ -384,7 +386,7 @@ class SpectrogramDataset(Dataset):
                 # Get dict with file names that are by convention
                 # derived from the original .wav file:
                 curr_file_family = FileFamily(spectro_file)
-                spect_df = pd.read_pickle(spectro_file)
+                spect_df = DSPUtils.load_spectrogram(spectro_file)
                 
                 # Compute mean energy in three frequency
                 # bands across the whole 24 hr spectrogram:
@@ -416,6 +418,7 @@ class SpectrogramDataset(Dataset):
     # mean_magnitudes 
     #-------------------
     
+    @timed()
     def mean_magnitudes(self, spectro):
         '''
         Given a spectrogram, compute the mean energy
@@ -428,34 +431,24 @@ class SpectrogramDataset(Dataset):
              }
              
         @param spectro: spectrogram of any width
-        @type spectro: pd.DataFrame
+        @type spectro: {pd.DataFrame | Spectrogram}
         '''
         
         # It is possible for some frequency ranges
         # to not be represented in the spectrogram.
-        # For those cases we set the corresponding
-        # mean to zero:
+        # For those cases band_mean() returns zero.
+        # The band means are computed over views of
+        # the matrix, without intermediate DataFrames:
         
-        low_freq_slice = spectro[(spectro.index.values >= self.LOW_FREQ_BAND.left) & 
-                                 (spectro.index.values < self.LOW_FREQ_BAND.right)]
-        if low_freq_slice.empty:
-            low_freq_mean = 0
-        else:
-            low_freq_mean  = low_freq_slice.mean().mean()
+        if type(spectro) == pd.DataFrame:
+            spectro = Spectrogram.from_dataframe(spectro)
         
-        med_freq_slice = spectro[(spectro.index.values >= self.MED_FREQ_BAND.left) & 
-                                 (spectro.index.values < self.MED_FREQ_BAND.right)]
-        if med_freq_slice.empty:
-            med_freq_mean = 0
-        else:
-            med_freq_mean  = med_freq_slice.mean().mean()
-        
-        high_freq_slice = spectro[(spectro.index.values >= self.HIGH_FREQ_BAND.left) & 
-                                 (spectro.index.values < self.HIGH_FREQ_BAND.right)]
-        if high_freq_slice.empty:
-            high_freq_mean = 0
-        else:
-            high_freq_mean  = high_freq_slice.mean().mean()
+        low_freq_mean  = spectro.band_mean(self.LOW_FREQ_BAND.left, 
+                                           self.LOW_FREQ_BAND.right)
+        med_freq_mean  = spectro.band_mean(self.MED_FREQ_BAND.left, 
+                                           self.MED_FREQ_BAND.right)
+        high_freq_mean = spectro.band_mean(self.HIGH_FREQ_BAND.left, 
+                                           self.HIGH_FREQ_BAND.right)
         
         return {'low_freq_mean'  : low_freq_mean,
                 'med_freq_mean'  : med_freq_mean,
@@ -467,6 +460,7 @@ class SpectrogramDataset(Dataset):
     # chop_one_spectrogram 
     #-------------------
     
+    @timed()
     def chop_one_spectrogram(self, 
                              spect_df, 
                              label_file,
@@ -509,6 +503,10 @@ class SpectrogramDataset(Dataset):
         @type curr_file_family: {str : str}
         '''
         
+        # Shares the magnitudes with spect_df if they
+        # are float32; used for the snippet energies:
+        spect = Spectrogram.from_dataframe(spect_df)
+        
         times = spect_df.columns
         earliest = times[0]
         latest   = times[-1]
@@ -557,7 +555,8 @@ class SpectrogramDataset(Dataset):
             
             # Get this snippet's mean energy in three frequency
             # bands:
-            snippet_freq_energies = self.mean_magnitudes(snippet)
+            snippet_freq_energies = self.mean_magnitudes(
+                spect.crop_times(snip_xtick_interval.left, snip_xtick_interval.right))
             # Combine parent and snippet energies:
             # Just for clarity:
             freq_energies = parent_freq_energies
@@ -579,13 +578,16 @@ class SpectrogramDataset(Dataset):
             curr_file_family.snippet_id = db_snippet_id
             
             # Save the snippet to file:
-            snippet.to_pickle(snippet_file_name)
+            with Instrumentation().span('save_snippet'):
+                snippet.to_pickle(snippet_file_name)
+            Instrumentation().count('snippets_written')
             
 
     #------------------------------------
     # label_for_snippet 
     #-------------------
     
+    @timed()
     def label_for_snippet(self, 
                           snippet_interval, 
                           label_file,
@@ -649,6 +651,7 @@ class SpectrogramDataset(Dataset):
     # add_snippet_to_db
     #-------------------
     
+    @timed()
     def add_snippet_to_db(self, 
                           snippet_file_name_template,
                           label,
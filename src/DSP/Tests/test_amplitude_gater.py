@@ -281,6 +281,50 @@ class Test(unittest.TestCase):
         finally:
             os.remove(tmp_file_obj.name)
 
+    #------------------------------------
+    # test_gate_in_blocks
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_gate_in_blocks(self):
+        
+        test_sound_path = os.path.join(os.path.dirname(__file__), 'testsound.wav')
+        with NamedTemporaryFile(prefix='gated_whole', suffix='.wav') as whole_fd,\
+             NamedTemporaryFile(prefix='gated_blocks', suffix='.wav') as blocks_fd:
+            
+            whole_gater  = AmplitudeGater(test_sound_path,
+                                          amplitude_cutoff=-20,
+                                          outfile=whole_fd.name)
+            blocks_gater = AmplitudeGater(test_sound_path,
+                                          amplitude_cutoff=-20,
+                                          outfile=blocks_fd.name,
+                                          block_size=1000)
+            
+            (_framerate, whole_samples) = wavfile.read(whole_fd.name)
+            (_framerate, block_samples) = wavfile.read(blocks_fd.name)
+            
+            # Carrying filter state across blocks must
+            # give the same result as gating all at once:
+            self.assertTrue(np.array_equal(whole_samples, block_samples))
+            self.assertEqual(whole_gater.percent_zeroed, blocks_gater.percent_zeroed)
+
+    #------------------------------------
+    # test_zero_phase_blocks
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_zero_phase_blocks(self):
+        
+        gater = AmplitudeGater(None, testing=True, framerate=4000)
+        sig   = np.random.default_rng(1).normal(size=40000)
+        
+        whole  = gater.freq_filter(sig, [10,50], zero_phase=True)
+        blocks = gater.freq_filter(sig, [10,50], block_size=3000, zero_phase=True)
+        
+        # Overlap margins make block borders invisible
+        # up to a small residue:
+        self.assertTrue(np.allclose(whole, blocks, atol=1e-4 * np.amax(np.abs(whole))))
+
 # --------------------------- Utils ---------------
  
     #------------------------------------
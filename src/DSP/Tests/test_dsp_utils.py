@@ -14,7 +14,16 @@ import unittest
 sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
+from matplotlib import mlab
+import numpy as np
+import pandas as pd
+from scipy.signal import stft
+
 from dsp_utils import DSPUtils
+from dsp_utils import SpectrogramFile
+from dsp_utils import Spectrogram
+from dsp_utils import SpectrogramPyramid
+from dsp_utils import FileFamily, AudioType
 
 TEST_ALL = True
 #TEST_ALL = False
@@ -103,6 +112,244 @@ class TestDSPUtils(unittest.TestCase):
                               str(match3_2_path)
                               ]))
 
+    #------------------------------------
+    # testNativeSpectrogramRoundTrip 
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def testNativeSpectrogramRoundTrip(self):
+        self.tmp_dir_obj = tempfile.TemporaryDirectory(prefix='spectro_tmp', 
+                                                       dir=self.curr_dir)
+        spect_df = self.make_spectrogram_df()
+        npy_path = os.path.join(self.tmp_dir_obj.name, 'foo_spectrogram.npy')
+        DSPUtils.save_spectrogram(spect_df, npy_path)
+        self.assertTrue(os.path.exists(SpectrogramFile.sidecar_path(npy_path)))
+
+        loaded_df = DSPUtils.load_spectrogram(npy_path)
+        self.assertTrue(np.allclose(loaded_df.to_numpy(), spect_df.to_numpy()))
+        self.assertTrue(np.allclose(loaded_df.index, spect_df.index))
+        self.assertTrue(np.allclose(loaded_df.columns, spect_df.columns))
+        
+        # Saving from np array plus labels:
+        DSPUtils.save_spectrogram(spect_df.to_numpy(), 
+                                  npy_path,
+                                  freq_labels=spect_df.index,
+                                  time_labels=spect_df.columns)
+        spect_file = SpectrogramFile(npy_path)
+        self.assertEqual(spect_file.magnitudes.dtype, np.float32)
+        self.assertEqual(spect_file.shape, spect_df.shape)
+        
+        # Time-range loads: frames 0.768 through 1.536 secs:
+        excerpt_df = DSPUtils.load_spectrogram(npy_path, start_sec=0.768, end_sec=1.536)
+        expected_df = spect_df.iloc[:, 3:7]
+        self.assertTrue(np.allclose(excerpt_df.columns, expected_df.columns))
+        self.assertTrue(np.allclose(excerpt_df.to_numpy(), expected_df.to_numpy()))
+        # Times between frames:
+        self.assertEqual(spect_file.frame_range(0.7, 1.6), (3, 7))
+        self.assertEqual(spect_file.frames(end_sec=0.3).shape, (spect_df.shape[0], 2))
+        
+        # Unevenly spaced time labels are refused by the 
+        # native format, and pickled instead:
+        uneven_path = os.path.join(self.tmp_dir_obj.name, 'bar_spectrogram.npy')
+        with self.assertRaises(ValueError):
+            SpectrogramFile.save(spect_df.to_numpy()[:, :3], 
+                                 uneven_path,
+                                 freq_labels=spect_df.index,
+                                 time_labels=[0., 1., 3.])
+        saved_path = DSPUtils.save_spectrogram(spect_df.to_numpy()[:, :3], 
+                                               uneven_path,
+                                               freq_labels=spect_df.index,
+                                               time_labels=[0., 1., 3.])
+        self.assertEqual(saved_path, os.path.join(self.tmp_dir_obj.name, 'bar_spectrogram.pickle'))
+        self.assertFalse(os.path.exists(uneven_path))
+        self.assertEqual(list(DSPUtils.load_spectrogram(saved_path).columns), [0., 1., 3.])
+        
+        # File families find whichever format is on disk:
+        self.assertEqual(FileFamily(saved_path).fullpath(AudioType.SPECTRO), saved_path)
+        self.assertEqual(FileFamily(saved_path.replace('bar', 'foo')).fullpath(AudioType.SPECTRO), 
+                         npy_path)
+
+    #------------------------------------
+    # testConvertPickledSpectrogram 
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def testConvertPickledSpectrogram(self):
+        self.tmp_dir_obj = tempfile.TemporaryDirectory(prefix='spectro_tmp', 
+                                                       dir=self.curr_dir)
+        spect_df = self.make_spectrogram_df()
+        pickle_path = os.path.join(self.tmp_dir_obj.name, 'foo_spectrogram.pickle')
+        DSPUtils.save_spectrogram(spect_df, pickle_path)
+        
+        npy_path = DSPUtils.convert_pickled_spectrogram(pickle_path, remove_pickle=True)
+        self.assertEqual(npy_path, os.path.join(self.tmp_dir_obj.name, 'foo_spectrogram.npy'))
+        self.assertFalse(os.path.exists(pickle_path))
+        loaded_df = DSPUtils.load_spectrogram(npy_path, start_sec=1.0)
+        self.assertTrue(np.allclose(loaded_df.to_numpy(), spect_df.iloc[:, 4:].to_numpy()))
+        
+        # Native spectrograms are members of file families:
+        family = FileFamily(npy_path)
+        self.assertEqual(family.file_type, AudioType.SPECTRO)
+        self.assertEqual(family.file_root, 'foo')
+        self.assertEqual(family.spectro_npy, 'foo_spectrogram.npy')
+
+    #------------------------------------
+    # testBandLimitedSpectrogram 
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def testBandLimitedSpectrogram(self):
+        samples = (np.random.default_rng(2).standard_normal(50000) * 3000).astype(np.int16)
+        
+        # Same as scipy's stft, cut to the freq cap:
+        (freqs, times, complex_spect) = stft(samples, 8000, nperseg=4096)
+        (band_freqs, band_times, band_spect) = \
+            DSPUtils.band_limited_spectrogram(samples, 
+                                              8000, 
+                                              nfft=4096, 
+                                              freq_cap=150,
+                                              frames_per_chunk=7)
+        num_bins = len(band_freqs)
+        self.assertEqual(num_bins, np.count_nonzero(freqs <= 150))
+        self.assertEqual(band_spect.dtype, np.float32)
+        self.assertTrue(np.allclose(band_times, times))
+        self.assertTrue(np.allclose(band_spect, 
+                                    np.abs(complex_spect[:num_bins]), 
+                                    rtol=1e-5))
+        
+        # Same as mlab's specgram:
+        (psd_spect, freqs, times) = mlab.specgram(samples, 
+                                                  NFFT=4096, 
+                                                  Fs=8000, 
+                                                  noverlap=4096 - 800, 
+                                                  window=mlab.window_hanning, 
+                                                  pad_to=4096)
+        (band_freqs, band_times, band_spect) = \
+            DSPUtils.band_limited_spectrogram(samples, 
+                                              8000, 
+                                              nfft=4096,
+                                              hop=800,
+                                              freq_cap=150,
+                                              mode='psd')
+        self.assertTrue(np.allclose(band_times, times))
+        self.assertTrue(np.allclose(band_spect, 
+                                    psd_spect[:len(band_freqs)], 
+                                    rtol=1e-5))
+
+    #------------------------------------
+    # testSpectrogramOps 
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def testSpectrogramOps(self):
+        spect_df = self.make_spectrogram_df().astype(np.float32)
+        spect = Spectrogram.from_dataframe(spect_df)
+        # No copy for float32 DataFrames:
+        self.assertTrue(np.shares_memory(spect.magnitudes, spect_df.to_numpy()))
+        
+        # Freq labels: 0, 2.5, 5, ..., 17.5
+        cropped = spect.crop_freqs(max_freq=5)
+        self.assertTrue(np.array_equal(cropped.freq_labels, [0, 2.5, 5]))
+        self.assertTrue(np.shares_memory(cropped.magnitudes, spect.magnitudes))
+        cropped = spect.crop_freqs(min_freq=2.5, max_freq=5, include_max=False)
+        self.assertTrue(np.array_equal(cropped.freq_labels, [2.5]))
+        self.assertEqual(spect.crop_times(2, 5).shape, (8, 3))
+        
+        self.assertAlmostEqual(spect.band_mean(5, 10),
+                               spect_df.iloc[2:4].mean().mean(),
+                               places=6)
+        self.assertEqual(spect.band_mean(100, 200), 0)
+        
+        # In-place suppression on a copy:
+        suppressed = spect.copy().suppress_energy(-2)
+        threshold  = spect_df.to_numpy().max() * 10**(-2/20)
+        self.assertTrue(np.all(suppressed.magnitudes[spect.magnitudes <= threshold] == 0))
+        self.assertTrue(np.array_equal(spect.magnitudes, spect_df.to_numpy()))
+        self.assertTrue(suppressed.to_dataframe().index.equals(spect_df.index))
+        
+        rows = Spectrogram.band_rows(spect.freq_labels, [(None, 5), (15, None)])
+        self.assertTrue(np.array_equal(rows, [0, 1, 6, 7]))
+
+    #------------------------------------
+    # testSpectrogramPyramid 
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def testSpectrogramPyramid(self):
+        self.tmp_dir_obj = tempfile.TemporaryDirectory(prefix='spectro_tmp', 
+                                                       dir=self.curr_dir)
+        # 1001 frames: odd lengths at every level
+        hop = 0.256
+        freq_labels = np.arange(0, 20, 2.5)
+        magnitudes  = np.random.default_rng(1).random((len(freq_labels), 1001)).astype(np.float32)
+        npy_path = os.path.join(self.tmp_dir_obj.name, 'foo_spectrogram.npy')
+        SpectrogramFile.save(magnitudes, npy_path, 
+                             freq_labels=freq_labels, 
+                             time_labels=hop * np.arange(1001))
+        self.assertFalse(SpectrogramPyramid.is_current(npy_path))
+        
+        # Levels until one would have fewer than 100 frames:
+        # 501, 251, 126 frames:
+        pyramid = SpectrogramPyramid.for_spectrogram(npy_path, min_level_frames=100)
+        self.assertEqual(pyramid.num_levels, 3)
+        self.assertTrue(SpectrogramPyramid.is_current(npy_path))
+        
+        level_2 = SpectrogramFile(SpectrogramPyramid.level_path_of(npy_path, 2, 'max'))
+        self.assertEqual(level_2.shape, (8, 251))
+        self.assertTrue(np.array_equal(level_2.magnitudes[:, 0], magnitudes[:, 0:4].max(axis=1)))
+        self.assertTrue(np.array_equal(level_2.magnitudes[:, -1], magnitudes[:, -1]))
+        level_2_mean = SpectrogramFile(SpectrogramPyramid.level_path_of(npy_path, 2, 'mean'))
+        self.assertTrue(np.allclose(level_2_mean.magnitudes[:, 1], magnitudes[:, 4:8].mean(axis=1)))
+        # Level frames are centered on the frames they pool:
+        self.assertAlmostEqual(level_2.time_labels[1], hop * 5.5)
+        
+        # Pooling masks as the levels pool frames:
+        mask = np.zeros(11)
+        mask[5] = 1
+        self.assertTrue(np.array_equal(SpectrogramPyramid.decimate(mask, 2), [0, 1, 0]))
+        
+        # Coarsest level with at least pixel_width frames:
+        self.assertEqual(pyramid.level_frames(pixel_width=300), (1, 0, 501))
+        self.assertEqual(pyramid.level_frames(pixel_width=10), (3, 0, 126))
+        # Short spans from the spectrogram itself: frames 4 through 8:
+        self.assertEqual(pyramid.level_frames(1.0, 2.1, pixel_width=100), (0, 4, 9))
+        excerpt = pyramid.to_dataframe(1.0, 2.1, pixel_width=100)
+        self.assertTrue(np.allclose(excerpt.to_numpy(), magnitudes[:, 4:9]))
+        excerpt = pyramid.to_dataframe(pixel_width=300, reduction='mean')
+        self.assertEqual(excerpt.shape, (8, 501))
+        self.assertTrue(np.allclose(excerpt.index, freq_labels))
+        
+        # Pyramids of pickled spectrograms:
+        pickle_path = os.path.join(self.tmp_dir_obj.name, 'bar_spectrogram.pickle')
+        DSPUtils.save_spectrogram(SpectrogramFile(npy_path).to_dataframe(), pickle_path)
+        pickle_pyramid = SpectrogramPyramid.for_spectrogram(pickle_path, min_level_frames=100)
+        self.assertTrue(np.array_equal(pickle_pyramid.to_dataframe(pixel_width=10).to_numpy(),
+                                       pyramid.to_dataframe(pixel_width=10).to_numpy()))
+        self.assertTrue(np.allclose(pickle_pyramid.to_dataframe(1.0, 2.1, pixel_width=100).to_numpy(),
+                                    magnitudes[:, 4:9]))
+        
+        # Changed spectrograms get a new pyramid:
+        SpectrogramFile.save(magnitudes[:, :300], npy_path, 
+                             freq_labels=freq_labels, 
+                             time_labels=hop * np.arange(300))
+        self.assertFalse(SpectrogramPyramid.is_current(npy_path))
+        self.assertEqual(SpectrogramPyramid.for_spectrogram(npy_path, min_level_frames=100).num_levels, 1)
+
+    #------------------------------------
+    # make_spectrogram_df 
+    #-------------------
+    
+    def make_spectrogram_df(self):
+        '''
+        Return a small spectrogram DataFrame with
+        time labels spaced by the usual hop of 
+        0.256 secs.
+        '''
+        freq_labels = np.arange(0, 20, 2.5)
+        time_labels = 0.256 * np.arange(10)
+        magnitudes  = np.random.default_rng(1).random((len(freq_labels), len(time_labels)))
+        return pd.DataFrame(magnitudes, index=freq_labels, columns=time_labels)
+
 # --------------- Main -----------
 
 if __name__ == "__main__":
@@ -5,8 +5,11 @@ Created on Feb 21, 2020
 '''
 
 import sys, os
+from tempfile import NamedTemporaryFile
 import unittest
 
+from scipy.io import wavfile
+
 sys.path.append(os.path.dirname(__file__))
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
@@ -278,6 +281,63 @@ class TestDSPPerformanceComputation(unittest.TestCase):
         self.assertEqual(aud_events[0].begin_time, 0)
         self.assertEqual(aud_events[0].end_time, burst.size)
 
+    #------------------------------------
+    # test_iter_audio_events_across_blocks
+    #-------------------
+    
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_iter_audio_events_across_blocks(self):
+        
+        samples = np.array([1, 1, 0, 0, 1, 1, 1, 1, 1, 0, 1, 0, 0, 1])
+        (burst_matrix, _mask) = self.pr_comp.collect_audio_events(samples)
+        
+        # Any block size must give the same bursts,
+        # whether bursts straddle block borders or not:
+        for block_size in range(1, samples.size + 2):
+            bursts = list(self.pr_comp.iter_audio_events(samples, block_size))
+            self.assertEqual(bursts, [(0,2), (4,9), (10,11), (13,14)])
+            self.assertTrue(np.array_equal(np.array(bursts), burst_matrix))
+            
+        # Burst spanning several entire blocks:
+        bursts = list(self.pr_comp.iter_audio_events(np.array([0, 1, 1, 1, 1, 1, 1, 0]), 2))
+        self.assertEqual(bursts, [(1,7)])
+
+        # No bursts at all:
+        bursts = list(self.pr_comp.iter_audio_events(np.zeros(10), 3))
+        self.assertEqual(bursts, [])
+
+    #------------------------------------
+    # test_collect_audio_events_from_wav
+    #-------------------
+    
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_collect_audio_events_from_wav(self):
+        
+        with NamedTemporaryFile(suffix='.wav', prefix='gated_', dir='/tmp') as fd:
+            wavfile.write(fd.name, 4000, self.samples4.astype(np.int16))
+            bursts = self.pr_comp.collect_audio_events_from_wav(fd.name, block_size=3)
+        
+        (burst_matrix, _mask) = self.pr_comp.collect_audio_events(self.samples4)
+        self.assertTrue(np.array_equal(bursts, burst_matrix))
+        self.assertEqual(self.pr_comp.framerate, 4000)
+
+    #------------------------------------
+    # test_count_sample_agreement
+    #-------------------
+    
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_count_sample_agreement(self):
+        
+        samples = np.array([0, 3, 3, 0, 0, 5, 5, 0, 2])
+        el_mask = np.array([0, 1, 0, 0, 1, 1, 1])
+        # Mask is implicitly padded by two zeros, so
+        # the last audio sample is a false positive:
+        for block_size in (1, 2, 4, 100):
+            (tp, fp, fn, tn) = self.pr_comp.count_sample_agreement(samples, 
+                                                                   el_mask, 
+                                                                   block_size)
+            self.assertEqual((tp, fp, fn, tn), (3, 2, 1, 3))
+
     #------------------------------------
     # test_get_total_labeled_samples
     #-------------------
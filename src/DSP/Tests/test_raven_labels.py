@@ -0,0 +1,132 @@
+import csv
+import math
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import numpy as np
+
+from elephant_utils.raven_labels import RavenLabelTable
+
+TEST_ALL = True
+#TEST_ALL = False
+
+class TestRavenLabels(unittest.TestCase):
+
+    #------------------------------------
+    # setUp
+    #-------------------
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='raven_labels_test')
+        # Copy, so that sidecars go to the temp dir:
+        self.label_file = os.path.join(self.tmp_dir.name, 'labels_for_testing.txt')
+        shutil.copy(os.path.join(os.path.dirname(__file__), 'labels_for_testing.txt'),
+                    self.label_file)
+        RavenLabelTable._cache.clear()
+
+    #------------------------------------
+    # tearDown
+    #-------------------
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        RavenLabelTable._cache.clear()
+
+    #------------------------------------
+    # testColumns
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testColumns(self):
+        table = RavenLabelTable.load(self.label_file)
+        with open(self.label_file, 'r') as fd:
+            rows = list(csv.DictReader(fd, delimiter='\t'))
+
+        self.assertEqual(len(table), len(rows))
+        self.assertEqual(table.selection.tolist(), [int(row['Selection']) for row in rows])
+        self.assertEqual(table.begin.tolist(), [float(row['Begin Time (s)']) for row in rows])
+        self.assertEqual(table.end.tolist(), [float(row['End Time (s)']) for row in rows])
+        self.assertEqual(table.file_offset.tolist(), [float(row['File Offset (s)']) for row in rows])
+        self.assertEqual(table.low_freq.tolist(), [float(row['Low Freq (Hz)']) for row in rows])
+        # No 'Marginal' column:
+        self.assertFalse(table.marginal.any())
+
+    #------------------------------------
+    # testFrameConversions
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testFrameConversions(self):
+        table = RavenLabelTable.load(self.label_file)
+        (samplerate, NFFT, hop) = (8000, 4096, 800)
+        num_frames = 1000
+
+        # The row by row conversion of the label consumers:
+        expected_mask = np.zeros(num_frames, dtype=int)
+        with open(self.label_file, 'r') as fd:
+            for row in csv.DictReader(fd, delimiter='\t'):
+                start_time = float(row['File Offset (s)'])
+                end_time = start_time + float(row['End Time (s)']) - float(row['Begin Time (s)'])
+                start_spec = max(math.ceil((start_time * samplerate - NFFT / 2.) / hop), 0)
+                end_spec = min(math.ceil((end_time * samplerate - NFFT / 2.) / hop), num_frames)
+                expected_mask[start_spec : end_spec] = 1
+
+        mask = table.frame_mask(num_frames, samplerate=samplerate, NFFT=NFFT, hop=hop)
+        self.assertTrue(np.array_equal(mask, expected_mask))
+
+        samples = table.sample_indices(samplerate)
+        self.assertEqual(samples[0].tolist(), [math.ceil(8000 * 1.293),
+                                               math.ceil(1 + 8000 * 6.464999999991385)])
+
+        # Spectrogram time bins every 10 seconds:
+        label_times = np.arange(0, 200, 10.)
+        (start_bins, end_bins, valid) = table.bin_indices(label_times)
+        for (begin, end, start_bin, end_bin) in zip(table.begin[valid], table.end[valid],
+                                                    start_bins[valid], end_bins[valid]):
+            self.assertEqual(start_bin, np.nonzero(label_times <= begin)[0][-1])
+            after_end = np.nonzero(label_times > end)[0]
+            self.assertEqual(end_bin, after_end[0] if len(after_end) > 0 else len(label_times))
+        # Labels after the last bin are not valid:
+        self.assertTrue(np.array_equal(valid, table.begin <= 190))
+
+    #------------------------------------
+    # testSidecar
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testSidecar(self):
+        table = RavenLabelTable.load(self.label_file)
+        sidecar = RavenLabelTable.sidecar_path(self.label_file)
+        self.assertTrue(os.path.exists(sidecar))
+        # Scans that pair files by their first dotted
+        # part must not take the sidecar for a table:
+        self.assertNotEqual(os.path.basename(sidecar).split('.')[1], 'txt')
+
+        # Same process: from memory
+        self.assertIs(RavenLabelTable.load(self.label_file), table)
+
+        # New process: from the sidecar
+        RavenLabelTable._cache.clear()
+        from_sidecar = RavenLabelTable._read_sidecar(sidecar, self.label_file,
+                                                     RavenLabelTable._cache_signature(self.label_file))
+        self.assertIsNotNone(from_sidecar)
+        self.assertTrue(np.array_equal(from_sidecar.end, table.end))
+
+        # Changed table: sidecar is stale and replaced
+        with open(self.label_file, 'a') as fd:
+            fd.write('99\tSpectrogram 1\t1\t500.0\t505.0\t10\t40\tx.wav\t500.0\tx.wav\t'
+                     'CEB1\t0\t7-Nov-2011\t7-Nov-2011\t\t\t\tal\tyes\n')
+        changed = RavenLabelTable.load(self.label_file)
+        self.assertEqual(len(changed), len(table) + 1)
+        self.assertEqual(changed.selection[-1], 99)
+
+# -------------------- Main --------------
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
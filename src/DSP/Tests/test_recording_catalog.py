@@ -0,0 +1,117 @@
+import os
+from pathlib import Path
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from dsp_utils import AudioType, FileFamily
+from recording_catalog import RecordingCatalog
+
+TEST_ALL = True
+#TEST_ALL = False
+
+class TestRecordingCatalog(unittest.TestCase):
+
+    #------------------------------------
+    # setUp
+    #-------------------
+
+    def setUp(self):
+        self.tmp_dir_obj = tempfile.TemporaryDirectory(prefix='catalog_test')
+        root = Path(self.tmp_dir_obj.name)
+        self.wav_dir = root.joinpath('wav')
+        self.out_dir = root.joinpath('out', 'spectro')
+        self.wav_dir.mkdir()
+        self.out_dir.mkdir(parents=True)
+
+        self.wav   = self.wav_dir.joinpath('nn05b_20180617_000000.wav')
+        self.label = self.wav_dir.joinpath('nn05b_20180617_000000.txt')
+        self.wav2  = self.wav_dir.joinpath('nn06a_20180618_000000.wav')
+        self.gated = self.out_dir.joinpath('nn05b_20180617_000000_gated.wav')
+        self.spectro = self.out_dir.joinpath('nn05b_20180617_000000_spectrogram.pickle')
+        self.snippet = self.out_dir.joinpath('nn05b_20180617_000000_3_spectrogram.pickle')
+        for path in [self.wav, self.label, self.wav2, self.gated, self.spectro, self.snippet]:
+            path.write_bytes(b'x')
+        self.wav_dir.joinpath('notes.doc').touch()
+
+        self.catalog = RecordingCatalog(str(root.joinpath('catalog.sqlite')))
+
+    #------------------------------------
+    # tearDown
+    #-------------------
+
+    def tearDown(self):
+        self.catalog.close()
+        self.tmp_dir_obj.cleanup()
+
+    #------------------------------------
+    # testIncrementalScan
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def testIncrementalScan(self):
+        found = self.catalog.scan([str(self.wav_dir), str(self.out_dir)])
+        self.assertEqual(len(found), 7)
+        self.assertEqual(self.catalog.num_new, 7)
+
+        todo = self.catalog.todo('wav_maker', [AudioType.WAV])
+        self.assertEqual([family.fullpath(AudioType.WAV) for family in todo],
+                         [str(self.wav), str(self.wav2)])
+        self.catalog.mark_done('wav_maker', str(self.wav))
+
+        # Nothing changed: only the second .wav is left:
+        self.catalog.scan([str(self.wav_dir), str(self.out_dir)])
+        self.assertEqual((self.catalog.num_new, self.catalog.num_changed, self.catalog.num_removed),
+                         (0, 0, 0))
+        todo = self.catalog.todo('wav_maker', [AudioType.WAV])
+        self.assertEqual([family.wav for family in todo], ['nn06a_20180618_000000.wav'])
+        # Other stages are independent:
+        self.assertEqual(len(self.catalog.todo('chop', [AudioType.WAV])), 2)
+
+        # Changed and removed files:
+        self.wav.write_bytes(b'xx')
+        self.wav2.unlink()
+        self.catalog.scan([str(self.wav_dir)])
+        self.assertEqual((self.catalog.num_new, self.catalog.num_changed, self.catalog.num_removed),
+                         (0, 1, 1))
+        todo = self.catalog.todo('wav_maker', [AudioType.WAV])
+        self.assertEqual([family.wav for family in todo], ['nn05b_20180617_000000.wav'])
+
+        # Restricting to paths of a scan:
+        self.assertEqual(self.catalog.todo('wav_maker', [AudioType.WAV], paths=[]), [])
+
+    #------------------------------------
+    # testFamilies
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def testFamilies(self):
+        self.catalog.scan(os.path.dirname(str(self.out_dir)))
+        self.catalog.scan(str(self.wav_dir))
+
+        artifacts = self.catalog.artifacts('nn05b_20180617_000000')
+        self.assertEqual(artifacts[AudioType.WAV], [str(self.wav)])
+        self.assertEqual(artifacts[AudioType.LABEL], [str(self.label)])
+        self.assertEqual(artifacts[AudioType.GATED_WAV], [str(self.gated)])
+        self.assertEqual(artifacts[AudioType.SPECTRO], [str(self.spectro)])
+        self.assertEqual(artifacts[AudioType.SNIPPET], [str(self.snippet)])
+
+        # Same as decoding the file names:
+        paths = sorted(str(path) for path in [self.wav, self.label, self.wav2, 
+                                              self.gated, self.spectro, self.snippet])
+        families = self.catalog.families(list(AudioType))
+        self.assertEqual(len(families), len(paths))
+        for (family, path) in zip(families, paths):
+            (catalogued, decoded) = (vars(family), vars(FileFamily(path)))
+            # The catalog tells snippets from 24-hr spectrograms:
+            if catalogued['file_type'] == AudioType.SNIPPET:
+                catalogued['file_type'] = AudioType.SPECTRO
+            self.assertEqual(catalogued, decoded)
+
+# -------------------- Main --------------
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
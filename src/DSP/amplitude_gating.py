@@ -33,22 +33,24 @@ import datetime
 import math
 import os
 import sys
+import wave
 
 from scipy.io import wavfile
-from scipy.signal import butter, lfilter, stft, istft 
-from scipy.signal import iirfilter, sosfilt
+from scipy.signal import butter, stft, istft 
+from scipy.signal import iirfilter, sosfilt, sosfiltfilt
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 
-from elephant_utils.logging_service import LoggingService
+from elephant_utils.logging_service import LoggingService, timed
 import numpy as np
 import numpy.ma as ma
 from plotting.plotter import Plotter
 from plotting.plotter import PlotterTasks
 
 from dsp_utils import DSPUtils
+from dsp_utils import Spectrogram
 
 class FrequencyError(Exception):
     pass
@@ -65,6 +67,16 @@ class AmplitudeGater(object):
     #****FRONT_END_LOW_PASS_FREQ = 40 # Hz
     FRONT_END_LOW_PASS_FREQ = 50 # Hz
     
+    # Samples per block when gating block by block.
+    # 2**18 samples at 8kHz are about 33 seconds of
+    # audio, and keep each float64 temporary at 2MB:
+    DEFAULT_BLOCK_SIZE = 2**18
+    
+    # Longest stretch of signal examined when estimating
+    # how long a filter takes to settle; this bounds
+    # the overlap margins of zero-phase block filtering:
+    MAX_SETTLE_SECS = 60
+    
     #------------------------------------
     # Constructor 
     #-------------------    
@@ -80,6 +92,8 @@ class AmplitudeGater(object):
                  spectrogram_dest=None,
                  outdir=None,
                  outfile=None,
+                 block_size=None,
+                 zero_phase=False,
                  testing=False
                  ):
         '''
@@ -124,8 +138,8 @@ class AmplitudeGater(object):
         @param spectrogram_dest: optionally a file to which a
             spectrogram of the entire noise-gated result is written.
             If None, no spectrogram is created. If a directory, a
-            name will be constructed by appending '_spectrogram'
-            to the input file before the extension
+            name will be constructed by replacing the input file's
+            extension with '_spectrogram.npy'
         @type spectrogram_dest: {None | str}
 
         @param logfile: file where to write logs; Default: stdout
@@ -143,6 +157,19 @@ class AmplitudeGater(object):
             If None: same outdir as input wav file, using infile root,
             and adding '_gated'
         @type: outfile str
+        
+        @param block_size: if None, the entire recording is read into
+            memory, and gated in one go. Else the recording is 
+            memory-mapped, and gated block_size samples at a time,
+            with the gated .wav written incrementally. Memory use
+            is then bounded by the block size, not the recording
+            length. See gate_in_blocks().
+        @type block_size: {None | int}
+        
+        @param zero_phase: if True, the front end bandpass filter
+            is applied forward and backward, canceling its phase
+            shift. Only used when gating in blocks.
+        @type zero_phase: bool
 
         @param testing: whether or not unittests are being run. If
             true, __init__() does not initiate any action, allowing
@@ -164,7 +191,7 @@ class AmplitudeGater(object):
                 outfile = f"{os.path.join(outdir, fileroot)}_gated{ext}"
             if spectrogram_dest is not None and os.path.isdir(spectrogram_dest):
                 spectrogram_dest =\
-                    f"{os.path.join(spectrogram_dest, fileroot)}_spectrogram.pickle"
+                    f"{os.path.join(spectrogram_dest, fileroot)}_spectrogram.npy"
     
             try:
                 with open(outfile, 'wb') as _fd:
@@ -183,7 +210,10 @@ class AmplitudeGater(object):
         if not testing:
             try:
                 self.log.info("Reading .wav file...")        
-                (self.framerate, samples) = wavfile.read(infile)
+                # When gating block by block, only map the
+                # file; blocks are paged in as needed:
+                (self.framerate, samples) = wavfile.read(infile, 
+                                                         mmap=block_size is not None)
                 self.log.info("Done reading .wav file.")        
             except Exception as e:
                 raise IOError(f"Cannot read .wav file {infile}: {repr(e)}")
@@ -202,6 +232,31 @@ class AmplitudeGater(object):
         
         if testing:
             return
+        
+        if block_size is not None:
+            self.log.info(f"Gating in blocks of {block_size} samples...")
+            self.gate_in_blocks(samples,
+                                outfile,
+                                amplitude_cutoff,
+                                low_freq=low_freq,
+                                high_freq=high_freq,
+                                normalize=normalize,
+                                block_size=block_size,
+                                zero_phase=zero_phase
+                                )
+            self.log.info(f"Done gating in blocks; wrote {outfile}.")
+            
+            # Make the gated result available via the
+            # 'gated_samples' property, without reading
+            # it into memory:
+            (_framerate, self._gated_samples) = wavfile.read(outfile, mmap=True)
+            self._gated_outfile = outfile
+            
+            if spectrogram_dest:
+                self.save_gated_spectrogram(self._gated_samples, 
+                                            spectrogram_dest, 
+                                            spectrogram_freq_cap)
+            return
 
         samples_float = samples.astype(float)
         
@@ -320,6 +375,7 @@ class AmplitudeGater(object):
     # frequency_gate 
     #-------------------
     
+    @timed()
     def frequency_gate(self, samples_raw, low_freq, high_freq):
         '''
         Input absolute values of time domain voltages.
@@ -348,6 +404,7 @@ class AmplitudeGater(object):
     # amplitude_gate
     #-------------------    
         
+    @timed()
     def amplitude_gate(self, 
                        samples_abs, 
                        threshold_db,
@@ -477,36 +534,14 @@ class AmplitudeGater(object):
         #************
 
         if spectrogram_dest:
-            
-            # Get a combined frequency x time matrix. The matrix values will
-            # be complex: 
-            (freq_labels, time_labels, freq_time_dB) = self.make_spectrogram(gated_samples)
-            
-            if spectrogram_freq_cap is not None:
-                self.log.info(f"Removing frequencies above {spectrogram_freq_cap}Hz...")
-                # Remove all frequencies above, and including
-                # spectrogram_freq_cap:
-                (new_freq_labels, capped_spectrogram) = self.filter_spectrogram(freq_labels,
-                                                                                freq_time_dB, 
-                                                                                [(None, spectrogram_freq_cap)]
-                                                                                )
-                self.log.info(f"Done removing frequencies above {spectrogram_freq_cap}Hz.")
-            else:
-                capped_spectrogram = freq_time_dB
-                new_freq_labels    = freq_labels
-        
-            # Save the spectrogram to file:
-            DSPUtils.save_spectrogram(capped_spectrogram, 
-                                      spectrogram_dest, 
-                                      new_freq_labels, 
-                                      time_labels)
+            self.save_gated_spectrogram(gated_samples, 
+                                        spectrogram_dest, 
+                                        spectrogram_freq_cap)
         
         if spectrogram_dest and PlotterTasks.has_task('spectrogram_excerpts') is not None:
-            # The matrix is large, and plotting takes forever,
-            # so define a matrix excerpt:
-            self.plotter.plot_spectrogram_from_magnitudes(new_freq_labels, 
-                                          time_labels,
-                                          capped_spectrogram)
+            # The matrix is large, so plot from its pyramid 
+            # of time-pooled levels, built next to it:
+            self.plotter.plot_spectrogram_from_dataframe_file(self._spectrogram_file)
 
         #************
         #print(f"Pid {os.getpid()}: exit amp gating")
@@ -514,6 +549,279 @@ class AmplitudeGater(object):
 
         return gated_samples
 
+    #------------------------------------
+    # save_gated_spectrogram
+    #-------------------
+    
+    @timed()
+    def save_gated_spectrogram(self, 
+                               gated_samples, 
+                               spectrogram_dest, 
+                               spectrogram_freq_cap):
+        '''
+        Create a spectrogram over the full duration of
+        the gated samples, and save it to spectrogram_dest
+        (see DSPUtils.save_spectrogram()). All frequencies above spectrogram_freq_cap
+        are removed from the spectrogram before saving.
+        
+        @param gated_samples: noise-gated audio
+        @type gated_samples: np.array
+        @param spectrogram_dest: file name where 
+            spectrogram is stored
+        @type spectrogram_dest: str
+        @param spectrogram_freq_cap: frequency above 
+            which all frequencies are removed from spectrogram.
+            If None, all frequencies are kept.
+        @type spectrogram_freq_cap: {None | int}
+        @return: frequency labels, time labels, and the
+            spectrogram matrix that was saved
+        @rtype: (np.array, np.array, np.array)
+        '''
+        # Get a combined frequency x time matrix. Frequencies
+        # at and above spectrogram_freq_cap are never computed:
+        (new_freq_labels, time_labels, capped_spectrogram) = \
+            self.make_spectrogram(gated_samples, freq_cap=spectrogram_freq_cap)
+    
+        # Save the spectrogram to file; the path changes
+        # to .pickle if it cannot be saved as .npy:
+        self._spectrogram_file = DSPUtils.save_spectrogram(capped_spectrogram, 
+                                                           spectrogram_dest, 
+                                                           new_freq_labels, 
+                                                           time_labels)
+        return (new_freq_labels, time_labels, capped_spectrogram)
+
+    #------------------------------------
+    # gate_in_blocks
+    #-------------------
+    
+    @timed()
+    def gate_in_blocks(self,
+                       samples,
+                       outfile,
+                       amplitude_cutoff,
+                       low_freq=10,
+                       high_freq=50,
+                       normalize=True,
+                       block_size=None,
+                       zero_phase=False
+                       ):
+        '''
+        Bounded-memory equivalent of the normalize, frequency_gate,
+        and amplitude_gate sequence that the constructor otherwise
+        applies to an entire recording at once. The samples are
+        usually a memory-mapped .wav file. They are visited in
+        up to three passes, one block at a time:
+        
+           1. Find min and max sample for normalization 
+              (skipped if normalize is False)
+           2. Band pass filter, and accumulate the RMS of
+              the filtered signal (skipped if amplitude_cutoff
+              is 0, i.e. if no noise gating is requested)
+           3. Band pass filter again, zero everything at or below 
+              amplitude_cutoff dB of the RMS, and append the
+              result to outfile as int16
+              
+        The filter state is carried from block to block, so the
+        result matches whole-recording gating. With zero_phase
+        True the filter runs forward and backward over each block
+        plus overlap margins instead. See sos_filter_blocks().
+        
+        Sets self.percent_zeroed.
+        
+        @param samples: audio samples
+        @type samples: {np.array | np.memmap}
+        @param outfile: path of the gated .wav file to write
+        @type outfile: str
+        @param amplitude_cutoff: dB below signal RMS under which
+            voltages are set to zero. If 0, no noise gating is done.
+        @type amplitude_cutoff: int
+        @param low_freq: low end of front end bandpass filter
+        @type low_freq: int
+        @param high_freq: high end of front end bandpass filter
+        @type high_freq: int
+        @param normalize: whether or not to normalize to the int16 range
+        @type normalize: bool
+        @param block_size: number of samples to process at a time.
+            Default: DEFAULT_BLOCK_SIZE
+        @type block_size: int
+        @param zero_phase: whether to filter forward and backward
+        @type zero_phase: bool
+        @return: number of samples written
+        @rtype: int
+        '''
+        if block_size is None:
+            block_size = self.DEFAULT_BLOCK_SIZE
+            
+        if normalize:
+            value_range = self.sample_range(samples, block_size)
+        else:
+            value_range = None
+        
+        def prepare_block(raw_block):
+            block = raw_block.astype(float)
+            if value_range is not None:
+                block = self.normalize(block, value_range)
+            return np.abs(block, out=block)
+            
+        sos = self.design_filter([low_freq, high_freq], pass_spec='bandpass')
+        
+        if amplitude_cutoff != 0:
+            self.log.info("Computing RMS of band passed signal...")
+            sum_of_squares = 0.
+            for (_block_start, filtered) in self.sos_filter_blocks(sos, 
+                                                                   samples, 
+                                                                   block_size, 
+                                                                   zero_phase=zero_phase,
+                                                                   prepare_block=prepare_block):
+                sum_of_squares += np.dot(filtered, filtered)
+            rms = np.sqrt(sum_of_squares / samples.size)
+            self.log.info(f"Signal RMS: {rms}")
+            Vthresh = rms * 10**(amplitude_cutoff/20)
+            self.log.info(f"Cutoff threshold amplitude: {Vthresh}")
+            
+        num_zeroed = 0
+        with wave.open(outfile, 'wb') as wav_fd:
+            wav_fd.setnchannels(1)
+            wav_fd.setsampwidth(2)
+            wav_fd.setframerate(self.framerate)
+            
+            for (_block_start, filtered) in self.sos_filter_blocks(sos, 
+                                                                   samples, 
+                                                                   block_size, 
+                                                                   zero_phase=zero_phase,
+                                                                   prepare_block=prepare_block):
+                if amplitude_cutoff != 0:
+                    gated = np.abs(filtered, out=filtered)
+                    gated[gated <= Vthresh] = 0
+                    num_zeroed += gated.size - np.count_nonzero(gated)
+                else:
+                    gated = filtered
+                wav_fd.writeframes(gated.astype('<i2').tobytes())
+        
+        if amplitude_cutoff != 0:
+            self.percent_zeroed = 100 * num_zeroed / samples.size
+            self.log.info(f"Zeroed {self.percent_zeroed:.2f}% of signal.")
+        
+        return samples.size
+
+    #------------------------------------
+    # sos_filter_blocks
+    #-------------------
+    
+    def sos_filter_blocks(self, 
+                          sos, 
+                          samples, 
+                          block_size, 
+                          zero_phase=False, 
+                          prepare_block=None):
+        '''
+        Generator that applies a second-order sections filter
+        to samples, block_size samples at a time. Yields
+        (start_index, filtered_block) pairs. Each filtered
+        block is a new float64 array that the caller may
+        modify.
+        
+        Causal mode (zero_phase False): the filter state
+        at the end of each block is the initial state for
+        the next one. Concatenating the yielded blocks
+        gives the same result as sosfilt() over all samples.
+        
+        Zero-phase mode: each block is extended on both sides
+        by a margin as long as the filter takes to settle,
+        filtered forward and backward with sosfiltfilt(), and 
+        trimmed back to the block. This closely approximates
+        sosfiltfilt() over all samples.
+        
+        @param sos: filter in second-order sections form
+        @type sos: np.array(n_sections, 6)
+        @param samples: the signal to filter
+        @type samples: {np.array | np.memmap}
+        @param block_size: number of samples yielded at a time
+        @type block_size: int
+        @param zero_phase: whether to filter forward and backward
+        @type zero_phase: bool
+        @param prepare_block: optional function applied to each 
+            raw block (including margins) before filtering
+        @type prepare_block: {None | callable}
+        @return: start index and filtered samples of one block at a time
+        @rtype: (int, np.array(float))
+        '''
+        if prepare_block is None:
+            prepare_block = lambda raw_block: raw_block.astype(float)
+        num_samples = samples.size
+        
+        if not zero_phase:
+            # Zero initial state, as in sosfilt() without zi:
+            filter_state = np.zeros((sos.shape[0], 2))
+            for block_start in range(0, num_samples, block_size):
+                block = prepare_block(samples[block_start:block_start + block_size])
+                (filtered, filter_state) = sosfilt(sos, block, zi=filter_state)
+                yield (block_start, filtered)
+            return
+        
+        margin = self.filter_settle_samples(sos)
+        for block_start in range(0, num_samples, block_size):
+            block_end = min(block_start + block_size, num_samples)
+            padded_start = max(0, block_start - margin)
+            padded_end   = min(num_samples, block_end + margin)
+            block = prepare_block(samples[padded_start:padded_end])
+            filtered = sosfiltfilt(sos, block)
+            yield (block_start, 
+                   filtered[block_start - padded_start : block_end - padded_start].copy())
+
+    #------------------------------------
+    # filter_settle_samples
+    #-------------------
+    
+    def filter_settle_samples(self, sos, tolerance=1e-6):
+        '''
+        Return the number of samples after which the 
+        impulse response of the given filter has decayed
+        below tolerance times its peak. Used as overlap 
+        margin when filtering block by block. Capped at
+        MAX_SETTLE_SECS of samples.
+        
+        @param sos: filter in second-order sections form
+        @type sos: np.array(n_sections, 6)
+        @param tolerance: fraction of the peak response below
+            which the filter is considered settled
+        @type tolerance: float
+        @return: number of samples
+        @rtype: int
+        '''
+        impulse = np.zeros(int(self.MAX_SETTLE_SECS * self.framerate))
+        impulse[0] = 1.
+        response = np.abs(sosfilt(sos, impulse))
+        above_tolerance = np.flatnonzero(response > tolerance * np.amax(response))
+        return int(above_tolerance[-1]) + 1
+
+    #------------------------------------
+    # sample_range
+    #-------------------
+    
+    def sample_range(self, samples, block_size=None):
+        '''
+        Return minimum and maximum of samples, 
+        visiting block_size samples at a time.
+        
+        @param samples: audio samples
+        @type samples: {np.array | np.memmap}
+        @param block_size: number of samples examined at a time
+            Default: DEFAULT_BLOCK_SIZE
+        @type block_size: int
+        @return: smallest and largest sample value
+        @rtype: (float, float)
+        '''
+        if block_size is None:
+            block_size = self.DEFAULT_BLOCK_SIZE
+        min_val = np.inf
+        max_val = -np.inf
+        for block_start in range(0, samples.size, block_size):
+            block = samples[block_start:block_start + block_size]
+            min_val = min(min_val, np.amin(block))
+            max_val = max(max_val, np.amax(block))
+        return (float(min_val), float(max_val))
+
     #------------------------------------
     # filter_spectrogram
     #-------------------
@@ -561,45 +869,11 @@ class AmplitudeGater(object):
             frequency labels
         @rtype: (np_array(1), np_array(n,m))
         '''
-        # Prepare a new spectrogram matrix with
-        # the same num of cols as the one passed
-        # in, but no rows:
-        
-        (_num_rows, num_cols) = freq_time.shape
-        new_freq_time    = np.empty((0,num_cols))
-        
-        # Same for the list of frequencies:
-        new_freq_labels  = np.empty((0,))
-        
-        for (min_freq, out_freq) in freq_bands:
-            if min_freq is None and out_freq is None:
-                # Degenerate case: keep all:
-                continue
-            if min_freq is None:
-                min_freq = 0
-            if out_freq is None:
-                # No upper bound, so make a ceiling
-                # higher than maximum frequency:
-                out_freq = np.amax(freq_labels) + 1.
-                
-            # Get the indices of the frequency array 
-            # where the frequency is within this interval.
-            # The np.where returns a tuple, therefore [0]
-
-            filter_indices =  np.where(np.logical_and(freq_labels >= min_freq,
-                                                      freq_labels < out_freq
-                                                      ))[0]
-        
-            # Keep only rows (axis=0) that contain the energies for
-            # included frequencies:
-            new_freq_time = np.vstack(
-                (new_freq_time, np.take(freq_time, filter_indices, axis=0))
-                )
-
-            # Also take away the row labels that where excluded:
-            new_freq_labels = np.hstack(
-                (new_freq_labels, np.take(freq_labels, filter_indices))
-                )
+        # Collect the rows of all bands, then
+        # extract them with a single copy:
+        filter_indices = Spectrogram.band_rows(freq_labels, freq_bands)
+        new_freq_time   = np.take(freq_time, filter_indices, axis=0)
+        new_freq_labels = np.take(freq_labels, filter_indices)
 
         return (new_freq_labels, new_freq_time)
 
@@ -607,7 +881,13 @@ class AmplitudeGater(object):
     # freq_filter 
     #-------------------
     
-    def freq_filter(self, data, cutoffs, pass_spec='bandpass', title=None):
+    def freq_filter(self, 
+                    data, 
+                    cutoffs, 
+                    pass_spec='bandpass', 
+                    title=None,
+                    block_size=None,
+                    zero_phase=False):
         '''
         Given a voltage sequence and one or two 
         frequency cutoffs, return a filtered version
@@ -619,6 +899,10 @@ class AmplitudeGater(object):
         
         The filter will be DEFAULT_FILTER_ORDER 
         Chebyshev II.
+        
+        If block_size is provided, the data are filtered
+        that many samples at a time, carrying the filter
+        state across blocks. See sos_filter_blocks(). 
          
         @param data: the signal to filter
         @type data: np_array
@@ -629,6 +913,50 @@ class AmplitudeGater(object):
             beforehand. If plot was requested, and title
             is None, a title is constructed by plot_frequency_reponse()
         @type title: {None | str}
+        @param block_size: if not None, number of samples
+            to filter at a time
+        @type block_size: {None | int}
+        @param zero_phase: whether to filter forward and 
+            backward. 
+        @type zero_phase: bool
+        '''
+        sos = self.design_filter(cutoffs, pass_spec)
+
+        if PlotterTasks.has_task('filter_response') is not None:
+            self.plotter.plot_frequency_response(sos,
+                                                 self.framerate, 
+                                                 cutoffs, 
+                                                 title)
+        if block_size is None:
+            if zero_phase:
+                return sosfiltfilt(sos, data)
+            return sosfilt(sos, data)
+
+        new_sig = np.empty(data.size)
+        for (block_start, filtered) in self.sos_filter_blocks(sos, 
+                                                              data, 
+                                                              block_size, 
+                                                              zero_phase=zero_phase):
+            new_sig[block_start:block_start + filtered.size] = filtered
+        
+        return new_sig
+
+    #------------------------------------
+    # design_filter
+    #-------------------
+    
+    def design_filter(self, cutoffs, pass_spec='bandpass'):
+        '''
+        Return second-order sections of a DEFAULT_FILTER_ORDER
+        Chebyshev II filter. See freq_filter() for the
+        meaning of cutoffs and pass_spec.
+        
+        @param cutoffs: one or two cutoff frequecies
+        @type cutoffs: {int | [int] | [int,int]}
+        @param pass_spec: one of 'bandpass', 'lowpass', 'highpass'
+        @type pass_spec: str
+        @return: filter in second-order sections form
+        @rtype: np.array(n_sections, 6)
         '''
         nyq = 0.5 * self.framerate
         if type(cutoffs) == list and len(cutoffs) == 1:
@@ -657,34 +985,35 @@ class AmplitudeGater(object):
                         analog=False, 
                         ftype='cheby2', 
                         output='sos')
-
-
-        if PlotterTasks.has_task('filter_response') is not None:
-            self.plotter.plot_frequency_response(sos,
-                                                 self.framerate, 
-                                                 cutoffs, 
-                                                 title)
-        new_sig = sosfilt(sos, data)
-        
-        return new_sig
+        return sos
 
     #------------------------------------
     # butter_lowpass_filter
     #-------------------    
 
-    def butter_lowpass_filter(self, data, cutoff, order=4):
+    def butter_lowpass_filter(self, data, cutoff, order=4, block_size=None):
         '''
         Not used.
+        
+        Butterworth lowpass in second-order sections
+        form. If block_size is given, data are filtered
+        that many samples at a time, carrying the filter
+        state across blocks.
         '''
 
         nyq = 0.5 * self.framerate
         normal_cutoff = cutoff / nyq
-        b, a = butter(order, normal_cutoff, btype='low', analog=False)
+        sos = butter(order, normal_cutoff, btype='low', analog=False, output='sos')
 
-        envelope = lfilter(b, a, data)
+        if block_size is None:
+            envelope = sosfilt(sos, data)
+        else:
+            envelope = np.empty(data.size)
+            for (block_start, filtered) in self.sos_filter_blocks(sos, data, block_size):
+                envelope[block_start:block_start + filtered.size] = filtered
         
         if PlotterTasks.has_task('filter_response') is not None:
-            self.plotter.plot_frequency_response(b, a, cutoff, order)
+            self.plotter.plot_frequency_response(sos, self.framerate, cutoff)
             # Plot a piece of envelope, roughly from the middle:
             mid_env_index = round(envelope.size/2)
             end_index     = mid_env_index + 100
@@ -829,7 +1158,8 @@ class AmplitudeGater(object):
     # normalize
     #-------------------
     
-    def normalize(self, samples):
+    @timed()
+    def normalize(self, samples, value_range=None):
         '''
         Make audio occupy the maximum dynamic range
         of int16: -2**15 to 2**15 - 1 (-32768 to 32767)
@@ -837,14 +1167,24 @@ class AmplitudeGater(object):
         Formula to compute new Intensity of each sample:
 
            I = ((I-Min) * (newMax - newMin)/Max-Min)) + newMin
+           
+        When normalizing one block of a longer recording,
+        pass the recording's (Min, Max) in value_range. 
 
         @param samples: samples from .wav file
         @type samples: np.narray('int16')
+        @param value_range: min and max of the entire recording.
+            If None, computed from samples.
+        @type value_range: {None | (float, float)}
         @result: a new np array with normalized values
         @rtype: np.narray('int16')
         '''
         new_min = -2**15       # + 10  # Leave a little bit of room with min val of -32768
         new_max = 2**15        # - 10   # same for max:
+        if value_range is not None:
+            (min_val, max_val) = value_range
+            return ((samples - min_val) * (new_max - new_min)/(max_val - min_val)) + new_min
+
         min_val = np.amin(samples)
         max_val = np.amax(samples)
         
@@ -949,12 +1289,18 @@ class AmplitudeGater(object):
     # make_spectrogram
     #-------------------
 
-    def make_spectrogram(self, data):
+    @timed()
+    def make_spectrogram(self, data, freq_cap=None):
         '''
         Given data, compute a spectrogram. Returned
         is a dB scaled spectrogram of the spectral power.
         I.e. values are squared, then dB is computed relative
         to highest value in the spectrogram.
+        
+        If freq_cap is provided, only frequencies below
+        freq_cap are computed, in chunks of time frames,
+        such that the full spectrum is never in memory 
+        (see DSPUtils.band_limited_spectrogram()).
 
         Assumptions:
             o self.framerate contains the data framerate
@@ -974,6 +1320,9 @@ class AmplitudeGater(object):
         
         @param data: the time/amplitude data
         @type data: np.array([float])
+        @param freq_cap: frequency at and above which nothing
+            is computed; None for all frequencies
+        @type freq_cap: {None | int}
         @return: (frequency_labels, time_labels, spectrogram_matrix)
         @rtype: (np.array, np.array, np.array)
         
@@ -999,13 +1348,22 @@ class AmplitudeGater(object):
 #         self.log.info("TEMPORARY: Creating spectrogram USING ML...")
         #*************
         self.log.info("Creating spectrogram...")
-        (freq_labels, time_labels, complex_freq_by_time) = stft(data, 
-                                                                self.framerate, 
-                                                                nperseg=self.FFT_WIDTH
-                                                                #nperseg=int(self.framerate)
-                                                                )
+        if freq_cap is not None:
+            (freq_labels, time_labels, freq_time) = \
+                DSPUtils.band_limited_spectrogram(data,
+                                                  self.framerate,
+                                                  nfft=self.FFT_WIDTH,
+                                                  freq_cap=freq_cap,
+                                                  include_cap=False
+                                                  )
+        else:
+            (freq_labels, time_labels, complex_freq_by_time) = stft(data, 
+                                                                    self.framerate, 
+                                                                    nperseg=self.FFT_WIDTH
+                                                                    #nperseg=int(self.framerate)
+                                                                    )
+            freq_time = np.absolute(complex_freq_by_time)
         self.log.info("Done creating spectrogram.")
-        freq_time = np.absolute(complex_freq_by_time)
         freq_time = DSPUtils.spectrogram_to_db(freq_time)
         return (freq_labels, time_labels, freq_time)
         
@@ -1205,6 +1563,19 @@ if __name__ == '__main__':
                         default=None
                         )
     
+    parser.add_argument('-b', '--block_size',
+                        help='gate this many samples at a time, with bounded memory;\n' +\
+                             'default: read and gate entire file at once',
+                        type=int,
+                        default=None
+                        )
+
+    parser.add_argument('-z', '--zero_phase',
+                        action='store_true',
+                        default=False,
+                        help="Filter forward and backward to cancel phase shift; only with --block_size"
+                        )
+    
     parser.add_argument('wavefile',
                         help="Input .wav file"
                         )
@@ -1235,6 +1606,8 @@ if __name__ == '__main__':
                        # If no_normalize is True, don't normalize:
                        normalize=not args.no_normalize,
                        outdir=args.outdir,
+                       block_size=args.block_size,
+                       zero_phase=args.zero_phase,
                        logfile=args.logfile,
                        )
     except Exception as e:
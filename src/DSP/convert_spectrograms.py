@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+'''
+Converts spectrograms that were saved as pickled
+DataFrames (foo_spectrogram.pickle) to the native
+format (foo_spectrogram.npy plus foo_spectrogram.json).
+See dsp_utils.SpectrogramFile.
+
+Input paths may be a mix of .pickle files, and directories.
+All _spectrogram.pickle files in the subdirs are recursively
+included. The converted files are placed next to the originals.
+
+@author: paepcke
+'''
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from dsp_utils import DSPUtils
+
+
+class SpectrogramConverter(object):
+    '''
+    Convert pickled spectrograms to native format
+    '''
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self, infiles, remove_pickle=False, overwrite=False):
+        '''
+        @param infiles: .pickle files and/or directories
+        @type infiles: [str]
+        @param remove_pickle: remove each pickle file
+            after it was converted
+        @type remove_pickle: bool
+        @param overwrite: convert even if the .npy
+            file already exists
+        @type overwrite: bool
+        '''
+        self.converted = []
+        for pickle_path in self.collect_pickle_files(infiles):
+            npy_path = pickle_path[:-len('.pickle')] + '.npy'
+            if os.path.exists(npy_path) and not overwrite:
+                print(f"Skipping {pickle_path}: {npy_path} exists.")
+                continue
+            print(f"Converting {pickle_path}...")
+            self.converted.append(DSPUtils.convert_pickled_spectrogram(pickle_path,
+                                                                      npy_path,
+                                                                      remove_pickle=remove_pickle
+                                                                      ))
+        print(f"Converted {len(self.converted)} spectrograms.")
+
+    #------------------------------------
+    # collect_pickle_files
+    #-------------------
+
+    def collect_pickle_files(self, infiles):
+        '''
+        Return list of all _spectrogram.pickle files
+        among the given files, and within the given
+        directory trees.
+
+        @param infiles: .pickle files and/or directories
+        @type infiles: [str]
+        @return: paths to pickled spectrograms
+        @rtype: [str]
+        '''
+        pickle_files = []
+        for infile in infiles:
+            if os.path.isdir(infile):
+                pickle_files.extend(str(path) for path in
+                                    DSPUtils.unix_find(infile, r".*_spectrogram\.pickle$"))
+            elif infile.endswith('.pickle'):
+                pickle_files.append(infile)
+            else:
+                print(f"Ignoring {infile}: neither a directory nor a .pickle file.")
+        return pickle_files
+
+# --------------------------- Main ----------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     description="Convert pickled spectrograms to native .npy format."
+                                     )
+
+    parser.add_argument('-r', '--remove_pickle',
+                        action='store_true',
+                        default=False,
+                        help='remove each .pickle file after conversion; default: keep'
+                        );
+    parser.add_argument('-f', '--overwrite',
+                        action='store_true',
+                        default=False,
+                        help='convert even if the .npy file already exists'
+                        );
+    parser.add_argument('infiles',
+                        nargs='+',
+                        help='Repeatable: _spectrogram.pickle files and directories')
+
+    args = parser.parse_args();
+
+    SpectrogramConverter(args.infiles,
+                         remove_pickle=args.remove_pickle,
+                         overwrite=args.overwrite
+                         )
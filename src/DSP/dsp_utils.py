@@ -5,8 +5,9 @@ Created on Apr 5, 2020
 '''
 
 from collections import OrderedDict
-import csv
 from enum import Enum
+import json
+import math
 import os
 from pathlib import Path, PosixPath
 import re
@@ -14,10 +15,12 @@ import sys
 import time
 
 from scipy.io import wavfile
+from scipy.signal import get_window
 import torch
 from torchaudio import transforms
 
-from elephant_utils.logging_service import LoggingService
+from elephant_utils.logging_service import LoggingService, timed
+from elephant_utils.raven_labels import RavenLabelTable
 import numpy as np
 import pandas as pd
 
@@ -40,6 +43,13 @@ class AudioType(Enum):
     IMAGE=5         # PNG of a spectgrogram
     GATED_WAV=6     # .wav file DSP after processing
 
+class UnevenTimesError(ValueError):
+    '''
+    Time labels of a spectrogram are not evenly
+    spaced, so it cannot be saved in native format.
+    '''
+    pass
+
 class DSPUtils(object):
     '''
     classdocs
@@ -144,6 +154,7 @@ class DSPUtils(object):
     #-------------------
     
     @classmethod
+    @timed()
     def save_spectrogram(cls, 
                          magnitudes_np_or_spectr_df, 
                          spectrogram_dest,
@@ -152,8 +163,18 @@ class DSPUtils(object):
                          ):
         '''
         Given magnitudes_np_or_spectr_df magnitudes_np_or_spectr_df, frequency
-        and time axes labels, save as a pickled
-        dataframe
+        and time axes labels, save the spectrogram.
+        
+        The format depends on the extension of spectrogram_dest:
+        
+           o .pickle: a pickled dataframe
+           o .npy:    the native format of SpectrogramFile: a float32
+                      frequency x time matrix that can be memory-mapped,
+                      plus a small .json sidecar with the frequency labels,
+                      frame hop, and start time. See SpectrogramFile.
+                      Spectrograms whose time labels are not evenly
+                      spaced cannot be stored that way; they are pickled
+                      to the same path, with .pickle instead of .npy.
         
         @param magnitudes_np_or_spectr_df: either a
              2d array of magnitudes, or a DataFrame
@@ -165,11 +186,24 @@ class DSPUtils(object):
         @type freq_labels: np_array
         @param time_labels: array of x-axis labels
         @type time_labels: np_array
+        @return: path of the file that was written
+        @rtype: str
         @raise ValueError if parameters are inconsistent.
         '''
+        if str(spectrogram_dest).endswith('.npy'):
+            try:
+                SpectrogramFile.save(magnitudes_np_or_spectr_df, 
+                                     spectrogram_dest, 
+                                     freq_labels, 
+                                     time_labels)
+                return spectrogram_dest
+            except UnevenTimesError:
+                # Fall back to a pickled DataFrame:
+                spectrogram_dest = str(spectrogram_dest)[:-len('.npy')] + '.pickle'
+        
         if type(magnitudes_np_or_spectr_df) == pd.DataFrame:
             magnitudes_np_or_spectr_df.to_pickle(spectrogram_dest)
-            return
+            return spectrogram_dest
         # Got an np array of magnitudes, not a ready-made
         # df. In that case, freq_labels and time_labels must
         # be available:
@@ -189,38 +223,230 @@ class DSPUtils(object):
         # the common protocol:
         
         df.to_pickle(spectrogram_dest, protocol=4)
+        return spectrogram_dest
 
     #------------------------------------
     # load_spectrogram
     #-------------------
     
     @classmethod
-    def load_spectrogram(cls, df_filename):
+    @timed()
+    def load_spectrogram(cls, df_filename, start_sec=None, end_sec=None):
         '''
         Given the path to a pickled dataframe
-        that holds a spectrogram, return the
-        dataframe. The df will have the index
-        (i.e. row labels) set to the frequencies,
+        that holds a spectrogram, or to a native
+        .npy spectrogram (see SpectrogramFile), return 
+        the spectrogram as a dataframe. The df will have
+        the index (i.e. row labels) set to the frequencies,
         and the column names to the time labels.
         
+        If start_sec and/or end_sec are provided, only the
+        time frames between them (inclusive) are returned.
+        For native spectrograms only those frames are read
+        from disk.
+        
         @param df_filename: location of the pickled df
         @type df_filename: str
+        @param start_sec: time of first frame to return
+        @type start_sec: {None | float}
+        @param end_sec: time of last frame to return
+        @type end_sec: {None | float}
         @return: spectrogram DataFrame: columns are 
             times in seconds, index are frequency bands
         @rtype pandas.DataFrame
         @raise FileNotFoundError: when pickle file not found
         @raise pickle.UnpicklingError
         '''
+        if str(df_filename).endswith('.npy'):
+            return SpectrogramFile(df_filename).to_dataframe(start_sec, end_sec)
 
         # Safely read the pickled DataFrame
         df = pd.read_pickle(df_filename)
-        return df
+        if start_sec is None and end_sec is None:
+            return df
+        time_labels = df.columns.astype(float)
+        keep = np.ones(len(time_labels), dtype=bool)
+        if start_sec is not None:
+            keep &= time_labels >= start_sec
+        if end_sec is not None:
+            keep &= time_labels <= end_sec
+        return df.loc[:, keep]
 
         #return({'spectrogram' : df.values,
         #        'freq_labels' : df.index,
         #        'time_labels' : df.columns
         #        })
 
+    #------------------------------------
+    # convert_pickled_spectrogram
+    #-------------------
+    
+    @classmethod
+    def convert_pickled_spectrogram(cls, pickle_path, dest=None, remove_pickle=False):
+        '''
+        Convert a spectrogram that was saved as a pickled
+        DataFrame to the native .npy + sidecar format. 
+        By default the new file is placed next to the
+        pickle file: foo_spectrogram.pickle becomes
+        foo_spectrogram.npy plus foo_spectrogram.json.
+        
+        @param pickle_path: path to the pickled spectrogram
+        @type pickle_path: str
+        @param dest: path of the .npy file to create. 
+            Default: pickle_path with extension .npy
+        @type dest: {None | str}
+        @param remove_pickle: whether or not to remove the
+            pickle file after successful conversion
+        @type remove_pickle: bool
+        @return: path to the new .npy file
+        @rtype: str
+        '''
+        if dest is None:
+            dest = str(Path(pickle_path).with_suffix('.npy'))
+        spect_df = pd.read_pickle(pickle_path)
+        SpectrogramFile.save(spect_df, dest)
+        if remove_pickle:
+            os.remove(pickle_path)
+        return dest
+
+    #------------------------------------
+    # band_limited_spectrogram 
+    #-------------------
+    
+    @classmethod
+    @timed()
+    def band_limited_spectrogram(cls,
+                                 samples,
+                                 framerate,
+                                 nfft=4096,
+                                 hop=None,
+                                 freq_cap=None,
+                                 include_cap=True,
+                                 pad_to=None,
+                                 mode='magnitude',
+                                 frames_per_chunk=256
+                                 ):
+        '''
+        Compute a spectrogram that only contains the frequencies
+        up to freq_cap. The FFTs are computed frames_per_chunk
+        time frames at a time, and bins above the cap are dropped
+        from each chunk before it is added to the result. So the
+        full spectrum of the recording is never in memory. For a
+        24-hr recording at 8kHz, nfft 4096, and a cap of 150Hz,
+        the result is 77 rather than 2049 frequencies, and 
+        float32 magnitudes rather than complex128.
+        
+        Samples may be a memory-mapped array. Modes:
+        
+           o 'magnitude': same values as np.abs() of
+                          scipy.signal.stft(samples, framerate, 
+                                            nperseg=nfft, 
+                                            noverlap=nfft-hop)
+           o 'psd':       same values as matplotlib's
+                          mlab.specgram(samples, NFFT=nfft, Fs=framerate,
+                                        noverlap=nfft-hop, pad_to=pad_to,
+                                        window=mlab.window_hanning)
+        
+        @param samples: audio samples
+        @type samples: np.array
+        @param framerate: samples per second
+        @type framerate: int
+        @param nfft: number of samples in each FFT window
+        @type nfft: int
+        @param hop: number of samples between windows;
+            default: half of nfft
+        @type hop: {None | int}
+        @param freq_cap: highest frequency to keep; 
+            None keeps all frequencies
+        @type freq_cap: {None | float}
+        @param include_cap: whether or not a frequency 
+            equal to freq_cap is kept
+        @type include_cap: bool
+        @param pad_to: length to which each window is
+            zero-padded before the FFT ('psd' mode only);
+            default: nfft
+        @type pad_to: {None | int}
+        @param mode: 'magnitude' or 'psd'
+        @type mode: str
+        @param frames_per_chunk: number of time frames 
+            transformed at a time
+        @type frames_per_chunk: int
+        @return: frequency labels, time labels, and 
+            frequency x time matrix of float32
+        @rtype: (np.array, np.array, np.array)
+        @raise ValueError: for unknown modes
+        '''
+        if hop is None:
+            hop = nfft // 2
+        if pad_to is None or mode == 'magnitude':
+            pad_to = nfft
+        num_samples = len(samples)
+        
+        all_freqs = np.fft.rfftfreq(pad_to, 1. / framerate)
+        if freq_cap is None:
+            num_bins = len(all_freqs)
+        elif include_cap:
+            num_bins = np.count_nonzero(all_freqs <= freq_cap)
+        else:
+            num_bins = np.count_nonzero(all_freqs < freq_cap)
+        freq_labels = all_freqs[:num_bins]
+        
+        if mode == 'magnitude':
+            # Like scipy's stft: pad half a window of zeros
+            # at both ends, and enough zeros at the end 
+            # for the last window to be full:
+            window = get_window('hann', nfft)
+            bin_scales = np.full(num_bins, 1. / window.sum())
+            lead_pad = nfft // 2
+            padded_len = num_samples + 2 * lead_pad
+            num_frames = 1 + math.ceil(max(padded_len - nfft, 0) / hop)
+            time_labels = hop * np.arange(num_frames) / framerate
+        elif mode == 'psd':
+            # Like mlab's specgram: one-sided power 
+            # spectral density, with only recordings shorter
+            # than one window zero-padded:
+            window = np.hanning(nfft)
+            bin_scales = np.full(num_bins, 1. / (framerate * (window**2).sum()))
+            # Power of all but the DC and Nyquist bins is doubled:
+            nyquist_bin = pad_to // 2 if pad_to % 2 == 0 else None
+            bin_scales[1:] *= 2
+            if nyquist_bin is not None and nyquist_bin < num_bins:
+                bin_scales[nyquist_bin] /= 2
+            lead_pad = 0
+            num_frames = 1 + max(num_samples - nfft, 0) // hop
+            time_labels = (nfft / 2 + hop * np.arange(num_frames)) / framerate
+        else:
+            raise ValueError(f"Spectrogram mode must be 'magnitude' or 'psd'; was {mode}")
+        
+        magnitudes = np.empty((num_bins, num_frames), dtype=np.float32)
+        for chunk_start in range(0, num_frames, frames_per_chunk):
+            chunk_end = min(chunk_start + frames_per_chunk, num_frames)
+            # Samples covered by this chunk's windows, in 
+            # coordinates of the original samples; may
+            # reach into the zero padding on either end:
+            first_sample = chunk_start * hop - lead_pad
+            end_sample   = (chunk_end - 1) * hop + nfft - lead_pad
+            excerpt = np.zeros(end_sample - first_sample)
+            src_start = max(first_sample, 0)
+            src_end   = min(end_sample, num_samples)
+            if src_end > src_start:
+                excerpt[src_start - first_sample:src_end - first_sample] = \
+                    samples[src_start:src_end]
+            # Each frame a view into the excerpt, hop samples
+            # after the previous one:
+            frames = np.lib.stride_tricks.as_strided(excerpt,
+                                                     shape=(chunk_end - chunk_start, nfft),
+                                                     strides=(hop * excerpt.strides[0], excerpt.strides[0]),
+                                                     writeable=False)
+            spectrum = np.fft.rfft(frames * window, n=pad_to, axis=1)[:, :num_bins]
+            if mode == 'magnitude':
+                chunk_mags = np.abs(spectrum)
+            else:
+                chunk_mags = spectrum.real**2 + spectrum.imag**2
+            magnitudes[:, chunk_start:chunk_end] = (chunk_mags * bin_scales).T
+            
+        return (freq_labels, time_labels, magnitudes)
+
     #------------------------------------
     # spectrogram_to_db 
     #-------------------
@@ -301,24 +527,14 @@ class DSPUtils(object):
             one inclusive start/end time pair of a call
         @rtype: [pd.Interval]
         '''
+        labels = RavenLabelTable.load(label_file)
         label_time_intervals = []
-        with open(label_file, 'r') as fd:
-            reader = csv.DictReader(fd, delimiter='\t')
-            begin_time_key = 'Begin Time (s)'
-            end_time_key   = 'End Time (s)'
-            # Get each el call time range spec in the labels:
-            for label_dict in reader:
-                try:
-                    begin_time = float(label_dict[begin_time_key])
-                    end_time   = float(label_dict[end_time_key])
-                except KeyError:
-                    raise IOError(f"Raven label file {label_file} does not contain one "
-                                  f"or both of keys '{begin_time_key}', {end_time_key}'")
-                
-                if end_time < begin_time:
-                    cls.log.err(f"Bad label: end label less than begin label: {end_time} < {begin_time}")
-                    continue
-                label_time_intervals.append(pd.Interval(left=begin_time, right=end_time))
+        # Get each el call time range spec in the labels:
+        for (begin_time, end_time) in zip(labels.begin.tolist(), labels.end.tolist()):
+            if end_time < begin_time:
+                cls.log.err(f"Bad label: end label less than begin label: {end_time} < {begin_time}")
+                continue
+            label_time_intervals.append(pd.Interval(left=begin_time, right=end_time))
         return label_time_intervals
 
     #------------------------------------
@@ -646,6 +862,11 @@ class FileFamily(object):
         elif filetype == AudioType.GATED_WAV:
             return os.path.join(self.path, self.gated_wav)
         elif filetype == AudioType.SPECTRO:
+            # The native spectrogram if there is one,
+            # else the pickled one:
+            native_path = os.path.join(self.path, self.spectro_npy)
+            if os.path.exists(native_path):
+                return native_path
             return os.path.join(self.path, self.spectro)
         elif filetype == AudioType.SNIPPET:
             # If snippet_id is None, return a list of 
@@ -715,6 +936,7 @@ class FileFamily(object):
            o .png file
            o _spectrogram.pickle
            o _spectrogram_<n>.pickle
+           o _spectrogram.npy, _<n>_spectrogram.npy
            o .npy file
            
         initialize all instance variables in 
@@ -738,18 +960,19 @@ class FileFamily(object):
         #    nn05b_20180617_000000_spectrogram.pickle
         # This last one is a 24-hr, full spectrogram:
         
-        snippet_search_pattern = re.compile(r"(.*_[0]+)_([0-9]+)_spectrogram[.]pickle") 
+        snippet_search_pattern = re.compile(r"(.*_[0]+)_([0-9]+)_spectrogram[.](pickle|npy)") 
 
         # Name without path and extension:
         file_root = fpath.name[:-len(fpath.suffix)]
-        # If it's foo_spectrogram.pickle or foo_<n>_spectrogram.pickle: 
-        if filename.endswith('_spectrogram.pickle'):
+        # If it's foo_spectrogram.pickle or foo_<n>_spectrogram.pickle
+        # (or the native .npy equivalents): 
+        if filename.endswith('_spectrogram.pickle') or filename.endswith('_spectrogram.npy'):
             # Lose the _spectrogram.pickle:
             file_root = file_root[:-len('_spectrogram')]
             # Get spectro_id if file is a spectrogram snippet:        
             matched_fragments = snippet_search_pattern.search(filename)
             if matched_fragments is not None:
-                (_path, snippet_id) = matched_fragments.groups()
+                (_path, snippet_id, _ext) = matched_fragments.groups()
                 self.snippet_ids.append(snippet_id)
                 # Remove the snippet id from file root:
                 # The 1+ is for the leading underscore
@@ -771,6 +994,9 @@ class FileFamily(object):
 
         if str(fpath).endswith("_gated.wav"):
             self.file_type = AudioType.GATED_WAV
+        elif str(fpath).endswith('_spectrogram.npy'):
+            # Native spectrogram; type was set above:
+            pass
         elif fpath.suffix == '.wav':
             self.file_type = AudioType.WAV
         elif fpath.suffix == '.txt':
@@ -785,12 +1011,986 @@ class FileFamily(object):
             # Unknown type of file:
             raise ValueError(f"File '{filename} not in family of elephant file name conventions.")
 
+        self._set_member_names(file_root)
+
+    #------------------------------------
+    # from_parts 
+    #-------------------
+
+    @classmethod
+    def from_parts(cls, filename, file_root, file_type, snippet_ids=None):
+        '''
+        Create an instance from an already decoded 
+        file name, such as one kept by RecordingCatalog,
+        without parsing the name again.
+        
+        @param filename: full path of the family member
+        @type filename: str
+        @param file_root: file root as set by decode_filename()
+        @type file_root: str
+        @param file_type: type of the member
+        @type file_type: AudioType
+        @param snippet_ids: snippet ids as set by decode_filename()
+        @type snippet_ids: {None|[str]}
+        @return: new instance
+        @rtype: FileFamily
+        '''
+        file_family = cls.__new__(cls)
+        file_family.snippet_ids = [] if snippet_ids is None else list(snippet_ids)
+        file_family.file_root = file_root
+        file_family.file_type = file_type
+        path = os.path.dirname(filename)
+        file_family.path = path if len(path) > 0 else None
+        file_family._set_member_names(file_root)
+        return file_family
+
+    #------------------------------------
+    # _set_member_names 
+    #-------------------
+
+    def _set_member_names(self, file_root):
         self.wav     = file_root + '.wav'
         self.gated_wav = f"{file_root}_gated.wav"
         self.label   = file_root + '.txt'
         self.mask    = file_root + '.npy'
         self.png     = file_root + '.png'
         self.spectro = file_root + '_spectrogram.pickle'
+        self.spectro_npy = file_root + '_spectrogram.npy'
+
+# ---------------------------- Class SpectrogramFile ------------
+
+class SpectrogramFile(object):
+    '''
+    Native on-disk spectrogram. Replaces pickled DataFrames,
+    whose column index of float time labels alone is heavy
+    for 24-hr spectrograms, and which can only be read 
+    as a whole. A spectrogram foo_spectrogram.npy consists of:
+    
+        o foo_spectrogram.npy:  float32 matrix, frequencies x time
+                                frames, in standard .npy format
+        o foo_spectrogram.json: sidecar with frequency labels, 
+                                the time between frames (hop),
+                                and the time of the first frame
+                                
+    Time labels are not stored, but computed as 
+    start_secs + frame_index * frame_hop_secs. 
+    
+    Instances memory-map the matrix, so opening is
+    immediate, and only the time frames actually 
+    accessed are read from disk:
+    
+        spect = SpectrogramFile('foo_spectrogram.npy')
+        spect.freq_labels
+        spect.frames(3600, 7200)        # np view of hour two
+        spect.to_dataframe(3600, 7200)  # Same, as a DataFrame
+    '''
+
+    SIDECAR_EXT = '.json'
+    FORMAT_VERSION = 1
+    
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self, npy_path):
+        '''
+        @param npy_path: path to the .npy matrix file
+        @type npy_path: str
+        @raise FileNotFoundError: if matrix or sidecar are missing
+        '''
+        self.npy_path = str(npy_path)
+        with open(self.sidecar_path(self.npy_path), 'r') as fd:
+            self.metadata = json.load(fd)
+            
+        self.freq_labels    = np.array(self.metadata['freq_labels'])
+        self.frame_hop_secs = self.metadata['frame_hop_secs']
+        self.start_secs     = self.metadata['start_secs']
+        self.magnitudes     = np.load(self.npy_path, mmap_mode='r')
+        
+    #------------------------------------
+    # shape
+    #-------------------
+    
+    @property
+    def shape(self):
+        return self.magnitudes.shape
+    
+    #------------------------------------
+    # time_labels
+    #-------------------
+    
+    @property
+    def time_labels(self):
+        '''
+        Time in seconds of every frame.
+        '''
+        return self.time_labels_of(0, self.shape[1])
+
+    #------------------------------------
+    # time_labels_of
+    #-------------------
+    
+    def time_labels_of(self, start_frame, end_frame):
+        '''
+        Time in seconds of frames start_frame up to,
+        but excluding end_frame.
+        '''
+        return self.start_secs + self.frame_hop_secs * np.arange(start_frame, end_frame)
+
+    #------------------------------------
+    # frame_range
+    #-------------------
+    
+    def frame_range(self, start_sec=None, end_sec=None):
+        '''
+        Return indices of the first frame at or after 
+        start_sec, and one beyond the last frame at or
+        before end_sec. 
+        
+        @param start_sec: earliest time; None for start of recording 
+        @type start_sec: {None | float}
+        @param end_sec: latest time; None for end of recording
+        @type end_sec: {None | float}
+        @return: start and (exclusive) end frame indices
+        @rtype: (int, int)
+        '''
+        num_frames = self.shape[1]
+        # Tolerance for float time labels that
+        # are a hair off the frame grid:
+        eps = 1e-6
+        if start_sec is None:
+            start_frame = 0
+        else:
+            start_frame = math.ceil((start_sec - self.start_secs) / self.frame_hop_secs - eps)
+            start_frame = min(max(0, start_frame), num_frames)
+        if end_sec is None:
+            end_frame = num_frames
+        else:
+            end_frame = 1 + math.floor((end_sec - self.start_secs) / self.frame_hop_secs + eps)
+            end_frame = min(max(start_frame, end_frame), num_frames)
+        return (start_frame, end_frame)
+
+    #------------------------------------
+    # frames
+    #-------------------
+    
+    def frames(self, start_sec=None, end_sec=None):
+        '''
+        Return the (read-only, memory-mapped) magnitudes
+        of the frames between start_sec and end_sec, 
+        inclusive. 
+        
+        @param start_sec: earliest time; None for start of recording 
+        @type start_sec: {None | float}
+        @param end_sec: latest time; None for end of recording
+        @type end_sec: {None | float}
+        @return: frequencies x frames view into the matrix
+        @rtype: np.memmap
+        '''
+        (start_frame, end_frame) = self.frame_range(start_sec, end_sec)
+        return self.magnitudes[:, start_frame:end_frame]
+
+    #------------------------------------
+    # to_dataframe
+    #-------------------
+    
+    def to_dataframe(self, start_sec=None, end_sec=None):
+        '''
+        Return the frames between start_sec and end_sec
+        as a DataFrame in the form that load_spectrogram()
+        has always returned: index are frequencies, columns
+        are times.
+        
+        @param start_sec: earliest time; None for start of recording 
+        @type start_sec: {None | float}
+        @param end_sec: latest time; None for end of recording
+        @type end_sec: {None | float}
+        @return: spectrogram excerpt
+        @rtype: pd.DataFrame
+        '''
+        (start_frame, end_frame) = self.frame_range(start_sec, end_sec)
+        return pd.DataFrame(np.array(self.magnitudes[:, start_frame:end_frame]),
+                            index=self.freq_labels,
+                            columns=self.time_labels_of(start_frame, end_frame)
+                            )
+
+    #------------------------------------
+    # save
+    #-------------------
+    
+    @classmethod
+    def save(cls, 
+             magnitudes_np_or_spectr_df, 
+             npy_path, 
+             freq_labels=None, 
+             time_labels=None):
+        '''
+        Write a spectrogram in native format. Accepts
+        either a spectrogram DataFrame, or a magnitudes
+        matrix plus frequency and time labels. Time labels 
+        must be evenly spaced.
+        
+        @param magnitudes_np_or_spectr_df: either a
+             2d array of magnitudes, or a DataFrame
+             comprising the magnitudes, times and freqs.
+        @type magnitudes_np_or_spectr_df: {pd.DataFrame|np.array}
+        @param npy_path: destination .npy file
+        @type npy_path: str
+        @param freq_labels: array of y-axis labels
+        @type freq_labels: np_array
+        @param time_labels: array of x-axis labels
+        @type time_labels: np_array
+        @raise ValueError if parameters are inconsistent.
+        @raise UnevenTimesError if time labels are not evenly spaced.
+        '''
+        if type(magnitudes_np_or_spectr_df) == pd.DataFrame:
+            freq_labels = magnitudes_np_or_spectr_df.index.to_numpy(dtype=float)
+            time_labels = magnitudes_np_or_spectr_df.columns.to_numpy(dtype=float)
+            magnitudes  = magnitudes_np_or_spectr_df.to_numpy(dtype=np.float32)
+        else:
+            if freq_labels is None or time_labels is None:
+                raise ValueError("When magnitudes_np_or_spectr_df is an np array, freq/time labels must be provided.")
+            magnitudes  = np.asarray(magnitudes_np_or_spectr_df, dtype=np.float32)
+            time_labels = np.asarray(time_labels, dtype=float)
+            
+        if magnitudes.shape != (len(freq_labels), len(time_labels)):
+            raise ValueError(f"Spectrogram shape {magnitudes.shape} does not match "
+                             f"{len(freq_labels)} freq labels by {len(time_labels)} time labels.")
+
+        if len(time_labels) > 1:
+            frame_hop_secs = float(time_labels[1] - time_labels[0])
+            expected_times = time_labels[0] + frame_hop_secs * np.arange(len(time_labels))
+            if not np.allclose(time_labels, expected_times, rtol=0, atol=1e-4 * frame_hop_secs):
+                raise UnevenTimesError("Time labels must be evenly spaced to be saved in native format.")
+        else:
+            frame_hop_secs = 1.
+        
+        np.save(npy_path, magnitudes)
+        cls.save_sidecar(npy_path, 
+                         freq_labels, 
+                         frame_hop_secs, 
+                         float(time_labels[0]) if len(time_labels) > 0 else 0.,
+                         magnitudes.shape)
+
+    #------------------------------------
+    # save_sidecar
+    #-------------------
+    
+    @classmethod
+    def save_sidecar(cls, npy_path, freq_labels, frame_hop_secs, start_secs, shape):
+        '''
+        Write the .json sidecar for a float32 matrix
+        that was, or will be written to npy_path by
+        other means than save(). 
+        
+        @param npy_path: the .npy matrix file
+        @type npy_path: str
+        @param freq_labels: frequency of each row
+        @type freq_labels: np_array
+        @param frame_hop_secs: time between frames
+        @type frame_hop_secs: float
+        @param start_secs: time of the first frame
+        @type start_secs: float
+        @param shape: shape of the matrix
+        @type shape: (int, int)
+        '''
+        metadata = {'format_version' : cls.FORMAT_VERSION,
+                    'freq_labels'    : [float(freq) for freq in freq_labels],
+                    'frame_hop_secs' : float(frame_hop_secs),
+                    'start_secs'     : float(start_secs),
+                    'shape'          : list(shape),
+                    'dtype'          : 'float32'
+                    }
+        with open(cls.sidecar_path(npy_path), 'w') as fd:
+            json.dump(metadata, fd)
+
+    #------------------------------------
+    # sidecar_path
+    #-------------------
+    
+    @classmethod
+    def sidecar_path(cls, npy_path):
+        return str(Path(npy_path).with_suffix(cls.SIDECAR_EXT))
+
+# ---------------------------- Class SpectrogramPyramid ------------
+
+class SpectrogramPyramid(object):
+    '''
+    Time-decimated copies of a spectrogram, for plotting
+    spans of hours without handing millions of frames
+    to matplotlib. Level k pools every 2**k adjacent 
+    frames of the spectrogram, once by their maximum, 
+    and once by their mean. Max pooling keeps short calls
+    visible in overviews; the mean shows the background.
+    Levels are added for as long as they have at
+    least min_level_frames frames.
+    
+    The pyramid of foo_spectrogram.npy (or .pickle) is 
+    kept next to it:
+    
+        foo_spectrogram_pyramid/pyramid.json    levels, and the size and
+                                                modification time of the
+                                                spectrogram they were made from
+        foo_spectrogram_pyramid/level_1_max.npy native spectrograms
+        foo_spectrogram_pyramid/level_1_max.json   (see SpectrogramFile)
+        foo_spectrogram_pyramid/level_1_mean.npy
+            ...
+    
+    for_spectrogram() builds the pyramid on first use, and
+    rebuilds it when the spectrogram changed:
+    
+        pyramid = SpectrogramPyramid.for_spectrogram('foo_spectrogram.npy')
+        pyramid.to_dataframe(pixel_width=1500)            # Whole day
+        pyramid.to_dataframe(3600, 3660, pixel_width=800) # One minute
+        
+    The level used for a time span is the coarsest that still has 
+    at least pixel_width frames in the span, so that little is 
+    lost at the resolution of the plot. Short spans come from
+    the spectrogram itself (level 0).
+    '''
+
+    INDEX_FILE = 'pyramid.json'
+    DIR_SUFFIX = '_pyramid'
+    FORMAT_VERSION = 1
+    REDUCTIONS = ('max', 'mean')
+    MIN_LEVEL_FRAMES = 512
+    # Spectrogram frames pooled at a time while building:
+    BUILD_BLOCK_FRAMES = 1 << 16
+    
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self, spectro_path):
+        '''
+        Open an existing pyramid. Use for_spectrogram()
+        to build it when needed.
+        
+        @param spectro_path: the spectrogram whose pyramid to open 
+        @type spectro_path: str
+        @raise FileNotFoundError: if the pyramid was not built
+        '''
+        self.spectro_path = str(spectro_path)
+        self.pyramid_dir  = self.pyramid_dir_of(self.spectro_path)
+        with open(os.path.join(self.pyramid_dir, self.INDEX_FILE), 'r') as fd:
+            self.index = json.load(fd)
+        self.num_levels     = self.index['num_levels']
+        self.num_frames     = self.index['num_frames']
+        self.frame_hop_secs = self.index['frame_hop_secs']
+        self.start_secs     = self.index['start_secs']
+        # Level files are opened when first needed:
+        self.levels = {}
+        # Level 0 of pickled spectrograms:
+        self.spectro_df = None
+
+    #------------------------------------
+    # end_secs
+    #-------------------
+    
+    @property
+    def end_secs(self):
+        '''
+        Time of the last frame of the spectrogram
+        '''
+        return self.start_secs + self.frame_hop_secs * (self.num_frames - 1)
+
+    #------------------------------------
+    # for_spectrogram
+    #-------------------
+    
+    @classmethod
+    def for_spectrogram(cls, spectro_path, min_level_frames=None):
+        '''
+        Return the pyramid of the given spectrogram, building
+        it first if it does not exist, or if the spectrogram
+        changed since it was built.
+        
+        @param spectro_path: .npy or .pickle spectrogram
+        @type spectro_path: str
+        @param min_level_frames: see build()
+        @type min_level_frames: {None | int}
+        @return: the pyramid
+        @rtype: SpectrogramPyramid
+        '''
+        if not cls.is_current(spectro_path):
+            cls.build(spectro_path, min_level_frames=min_level_frames)
+        return cls(spectro_path)
+
+    #------------------------------------
+    # is_current
+    #-------------------
+    
+    @classmethod
+    def is_current(cls, spectro_path):
+        '''
+        Whether the pyramid of spectro_path exists, and was
+        built from the spectrogram as it is now.
+        '''
+        try:
+            with open(os.path.join(cls.pyramid_dir_of(spectro_path), cls.INDEX_FILE), 'r') as fd:
+                index = json.load(fd)
+        except (OSError, ValueError):
+            return False
+        stat = os.stat(spectro_path)
+        return index.get('format_version') == cls.FORMAT_VERSION \
+            and index.get('source_size') == stat.st_size \
+            and index.get('source_mtime_ns') == stat.st_mtime_ns
+
+    #------------------------------------
+    # build
+    #-------------------
+    
+    @classmethod
+    def build(cls, spectro_path, min_level_frames=None):
+        '''
+        Create the pyramid of a spectrogram. Native spectrograms
+        are read block by block, so that building the pyramid
+        of a 24-hr spectrogram does not need it in memory.
+        
+        @param spectro_path: .npy or .pickle spectrogram
+        @type spectro_path: str
+        @param min_level_frames: no level is made with fewer 
+            frames than this. Default: MIN_LEVEL_FRAMES
+        @type min_level_frames: {None | int}
+        @return: the number of levels built
+        @rtype: int
+        '''
+        if min_level_frames is None:
+            min_level_frames = cls.MIN_LEVEL_FRAMES
+        spectro_path = str(spectro_path)
+        stat = os.stat(spectro_path)
+        if spectro_path.endswith('.npy'):
+            spect_file  = SpectrogramFile(spectro_path)
+            magnitudes  = spect_file.magnitudes
+            freq_labels = spect_file.freq_labels
+            frame_hop_secs = spect_file.frame_hop_secs
+            start_secs  = spect_file.start_secs
+        else:
+            spect = Spectrogram.from_dataframe(DSPUtils.load_spectrogram(spectro_path))
+            magnitudes  = spect.magnitudes
+            freq_labels = spect.freq_labels
+            time_labels = spect.time_labels
+            frame_hop_secs = float(time_labels[1] - time_labels[0]) if len(time_labels) > 1 else 1.
+            start_secs  = float(time_labels[0]) if len(time_labels) > 0 else 0.
+
+        (num_freqs, num_frames) = magnitudes.shape
+        num_levels = 0
+        while math.ceil(num_frames / 2**(num_levels + 1)) >= min_level_frames:
+            num_levels += 1
+
+        pyramid_dir = cls.pyramid_dir_of(spectro_path)
+        os.makedirs(pyramid_dir, exist_ok=True)
+        # A pyramid without index is incomplete, and
+        # is not used, should the build be interrupted:
+        index_path = os.path.join(pyramid_dir, cls.INDEX_FILE)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        
+        level_mats = {}
+        for level in range(1, num_levels + 1):
+            factor = 2**level
+            level_frames = math.ceil(num_frames / factor)
+            for reduction in cls.REDUCTIONS:
+                level_path = cls.level_path_of(spectro_path, level, reduction)
+                level_mats[(level, reduction)] = \
+                    np.lib.format.open_memmap(level_path, 
+                                              mode='w+', 
+                                              dtype=np.float32,
+                                              shape=(num_freqs, level_frames))
+                # Level frames lie at the center 
+                # of the frames they pool:
+                SpectrogramFile.save_sidecar(level_path, 
+                                             freq_labels, 
+                                             frame_hop_secs * factor, 
+                                             start_secs + frame_hop_secs * (factor - 1) / 2.,
+                                             (num_freqs, level_frames))
+
+        # Blocks start at multiples of the coarsest level's 
+        # factor, so that every level's frames come out whole:
+        block_frames = max(2**num_levels, 
+                           cls.BUILD_BLOCK_FRAMES - cls.BUILD_BLOCK_FRAMES % 2**num_levels)
+        for block_start in range(0, num_frames if num_levels > 0 else 0, block_frames):
+            block = np.asarray(magnitudes[:, block_start:block_start + block_frames], 
+                               dtype=np.float32)
+            pooled = {reduction : block for reduction in cls.REDUCTIONS}
+            for level in range(1, num_levels + 1):
+                level_start = block_start // 2**level
+                for reduction in cls.REDUCTIONS:
+                    pooled[reduction] = cls.pool_pairs(pooled[reduction], reduction)
+                    level_mat = level_mats[(level, reduction)]
+                    level_mat[:, level_start:level_start + pooled[reduction].shape[1]] = pooled[reduction]
+
+        for level_mat in level_mats.values():
+            level_mat.flush()
+        del level_mats
+        
+        index = {'format_version'  : cls.FORMAT_VERSION,
+                 'num_levels'      : num_levels,
+                 'num_frames'      : num_frames,
+                 'frame_hop_secs'  : frame_hop_secs,
+                 'start_secs'      : start_secs,
+                 'source_size'     : stat.st_size,
+                 'source_mtime_ns' : stat.st_mtime_ns
+                 }
+        with open(index_path + '.tmp', 'w') as fd:
+            json.dump(index, fd)
+        os.replace(index_path + '.tmp', index_path)
+        return num_levels
+
+    #------------------------------------
+    # pool_pairs
+    #-------------------
+    
+    @classmethod
+    def pool_pairs(cls, values, reduction='max'):
+        '''
+        Pool each two adjacent columns (or elements of a 
+        1D array) into one, by their max or mean. An odd 
+        last column is kept as is.
+        
+        @param values: frequency x time matrix, or 1D array
+        @type values: np.array
+        @param reduction: 'max' or 'mean'
+        @type reduction: str
+        @return: values with half as many columns, rounded up
+        @rtype: np.array
+        '''
+        values = np.asarray(values)
+        num_cols = values.shape[-1]
+        even_cols = num_cols - num_cols % 2
+        left  = values[..., 0:even_cols:2]
+        right = values[..., 1:even_cols:2]
+        if reduction == 'max':
+            pooled = np.maximum(left, right)
+        elif reduction == 'mean':
+            pooled = (left + right) / 2
+        else:
+            raise ValueError(f"Reduction must be one of {cls.REDUCTIONS}, not '{reduction}'")
+        if num_cols % 2 == 1:
+            pooled = np.concatenate((pooled, values[..., -1:]), axis=-1)
+        return pooled
+
+    #------------------------------------
+    # decimate
+    #-------------------
+    
+    @classmethod
+    def decimate(cls, values, level, reduction='max'):
+        '''
+        Pool the columns of a matrix, or the elements of a 1D
+        array, such as a label mask or model predictions, the
+        way level level of a pyramid pools frames.
+        
+        @param values: frequency x time matrix, or 1D array
+        @type values: np.array
+        @param level: pyramid level; 0 returns values unchanged
+        @type level: int
+        @param reduction: 'max' or 'mean'
+        @type reduction: str
+        @return: values with 2**level times fewer columns, rounded up
+        @rtype: np.array
+        '''
+        for _i in range(level):
+            values = cls.pool_pairs(values, reduction)
+        return values
+
+    #------------------------------------
+    # level_for_span
+    #-------------------
+    
+    @classmethod
+    def level_for_span(cls, span_frames, pixel_width, max_level=None):
+        '''
+        The coarsest level at which span_frames spectrogram
+        frames still take up at least pixel_width frames.
+        
+        @param span_frames: number of frames to plot
+        @type span_frames: int
+        @param pixel_width: width of the plot in pixels
+        @type pixel_width: int
+        @param max_level: highest level available
+        @type max_level: {None | int}
+        @return: pyramid level
+        @rtype: int
+        '''
+        if span_frames <= pixel_width or pixel_width < 1:
+            return 0
+        level = int(math.floor(math.log2(span_frames / pixel_width)))
+        return level if max_level is None else min(level, max_level)
+
+    #------------------------------------
+    # level_file
+    #-------------------
+    
+    def level_file(self, level, reduction='max'):
+        '''
+        The SpectrogramFile of one level, or of the
+        spectrogram itself for level 0 of native
+        spectrograms.
+        '''
+        try:
+            return self.levels[(level, reduction)]
+        except KeyError:
+            pass
+        if level == 0:
+            spect_file = SpectrogramFile(self.spectro_path)
+        else:
+            spect_file = SpectrogramFile(self.level_path_of(self.spectro_path, level, reduction))
+        self.levels[(level, reduction)] = spect_file
+        return spect_file
+
+    #------------------------------------
+    # level_frames
+    #-------------------
+    
+    def level_frames(self, start_sec=None, end_sec=None, pixel_width=1000):
+        '''
+        Choose the level at which to plot the time span
+        between start_sec and end_sec: the coarsest that
+        has at least pixel_width frames in the span. Return
+        that level, and the range of its frames that cover
+        the span. Frame i of level k pools the spectrogram 
+        frames i * 2**k up to, but excluding (i + 1) * 2**k.
+        
+        @param start_sec: earliest time; None for start of recording 
+        @type start_sec: {None | float}
+        @param end_sec: latest time; None for end of recording
+        @type end_sec: {None | float}
+        @param pixel_width: width of the plot in pixels
+        @type pixel_width: int
+        @return: level, and its start and (exclusive) end frame
+        @rtype: (int, int, int)
+        '''
+        # Tolerance for times that are a hair off the frame grid:
+        eps = 1e-6
+        first_frame = 0 if start_sec is None \
+            else math.ceil((start_sec - self.start_secs) / self.frame_hop_secs - eps)
+        last_frame  = self.num_frames - 1 if end_sec is None \
+            else math.floor((end_sec - self.start_secs) / self.frame_hop_secs + eps)
+        first_frame = min(max(0, first_frame), self.num_frames)
+        last_frame  = min(max(first_frame - 1, last_frame), self.num_frames - 1)
+        
+        level = self.level_for_span(last_frame - first_frame + 1, pixel_width, self.num_levels)
+        factor = 2**level
+        if last_frame < first_frame:
+            return (level, first_frame // factor, first_frame // factor)
+        return (level, first_frame // factor, last_frame // factor + 1)
+
+    #------------------------------------
+    # excerpt
+    #-------------------
+    
+    def excerpt(self, level, start_frame, end_frame, reduction='max'):
+        '''
+        Frames start_frame up to, but excluding end_frame of
+        one level as a DataFrame in the form returned by
+        DSPUtils.load_spectrogram(): index are frequencies,
+        columns are the times at the center of the pooled frames.
+        
+        @param level: pyramid level; 0 for the spectrogram itself
+        @type level: int
+        @param start_frame: first frame of the level
+        @type start_frame: int
+        @param end_frame: frame beyond the last frame
+        @type end_frame: int
+        @param reduction: 'max' or 'mean' pooling
+        @type reduction: str
+        @return: spectrogram excerpt
+        @rtype: pd.DataFrame
+        '''
+        if level == 0 and not self.spectro_path.endswith('.npy'):
+            # Pickled spectrograms can only be read whole:
+            if self.spectro_df is None:
+                self.spectro_df = DSPUtils.load_spectrogram(self.spectro_path)
+            return self.spectro_df.iloc[:, start_frame:end_frame]
+        
+        spect_file = self.level_file(level, reduction)
+        return pd.DataFrame(np.array(spect_file.magnitudes[:, start_frame:end_frame]),
+                            index=spect_file.freq_labels,
+                            columns=spect_file.time_labels_of(start_frame, end_frame)
+                            )
+
+    #------------------------------------
+    # to_dataframe
+    #-------------------
+    
+    def to_dataframe(self, start_sec=None, end_sec=None, pixel_width=1000, reduction='max'):
+        '''
+        Return the spectrogram between start_sec and end_sec
+        at the coarsest level that still has at least
+        pixel_width frames in that span (see level_frames()).
+        
+        @param start_sec: earliest time; None for start of recording 
+        @type start_sec: {None | float}
+        @param end_sec: latest time; None for end of recording
+        @type end_sec: {None | float}
+        @param pixel_width: width of the plot in pixels
+        @type pixel_width: int
+        @param reduction: 'max' or 'mean' pooling
+        @type reduction: str
+        @return: spectrogram excerpt
+        @rtype: pd.DataFrame
+        '''
+        (level, start_frame, end_frame) = self.level_frames(start_sec, end_sec, pixel_width)
+        return self.excerpt(level, start_frame, end_frame, reduction)
+
+    #------------------------------------
+    # pyramid_dir_of
+    #-------------------
+    
+    @classmethod
+    def pyramid_dir_of(cls, spectro_path):
+        return str(Path(spectro_path).with_suffix('')) + cls.DIR_SUFFIX
+
+    #------------------------------------
+    # level_path_of
+    #-------------------
+    
+    @classmethod
+    def level_path_of(cls, spectro_path, level, reduction):
+        return os.path.join(cls.pyramid_dir_of(spectro_path), f"level_{level}_{reduction}.npy")
+
+# ---------------------------- Class Spectrogram ------------
+
+class Spectrogram(object):
+    '''
+    Lightweight in-memory spectrogram: a float32 frequency x time
+    matrix, plus the frequency labels of its rows, and the time
+    labels of its columns. Used instead of DataFrames within
+    processing steps; DataFrames are only created when
+    spectrograms are read or written (see from_dataframe() and
+    to_dataframe()).
+    
+    Cropping returns Spectrogram instances that are views
+    into the same matrix. Modifying methods operate in place.
+    Frequency labels are expected in ascending order, as
+    produced by all of our spectrogram creation methods.
+    
+        spect = Spectrogram.from_dataframe(spect_df)
+        spect.crop_freqs(max_freq=150).suppress_energy(-50)
+        spect.band_mean(10, 30)
+    '''
+    
+    __slots__ = ('magnitudes', 'freq_labels', 'time_labels')
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self, magnitudes, freq_labels, time_labels):
+        '''
+        Magnitudes are not copied if they already are
+        a float32 array.
+        
+        @param magnitudes: frequency x time matrix
+        @type magnitudes: np.array
+        @param freq_labels: frequency of each row
+        @type freq_labels: np.array
+        @param time_labels: time of each column
+        @type time_labels: np.array
+        @raise ValueError: if labels do not match the matrix
+        '''
+        self.magnitudes  = np.asarray(magnitudes, dtype=np.float32)
+        self.freq_labels = np.asarray(freq_labels, dtype=float)
+        self.time_labels = np.asarray(time_labels, dtype=float)
+        if self.magnitudes.shape != (len(self.freq_labels), len(self.time_labels)):
+            raise ValueError(f"Spectrogram shape {self.magnitudes.shape} does not match "
+                             f"{len(self.freq_labels)} freq labels by {len(self.time_labels)} time labels.")
+
+    #------------------------------------
+    # from_dataframe
+    #-------------------
+
+    @classmethod
+    def from_dataframe(cls, spect_df):
+        '''
+        Create a Spectrogram from a DataFrame whose index
+        are frequencies, and whose columns are times. The
+        matrix is shared with the DataFrame when it already
+        holds float32 values.
+        
+        @param spect_df: spectrogram
+        @type spect_df: pd.DataFrame
+        @return: new spectrogram
+        @rtype: Spectrogram
+        '''
+        return cls(spect_df.to_numpy(dtype=np.float32),
+                   spect_df.index.to_numpy(dtype=float),
+                   spect_df.columns.to_numpy(dtype=float)
+                   )
+
+    #------------------------------------
+    # to_dataframe
+    #-------------------
+
+    def to_dataframe(self):
+        '''
+        Return a DataFrame with index set to the 
+        frequencies, and columns to the times. 
+        '''
+        return pd.DataFrame(self.magnitudes,
+                            index=self.freq_labels,
+                            columns=self.time_labels
+                            )
+
+    #------------------------------------
+    # shape
+    #-------------------
+
+    @property
+    def shape(self):
+        return self.magnitudes.shape
+
+    #------------------------------------
+    # copy
+    #-------------------
+
+    def copy(self):
+        return Spectrogram(self.magnitudes.copy(), 
+                           self.freq_labels.copy(), 
+                           self.time_labels.copy())
+
+    #------------------------------------
+    # crop_freqs
+    #-------------------
+
+    def crop_freqs(self, min_freq=None, max_freq=None, include_max=True):
+        '''
+        Return a view of this spectrogram that only has
+        the rows of frequencies between min_freq (inclusive)
+        and max_freq. 
+        
+        @param min_freq: lowest frequency to keep; None for no bound
+        @type min_freq: {None | float}
+        @param max_freq: highest frequency to keep; None for no bound
+        @type max_freq: {None | float}
+        @param include_max: whether a row with frequency 
+            max_freq is kept
+        @type include_max: bool
+        @return: spectrogram that shares the matrix with this one
+        @rtype: Spectrogram
+        '''
+        (first_row, end_row) = self.freq_rows(min_freq, max_freq, include_max)
+        return Spectrogram(self.magnitudes[first_row:end_row],
+                           self.freq_labels[first_row:end_row],
+                           self.time_labels)
+
+    #------------------------------------
+    # crop_times
+    #-------------------
+
+    def crop_times(self, start_col, end_col):
+        '''
+        Return a view of this spectrogram that only has
+        columns start_col up to, but excluding end_col.
+        '''
+        return Spectrogram(self.magnitudes[:, start_col:end_col],
+                           self.freq_labels,
+                           self.time_labels[start_col:end_col])
+
+    #------------------------------------
+    # freq_rows
+    #-------------------
+
+    def freq_rows(self, min_freq=None, max_freq=None, include_max=False):
+        '''
+        Return the first row index whose frequency is at 
+        least min_freq, and the index one beyond the last
+        row whose frequency is below (or at, if include_max)
+        max_freq.
+        
+        @return: start and (exclusive) end row
+        @rtype: (int, int)
+        '''
+        first_row = 0 if min_freq is None \
+            else np.searchsorted(self.freq_labels, min_freq, side='left')
+        if max_freq is None:
+            end_row = len(self.freq_labels)
+        else:
+            end_row = np.searchsorted(self.freq_labels, 
+                                      max_freq, 
+                                      side='right' if include_max else 'left')
+        return (int(first_row), int(max(first_row, end_row)))
+
+    #------------------------------------
+    # suppress_energy
+    #-------------------
+
+    def suppress_energy(self, energy_suppression):
+        '''
+        In place: set all magnitudes at or below
+        max_magnitude * 10**(energy_suppression/20) 
+        to zero. 
+        
+        @param energy_suppression: dB relative to the 
+            maximum magnitude
+        @type energy_suppression: {int | float}
+        @return: this spectrogram
+        @rtype: Spectrogram
+        '''
+        if self.magnitudes.size == 0:
+            return self
+        max_energy = np.amax(self.magnitudes)
+        low_energy_thres = max_energy * 10**(energy_suppression/20)
+        self.magnitudes[self.magnitudes <= low_energy_thres] = 0.0
+        return self
+
+    #------------------------------------
+    # band_mean
+    #-------------------
+
+    def band_mean(self, low_freq, high_freq):
+        '''
+        Mean magnitude of the frequencies low_freq <= f < high_freq 
+        over the entire spectrogram. Zero if the band has no
+        rows in this spectrogram.
+        
+        @param low_freq: lowest frequency in band
+        @type low_freq: float
+        @param high_freq: frequency above the band
+        @type high_freq: float
+        @return: mean magnitude
+        @rtype: float
+        '''
+        (first_row, end_row) = self.freq_rows(low_freq, high_freq)
+        band = self.magnitudes[first_row:end_row]
+        if band.size == 0:
+            return 0
+        return float(band.mean(dtype=np.float64))
+
+    #------------------------------------
+    # band_rows
+    #-------------------
+
+    @classmethod
+    def band_rows(cls, freq_labels, freq_bands):
+        '''
+        Given frequency labels and a list of frequency
+        bands (min_freq, out_freq), return the indices 
+        of the rows that lie within each band, concatenated
+        in the order of the bands. A min_freq of None is
+        taken to be 0; an out_freq of None means no upper
+        bound. A band (None, None) is ignored.
+        
+        @param freq_labels: frequencies
+        @type freq_labels: np.array
+        @param freq_bands: list of (min_freq, out_freq) 
+        @type freq_bands: [({None | float}, {None | float})]
+        @return: row indices
+        @rtype: np.array(int)
+        '''
+        freq_labels = np.asarray(freq_labels)
+        rows = []
+        for (min_freq, out_freq) in freq_bands:
+            if min_freq is None and out_freq is None:
+                continue
+            in_band = freq_labels >= (0 if min_freq is None else min_freq)
+            if out_freq is not None:
+                in_band &= freq_labels < out_freq
+            rows.append(np.flatnonzero(in_band))
+        if len(rows) == 0:
+            return np.empty((0,), dtype=int)
+        return np.concatenate(rows)
 
 # ---------------------------- Class SignalTreatment ------------
     
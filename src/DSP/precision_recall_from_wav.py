@@ -5,7 +5,6 @@ Created on Mar 2, 2020
 '''
 
 from collections import OrderedDict
-import csv
 import os
 import re
 import sys
@@ -15,9 +14,9 @@ from dsp_utils import SignalTreatmentDescriptor
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from elephant_utils.logging_service import LoggingService
+from elephant_utils.logging_service import LoggingService, timed
+from elephant_utils.raven_labels import RavenLabelTable
 import numpy as np
-import numpy.ma as ma
 from plotting.plotter import PlotterTasks
 
 class PrecRecComputer(object):
@@ -42,6 +41,12 @@ class PrecRecComputer(object):
 
     SAMPLE_RATE_FOR_TESTING = 4000
     logfile = '/tmp/precrec_computer.log'
+    
+    # Number of audio samples examined at a time
+    # when scanning (possibly memory-mapped) gated
+    # audio for bursts. 2**20 samples at 8kHz is
+    # a bit over 2 minutes of sound:
+    AUDIO_BLOCK_SIZE = 2**20
 
     def __init__(self,
                  signal_treatment,
@@ -70,9 +75,12 @@ class PrecRecComputer(object):
         # Read the samples:
         if not testing:
             try:
-                self.log.info("Reading .wav file...")        
-                (self.framerate, samples) = wavfile.read(wavefile)
-                self.log.info("Done reading .wav file.")        
+                # Memory-map rather than read: gated full-day
+                # files are scanned block by block further down,
+                # and need never be resident in RAM all at once:
+                self.log.info("Mapping .wav file...")        
+                (self.framerate, samples) = wavfile.read(wavefile, mmap=True)
+                self.log.info("Done mapping .wav file.")        
             except Exception as e:
                 print(f"Cannot read .wav file {wavefile}: {repr(e)}")
                 sys.exit(1)
@@ -100,6 +108,7 @@ class PrecRecComputer(object):
     # compute_performance
     #-------------------
     
+    @timed()
     def compute_performance(self, 
                             signal_treatment, 
                             samples, 
@@ -142,7 +151,9 @@ class PrecRecComputer(object):
         #      [start_second_burst, end_second_burst],
         #      ...
         #     ]
-        (audio_burst_indices, aud_samples_mask)  = self.collect_audio_events(samples)
+        with self.log.span('find_audio_events'):
+            audio_burst_indices = np.array(list(self.iter_audio_events(samples)), 
+                                           dtype=int).reshape(-1,2)
         
         # Get the 'non-events' for both the labels and
         # the audio guesses. A non-event is the distance
@@ -163,7 +174,7 @@ class PrecRecComputer(object):
 
         # Same for audio bursts:
         audio_burst_indices_shifted = np.roll(audio_burst_indices, -1, axis=0)
-        last_sample_index = aud_samples_mask.size # mele.size
+        last_sample_index = samples.size
         audio_burst_indices_shifted[-1] = np.array([last_sample_index, -1])
         starts_and_ends = audio_burst_indices[:,1], audio_burst_indices_shifted[:,0]
         audio_non_burst_indices = np.column_stack(starts_and_ends)
@@ -171,39 +182,24 @@ class PrecRecComputer(object):
         # Add that entry:
         audio_non_burst_indices = np.vstack((np.array([0,audio_burst_indices[0,0]]), audio_non_burst_indices))
         
-        # Pad the shorter of the two masks with zeros to make
-        # them the same lengths:
-        mask_size_diff = aud_samples_mask.size - el_samples_mask.size
-        if mask_size_diff > 0:
-            el_samples_mask = np.pad(el_samples_mask, (0,mask_size_diff), 'constant')
-        elif mask_size_diff < 0:
-            aud_samples_mask = np.pad(aud_samples_mask, (0, -mask_size_diff), 'constant')
-        
         # Easy to do the various audio false positive/negative counts
-        # at the sample level using the two 1/0 masks:
-        self.log.info('Computing true-pos at sample granularity...')
-        num_true_positive_samples  = np.sum(np.logical_and(el_samples_mask, aud_samples_mask))
-        self.log.info('Done computing true-pos at sample granularity.')
-        
-        self.log.info('Computing true-neg at sample granularity...')
-        num_true_negative_samples  = np.sum(np.logical_not(np.logical_or(el_samples_mask, aud_samples_mask)))
-        self.log.info('Done computing true-neg at sample granularity.')
-        
-        self.log.info('Computing false-neg at sample granularity...')
-        num_false_negative_samples  = np.where(np.logical_and(el_samples_mask == 1, 
-                                                              aud_samples_mask == 0))[0].size
-        self.log.info('Done computing false-neg at sample granularity.')
-        
-        self.log.info('Computing false-pos at sample granularity...')
-        num_false_positive_samples  = np.where(np.logical_and(el_samples_mask == 0, 
-                                                              aud_samples_mask == 1))[0].size
-        self.log.info('Done computing false-pos at sample granularity.')
+        # at the sample level by comparing the labels mask with
+        # the non-zero audio samples. Done block by block so that
+        # no full-length audio mask is ever created. The shorter
+        # of the two is implicitly padded with zeros:
+        self.log.info('Computing true/false-pos/neg at sample granularity...')
+        (num_true_positive_samples,
+         num_false_positive_samples,
+         num_false_negative_samples,
+         num_true_negative_samples) = self.count_sample_agreement(samples, el_samples_mask)
+        self.log.info('Done computing true/false-pos/neg at sample granularity.')
 
         # Recall: samples recognized by audio as part of a call,
         #         over samples labeled as par of a call:
         self.log.info('Computing recall/precision/F1 at sample granularity...')
         try:
-            recall_samples    = num_true_positive_samples / np.sum(el_samples_mask)
+            recall_samples    = num_true_positive_samples / \
+                (num_true_positive_samples + num_false_negative_samples)
         except ZeroDivisionError:
             recall_samples = np.inf
             
@@ -337,6 +333,7 @@ class PrecRecComputer(object):
     # compute_overlap_percentage
     #-------------------
     
+    @timed()
     def compute_overlap_percentage(self, 
                                    audio_burst_indices, 
                                    elephant_burst_indices):
@@ -573,7 +570,7 @@ class PrecRecComputer(object):
     # collect_audio_events
     #-------------------    
 
-    def collect_audio_events(self, samples):
+    def collect_audio_events(self, samples, block_size=None):
         '''
         Given a 1d array of audio samples, 
         returns a 2-column array containing the
@@ -591,54 +588,195 @@ class PrecRecComputer(object):
             [7,9]
             ]
         
+        Also returned is a 1/0 mask the length of samples.
+        Callers who only need the burst indices should use
+        iter_audio_events(), which never materializes 
+        anything of full recording length.
+        
         @param samples: array of audio samples
         @type samples: numpy.array
-        @return: 2-col array with start/stop indices into samples. 
+        @param block_size: number of samples to examine at a time.
+            Default: AUDIO_BLOCK_SIZE
+        @type block_size: int
+        @return: 2-col array with start/stop indices into samples,
+            and the audio event mask
+        @rtype: (np.array(2D), np.array(int))
+        '''
+        self.log.info("Finding audio burst start/end indices...")
+        burst_index_pairs = np.array(list(self.iter_audio_events(samples, block_size)),
+                                     dtype=int).reshape(-1,2)
+        self.log.info(f"Done finding {burst_index_pairs.shape[0]} audio bursts.")
+
+        # If entire audio event seq was 0, we are done:
+        if burst_index_pairs.size == 0:
+            return([], 0)
+        
+        self.log.info("Creating audio event mask...")
+        audio_mask = (samples != 0).astype(int)
+        self.log.info("Done creating audio event mask.")
+        
+        return (burst_index_pairs, audio_mask)
+
+    #------------------------------------
+    # collect_audio_events_from_wav
+    #-------------------
+    
+    def collect_audio_events_from_wav(self, wav_path, block_size=None):
+        '''
+        Memory-maps the given (usually gated) .wav file,
+        and returns the start/stop indices of its audio 
+        bursts as a 2-column array. Only one block of 
+        samples is examined at a time, so full-day files 
+        are never loaded into RAM. Sets self.framerate
+        to the rate of the .wav file.
+        
+        @param wav_path: path to .wav file
+        @type wav_path: str
+        @param block_size: number of samples to examine at a time.
+            Default: AUDIO_BLOCK_SIZE
+        @type block_size: int
+        @return: 2-col array with start/stop indices into the samples 
         @rtype: np.array(2D)
         '''
-        # Add a zero before and after the signal array:
-        samples_padded = np.insert(samples,(0,samples.size),0)
+        (self.framerate, samples) = wavfile.read(wav_path, mmap=True)
+        return np.array(list(self.iter_audio_events(samples, block_size)),
+                        dtype=int).reshape(-1,2)
+
+    #------------------------------------
+    # iter_audio_events
+    #-------------------
+
+    def iter_audio_events(self, samples, block_size=None):
+        '''
+        Generator that yields (start, end) index pairs
+        of audio bursts, i.e. of runs of non-zero samples.
+        The end index is exclusive. Equivalent to iterating
+        over the rows of collect_audio_events()'s burst
+        array, but samples are examined in blocks of 
+        block_size. Whether a burst is ongoing at the
+        end of one block is carried over to the next,
+        so bursts that straddle block borders are 
+        reported once.
+
+        The samples may be an np.memmap, as returned by 
+        wavfile.read(..., mmap=True). Only one block at
+        a time is then paged in.
         
-        # To use only vector ops, we replicate the padded samples
-        # array with one shifted left:
-        samples_padded_after = np.roll(samples_padded,-1)
+        Example:
+           samples =  np.array([20, 40, 0, 0, 0, 30, 0, 60, 50, 0])
+           
+        Yields:
+           (0,2), (5,6), (7,9)
         
-        # Start indices are the ones in which samples_padded is a 0,
-        # followed by a non-zero:
-        self.log.info("Finding audio burst start indices...")
-        start_indices = 1 + np.where(np.logical_and(samples_padded == 0, samples_padded_after != 0))[0]
-        self.log.info("Done finding audio burst start indices.")
+        @param samples: array of audio samples
+        @type samples: {np.array | np.memmap}
+        @param block_size: number of samples to examine at a time.
+            Default: AUDIO_BLOCK_SIZE
+        @type block_size: int
+        @return: start and (exclusive) end of one burst at a time
+        @rtype: (int, int)
+        '''
+        if block_size is None:
+            block_size = self.AUDIO_BLOCK_SIZE
         
-        # Analogously for the end indices of each burst:
-        self.log.info("Finding audio burst end indices...")
-        end_indices   = 1 + np.where(np.logical_and(samples_padded != 0, samples_padded_after == 0))[0]
-        self.log.info("Done finding audio burst end indices.")
-
-        self.log.info(f"Creating {start_indices.size} audio burst specs...")
-        burst_index_pairs = np.column_stack((start_indices, end_indices))
-        self.log.info(f"Done creating {start_indices.size} audio burst specs.")
+        # Run state carried across block borders:
+        in_burst    = False
+        burst_start = None
         
-        self.log.info("Creating audio event mask...")
-        audio_mask = ma.masked_not_equal(samples_padded, 0).mask
-        self.log.info("Done creating audio event mask.")
+        for block_start in range(0, samples.size, block_size):
+            non_zero = np.asarray(samples[block_start:block_start + block_size]) != 0
+            
+            # Indices (relative to the block) where the 
+            # zero/non-zero state differs from the preceding 
+            # sample. The first sample is compared to the 
+            # state carried in from the previous block:
+            transitions = 1 + np.flatnonzero(non_zero[1:] != non_zero[:-1])
+            if non_zero[0] != in_burst:
+                transitions = np.insert(transitions, 0, 0)
+            transitions += block_start
+            
+            if transitions.size == 0:
+                continue
+            
+            # Close a burst that started in an earlier block:
+            if in_burst:
+                yield (int(burst_start), int(transitions[0]))
+                transitions = transitions[1:]
+                in_burst = False
+            
+            # Remaining transitions alternate start, end, start, ...
+            num_complete = transitions.size // 2
+            for (start, end) in transitions[:2 * num_complete].reshape(-1,2):
+                yield (int(start), int(end))
+            
+            # Odd number left: a burst runs into the next block:
+            if transitions.size % 2 == 1:
+                burst_start = transitions[-1]
+                in_burst = True
+        
+        # Burst running to the very end of the samples:
+        if in_burst:
+            yield (int(burst_start), int(samples.size))
+
+    #------------------------------------
+    # count_sample_agreement
+    #-------------------
+    
+    @timed()
+    def count_sample_agreement(self, samples, el_samples_mask, block_size=None):
+        '''
+        Compares audio samples against a 1/0 mask of 
+        labeled samples, and returns the number of 
+        true positive, false positive, false negative,
+        and true negative samples. A sample counts as
+        audio-positive if it is non-zero. If samples and
+        mask differ in length, the shorter of the two is
+        treated as padded with zeros.
+        
+        Work proceeds in blocks of block_size samples,
+        so samples may be a memory-mapped full-day 
+        recording.
         
-        # If entire audio event seq was 0, we are done.
-        # The audio_mask is still an np array. But 
-        # it has 'no shape':
-        if audio_mask.shape == ():
-            return([], 0)
-         
-        # We have one extra mask bit at the front, and the
-        # end: chop those off:
-        audio_mask = audio_mask[1:-1]
-        # And correct the burst start/ends accordingly:
-        burst_index_pairs -= 1
-        return (burst_index_pairs, audio_mask.astype(int))
+        @param samples: array of audio samples
+        @type samples: {np.array | np.memmap}
+        @param el_samples_mask: 1/0 mask of labeled samples
+        @type el_samples_mask: np.array(int)
+        @param block_size: number of samples to examine at a time.
+            Default: AUDIO_BLOCK_SIZE
+        @type block_size: int
+        @return: true_pos, false_pos, false_neg, true_neg counts
+        @rtype: (int, int, int, int)
+        '''
+        if block_size is None:
+            block_size = self.AUDIO_BLOCK_SIZE
+            
+        total_len  = max(samples.size, el_samples_mask.size)
+        true_pos   = 0
+        false_pos  = 0
+        false_neg  = 0
+        
+        for block_start in range(0, total_len, block_size):
+            block_end = min(block_start + block_size, total_len)
+            aud_block = np.zeros(block_end - block_start, dtype=bool)
+            ele_block = np.zeros(block_end - block_start, dtype=bool)
+            
+            aud_part = np.asarray(samples[block_start:block_end]) != 0
+            aud_block[:aud_part.size] = aud_part
+            ele_part = el_samples_mask[block_start:block_end] != 0
+            ele_block[:ele_part.size] = ele_part
+            
+            true_pos  += np.count_nonzero(aud_block & ele_block)
+            false_pos += np.count_nonzero(aud_block & ~ele_block)
+            false_neg += np.count_nonzero(~aud_block & ele_block)
+
+        true_neg = total_len - true_pos - false_pos - false_neg
+        return (true_pos, false_pos, false_neg, true_neg)
     
     #------------------------------------
     # label_file_reader
     #-------------------
     
+    @timed()
     def label_file_reader(self, label_file_path):
         '''
         Given the path to a Raven export, return two representations
@@ -669,48 +807,25 @@ class PrecRecComputer(object):
         self.events = []
         
         self.log.info("Reading label file...")
-        with open(label_file_path, 'r') as fd:
-            csv_reader = csv.reader(fd, delimiter='\t')
-            # Discard col header:
-            _header = next(csv_reader)
-            
-            COL_SELECTION_INDEX = 0
-            COL_BEGIN_TIME_INDEX = 3
-            COL_END_TIME_INDEX = 4
-            start_end_list = []
-            # Each line is an array of 18 fields:
-            for line in csv_reader:
-                # Watch for (usually closing...) empty line(s):
-                if len(line) == 0:
-                    continue
-                if csv_reader.dialect.delimiter != '\t':
-                    # Unless the csv reader knows that elephant
-                    # label files are tab-delimited, lines come 
-                    # in as an arr of len 1: a string with embedded 
-                    # '\t' chars. In that case: create an array:
-                    line = line[0].split('\t')
-                    
-                selection_index = int(line[COL_SELECTION_INDEX])
-                begin_time_secs = float(line[COL_BEGIN_TIME_INDEX])
-                end_time_secs = float(line[COL_END_TIME_INDEX])
-                self.events.append(ElephantEvent(selection_index, begin_time_secs, end_time_secs))
-                begin_time_samples = int(np.ceil(self.framerate * begin_time_secs))
-                # Don't know whether Cornell end time is inclusive or not,
-                # so for safety, add one to make the sample end time exclusive:
-                end_time_samples   = int(np.ceil(1 + self.framerate * end_time_secs))
-                start_end_list.append([begin_time_samples,end_time_samples])
-                
-        last_end_time_samples = end_time_samples
-        # Make np.array of sample-level start-stop:
-        elephant_burst_indices = np.array(start_end_list)
+        labels = RavenLabelTable.load(label_file_path)
+        for (selection_index, begin_time_secs, end_time_secs) in zip(labels.selection.tolist(),
+                                                                     labels.begin.tolist(),
+                                                                     labels.end.tolist()):
+            self.events.append(ElephantEvent(selection_index, begin_time_secs, end_time_secs))
+
+        # Don't know whether Cornell end time is inclusive or not,
+        # so for safety, the end sample is one past the end time
+        # to make it exclusive. Np.array of sample-level start-stop:
+        elephant_burst_indices = labels.sample_indices(self.framerate)
+        last_end_time_samples = elephant_burst_indices[-1, 1]
         self.log.info("Done reading label file.")
         
         self.log.info("Creating elephant burst mask...")
         # Mask is as long as the end of the last burst in
         # sample space:    
-        el_mask = np.zeros(last_end_time_samples + 1, dtype=int)
-        for (burst_start, burst_end) in elephant_burst_indices:
-            el_mask[burst_start:burst_end] = 1
+        el_mask = RavenLabelTable.ranges_to_mask(elephant_burst_indices[:,0],
+                                                 elephant_burst_indices[:,1],
+                                                 last_end_time_samples + 1)
         self.log.info("Done creating elephant burst mask.")
 
         return (elephant_burst_indices, el_mask)
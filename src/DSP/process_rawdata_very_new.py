@@ -346,6 +346,9 @@ def collect_file_families(files_or_dirs, file_family_list=None):
             new_paths = [os.path.join(file_or_dir, file_name) for file_name in os.listdir(file_or_dir)]
             file_family_list = collect_file_families(new_paths, file_family_list)
             continue
+        # Skip the parsed-label caches next to the tables:
+        if file_or_dir.endswith('.labels.npz'):
+            continue
         # Strip off the location and time tags
         tags = os.path.basename(file_or_dir).split('_')
         data_id = tags[0] + '_' + tags[1]
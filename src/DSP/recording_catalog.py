@@ -0,0 +1,345 @@
+'''
+Persistent catalog of elephant recordings and the
+files derived from them: Raven label files, gated
+.wav files, 24-hr spectrograms, label masks, and
+spectrogram snippets.
+
+The catalog is an Sqlite db. Each file is entered
+once, with its size and mtime, and with the result
+of decoding its name via FileFamily. Rescans only
+stat() the files of the given directories, and only
+decode names not seen before, so that rescanning a
+large archive takes seconds.
+
+Pipeline stages (e.g. WavMaker, SpectrogramChopper)
+record which files they processed, at which size and
+mtime. They can then ask for just the new or changed
+files:
+
+    catalog = RecordingCatalog('/data/recordings.sqlite')
+    catalog.scan(['/data/wav'])
+    for file_family in catalog.todo('wav_maker', [AudioType.WAV]):
+        ...
+        catalog.mark_done('wav_maker', [file_family.fullpath(AudioType.WAV)])
+
+Schema:
+
+    Files(path, dir, recording, file_type, snippet_id, size, mtime_ns)
+    Done(path, stage, size, mtime_ns, done_at)
+
+where recording is the file root shared by all
+members of a family, and file_type is the name
+of an AudioType, or NULL for files that are not
+family members.
+'''
+import os
+import sqlite3
+import time
+
+# Use the same dsp_utils module as the importer, so
+# that AudioType members compare equal:
+if __package__:
+    from .dsp_utils import AudioType, FileFamily
+else:
+    from dsp_utils import AudioType, FileFamily
+
+
+class RecordingCatalog(object):
+    '''
+    Sqlite catalog of recordings and derived files.
+    Safe to share among processes: each connection
+    waits for the others' transactions to finish.
+    '''
+
+    GATED_SUFFIX = '_gated'
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self, db_path, timeout=60):
+        '''
+        @param db_path: Sqlite file of the catalog;
+            created if it does not exist
+        @type db_path: str
+        @param timeout: seconds to wait for other
+            processes' writes to finish
+        @type timeout: {int|float}
+        '''
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path, timeout=timeout)
+        self.db.row_factory = sqlite3.Row
+        # Readers need not wait for writers:
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self._create_tables()
+
+    #------------------------------------
+    # close
+    #-------------------
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    #------------------------------------
+    # scan
+    #-------------------
+
+    def scan(self, files_or_dirs):
+        '''
+        Bring the catalog up to date with the given
+        files and directory trees. New files are added,
+        files with changed size or mtime are updated,
+        and catalogued files that no longer exist
+        below a given directory are removed.
+
+        @param files_or_dirs: files and directories
+        @type files_or_dirs: {str|[str]}
+        @return: absolute paths of all files found
+        @rtype: [str]
+        '''
+        if type(files_or_dirs) != list:
+            files_or_dirs = [files_or_dirs]
+
+        known = {row['path'] : (row['size'], row['mtime_ns'])
+                 for row in self.db.execute('SELECT path, size, mtime_ns FROM Files')}
+
+        found = []
+        new_rows = []
+        changed_rows = []
+        scanned_dirs = []
+        for file_or_dir in files_or_dirs:
+            file_or_dir = os.path.abspath(file_or_dir)
+            if os.path.isdir(file_or_dir):
+                scanned_dirs.append(file_or_dir)
+                stats = self._walk(file_or_dir)
+            elif os.path.exists(file_or_dir):
+                stats = [(file_or_dir, os.stat(file_or_dir))]
+            else:
+                continue
+
+            for (path, stat) in stats:
+                found.append(path)
+                signature = (stat.st_size, stat.st_mtime_ns)
+                try:
+                    if known[path] != signature:
+                        changed_rows.append(signature + (path,))
+                except KeyError:
+                    # Only new names are decoded:
+                    new_rows.append(self._file_row(path, signature))
+
+        found_set = set(found)
+        vanished = [(path,) for path in known
+                    if path not in found_set and
+                       any(path.startswith(scanned_dir + os.sep)
+                           for scanned_dir in scanned_dirs)]
+
+        with self.db:
+            self.db.executemany('''INSERT OR REPLACE INTO Files
+                                   (path, dir, recording, file_type, snippet_id, size, mtime_ns)
+                                   VALUES (?, ?, ?, ?, ?, ?, ?)''', new_rows)
+            self.db.executemany('UPDATE Files SET size = ?, mtime_ns = ? WHERE path = ?',
+                                changed_rows)
+            self.db.executemany('DELETE FROM Files WHERE path = ?', vanished)
+            self.db.executemany('DELETE FROM Done WHERE path = ?', vanished)
+
+        self.num_new = len(new_rows)
+        self.num_changed = len(changed_rows)
+        self.num_removed = len(vanished)
+        return found
+
+    #------------------------------------
+    # todo
+    #-------------------
+
+    def todo(self, stage, file_types, paths=None):
+        '''
+        Return FileFamily instances for the catalogued
+        files of the given types that the given stage
+        has not yet processed, or that changed since.
+        Families are ordered by path, so that parallel
+        workers see the same list.
+
+        @param stage: name of a pipeline stage
+        @type stage: str
+        @param file_types: types of files to include
+        @type file_types: [AudioType]
+        @param paths: if provided, only consider these
+            files, such as the result of scan()
+        @type paths: {None|[str]}
+        @return: file families of the files to process
+        @rtype: [FileFamily]
+        '''
+        rows = self.db.execute(f'''
+            SELECT Files.* FROM Files
+              LEFT JOIN Done ON Done.path = Files.path AND Done.stage = ?
+             WHERE Files.file_type IN ({",".join("?" * len(file_types))})
+               AND (Done.path IS NULL OR
+                    Done.size != Files.size OR
+                    Done.mtime_ns != Files.mtime_ns)
+             ORDER BY Files.path''',
+            [stage] + [file_type.name for file_type in file_types])
+        if paths is not None:
+            paths = set(paths)
+            rows = [row for row in rows if row['path'] in paths]
+        return [self._family(row) for row in rows]
+
+    #------------------------------------
+    # mark_done
+    #-------------------
+
+    def mark_done(self, stage, paths):
+        '''
+        Record that the given stage processed the
+        given catalogued files, at their current
+        size and mtime.
+
+        @param stage: name of a pipeline stage
+        @type stage: str
+        @param paths: processed files
+        @type paths: {str|[str]}
+        '''
+        if type(paths) != list:
+            paths = [paths]
+        done_at = time.time()
+        with self.db:
+            self.db.executemany('''INSERT OR REPLACE INTO Done
+                                   SELECT path, ?, size, mtime_ns, ?
+                                     FROM Files WHERE path = ?''',
+                                [(stage, done_at, os.path.abspath(path)) for path in paths])
+
+    #------------------------------------
+    # families
+    #-------------------
+
+    def families(self, file_types, paths=None):
+        '''
+        Like todo(), but regardless of processing.
+        '''
+        rows = self.db.execute(f'''
+            SELECT * FROM Files
+             WHERE file_type IN ({",".join("?" * len(file_types))})
+             ORDER BY path''',
+            [file_type.name for file_type in file_types])
+        if paths is not None:
+            paths = set(paths)
+            rows = [row for row in rows if row['path'] in paths]
+        return [self._family(row) for row in rows]
+
+    #------------------------------------
+    # artifacts
+    #-------------------
+
+    def artifacts(self, recording):
+        '''
+        All catalogued files of one recording, in
+        any directory.
+
+        @param recording: file root, such as nn05b_20180617_000000
+        @type recording: str
+        @return: paths by file type
+        @rtype: {AudioType : [str]}
+        '''
+        artifacts = {}
+        for row in self.db.execute('''SELECT path, file_type FROM Files
+                                       WHERE recording = ? ORDER BY path''',
+                                   (recording,)):
+            artifacts.setdefault(AudioType[row['file_type']], []).append(row['path'])
+        return artifacts
+
+    #------------------------------------
+    # _walk
+    #-------------------
+
+    def _walk(self, start_dir):
+        '''
+        Yield (path, stat) for all files below
+        start_dir. Uses os.scandir(), which does not
+        need a stat() call to tell files from dirs.
+        '''
+        dirs_todo = [start_dir]
+        while len(dirs_todo) > 0:
+            try:
+                entries = list(os.scandir(dirs_todo.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=True):
+                    dirs_todo.append(entry.path)
+                elif entry.is_file(follow_symlinks=True):
+                    yield (entry.path, entry.stat())
+
+    #------------------------------------
+    # _file_row
+    #-------------------
+
+    def _file_row(self, path, signature):
+        try:
+            file_family = FileFamily(path)
+        except ValueError:
+            # Not a family member; catalogued anyway,
+            # so that it is not decoded again:
+            return (path, os.path.dirname(path), None, None, None) + signature
+
+        recording = file_family.file_root
+        if file_family.file_type == AudioType.GATED_WAV and \
+                recording.endswith(self.GATED_SUFFIX):
+            recording = recording[:-len(self.GATED_SUFFIX)]
+        if len(file_family.snippet_ids) > 0:
+            # FileFamily types snippet .pickle files
+            # as 24-hr spectrograms:
+            (file_type, snippet_id) = (AudioType.SNIPPET, file_family.snippet_ids[0])
+        else:
+            (file_type, snippet_id) = (file_family.file_type, None)
+        return (path,
+                os.path.dirname(path),
+                recording,
+                file_type.name,
+                snippet_id) + signature
+
+    #------------------------------------
+    # _family
+    #-------------------
+
+    def _family(self, row):
+        file_type = AudioType[row['file_type']]
+        file_root = row['recording']
+        if file_type == AudioType.GATED_WAV:
+            # As FileFamily decodes gated file names:
+            file_root += self.GATED_SUFFIX
+        snippet_ids = [] if row['snippet_id'] is None else [row['snippet_id']]
+        return FileFamily.from_parts(row['path'], file_root, file_type, snippet_ids)
+
+    #------------------------------------
+    # _create_tables
+    #-------------------
+
+    def _create_tables(self):
+        with self.db:
+            self.db.execute('''CREATE TABLE IF NOT EXISTS Files(
+                                 path TEXT PRIMARY KEY,
+                                 dir TEXT,
+                                 recording TEXT,
+                                 file_type TEXT,
+                                 snippet_id TEXT,
+                                 size INTEGER,
+                                 mtime_ns INTEGER
+                                 )''')
+            self.db.execute('''CREATE INDEX IF NOT EXISTS Files_recording
+                                 ON Files(recording)''')
+            self.db.execute('''CREATE INDEX IF NOT EXISTS Files_file_type
+                                 ON Files(file_type)''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS Done(
+                                 path TEXT,
+                                 stage TEXT,
+                                 size INTEGER,
+                                 mtime_ns INTEGER,
+                                 done_at REAL,
+                                 PRIMARY KEY (path, stage)
+                                 )''')
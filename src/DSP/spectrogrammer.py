@@ -5,7 +5,6 @@ Created on Feb 23, 2020
 @author: paepcke
 '''
 import argparse
-import csv
 import os
 import sys
 import tempfile
@@ -22,9 +21,11 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from dsp_utils import AudioType
 from dsp_utils import DSPUtils
+from dsp_utils import Spectrogram
 from dsp_utils import FileFamily
 from amplitude_gating import AmplitudeGater
-from elephant_utils.logging_service import LoggingService
+from elephant_utils.logging_service import LoggingService, timed
+from elephant_utils.raven_labels import RavenLabelTable
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
@@ -69,6 +70,7 @@ class Spectrogrammer(object):
                  high_freq=40,     # Hz
                  spectrogram_freq_cap=None,
                  nfft=None,
+                 block_size=None,
                  logfile=None,
                  testing=False
                  ):
@@ -76,7 +78,10 @@ class Spectrogrammer(object):
         @param infiles:
         @type infiles:
         @param actions: the tasks to accomplish: 
-            {spectro|melspectro|plot|plotexcerpts|labelmask}
+            {spectro|bandspectro|melspectro|plot|plotexcerpts|labelmask}
+            The bandspectro action is like spectro, but only computes
+            frequencies up to spectrogram_freq_cap, which saves 
+            most of the memory that spectro needs.
         @type actions: [str] 
         @param outdir: if provided, everything that is created is written
             to this directory (spectrograms, label masks, gated versions of 
@@ -98,6 +103,9 @@ class Spectrogrammer(object):
         @type high_freq: int
         @param nfft: window width
         @type nfft: int,
+        @param block_size: if not None, .wav files are noise gated
+            this many samples at a time, with bounded memory
+        @type block_size: {None | int}
         @param logfile: destination for log. Default: display
         @type logfile: {None|str}
         @param testing: if True, only create the instance, and return
@@ -173,7 +181,8 @@ class Spectrogrammer(object):
                 
                 try:
                     self.log.info(f"Reading wav file {infile}...")
-                    (self.framerate, samples) = wavfile.read(infile)
+                    (self.framerate, samples) = wavfile.read(infile, 
+                                                             mmap=block_size is not None)
                     self.log.info(f"Processing wav file {infile}...")
                     # Get as a dict:
                     #    the gated samples:                           'gated_samples',
@@ -181,8 +190,10 @@ class Spectrogrammer(object):
                     #    path to the gated wav file on disk:          'result_file'
                     #    path to untreated excerpt file if requested: 'excerpt_file'
                     
+                    # Block-wise gating works from the file
+                    # itself, rather than an in-memory copy:
                     process_result_dict = \
-                        self.process_wav_file(samples,
+                        self.process_wav_file(samples if block_size is None else infile,
                                               file_family, 
                                               start_sec=start_sec, 
                                               end_sec=end_sec, 
@@ -190,24 +201,29 @@ class Spectrogrammer(object):
                                               threshold_db=threshold_db,
                                               low_freq=low_freq,
                                               high_freq=high_freq,
-                                              outdir=outdir
+                                              outdir=outdir,
+                                              block_size=block_size
                                               )
                     self.log.info(f"Done processing wav file {infile}.")
                 except Exception as e:
                     print(f"Cannot process .wav file: {repr(e)}")
                     return
 
-                if 'spectro' in actions:
+                if 'spectro' in actions or 'bandspectro' in actions:
                     try:
                         # Create spectrogram, receiving a dataframe
                         # with magnitudes in dB:
                         spect = \
-                            self.make_spectrogram(process_result_dict['gated_samples'])
+                            self.make_spectrogram(process_result_dict['gated_samples'],
+                                                  freq_cap=spectrogram_freq_cap \
+                                                    if 'bandspectro' in actions else None
+                                                  )
                     except Exception as e:
                         print(f"Cannot create spectrogram for {infile}: {repr(e)}")
                         return
-                    # Save the spectrogram:
-                    spectro_outfile = os.path.join(outdir,file_family.spectro)
+                    # Save the spectrogram in native format; it
+                    # is pickled instead if its times are uneven:
+                    spectro_outfile = os.path.join(outdir,file_family.spectro_npy)
                     DSPUtils.save_spectrogram(spect, spectro_outfile)
 
             elif infile.endswith('.txt'):
@@ -221,8 +237,8 @@ class Spectrogrammer(object):
                 DSPUtils.save_label_mask(label_mask, 
                                          os.path.join(outdir,file_family.mask))
                 
-            elif infile.endswith('.pickle'):
-                # Infile is a .pickle spectrogram file:
+            elif infile.endswith('.pickle') or infile.endswith('_spectrogram.npy'):
+                # Infile is a .pickle or native spectrogram file:
                 self.log.info(f"Loading spectrogram file {infile}...")
                 try:
                     spect = DSPUtils.load_spectrogram(infile)
@@ -346,7 +362,9 @@ class Spectrogrammer(object):
             # We either need a .pickle file that must be
             # a spectrogram, or we need a .wav file that will
             # be turned into a spectrogram to be plotted
-            if not any(filename.endswith('.pickle') or filename.endswith('.wav') 
+            if not any(filename.endswith('.pickle') 
+                       or filename.endswith('_spectrogram.npy')
+                       or filename.endswith('.wav') 
                        for filename in infiles):
                 self.log.err("To plot something, there must be either a .pickle spectrogram file\n"
                              "or a .wav file"
@@ -371,6 +389,7 @@ class Spectrogrammer(object):
     # process_spectrogram 
     #-------------------
     
+    @timed()
     def process_spectrogram(self, 
                             spectro,
                             energy_suppression=None,
@@ -386,44 +405,46 @@ class Spectrogrammer(object):
               
         
         @param spectro: spectrogram on which to operate
-        @type spectro: pd.DataFrame
+        @type spectro: {pd.DataFrame | Spectrogram}
         @param energy_suppression: magnitudes in dB below max energy
             in the spectrogram are zeroed
         @type energy_suppression: int
         @param spectrogram_freq_cap: frequency above which all
             rows in the spectrogram are removed
         @type spectrogram_freq_cap: int
-        @return: a new spectrogram.
-        @rtype: pd.DataFrame 
+        @return: a new spectrogram of the same type as spectro.
+        @rtype: {pd.DataFrame | Spectrogram}
         '''
         
-        new_spectro = spectro.copy()
-        # Chop off high freqs:
+        # Pandas only at the edges: 
+        is_dataframe = type(spectro) == pd.DataFrame
+        spect = Spectrogram.from_dataframe(spectro) if is_dataframe else spectro
+        
+        # Chop off high freqs; this is a view, not a copy:
         if spectrogram_freq_cap is not None:
-            trimmed_spectro = new_spectro.iloc[spectro.index <= spectrogram_freq_cap]
-        else:
-            trimmed_spectro = new_spectro
+            spect = spect.crop_freqs(max_freq=spectrogram_freq_cap)
 
         if energy_suppression is None:
             energy_suppression = Spectrogrammer.ENERGY_SUPPRESSION
-        mags_only = trimmed_spectro.to_numpy()
-        max_energy = np.amax(mags_only)
-        low_energy_thres = max_energy * 10**(energy_suppression/20)
-        spect_low_energy_indices = np.nonzero(mags_only <= low_energy_thres)
-        mags_only[spect_low_energy_indices] = 0.0
+        # The only copy of the magnitudes:
+        processed_spectro = spect.copy().suppress_energy(energy_suppression)
         
-        processed_spectro = pd.DataFrame(mags_only,
-                                         index=trimmed_spectro.index,
-                                         columns=trimmed_spectro.columns)
+        if is_dataframe:
+            return processed_spectro.to_dataframe()
         return processed_spectro
 
     #------------------------------------
     # make_spectrogram
     #-------------------
 
-    def make_spectrogram(self, data):
+    @timed()
+    def make_spectrogram(self, data, freq_cap=None):
         '''
-        Given data, compute a spectrogram.
+        Given data, compute a spectrogram. If freq_cap
+        is provided, only frequencies up to, and including
+        freq_cap are computed (see DSPUtils.band_limited_spectrogram()).
+        The values are the same as those of the full spectrogram
+        at those frequencies.
 
         Assumptions:
             o self.framerate contains the data framerate
@@ -443,6 +464,8 @@ class Spectrogrammer(object):
         
         @param data: the time/amplitude data
         @type data: np.array([float])
+        @param freq_cap: highest frequency to compute; None for all
+        @type freq_cap: {None | int}
         @return: spectrogram dataframe with index being frequencies,
             and columns being time labels.
         @rtype: pd.DataFrame
@@ -453,16 +476,23 @@ class Spectrogrammer(object):
         # they will be fractions of a second, like
         #   0, 0.256, ... 1440
         self.log.info("Creating spectrogram...")
-        (freq_labels, time_labels, complex_freq_by_time) = \
-            stft(data, 
-                 self.framerate, 
-                 nperseg=self.NFFT
-                 #nperseg=int(self.framerate)
-                 )
+        if freq_cap is not None:
+            (freq_labels, time_labels, freq_time) = \
+                DSPUtils.band_limited_spectrogram(data,
+                                                  self.framerate,
+                                                  nfft=self.NFFT,
+                                                  freq_cap=freq_cap
+                                                  )
+        else:
+            (freq_labels, time_labels, complex_freq_by_time) = \
+                stft(data, 
+                     self.framerate, 
+                     nperseg=self.NFFT
+                     #nperseg=int(self.framerate)
+                     )
+            freq_time = np.absolute(complex_freq_by_time)
             
         self.log.info("Done creating spectrogram.")
-
-        freq_time = np.absolute(complex_freq_by_time)
         
         # Transformer for magnitude to power dB:
         amp_to_dB_transformer = torchaudio.transforms.AmplitudeToDB()
@@ -526,6 +556,7 @@ class Spectrogrammer(object):
     # filter_spectrogram
     #-------------------
     
+    @timed()
     def filter_spectrogram(self, 
                            freq_labels, 
                            freq_time, 
@@ -569,45 +600,11 @@ class Spectrogrammer(object):
             frequency labels
         @rtype: (np_array(1), np_array(n,m))
         '''
-        # Prepare a new spectrogram matrix with
-        # the same num of cols as the one passed
-        # in, but no rows:
-        
-        (_num_rows, num_cols) = freq_time.shape
-        new_freq_time    = np.empty((0,num_cols))
-        
-        # Same for the list of frequencies:
-        new_freq_labels  = np.empty((0,))
-        
-        for (min_freq, out_freq) in freq_bands:
-            if min_freq is None and out_freq is None:
-                # Degenerate case: keep all:
-                continue
-            if min_freq is None:
-                min_freq = 0
-            if out_freq is None:
-                # No upper bound, so make a ceiling
-                # higher than maximum frequency:
-                out_freq = np.amax(freq_labels) + 1.
-                
-            # Get the indices of the frequency array 
-            # where the frequency is within this interval.
-            # The np.where returns a tuple, therefore [0]
-
-            filter_indices =  np.where(np.logical_and(freq_labels >= min_freq,
-                                                      freq_labels < out_freq
-                                                      ))[0]
-        
-            # Keep only rows (axis=0) that contain the energies for
-            # included frequencies:
-            new_freq_time = np.vstack(
-                (new_freq_time, np.take(freq_time, filter_indices, axis=0))
-                )
-
-            # Also take away the row labels that where excluded:
-            new_freq_labels = np.hstack(
-                (new_freq_labels, np.take(freq_labels, filter_indices))
-                )
+        # Collect the rows of all bands, then
+        # extract them with a single copy:
+        filter_indices = Spectrogram.band_rows(freq_labels, freq_bands)
+        new_freq_time   = np.take(freq_time, filter_indices, axis=0)
+        new_freq_labels = np.take(freq_labels, filter_indices)
 
         return (new_freq_labels, new_freq_time)
 
@@ -615,6 +612,7 @@ class Spectrogrammer(object):
     # process_wav_file
     #-------------------
 
+    @timed()
     def process_wav_file(self,
                          infile_or_samples,
                          file_family,
@@ -626,6 +624,7 @@ class Spectrogrammer(object):
                          normalize=False,
                          outdir=None,
                          keep_excerpt=False,
+                         block_size=None
                          ):
         '''
         Takes either a wav file path, or the audio samples
@@ -657,6 +656,9 @@ class Spectrogrammer(object):
         @param keep_excerpt: if excerpt was requested, whether or
             not to keep the excerpt in the file system after processing.
         @type keep_excerpt: bool
+        @param block_size: if not None, gate this many samples at
+            a time. See AmplitudeGater.gate_in_blocks()
+        @type block_size: {None | int}
         @return: dict with:
 
              the gated samples:                           'gated_samples',
@@ -716,13 +718,15 @@ class Spectrogrammer(object):
                 # none is created in AmplitudeGater; just the
                 # gated .wav file:
                 gated_file_dest = os.path.join(outdir, file_family.gated_wav)
-                gater = AmplitudeGater(excerpt_infile.name,
+                gater = AmplitudeGater(excerpt_infile if type(excerpt_infile) == str 
+                                                      else excerpt_infile.name,
                                        amplitude_cutoff=threshold_db,
                                        low_freq=low_freq,
                                        high_freq=high_freq,
                                        outdir=outdir,
                                        outfile=gated_file_dest,
-                                       normalize=normalize
+                                       normalize=normalize,
+                                       block_size=block_size
                                        )
             except Exception as e:
                 self.log.err(f"Processing failed for '{excerpt_infile}: {repr(e)}")
@@ -745,6 +749,7 @@ class Spectrogrammer(object):
     # create_label_mask_from_raven_table
     #-------------------
     
+    @timed()
     def create_label_mask_from_raven_table(self,
                                            wav_file_or_sig,
                                            label_txt_file,
@@ -785,30 +790,17 @@ class Spectrogrammer(object):
                                                              framerate=framerate
                                                              )
                                      
-        # Start with an all-zero label mask:
-        label_mask = np.zeros(len(time_tick_secs_labels), dtype=int)
-        
-        try:
-            if type(label_txt_file) == str:
-                fd = open(label_txt_file, 'r')
-            else:
-                fd = label_txt_file 
-            reader = csv.DictReader(fd, delimiter='\t')
-            for (start_bin_idx, end_bin_idx) in self._get_label_indices(reader, 
-                                                                        time_tick_secs_labels,
-                                                                        label_txt_file):
-            
-                # Fill the mask with 1s in the just-computed range:
-                label_mask[start_bin_idx:end_bin_idx] = 1
-                
-        finally:
-            # Only close an fd that we may have
-            # opened in this method. Fds passed
-            # in remain open for caller to close:
-            if type(label_txt_file) == str:
-                fd.close()
-            
-        return label_mask
+        labels = self._read_label_table(label_txt_file)
+        bin_ranges = np.array(list(self._get_label_indices(labels,
+                                                           time_tick_secs_labels,
+                                                           label_txt_file)),
+                              dtype=int).reshape(-1, 2)
+
+        # All-zero label mask, with 1s in the
+        # just-computed ranges:
+        return RavenLabelTable.ranges_to_mask(bin_ranges[:,0], 
+                                              bin_ranges[:,1],
+                                              len(time_tick_secs_labels))
 
     #------------------------------------
     # create_label_intervals_from_raven_table
@@ -841,32 +833,40 @@ class Spectrogrammer(object):
         # The x-axis time labels:
         label_times    = spect.columns.astype(float)
         
-        try:
-            if type(label_txt_file) == str:
-                fd = open(label_txt_file, 'r')
-            else:
-                fd = label_txt_file 
-            reader = csv.DictReader(fd, delimiter='\t')
-            for (start_bin_idx, end_bin_idx) in self._get_label_indices(reader, 
-                                                                        label_times,
-                                                                        label_txt_file):
+        labels = self._read_label_table(label_txt_file)
+        for (start_bin_idx, end_bin_idx) in self._get_label_indices(labels, 
+                                                                    label_times,
+                                                                    label_txt_file):
+        
+            # Next time interval:
+            time_interval = pd.Interval(left=label_times[start_bin_idx], 
+                                        right=label_times[end_bin_idx]
+                                        )
             
-                # Next time interval:
-                time_interval = pd.Interval(left=label_times[start_bin_idx], 
-                                            right=label_times[end_bin_idx]
-                                            )
-                
-                label_intervals.append(time_interval)
-                
-        finally:
-            # Only close an fd that we may have
-            # opened in this method. Fds passed
-            # in remain open for caller to close:
-            if type(label_txt_file) == str:
-                fd.close()
+            label_intervals.append(time_interval)
             
         return label_intervals
 
+    #------------------------------------
+    # _read_label_table
+    #-------------------
+    
+    def _read_label_table(self, label_txt_file):
+        '''
+        Given either a path to a Raven label file, or
+        an open fd to such a file, return the parsed
+        table. Tables in files are cached; fds passed
+        in remain open for caller to close.
+        
+        @param label_txt_file: label file or fd
+        @type label_txt_file: {str|file-like}
+        @return: the label table
+        @rtype: RavenLabelTable
+        '''
+        if type(label_txt_file) == str:
+            return RavenLabelTable.load(label_txt_file)
+        return RavenLabelTable.from_fd(label_txt_file)
+
     #------------------------------------
     # _read_spectrogram_if_needed
     #-------------------
@@ -898,59 +898,40 @@ class Spectrogrammer(object):
     #-------------------
 
     def _get_label_indices(self, 
-                           reader,
+                           labels,
                            label_times,
                            label_txt_file
                            ):
+        '''
+        Yield the (start, end) spectrogram time bin
+        indices of each good label in a label table.
+        The start bin is the one just below the label's
+        start time (or 0); the end bin is the first one
+        after the label's end time (or the number of
+        bins, if the label goes beyond the recording).
+        
+        @param labels: parsed Raven label table
+        @type labels: RavenLabelTable
+        @param label_times: spectrogram time bins in seconds
+        @type label_times: [float]
+        @param label_txt_file: label file, for messages
+        @type label_txt_file: {str|file-like}
+        '''
 
         if type(label_times) != np.ndarray:
             label_times = np.array(label_times)
         
-        begin_time_key = 'Begin Time (s)'
-        end_time_key   = 'End Time (s)'
+        (start_bins, end_bins, valid) = labels.bin_indices(label_times)
 
-        # Get each el call time range spec in the labels:
-        for label_dict in reader:
-            try:
-                begin_time = float(label_dict[begin_time_key])
-                end_time   = float(label_dict[end_time_key])
-            except KeyError:
-                raise IOError(f"Raven label file {label_txt_file} does not contain one "
-                              f"or both of keys '{begin_time_key}', {end_time_key}'")
-            
+        for (begin_time, end_time) in zip(labels.begin[~valid], labels.end[~valid]):
             if end_time < begin_time:
                 self.log.err(f"Bad label: end label less than begin label: {end_time} < {begin_time}")
-                continue
-            
-            if begin_time > label_times[-1]:
+            elif begin_time > label_times[-1]:
                 self.log.err(f"Bad label: begin label after end of recording: {begin_time} > {label_times[-1]}")
-                continue
-            if end_time < label_times[0]:
-                self.log.err(f"Bad label: end label before start of recording: {end_time} < {label_times[0]}")
-                continue
-            
-            # Want the time bin that's just below
-            # the start of the label's
-            # start time. Method nonzero returns a
-            # 1 el tuple for 1D arrays; therefore the [0] 
-            
-            pre_begin_indices = np.nonzero(label_times <= begin_time)[0]
-            # Is label start time beyond end of recording?
-            if len(pre_begin_indices) == 0:
-                start_bin_idx = 0
             else:
-                # The last match is closest in the spectro
-                # time line to the start time of the label:
-                start_bin_idx = pre_begin_indices[-1]
-            
-            # Similarly with end time:
-            post_end_indices = np.nonzero(label_times > end_time)[0]
-            if len(post_end_indices) == 0:
-                # Label end time is beyond recording. Just 
-                # go up to the end:
-                end_bin_idx = len(label_times)
-            else:
-                end_bin_idx = post_end_indices[0]
+                self.log.err(f"Bad label: end label before start of recording: {end_time} < {label_times[0]}")
+
+        for (start_bin_idx, end_bin_idx) in zip(start_bins[valid], end_bins[valid]):
             yield (start_bin_idx, end_bin_idx)
 
     #------------------------------------
@@ -1169,14 +1150,25 @@ if __name__ == '__main__':
                         help='Outfile for any created files'
                         )
 
+    parser.add_argument('-b', '--block_size', 
+                        type=int,
+                        default=None, 
+                        help='Noise gate this many samples at a time to bound memory use; default: whole file'
+                        )
+
     parser.add_argument('--labelfiles',
                         nargs='+',
                         help="Input .txt/.npy file(s)"
                         )
 
+    parser.add_argument('--trace_file',
+                        default=None,
+                        help='Save a JSON timing trace of the run to this file'
+                        )
+
     parser.add_argument('--actions',
                         nargs='+',
-                        choices=['spectro', 'melspectro','cleanspectro','plot',
+                        choices=['spectro', 'bandspectro', 'melspectro','cleanspectro','plot',
                                  'plotexcerpts','plothits', 'labelmask'],
                         help="Which tasks to accomplish (repeatable)"
                         )
@@ -1187,6 +1179,8 @@ if __name__ == '__main__':
                         )
 
     args = parser.parse_args();
+    if args.trace_file is not None:
+        LoggingService().instrumentation.enable_tracing()
     Spectrogrammer(args.infiles,
                    args.actions,
                    outdir=args.outdir,
@@ -1198,7 +1192,10 @@ if __name__ == '__main__':
                    normalize=not args.no_normalize,
                    framerate=args.framerate,
                    spectrogram_freq_cap=args.freq_cap,
-                   nfft=args.nfft
+                   nfft=args.nfft,
+                   block_size=args.block_size
                    )
+    if args.trace_file is not None:
+        LoggingService().save_trace(args.trace_file)
     # Keep charts up till user kills the windows:
     Plotter.block_till_figs_dismissed()
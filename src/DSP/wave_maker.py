@@ -28,12 +28,18 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from dsp_utils import AudioType
 from dsp_utils import FileFamily
 from elephant_utils.logging_service import LoggingService
+from elephant_utils.work_queue import WorkQueue
+from recording_catalog import RecordingCatalog
 from spectrogrammer import Spectrogrammer
 
 class WavMaker(object):
     '''
     classdocs
     '''
+    
+    # Name under which processed files are
+    # recorded in a RecordingCatalog:
+    CATALOG_STAGE = 'wav_maker'
 
     #------------------------------------
     # Constructor
@@ -51,10 +57,27 @@ class WavMaker(object):
                  limit=None,
                  num_workers=0,
                  this_worker=0,
-                 logfile=None
+                 block_size=None,
+                 logfile=None,
+                 catalog=None,
+                 work_queue=False
                  ):
         '''
         Constructor
+        
+        @param catalog: if provided, path to a RecordingCatalog
+            Sqlite file. Only .wav and label files that are new,
+            or changed since they were last processed with the
+            catalog are then processed. With more than one
+            worker, each worker takes a share of all catalogued
+            files, and processes the new or changed ones among
+            them.
+        @type catalog: {None|str}
+        @param work_queue: if True, workers do not each take a 
+            fixed share of the files. Instead, all workers
+            repeatedly claim the largest remaining file from a
+            WorkQueue in outdir.
+        @type work_queue: bool
         '''
         # Make sure the full path to the 
         # outdir exists:
@@ -62,25 +85,60 @@ class WavMaker(object):
             os.makedirs(outdir)
         self.log = LoggingService(logfile=logfile,
                                   msg_identifier=f"wave_maker#{this_worker}")
+        self.catalog = None if catalog is None else RecordingCatalog(catalog)
 
 
+        # Several workers sharing a catalog split all its
+        # files among them, rather than only those to do:
+        # that list shrinks as workers that started earlier
+        # mark their files done, and shares of differing 
+        # lists would overlap or leave gaps:
+        shared_catalog = self.catalog is not None and num_workers > 1 and not work_queue
+
         # Get a list of FileFamily instances. The
         # list includes all recursively found files:
-        file_families = self.get_files_todo_info(infiles)
+        file_families = self.get_files_todo_info(infiles, only_todo=not shared_catalog)
         num_wav_files = len(file_families)
         
         # If this instance is one of several gnu parallel
         # workers, find which of the files this worker
         # is supposed to do:
         
-        if num_workers > 0:
+        self.queue = None
+        if work_queue:
+            # All workers add all files; each then
+            # claims the largest file left:
+            self.queue = WorkQueue(os.path.join(outdir, WorkQueue.QUEUE_FILE),
+                                   worker=f"wave_maker#{this_worker}")
+            families_by_path = {file_family.fullpath(file_family.file_type) : file_family
+                                for file_family in file_families}
+            # Files done with other settings are done again:
+            self.queue.add(list(families_by_path.keys()),
+                           params={'normalize'            : normalize,
+                                   'threshold_db'         : threshold_db,
+                                   'low_freq'             : low_freq,
+                                   'high_freq'            : high_freq,
+                                   'spectrogram_freq_cap' : spectrogram_freq_cap,
+                                   'copy_label_files'     : copy_label_files
+                                   })
+            my_file_families = self.queue.claimed(families_by_path)
+            num_todo = self.queue.remaining()
+        elif num_workers > 0:
             my_file_families = self.select_my_infiles(file_families, num_workers, this_worker)
+            if shared_catalog:
+                # Only the new or changed files of this share:
+                my_file_families = self.catalog.todo(
+                    self.CATALOG_STAGE,
+                    [AudioType.WAV, AudioType.LABEL],
+                    paths=[family.fullpath(family.file_type) for family in my_file_families])
+            num_todo = len(my_file_families)
         else:
             my_file_families = file_families
+            num_todo = len(my_file_families)
         
         if copy_label_files:
             # We are to copy txt files where available:
-            num_lab = len([True for file_family in my_file_families \
+            num_lab = len([True for file_family in file_families \
                                 if os.path.exists(file_family.fullpath(AudioType.LABEL))
                                 ])
             self.log.debug(f"Todo: {num_wav_files} .wav files; copy {num_lab} label files.")
@@ -109,6 +167,8 @@ class WavMaker(object):
                             shutil.copy(full_label_path, outdir)
                         except Exception as e:
                             self.log.err(f"Could not copy label file {full_label_path} to {outdir}: {repr(e)}")
+                            if self.queue is not None:
+                                self.queue.failed(infile, repr(e))
                             continue
                 else:
                     continue
@@ -121,12 +181,19 @@ class WavMaker(object):
                                low_freq=low_freq,
                                high_freq=high_freq,
                                threshold_db=threshold_db,
-                               spectrogram_freq_cap=spectrogram_freq_cap
+                               spectrogram_freq_cap=spectrogram_freq_cap,
+                               block_size=block_size
                                )
                 self.log.info(f"Spectrogrammer finished; done with {infile}...")
+                if self.catalog is not None:
+                    self.catalog.mark_done(self.CATALOG_STAGE, infile)
+                if self.queue is not None:
+                    self.queue.done(infile)
 
             except Exception as e:
                 self.log.err(f"Processing failed for '{infile}: {repr(e)}")
+                if self.queue is not None:
+                    self.queue.failed(infile, repr(e))
                 continue
 
             files_done += 1
@@ -137,7 +204,13 @@ class WavMaker(object):
                 if limit is not None:
                     self.log.info(f"\nBatch gated {files_done} of {limit} wav files.")
                 else:
-                    self.log.info(f"\nBatch gated {files_done} of {len(my_file_families)} wav files.")
+                    self.log.info(f"\nBatch gated {files_done} of {num_todo} wav files.")
+
+        if self.queue is not None:
+            if self.queue.num_reclaimed > 0:
+                self.log.info(f"Took over {self.queue.num_reclaimed} file(s) from crashed workers")
+            self.queue.log_throughput(self.log)
+            self.queue.close()
 
 
     #------------------------------------
@@ -186,7 +259,7 @@ class WavMaker(object):
     # get_files_todo_info 
     #-------------------
 
-    def get_files_todo_info(self, infiles):
+    def get_files_todo_info(self, infiles, only_todo=True):
         '''
         Input: a possibly mixed list of .wav, .txt, files,
         and directories. Returns a list of FileFamily instances
@@ -197,6 +270,9 @@ class WavMaker(object):
         
         @param infiles: list of files/directories
         @type infiles: [str]
+        @param only_todo: with a catalog, whether to only return
+            new or changed files, or all catalogued ones
+        @type only_todo: bool
         @return: list of file information FileFamily instances
         @rtype: [FileFamily]
         '''
@@ -205,7 +281,22 @@ class WavMaker(object):
         # family is is guaranteed the .wav version (foo.wav)
         # exists. None of the others, such as the label file
         # variant (foo.txt) need exist:
-        file_todos = self.collect_file_families(infiles)
+        if self.catalog is not None:
+            found = self.catalog.scan(infiles)
+            if only_todo:
+                # Only new or changed files:
+                file_todos = self.catalog.todo(self.CATALOG_STAGE,
+                                               [AudioType.WAV, AudioType.LABEL],
+                                               paths=found)
+            else:
+                file_todos = self.catalog.families([AudioType.WAV, AudioType.LABEL],
+                                                   paths=found)
+            self.log.info(f"Catalog: {self.catalog.num_new} new, "
+                          f"{self.catalog.num_changed} changed, "
+                          f"{self.catalog.num_removed} removed files; "
+                          f"{len(file_todos)} {'to process' if only_todo else 'to share among workers'}")
+        else:
+            file_todos = self.collect_file_families(infiles)
         
         # Remove entries that only have a label file:
         # Strategy: search the list of file families from end to front,
@@ -326,6 +417,21 @@ if __name__ == '__main__':
                         default=0,
                         help="this worker's rank within num_workers started via gnu parallel"
                         );
+    parser.add_argument('-b', '--block_size',
+                        type=int,
+                        default=None,
+                        help='gate this many samples at a time to bound memory use; default: whole file'
+                        );
+    parser.add_argument('-c', '--catalog',
+                        default=None,
+                        help='recording catalog sqlite file; if given, only new or changed files are processed'
+                        );
+    parser.add_argument('-q', '--work_queue',
+                        action='store_true',
+                        default=False,
+                        help='workers claim the largest remaining file from a queue in outdir,\n' +\
+                             'rather than each taking a fixed share'
+                        );
     parser.add_argument('infiles',
                         nargs='+',
                         help='Repeatable: .wav input files and directories')
@@ -347,5 +453,8 @@ if __name__ == '__main__':
              limit=args.limit,
              num_workers=args.num_workers,
              this_worker=args.this_worker,
-             logfile=args.logfile
+             block_size=args.block_size,
+             logfile=args.logfile,
+             catalog=args.catalog,
+             work_queue=args.work_queue
              )
\ No newline at end of file
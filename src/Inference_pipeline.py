@@ -36,6 +36,11 @@ python Inference_pipeline.py --process_data --data_dir <data directory> --spect_
 Model Predictions:
 python Inference_pipeline.py --make_predictions --model_0 2_Stage_Model/first_stage.pt --model_1 2_Stage_Model/second_stage.pt --spect_path <directory with processed spectrograms>
 
+------------------------------------
+
+For recordings that keep arriving, inference_daemon.py keeps both models
+loaded and predicts the calls of each .wav file placed in an inbox directory.
+
 """
 
 import temp_spectrogramer
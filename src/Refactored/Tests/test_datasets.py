@@ -0,0 +1,125 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+# Ahead of src, whose parameters and models modules
+# share their names with the refactored ones:
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+from datasets import Subsampled_ElephantDataset, Balanced_Sampler, Window_Id
+from toy_windows import write_windows
+
+TEST_ALL = True
+#TEST_ALL = False
+
+
+class TestBalancedSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='datasets_test')
+        self.data_path = os.path.join(self.tmp_dir.name, 'Train')
+        write_windows(self.data_path, num_pos=4, num_neg=40, num_frames=8)
+        np.random.seed(8)
+        self.dataset = Subsampled_ElephantDataset(self.data_path, neg_ratio=2)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def negatives(self, ids):
+        return set(ids) - set(range(4))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_current_examples(self):
+        # The dataset holds its current examples; the sampler
+        # addresses any window by its Window_Id
+        self.assertEqual(len(self.dataset), 4 + 8)
+        self.assertEqual(self.dataset.num_window_ids(), 4 + 40)
+        example_ids = self.dataset.example_ids().tolist()
+        for index in range(len(self.dataset)):
+            _feature, _label, paths, window_id = self.dataset[index]
+            self.assertEqual(window_id, example_ids[index])
+            self.assertEqual(paths, self.dataset.window_paths(window_id))
+
+        window_id = max(set(range(4, 44)) - set(example_ids))
+        _feature, _label, paths, returned_id = self.dataset[Window_Id(window_id)]
+        self.assertEqual(returned_id, window_id)
+        self.assertEqual(paths, self.dataset.window_paths(window_id))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_new_negatives_each_epoch(self):
+        sampler = self.dataset.balanced_sampler(shuffle=True)
+        epochs = [list(sampler) for _ in range(3)]
+        for ids in epochs:
+            self.assertEqual(len(ids), len(sampler))
+            self.assertEqual(len(ids), 4 + 8)
+            self.assertTrue(all(isinstance(window_id, Window_Id) for window_id in ids))
+            # All positives, and distinct negatives
+            self.assertTrue(set(range(4)) <= set(ids))
+            self.assertEqual(len(set(ids)), len(ids))
+        self.assertNotEqual(self.negatives(epochs[0]), self.negatives(epochs[1]))
+        self.assertNotEqual(self.negatives(epochs[1]), self.negatives(epochs[2]))
+
+        # Evaluation iterates the current examples
+        self.assertEqual(list(self.dataset.balanced_sampler(shuffle=False)), self.dataset.example_ids().tolist())
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_reproducible_draws(self):
+        first = self.dataset.balanced_sampler(shuffle=True, seed=3)
+        first_epochs = [list(first) for _ in range(3)]
+
+        # Same seed and epoch, same draw, whatever came before
+        second = self.dataset.balanced_sampler(shuffle=True, seed=3)
+        second.set_epoch(2)
+        self.assertEqual(list(second), first_epochs[2])
+        second.set_epoch(0)
+        self.assertEqual(list(second), first_epochs[0])
+
+        other_seed = self.dataset.balanced_sampler(shuffle=True, seed=4)
+        self.assertNotEqual(list(other_seed), first_epochs[0])
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_fixed_negatives(self):
+        negatives = [self.dataset.neg_window_paths(neg_id) for neg_id in (3, 17, 29)]
+        self.dataset.set_neg_examples(negatives)
+        self.assertEqual(len(self.dataset), 4 + 3)
+
+        sampler = self.dataset.balanced_sampler(shuffle=True)
+        expected = sorted(self.dataset.example_ids().tolist())
+        for _ in range(3):
+            ids = list(sampler)
+            self.assertEqual(sorted(ids), expected)
+            self.assertEqual(len(ids), len(sampler))
+        self.assertEqual(sorted(self.dataset.window_paths(window_id) for window_id in expected[4:]),
+                         sorted(negatives))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_shards(self):
+        for num_replicas in (2, 3):
+            samplers = [Balanced_Sampler(self.dataset, shuffle=True, seed=5, num_replicas=num_replicas, rank=rank)
+                        for rank in range(num_replicas)]
+            for epoch in range(2):
+                shards = [list(sampler) for sampler in samplers]
+                reference = Balanced_Sampler(self.dataset, shuffle=True, seed=5)
+                reference.set_epoch(epoch)
+                # 12 ids split evenly, without overlap, and all ranks draw alike
+                self.assertEqual({len(shard) for shard in shards}, {12 // num_replicas})
+                self.assertEqual([len(sampler) for sampler in samplers], [12 // num_replicas] * num_replicas)
+                self.assertEqual(sorted(sum(shards, [])), sorted(reference.epoch_ids().tolist()))
+
+        # Ids that do not split evenly are padded when training, so
+        # that every rank runs as many batches...
+        samplers = [Balanced_Sampler(self.dataset, shuffle=True, num_replicas=5, rank=rank) for rank in range(5)]
+        self.assertEqual({len(list(sampler)) for sampler in samplers}, {3})
+        # ... and each evaluated once otherwise
+        samplers = [Balanced_Sampler(self.dataset, shuffle=False, num_replicas=5, rank=rank) for rank in range(5)]
+        shards = [list(sampler) for sampler in samplers]
+        self.assertEqual([len(shard) for shard in shards], [len(sampler) for sampler in samplers])
+        self.assertEqual(sorted(sum(shards, [])), sorted(self.dataset.example_ids().tolist()))
+
+
+if __name__ == '__main__':
+    unittest.main()
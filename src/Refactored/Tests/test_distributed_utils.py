@@ -0,0 +1,164 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+# Ahead of src, whose parameters and models modules
+# share their names with the refactored ones:
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import torch
+import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import TensorDataset
+
+from distributed_utils import Distributed_Utils
+from model_utils import Model_Utils
+
+TEST_ALL = True
+#TEST_ALL = False
+
+
+def _write_rank(out_path):
+    # Runs in the process that Distributed_Utils.launch() starts
+    with open(out_path, 'w') as f:
+        f.write('{} {}'.format(Distributed_Utils.rank(), Distributed_Utils.world_size()))
+
+
+def _run_two_ranks(out_dir):
+    # Runs in each of the processes of a two rank group
+    rank = Distributed_Utils.rank()
+    results = {'world_size': Distributed_Utils.world_size()}
+    results['sum'] = Distributed_Utils.all_reduce_sum({'count': rank + 1, 'loss': 0.5})
+    results['gathered'] = Distributed_Utils.all_gather(rank)
+    results['broadcast'] = Distributed_Utils.broadcast({'rank': rank})
+
+    dataset = TensorDataset(torch.arange(10, dtype=torch.float32))
+    loader = Model_Utils.get_loader(dataset, 2, shuffle=False, num_workers=0, distributed=True)
+    results['shard'] = [int(x) for batch in loader for x in batch[0]]
+
+    # Start from different weights on each rank; DDP copies rank 0's
+    # and averages the gradients over the ranks
+    model = nn.Linear(1, 1, bias=False)
+    with torch.no_grad():
+        model.weight.fill_(rank + 1.)
+    wrapped = Distributed_Utils.wrap_model(model)
+    results['weight'] = model.weight.item()
+    wrapped(torch.full((1, 1), rank + 1.)).sum().backward()
+    results['grad'] = model.weight.grad.item()
+
+    with open(os.path.join(out_dir, 'rank{}.json'.format(rank)), 'w') as f:
+        json.dump(results, f)
+
+
+class TestDistributedUtils(unittest.TestCase):
+    """
+        Smoke tests of the gloo process group with a single process
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='distributed_test')
+        self.saved_env = {name: os.environ.get(name) for name in ('MASTER_ADDR', 'MASTER_PORT')}
+        os.environ['MASTER_ADDR'] = 'localhost'
+        os.environ['MASTER_PORT'] = str(Distributed_Utils.free_port())
+        self.num_threads = torch.get_num_threads()
+
+    def tearDown(self):
+        Distributed_Utils.cleanup()
+        torch.set_num_threads(self.num_threads)
+        for (name, value) in self.saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        self.tmp_dir.cleanup()
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_process_group(self):
+        self.assertFalse(Distributed_Utils.is_distributed())
+        self.assertEqual(Distributed_Utils.world_size(), 1)
+
+        Distributed_Utils.setup(0, 1)
+        self.assertTrue(Distributed_Utils.is_distributed())
+        self.assertEqual(Distributed_Utils.rank(), 0)
+        self.assertEqual(Distributed_Utils.world_size(), 1)
+        self.assertTrue(Distributed_Utils.is_main_process())
+
+        model = nn.Linear(4, 1)
+        wrapped = Distributed_Utils.wrap_model(model)
+        self.assertIsInstance(wrapped, DistributedDataParallel)
+        self.assertIs(Distributed_Utils.unwrap_model(wrapped), model)
+        # A forward and backward pass through the gloo reducer:
+        wrapped(torch.ones(2, 4)).sum().backward()
+        self.assertIsNotNone(model.weight.grad)
+
+        self.assertEqual(Distributed_Utils.all_reduce_sum({'loss': 1.5, 'count': 3}),
+                         {'loss': 1.5, 'count': 3.0})
+        self.assertEqual(Distributed_Utils.broadcast({'epoch': 2}), {'epoch': 2})
+
+        # With a single replica each rank gets all of the data
+        dataset = TensorDataset(torch.arange(10, dtype=torch.float32))
+        loader = Model_Utils.get_loader(dataset, 4, shuffle=False, num_workers=0, distributed=True)
+        self.assertEqual(sum(len(batch[0]) for batch in loader), 10)
+
+        Distributed_Utils.cleanup()
+        self.assertFalse(Distributed_Utils.is_distributed())
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_launch(self):
+        out_path = os.path.join(self.tmp_dir.name, 'rank.txt')
+        Distributed_Utils.launch(_write_rank, 1, out_path)
+        with open(out_path) as f:
+            self.assertEqual(f.read(), '0 1')
+        # The spawned process left no group behind in this one
+        self.assertFalse(Distributed_Utils.is_distributed())
+
+
+class TestDistributedUtilsTwoRanks(unittest.TestCase):
+    """
+        Sharding and reductions across two gloo processes
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='distributed_test')
+        self.saved_env = {name: os.environ.get(name) for name in ('MASTER_ADDR', 'MASTER_PORT')}
+        os.environ['MASTER_ADDR'] = 'localhost'
+        os.environ['MASTER_PORT'] = str(Distributed_Utils.free_port())
+
+    def tearDown(self):
+        for (name, value) in self.saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        self.tmp_dir.cleanup()
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_two_ranks(self):
+        Distributed_Utils.launch(_run_two_ranks, 2, self.tmp_dir.name)
+        results = []
+        for rank in range(2):
+            with open(os.path.join(self.tmp_dir.name, 'rank{}.json'.format(rank))) as f:
+                results.append(json.load(f))
+
+        for rank_results in results:
+            self.assertEqual(rank_results['world_size'], 2)
+            self.assertEqual(rank_results['sum'], {'count': 3.0, 'loss': 1.0})
+            self.assertEqual(rank_results['gathered'], [0, 1])
+            self.assertEqual(rank_results['broadcast'], {'rank': 0})
+            # Rank 0's weight on both ranks, and the mean of
+            # the two ranks' gradients (1 and 2)
+            self.assertEqual(rank_results['weight'], 1.0)
+            self.assertAlmostEqual(rank_results['grad'], 1.5)
+
+        # Equal, disjoint shards that together cover the dataset
+        (shard_0, shard_1) = (results[0]['shard'], results[1]['shard'])
+        self.assertEqual(len(shard_0), len(shard_1))
+        self.assertFalse(set(shard_0) & set(shard_1))
+        self.assertEqual(sorted(shard_0 + shard_1), list(range(10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+# Ahead of src, whose parameters and models modules
+# share their names with the refactored ones:
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from model_utils import Model_Utils
+from elephant_utils.model_files import is_torchscript_file
+
+TEST_ALL = True
+#TEST_ALL = False
+
+
+class Recurrent_Model(nn.Module):
+    """
+        Small model with each of the layer types that get quantized
+    """
+    def __init__(self):
+        super(Recurrent_Model, self).__init__()
+        self.input_linear = nn.Linear(77, 32)
+        self.gru = nn.GRU(32, 16, batch_first=True)
+        self.output_linear = nn.Linear(16, 1)
+
+    def forward(self, inputs):
+        out, _ = self.gru(torch.relu(self.input_linear(inputs)))
+        return self.output_linear(out)
+
+
+class TestInferenceVariants(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='model_utils_test')
+        self.model_path = os.path.join(self.tmp_dir.name, 'model_17.pt')
+        Model_Utils.set_seed(8)
+        self.model = Recurrent_Model()
+        torch.save(self.model, self.model_path)
+        rng = np.random.default_rng(0)
+        self.spectrograms = [rng.standard_normal((1024, 77)).astype(np.float32) for _ in range(2)]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    #------------------------------------
+    # test_export_and_reload
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_export_and_reload(self):
+        example_inputs = torch.randn(1, 64, 77)
+        variant_paths = Model_Utils.export_inference_variants(self.model, self.model_path, example_inputs)
+        self.assertEqual(variant_paths, {'int8': os.path.join(self.tmp_dir.name, 'model_17_int8.pt'),
+                                         'frozen': os.path.join(self.tmp_dir.name, 'model_17_frozen.pt')})
+
+        float_model = Model_Utils.load_model(self.model_path, device='cpu')
+        self.assertFalse(is_torchscript_file(self.model_path))
+        self.assertIsInstance(float_model, Recurrent_Model)
+
+        for variant, variant_path in variant_paths.items():
+            self.assertTrue(is_torchscript_file(variant_path))
+            variant_model = Model_Utils.load_model(variant_path)
+            self.assertIsInstance(variant_model, torch.jit.ScriptModule)
+
+            drift = Model_Utils.prediction_drift(float_model, variant_model, self.spectrograms, chunk_size=64)
+            self.assertEqual(drift['num_windows'], 32)
+            if variant == 'frozen':
+                self.assertLess(drift['max_abs_diff'], 1e-5)
+                self.assertEqual(drift['disagreement'], 0.)
+            else:
+                self.assertLess(drift['max_abs_diff'], 0.05)
+                self.assertLess(drift['disagreement'], 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import importlib
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+# Ahead of src, whose parameters and models modules
+# share their names with the refactored ones:
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import parameters
+from datasets import Subsampled_ElephantDataset
+from stage_artifacts import Stage_Artifacts, STAGE_2_PARAMETERS
+from toy_windows import write_windows
+
+TEST_ALL = True
+#TEST_ALL = False
+
+
+class TestStageArtifacts(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='stage_artifacts_test')
+        self.save_path = os.path.join(self.tmp_dir.name, 'Models')
+        os.makedirs(self.save_path)
+        self.data_path = os.path.join(self.tmp_dir.name, 'Train')
+        write_windows(self.data_path, num_pos=3, num_neg=9)
+
+    def tearDown(self):
+        importlib.reload(parameters)
+        self.tmp_dir.cleanup()
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_key(self):
+        key = Stage_Artifacts.key({'a': 1, 'b': [1, 2]})
+        self.assertEqual(len(key), 64)
+        # Independent of the order of dict entries, but not of lists
+        self.assertEqual(key, Stage_Artifacts.key({'b': [1, 2], 'a': 1}))
+        self.assertNotEqual(key, Stage_Artifacts.key({'a': 1, 'b': [2, 1]}))
+        self.assertNotEqual(key, Stage_Artifacts.key({'a': 2, 'b': [1, 2]}))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_training_inputs(self):
+        model_id = parameters.MODEL_ID
+        key = Stage_Artifacts.key(Stage_Artifacts.training_inputs(model_id))
+        stage_2_key = Stage_Artifacts.key(Stage_Artifacts.training_inputs(model_id, STAGE_2_PARAMETERS))
+        self.assertNotEqual(key, stage_2_key)
+
+        # A stage 2 setting changes only the stage 2 key
+        parameters.HIERARCHICAL_REPEATS += 1
+        self.assertEqual(key, Stage_Artifacts.key(Stage_Artifacts.training_inputs(model_id)))
+        self.assertNotEqual(stage_2_key,
+                            Stage_Artifacts.key(Stage_Artifacts.training_inputs(model_id, STAGE_2_PARAMETERS)))
+
+        # A training setting changes both
+        parameters.NUM_EPOCHS += 1
+        self.assertNotEqual(key, Stage_Artifacts.key(Stage_Artifacts.training_inputs(model_id)))
+        # As does the model
+        self.assertNotEqual(Stage_Artifacts.training_inputs(model_id),
+                            Stage_Artifacts.training_inputs(model_id + 1))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_dataset_inputs(self):
+        dataset = Subsampled_ElephantDataset(self.data_path, neg_ratio=1)
+        key = Stage_Artifacts.dataset_inputs(dataset)
+        # Resampled negatives are keyed by the negatives they come from
+        self.assertEqual(key, Stage_Artifacts.dataset_inputs(Subsampled_ElephantDataset(self.data_path, neg_ratio=1, seed=9)))
+        self.assertNotEqual(key, Stage_Artifacts.dataset_inputs(Subsampled_ElephantDataset(self.data_path, neg_ratio=2)))
+
+        # Fixed negatives by the ones in use
+        negatives = list(zip(dataset.all_neg_features, dataset.all_neg_features))
+        dataset.set_neg_examples(negatives[:2])
+        fixed_key = Stage_Artifacts.dataset_inputs(dataset)
+        self.assertNotEqual(key, fixed_key)
+        dataset.set_neg_examples(negatives[1::-1])
+        self.assertEqual(fixed_key, Stage_Artifacts.dataset_inputs(dataset))
+        dataset.set_neg_examples(negatives[2:4])
+        self.assertNotEqual(fixed_key, Stage_Artifacts.dataset_inputs(dataset))
+
+        # A window regenerated under the same name
+        with open(dataset.pos_labels[0], 'ab') as f:
+            f.write(b'\0')
+        self.assertNotEqual(key, Stage_Artifacts.dataset_inputs(Subsampled_ElephantDataset(self.data_path, neg_ratio=1)))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_done_and_publish(self):
+        artifacts = Stage_Artifacts(self.save_path)
+        key = Stage_Artifacts.key({'stage': 1})
+        stage_dir = artifacts.stage_dir('Stage_1', key)
+        self.assertEqual(stage_dir, os.path.join(self.save_path, 'Stage_1', key[:Stage_Artifacts.KEY_LENGTH]))
+        self.assertFalse(artifacts.is_done('Stage_1', key))
+
+        with open(os.path.join(stage_dir, 'model.pt'), 'w') as f:
+            f.write('weights')
+        artifacts.mark_done('Stage_1', key, {'stage': 1}, ['model.pt'])
+        self.assertTrue(artifacts.is_done('Stage_1', key))
+        self.assertFalse(artifacts.is_done('Stage_1', Stage_Artifacts.key({'stage': 2})))
+
+        latest_dir = os.path.join(self.save_path, 'Latest')
+        os.makedirs(latest_dir)
+        artifacts.publish('Stage_1', key, ['model.pt'], latest_dir)
+        with open(os.path.join(latest_dir, 'model.pt')) as f:
+            self.assertEqual(f.read(), 'weights')
+        with open(os.path.join(self.save_path, Stage_Artifacts.MANIFEST_FILE)) as f:
+            self.assertEqual(json.load(f), {'Stage_1': {'key': key, 'path': stage_dir}})
+
+
+if __name__ == '__main__':
+    unittest.main()
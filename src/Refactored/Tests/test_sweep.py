@@ -0,0 +1,118 @@
+import importlib
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+# Ahead of src, whose parameters and models modules
+# share their names with the refactored ones:
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import torch
+
+import parameters
+import sweep
+from datasets import Subsampled_ElephantDataset
+from toy_windows import write_windows
+from window_pack import Window_Pack
+
+TEST_ALL = True
+#TEST_ALL = False
+
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='sweep_test')
+        self.data_path = os.path.join(self.tmp_dir.name, 'Train')
+        write_windows(self.data_path, num_pos=4, num_neg=12)
+
+    def tearDown(self):
+        # apply_setting changes the module's values
+        importlib.reload(parameters)
+        self.tmp_dir.cleanup()
+
+    def build_dataset(self):
+        return Subsampled_ElephantDataset(self.data_path, neg_ratio=parameters.NEG_SAMPLES,
+                                          normalization=parameters.NORM, log_scale=parameters.SCALE,
+                                          gaussian_smooth=parameters.LABEL_SMOOTH, seed=parameters.DATASET_SEED)
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_neg_ratio_settings(self):
+        args = sweep.parser.parse_args(['--neg_ratio', '1', '2', '--seed', '8'])
+        settings = sweep.grid_from_args(args)
+        self.assertEqual(settings, [{'neg_ratio': 1, 'seed': 8}, {'neg_ratio': 2, 'seed': 8}])
+
+        for setting in settings:
+            importlib.reload(parameters)
+            sweep.apply_setting(setting)
+            self.assertEqual(parameters.NEG_SAMPLES, setting['neg_ratio'])
+            self.assertEqual(parameters.MODEL_SEED, 8)
+
+            dataset = self.build_dataset()
+            num_neg = 4 * setting['neg_ratio']
+            self.assertEqual(len(dataset.neg_ids), num_neg)
+
+            sampler = dataset.balanced_sampler(shuffle=True)
+            ids = list(sampler)
+            self.assertEqual(len(ids), len(sampler))
+            self.assertEqual(len(ids), 4 + num_neg)
+            feature, label, _paths, index = dataset[ids[0]]
+            self.assertEqual(index, ids[0])
+            self.assertEqual(tuple(feature.shape), (64, 77))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_float_ratio_from_grid(self):
+        grid_path = os.path.join(self.tmp_dir.name, 'grid.json')
+        with open(grid_path, 'w') as f:
+            json.dump({'neg_ratio': [1.5], 'lr': [3e-4]}, f)
+        args = sweep.parser.parse_args(['--grid', grid_path])
+        (setting,) = sweep.grid_from_args(args)
+        sweep.apply_setting(setting)
+        self.assertEqual(parameters.HYPERPARAMETERS[parameters.MODEL_ID]['lr'], 3e-4)
+
+        # Ratios that are not whole numbers round down to a count
+        dataset = self.build_dataset()
+        self.assertEqual(len(dataset.neg_ids), 6)
+        self.assertEqual(len(list(dataset.balanced_sampler(shuffle=True))), 10)
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_partial_pack_not_reused(self):
+        pack_dir = os.path.join(self.tmp_dir.name, 'packs', 'Train')
+        dataset = Subsampled_ElephantDataset(self.data_path, neg_ratio=0)
+        feature_paths = list(dataset.pos_features) + list(dataset.all_neg_features)
+        pack = Window_Pack.build(dataset, pack_dir)
+        self.assertEqual(len(pack), 16)
+        self.assertTrue(Window_Pack.is_packed(pack_dir, feature_paths))
+        self.assertFalse(Window_Pack.is_packed(pack_dir, feature_paths[:-1]))
+
+        # Cut short, e.g. by a crash while the pack was rewritten
+        features_path = os.path.join(pack_dir, Window_Pack.FEATURES_FILE)
+        with open(features_path, 'r+b') as f:
+            f.truncate(os.path.getsize(features_path) // 2)
+        self.assertFalse(Window_Pack.is_packed(pack_dir, feature_paths))
+        pack = Window_Pack.build(dataset, pack_dir)
+        self.assertTrue(Window_Pack.is_packed(pack_dir, feature_paths))
+        feature, _label = pack.window(feature_paths[-1])
+        self.assertEqual(tuple(feature.shape), (64, 77))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_run_job_restores_streams(self):
+        (stdout, stderr) = (sys.stdout, sys.stderr)
+        job_path = os.path.join(self.tmp_dir.name, 'job')
+        # Fails for want of a pack, as a job would in a pool worker
+        result = sweep.run_job({'seed': 8}, job_path, [self.data_path, self.data_path],
+                               [os.path.join(self.tmp_dir.name, 'no_pack')] * 2,
+                               torch.get_num_threads(), 0)
+        self.assertIs(sys.stdout, stdout)
+        self.assertIs(sys.stderr, stderr)
+        self.assertFalse(sys.stdout.closed)
+        self.assertNotEqual(result['error'], '')
+        with open(os.path.join(job_path, 'train.log')) as f:
+            self.assertIn('Traceback', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+# Ahead of src, whose parameters and models modules
+# share their names with the refactored ones:
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+import parameters
+from datasets import Subsampled_ElephantDataset, Window_Id
+from model_utils import Model_Utils
+from train import Train_Pipeline
+from window_scores import Window_Scores
+from toy_windows import write_windows
+from elephant_utils.model_files import load_pickled
+
+TEST_ALL = True
+#TEST_ALL = False
+
+
+class Frame_Model(nn.Module):
+    """
+        Scores each frame from its spectrum alone
+    """
+    def __init__(self):
+        super(Frame_Model, self).__init__()
+        self.linear = nn.Linear(77, 1)
+
+    def forward(self, inputs):
+        return self.linear(inputs)
+
+
+class TestTrainPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='train_test')
+        self.train_path = os.path.join(self.tmp_dir.name, 'Train')
+        self.test_path = os.path.join(self.tmp_dir.name, 'Test')
+        write_windows(self.train_path, num_pos=4, num_neg=12, seed=0)
+        write_windows(self.test_path, num_pos=2, num_neg=4, seed=1)
+        self.checkpoint_path = os.path.join(self.tmp_dir.name, 'checkpoint.pt')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_pipeline(self, model_seed=8, **kwargs):
+        # The datasets undersample their negatives with numpy's global generator
+        Model_Utils.set_seed(parameters.DATASET_SEED)
+        train_dataset = Subsampled_ElephantDataset(self.train_path, neg_ratio=2)
+        test_dataset = Subsampled_ElephantDataset(self.test_path, neg_ratio=1)
+        dataloaders = {'train': Model_Utils.get_loader(train_dataset, 4, shuffle=True, num_workers=0),
+                       'valid': Model_Utils.get_loader(test_dataset, 4, shuffle=False, num_workers=0)}
+
+        Model_Utils.set_seed(model_seed)
+        model = Frame_Model().to(parameters.device)
+        optimizer = torch.optim.Adam(model.parameters(), lr=1e-2)
+        scheduler = torch.optim.lr_scheduler.StepLR(optimizer, 1, gamma=0.5)
+        return Train_Pipeline(dataloaders, model, nn.BCEWithLogitsLoss(), optimizer,
+                              scheduler, None, self.tmp_dir.name, **kwargs)
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_resume_from_checkpoint(self):
+        num_epochs = 3
+        uninterrupted = self.make_pipeline()
+        uninterrupted.train(num_epochs)
+
+        # Stopped after the first epoch...
+        first_run = self.make_pipeline(checkpoint_path=self.checkpoint_path)
+        first_run.train(1)
+        checkpoint = load_pickled(self.checkpoint_path, map_location='cpu')
+        self.assertEqual(checkpoint['epoch'], 0)
+        self.assertEqual(checkpoint['torch_rng'].device, torch.device('cpu'))
+
+        # ... and restarted from scratch, with other initial weights
+        resumed = self.make_pipeline(model_seed=9, checkpoint_path=self.checkpoint_path)
+        resumed.train(num_epochs)
+
+        for name, weights in uninterrupted.model.state_dict().items():
+            self.assertTrue(torch.allclose(weights, resumed.model.state_dict()[name]), name)
+        self.assertEqual(uninterrupted.scheduler.state_dict()['last_epoch'],
+                         resumed.scheduler.state_dict()['last_epoch'])
+        for name, value in uninterrupted.best_valid_stats.items():
+            self.assertAlmostEqual(value, resumed.best_valid_stats[name], places=5)
+        self.assertEqual(uninterrupted.train_dataloader.sampler.epoch,
+                         resumed.train_dataloader.sampler.epoch)
+
+        # A finished run resumes to nothing more to do
+        checkpoint = load_pickled(self.checkpoint_path, map_location='cpu')
+        self.assertEqual(checkpoint['epoch'], num_epochs - 1)
+        weights = {name: value.clone() for name, value in resumed.model.state_dict().items()}
+        finished = self.make_pipeline(checkpoint_path=self.checkpoint_path)
+        finished.train(num_epochs)
+        for name, value in weights.items():
+            self.assertTrue(torch.equal(value, finished.model.state_dict()[name]))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_window_scores(self):
+        pipeline = self.make_pipeline(record_window_scores=True)
+        train_dataset = pipeline.train_dataloader.dataset
+        test_dataset = pipeline.test_dataloader.dataset
+        self.assertEqual(len(pipeline.train_window_scores), train_dataset.num_window_ids())
+        self.assertEqual(len(pipeline.valid_window_scores), test_dataset.num_window_ids())
+
+        # A training epoch scores the windows it draws
+        epoch_ids = pipeline.train_dataloader.sampler.epoch_ids()
+        pipeline.run_epoch(pipeline.train_dataloader, train=True, 
+                            window_scores=pipeline.train_window_scores, epoch=0)
+        train_window_scores = pipeline.train_window_scores
+        self.assertEqual(train_window_scores.scored().tolist(), sorted(epoch_ids.tolist()))
+        self.assertTrue(np.all(train_window_scores.epoch[epoch_ids] == 0))
+
+        # Each score lands at the index of its window
+        pipeline.run_epoch(pipeline.test_dataloader, train=False, 
+                            window_scores=pipeline.valid_window_scores, epoch=1)
+        valid_window_scores = pipeline.valid_window_scores
+        self.assertEqual(valid_window_scores.scored().tolist(), sorted(test_dataset.example_ids().tolist()))
+        bce = nn.BCEWithLogitsLoss(reduction='none')
+        with torch.no_grad():
+            for index in valid_window_scores.scored().tolist():
+                feature, label, _, _ = test_dataset[Window_Id(index)]
+                logits = pipeline.model(feature.unsqueeze(0)).squeeze(-1)
+                num_errors = torch.sum((torch.sigmoid(logits) > 0.5) != (label > 0.5)).item()
+                self.assertAlmostEqual(valid_window_scores.loss[index], bce(logits, label.unsqueeze(0)).mean().item(), places=5)
+                self.assertEqual(valid_window_scores.num_errors[index], num_errors)
+                self.assertEqual(valid_window_scores.epoch[index], 1)
+
+        # train() saves the scores with the model
+        pipeline.train(1)
+        saved = Window_Scores.load(os.path.join(self.tmp_dir.name, Train_Pipeline.WINDOW_SCORE_FILES['train']))
+        self.assertTrue(np.array_equal(saved.epoch, pipeline.train_window_scores.epoch))
+        self.assertTrue(np.allclose(saved.loss, pipeline.train_window_scores.loss, equal_nan=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
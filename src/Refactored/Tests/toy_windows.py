@@ -0,0 +1,21 @@
+import os
+
+import numpy as np
+
+
+def write_windows(data_path, num_pos, num_neg, num_frames=64, num_freqs=77, seed=0):
+    """
+        A small data folder of windows named as the dataset
+        classes expect them: <rec>_{pos,neg}-{features,labels}_<i>.npy.
+        Positive windows have a call in their middle half.
+    """
+    os.makedirs(data_path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for kind, num_windows in [('pos', num_pos), ('neg', num_neg)]:
+        for i in range(num_windows):
+            feature = rng.uniform(1., 10., size=(num_frames, num_freqs)).astype(np.float32)
+            label = np.zeros(num_frames, dtype=np.float32)
+            if kind == 'pos':
+                label[num_frames // 4: 3 * num_frames // 4] = 1.
+            np.save(os.path.join(data_path, 'rec_{}-features_{}.npy'.format(kind, i)), feature)
+            np.save(os.path.join(data_path, 'rec_{}-labels_{}.npy'.format(kind, i)), label)
@@ -0,0 +1,217 @@
+from tensorboardX import SummaryWriter
+import numpy as np
+import matplotlib.pyplot as plt
+import torch
+import time
+import os
+import argparse
+
+import parameters
+from models import get_model
+from loss import get_loss
+from train import Train_Pipeline
+from model_utils import Model_Utils
+from datasets import Subsampled_ElephantDataset, Full_ElephantDataset
+
+### THINGS THAT I WANT TO DO
+"""
+    Where do we want to start writing this code:
+        - We can still leverage the run_epoch function of the Train_Pipeline
+        in train.py. Note later if we really want to do the batches or iteration
+        level than we can re-write this. Overall, the train.py file should
+        really just be responsible for either training one epoch, training
+        several epochs, or training several iterations. A separate file 
+        should be responsible for re-sampling the data and then calling
+        the necessary train functions. 
+        - In this class we should define the outward framework for doing the curriculum
+        learning, including the curriculum scheduling and curriculum defining
+        - Methods to write here:
+        ...
+    Look at some profiling:
+        - After five epochs keep a histogram of how many get x segments incorrect
+        - keep track of the variance of number of wrong (segments) for each example! Namely,
+        for each example, see how many wrong were for that example after 
+        5, 10, 15, 20, 25 epochs and then calculate the # wrong variance.
+        - Also keep track of the variance of "avg" confidence like in focal loss
+        - Methods to write:
+            - Profiling method that trains a model for 5 then 10 then 15 then ...
+            epochs and at each time looks at per window statistics of the full data.
+            - Full data "scoring" statistics. These now come for free from the 
+            epochs' forward passes (see Window_Scores), rather than from running
+            the model over the full dataset again:
+                - the number of incorrect chunks
+                - the avg prediction cofidence for the correct slice class (i.e. 
+                think the chunk focal loss)
+"""
+parser = argparse.ArgumentParser()
+
+parser.add_argument('--local_files', dest='local_files', action='store_true',
+    help='Flag specifying to read data from the local elephant_dataset directory.'
+    'The default is to read from the quatro data directory.')
+parser.add_argument('--save_local', dest='save_local', action='store_true',
+    help='Flag specifying to save model run information to the local models directory.'
+    'The default is to save to the quatro data directory.')
+
+# Just so numpy does not print rediculously un-readible stuff
+np.set_printoptions(precision=2)
+
+
+def round_statistics(window_scores, first_epoch):
+    """
+        Per window statistics of the windows scored since first_epoch,
+        and NaN for the others:
+            - the number of incorrect chunks
+            - the avg prediction cofidence for the correct slice class (i.e. 
+            think the chunk focal loss)
+    """
+    scored = window_scores.epoch >= first_epoch
+    window_errors = np.where(scored, window_scores.num_errors, np.nan)
+    window_inv_avg_predictions = np.where(scored, window_scores.inv_confidence, np.nan)
+    return window_errors, window_inv_avg_predictions
+
+
+def save_histogram(values, title, file_path, bins=25):
+    """
+        Save and print the histogram of the non NaN values
+    """
+    n, bins, _ = plt.hist(values[~np.isnan(values)], bins=bins)
+    plt.title(title)
+    plt.savefig(file_path)
+    # Print out to visually inspect
+    print (title)
+    print ('Vals:', n)
+    print ('Bins:', bins)
+    plt.clf()
+
+
+def curriculum_profiling(train_pipeline, curriculum_path, num_rounds=20, round_epochs=5):
+    """
+        Trains a model for 5 then 10 then 15 then ... epochs, and after 
+        each round looks at the per window statistics of the full training
+        and test data. The train_pipeline must record window scores. Its
+        training epochs score the windows they draw, which come from
+        all of the negatives of the training data, and a validation epoch
+        over the full test data after each round scores all of its windows.
+    """
+    train_window_scores = train_pipeline.train_window_scores
+    valid_window_scores = train_pipeline.valid_window_scores
+    # Things to profile
+    window_errors = {'train': [], 'valid': []}
+    inv_avg_predictions = {'train': [], 'valid': []}
+    # Train 5, 10, 15, 20, 25 epochs
+    for i in range(num_rounds):
+        num_epochs = (i + 1) * round_epochs
+        # For now do not pick a model based on best performance
+        # but simply keep training the model of the last round
+        first_epoch = i * round_epochs
+        for epoch in range(first_epoch, num_epochs):
+            print ('Epoch [{}/{}]'.format(epoch + 1, num_epochs))
+            train_epoch_results = train_pipeline.run_epoch(train_pipeline.train_dataloader, train=True, 
+                                                    window_scores=train_window_scores, epoch=epoch)
+            train_pipeline.update_writer(train_epoch_results, epoch, lr=train_pipeline.scheduler.get_lr())
+
+        val_epoch_results = train_pipeline.run_epoch(train_pipeline.test_dataloader, train=False, 
+                                                    window_scores=valid_window_scores, epoch=epoch)
+        train_pipeline.update_writer(val_epoch_results, epoch)
+
+        # Window difficulties of the windows scored in this round
+        for phase, window_scores in [('train', train_window_scores), ('valid', valid_window_scores)]:
+            window_errors_i, inv_avg_predictions_i = round_statistics(window_scores, first_epoch)
+            window_errors[phase].append(window_errors_i)
+            inv_avg_predictions[phase].append(inv_avg_predictions_i)
+
+        # Save the histograms so that we can open them in jupyter
+        print ("Saving Histograms for Iteration i:", i)
+        for phase, name in [('train', 'Train'), ('valid', 'Valid')]:
+            # Number of incorrect slices distribution
+            window_errors_i = window_errors[phase][-1]
+            save_histogram(window_errors_i, name + ' - Number incorrect slices iteration' + str(num_epochs),
+                            os.path.join(curriculum_path, name + "_Num_Incorrect_i-" + str(num_epochs) + ".png"))
+            print ('Number Incorrect > 15:', np.sum(window_errors_i > 15))
+            print ('Number Incorrect > 25:', np.sum(window_errors_i > 25))
+            print('------------------------------')
+
+            # 1 - avg. prediction confidence distribution
+            save_histogram(inv_avg_predictions[phase][-1], 
+                            name + ' - (1 - avg. prediction confidence) iteration' + str(num_epochs),
+                            os.path.join(curriculum_path, name + "_pred_condfidence_i-" + str(num_epochs) + ".png"))
+            print('------------------------------')
+
+        # Look at the distribution of variances across the 
+        # trails until now! Training windows not drawn in
+        # a round do not count for it
+        if i != 0:
+            std_train_window_errors = np.nanstd(np.stack(window_errors['train']), axis=0)
+            std_train_inv_avg_predictions = np.nanstd(np.stack(inv_avg_predictions['train']), axis=0)
+
+            save_histogram(std_train_window_errors, 'Train - STD incorrect slices after iteration' + str(num_epochs),
+                            os.path.join(curriculum_path, "Train_std_window_errors_i-" + str(num_epochs) + ".png"), bins=20)
+            print('------------------------------')
+            save_histogram(std_train_inv_avg_predictions, 
+                            'Train - STD (1 - avg. prediction confidence) after iteration' + str(num_epochs),
+                            os.path.join(curriculum_path, "Train_std_pred_condfidence_i-" + str(num_epochs) + ".png"), bins=20)
+            print('------------------------------')
+
+    # We should also save the actual saved stats to look at later!
+    np.save(os.path.join(curriculum_path, 'train_window_errors'), np.stack(window_errors['train']))
+    np.save(os.path.join(curriculum_path, 'train_inv_avg_predictions'), np.stack(inv_avg_predictions['train']))
+    np.save(os.path.join(curriculum_path, 'test_window_errors'), np.stack(window_errors['valid']))
+    np.save(os.path.join(curriculum_path, 'test_inv_avg_predictions'), np.stack(inv_avg_predictions['valid']))
+    # And the latest scores of each window
+    train_pipeline.save_window_scores()
+    print ("Completed")
+
+
+def main():
+    args = parser.parse_args()
+
+    train_data_path, test_data_path = Model_Utils.get_dataset_paths(local_files=args.local_files)
+
+    # Training draws new negatives each epoch, so that over the 
+    # rounds its window scores cover the full training data
+    train_dataset = Subsampled_ElephantDataset(train_data_path, neg_ratio=parameters.NEG_SAMPLES, 
+                                        normalization=parameters.NORM, log_scale=parameters.SCALE, 
+                                        gaussian_smooth=parameters.LABEL_SMOOTH, seed=8)
+    # Validate on the full test data, to score all of its windows
+    full_test_dataset = Full_ElephantDataset(test_data_path, normalization=parameters.NORM, 
+                                                        log_scale=parameters.SCALE, 
+                                                        gaussian_smooth=False, seed=8)
+
+    train_loader = Model_Utils.get_loader(train_dataset, parameters.BATCH_SIZE, shuffle=True)
+    full_test_loader = Model_Utils.get_loader(full_test_dataset, parameters.BATCH_SIZE, shuffle=False)
+    dataloaders = {'train': train_loader, 'valid': full_test_loader}
+
+    save_path = Model_Utils.create_save_path(time.strftime("%Y-%m-%d_%H:%M:%S", time.localtime()), args.save_local)
+
+    model = get_model(parameters.MODEL_ID)
+    model.to(parameters.device)
+
+    print(model)
+
+    writer = SummaryWriter(save_path)
+    writer.add_scalar('batch_size', parameters.BATCH_SIZE)
+    writer.add_scalar('weight_decay', parameters.HYPERPARAMETERS[parameters.MODEL_ID]['l2_reg'])
+
+    # Want to use focal loss! Next thing to check on!
+    loss_func, _ = get_loss()
+
+    # Honestly probably do not need to have hyper-parameters per model, but leave it for now.
+    optimizer = torch.optim.Adam(model.parameters(), lr=parameters.HYPERPARAMETERS[parameters.MODEL_ID]['lr'],
+                                 weight_decay=parameters.HYPERPARAMETERS[parameters.MODEL_ID]['l2_reg'])
+    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, parameters.HYPERPARAMETERS[parameters.MODEL_ID]['lr_decay_step'], 
+                                            gamma=parameters.HYPERPARAMETERS[parameters.MODEL_ID]['lr_decay'])
+
+    train_pipeline = Train_Pipeline(dataloaders, model, loss_func, optimizer, scheduler, writer, save_path,
+                                    record_window_scores=True)
+
+    start_time = time.time()
+
+    curriculum_profiling(train_pipeline, '../Curriculum_profiling/')
+
+    print('Training time: {:10f} minutes'.format((time.time()-start_time)/60))
+
+    writer.close()
+
+
+if __name__ == '__main__':
+    main()
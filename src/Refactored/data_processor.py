@@ -113,7 +113,10 @@ class Spectrogram_Generator(object):
         data_paths = []
         for(dirpath, dirnames, filenames) in os.walk(data_dir):
             for file in filenames:
-                # Make sure that we don't get garbage files
+                # Make sure that we don't get garbage files,
+                # or the parsed-label caches next to the tables
+                if file.endswith('.labels.npz'):
+                    continue
                 file_type = file.split('.')
                 if len(file_type) == 1 or (file_type[1] not in ['wav', 'txt']):
                     continue
@@ -5,7 +5,6 @@ Created on Apr 5, 2020
 '''
 
 from collections import OrderedDict
-import csv
 from enum import Enum
 import os
 from pathlib import Path, PosixPath
@@ -18,6 +17,7 @@ import torch
 from torchaudio import transforms
 
 from elephant_utils.logging_service import LoggingService
+from elephant_utils.raven_labels import RavenLabelTable
 import numpy as np
 import pandas as pd
 import math
@@ -305,24 +305,14 @@ class DATAUtils(object):
             one inclusive start/end time pair of a call
         @rtype: [pd.Interval]
         '''
+        labels = RavenLabelTable.load(label_file)
         label_time_intervals = []
-        with open(label_file, 'r') as fd:
-            reader = csv.DictReader(fd, delimiter='\t')
-            begin_time_key = 'Begin Time (s)'
-            end_time_key   = 'End Time (s)'
-            # Get each el call time range spec in the labels:
-            for label_dict in reader:
-                try:
-                    begin_time = float(label_dict[begin_time_key])
-                    end_time   = float(label_dict[end_time_key])
-                except KeyError:
-                    raise IOError(f"Raven label file {label_file} does not contain one "
-                                  f"or both of keys '{begin_time_key}', {end_time_key}'")
-                
-                if end_time < begin_time:
-                    #cls.log.err(f"Bad label: end label less than begin label: {end_time} < {begin_time}")
-                    continue
-                label_time_intervals.append(pd.Interval(left=begin_time, right=end_time))
+        # Get each el call time range spec in the labels:
+        for (begin_time, end_time) in zip(labels.begin.tolist(), labels.end.tolist()):
+            if end_time < begin_time:
+                #cls.log.err(f"Bad label: end label less than begin label: {end_time} < {begin_time}")
+                continue
+            label_time_intervals.append(pd.Interval(left=begin_time, right=end_time))
         return label_time_intervals
 
     #------------------------------------
@@ -47,6 +47,17 @@ class Subsampled_ElephantDataset(data.Dataset):
                 shift_windows=False, seed=8):
         """
             @TODO: add comments for these!!!
+
+            Windows are addressed by integer ids: the positive windows
+            come first, followed by the table of all negative windows
+            (see window_paths). The negatives currently in use are kept
+            as ids into that table (self.neg_ids), so that sampling
+            negatives never touches the path strings. Balanced_Sampler
+            uses these ids to draw fresh negatives each epoch.
+
+            Like other datasets, the dataset holds len(dataset) current
+            examples, which plain int indices address. Balanced_Sampler
+            yields Window_Ids instead, which address any window.
         """
         # SET THE SEED???
 
@@ -64,31 +75,38 @@ class Subsampled_ElephantDataset(data.Dataset):
         self.pos_labels = None
         self.init_positive_examples(data_path)
 
-        # Step 2) Initialize the negative examples, 
+        # Step 2) Initialize the table of all negative windows. Their
+        # label paths are only derived once a window is used. Negatives
+        # set later on (e.g. adversarial examples) are added to the table
+        self.all_neg_features = glob.glob(os.path.join(data_path, "*_neg-features_*"), recursive=True)
+        self.all_neg_labels = [None] * len(self.all_neg_features)
+        # Undersampling draws from the negatives of the data_path
+        self.num_undersample_negatives = len(self.all_neg_features)
+        # {feature path : negative id}, built when first needed
+        self.neg_table_ids = None
+        # Read-only shared copy of the windows (see use_window_pack)
+        self.window_pack = None
+
+        # Step 3) Initialize the negative examples, 
         # either through direct assignment or through
         # random undersampling.
-        self.neg_features = None
-        self.neg_labels = None
+        self.neg_ids = np.zeros(0, dtype=np.int64)
+        # Whether the negatives were set explicitly, rather than
+        # sampled, and so must not be resampled each epoch
+        self.fixed_negatives = False
         if neg_features is not None:
             self.set_neg_examples(neg_features)
         # By default randomly undersample to get the negative features
         else: 
             self.undersample_negative_features(data_path)
-        
-        # Step 3) Combine the pos and neg features to get the complete data
-        self.data = None
-        self.combine_data()
-
-        # Check for consistancy
-        assert len(self.data) == len(self.labels)
 
         print("================================")
         print("=======  ElephantDataset =======")
         print("================================")
         print()
-        print("Number of examples for training / evaluation".format(len(self.data)))
+        print("Number of examples for training / evaluation {}".format(len(self.pos_features) + len(self.neg_ids)))
         print("Number of positive examples {}".format(len(self.pos_features)))
-        print("Number of negative examples {}".format(len(self.neg_features)))
+        print("Number of negative examples {}".format(len(self.neg_ids)))
         print("Total number of negative examples {}.".format(len(self.all_neg_features)))
         print('Normalizing with {} and scaling {}'.format(normalization, log_scale))
 
@@ -106,25 +124,20 @@ class Subsampled_ElephantDataset(data.Dataset):
             feature_parts = feature_path.split("pos-features")
             self.pos_labels.append(feature_parts[0] + "pos-labels" + feature_parts[1])
 
+    @property
+    def neg_features(self):
+        return [self.all_neg_features[neg_id] for neg_id in self.neg_ids.tolist()]
 
-    def undersample_negative_features(self, data_path):
+    @property
+    def neg_labels(self):
+        return [self.neg_label_path(neg_id) for neg_id in self.neg_ids.tolist()]
+
+    def undersample_negative_features(self, data_path=None):
         """
             Perform majority class random undersampling
         """
-        num_neg_samples = self.neg_ratio * len(self.pos_features)
-
-        # Collect all of the negative features and sample a random set of them.
-        # For now let us just keep them around! (MAY CHANGE!!)
-        self.all_neg_features = glob.glob(os.path.join(data_path, "*_neg-features_*"), recursive=True)
-        # Sample without replacement
-        sampled_idxs = np.random.choice(len(self.all_neg_features), num_neg_samples, replace=False)
-
-        self.neg_features = [self.all_neg_features[idx] for idx in sampled_idxs]
-        # Set the corresponding negative labels
-        self.neg_labels = []
-        for feature_path in self.neg_features:
-            feature_parts = feature_path.split("neg-features")
-            self.neg_labels.append(feature_parts[0] + "neg-labels" + feature_parts[1])
+        self.neg_ids = self.sample_negative_ids(self.num_ratio_negatives())
+        self.fixed_negatives = False
 
     
     def undersample_negative_features_to_balance(self):
@@ -135,40 +148,67 @@ class Subsampled_ElephantDataset(data.Dataset):
         """
         # Step 1) Compute how many negative examples to sample to rebalance
         # as: len(pos) * neg_ratio = len(neg)
-        num_neg_samples = self.neg_ratio * len(self.pos_features) - len(self.neg_features)
+        num_neg_samples = self.num_ratio_negatives() - len(self.neg_ids)
 
-        # Step 2) Collect all of the negative features and discard the negative features
-        # we have already sampled
-        neg_features_to_sample = list(np.setdiff1d(self.all_neg_features, self.neg_features))
+        # Step 2-4) Sample among the negatives we have not sampled yet, and add them
+        new_neg_ids = self.sample_negative_ids(num_neg_samples, exclude=self.neg_ids)
+        self.neg_ids = np.concatenate((self.neg_ids, new_neg_ids))
 
-        # Step 3) Sample without replacement
-        sampled_idxs = np.random.choice(len(neg_features_to_sample), num_neg_samples, replace=False)
+        print("Undersampling more negative features to match ratio!")
+        print ("New number of negative features is {}".format(len(self.neg_ids)))
 
-        # Step 4) Append these new negative features
-        self.neg_features += [neg_features_to_sample[idx] for idx in sampled_idxs]
-        # Set the corresponding negative labels
-        for feature_path in self.neg_features:
-            feature_parts = feature_path.split("neg-features")
-            self.neg_labels.append(feature_parts[0] + "neg-labels" + feature_parts[1])
+    def num_ratio_negatives(self):
+        """
+            Number of negatives for neg_ratio times as many negatives
+            as positives. The ratio may be given as a float, e.g. by
+            a sweep or a json grid, while sampling needs a count.
+        """
+        return int(self.neg_ratio * len(self.pos_features))
 
-        # Make sure to combine the data to reflect the added negative features
-        self.combine_data()
-        print("Undersampling more negative features to match ratio!")
-        print ("New number of negative features is {}".format(len(self.neg_features)))
-    
+    def sample_negative_ids(self, num_samples, exclude=None, rng=np.random):
+        """
+            Sample without replacement the ids of num_samples of the
+            negative windows of the data_path, leaving out the ids
+            in exclude. rng is a numpy RandomState or Generator.
+        """
+        if exclude is None or len(exclude) == 0:
+            return rng.choice(self.num_undersample_negatives, num_samples, replace=False)
 
-    def combine_data(self):
+        candidates = np.ones(self.num_undersample_negatives, dtype=bool)
+        candidates[exclude[exclude < self.num_undersample_negatives]] = False
+        candidates = np.flatnonzero(candidates)
+        return candidates[rng.choice(len(candidates), num_samples, replace=False)]
+
+    def neg_label_path(self, neg_id):
+        """
+            Label path of a negative window
         """
-            Combines the pos and neg data examples! Outputs some just logging if 
-            we are changing the data
+        label_path = self.all_neg_labels[neg_id]
+        if label_path is None:
+            feature_parts = self.all_neg_features[neg_id].split("neg-features")
+            label_path = feature_parts[0] + "neg-labels" + feature_parts[1]
+            self.all_neg_labels[neg_id] = label_path
+        return label_path
+
+    def add_to_neg_table(self, neg_examples):
         """
-        # Logging
-        if self.data is not None:
-            print("Total number of samples was {} and is now {}".format(len(self.data), len(self.pos_features) + len(self.neg_features)))
+            Return the negative ids of the (feature, label) examples,
+            adding those not in the table yet
+        """
+        if self.neg_table_ids is None:
+            self.neg_table_ids = {feature : neg_id for neg_id, feature in enumerate(self.all_neg_features)}
 
-        # Combine
-        self.data = self.pos_features + self.neg_features
-        self.labels = self.pos_labels + self.neg_labels
+        neg_ids = []
+        for feature, label in neg_examples:
+            neg_id = self.neg_table_ids.get(feature)
+            if neg_id is None:
+                neg_id = len(self.all_neg_features)
+                self.all_neg_features.append(feature)
+                self.all_neg_labels.append(label)
+                self.neg_table_ids[feature] = neg_id
+            neg_ids.append(neg_id)
+
+        return np.array(neg_ids, dtype=np.int64)
 
 
     def set_pos_examples(self, pos_examples):
@@ -181,14 +221,12 @@ class Subsampled_ElephantDataset(data.Dataset):
             that includes the feature, the label, and any other things we want!
         """
         print("Length of pos_features was {} and is now {} ".format(len(self.pos_features), len(pos_examples)))
-        print("Length of neg_features is {}".format(len(self.neg_features)))
+        print("Length of neg_features is {}".format(len(self.neg_ids)))
         self.pos_features = []
         self.pos_labels = []
         for feature, label in pos_examples:
             self.pos_features.append(feature)
             self.pos_labels.append(label)
-        
-        self.combine_data()
 
     def add_positive_examples_from_dir(self, data_dir):
         """ 
@@ -224,12 +262,10 @@ class Subsampled_ElephantDataset(data.Dataset):
             @TODO comments
         """
         print("Length of pos_features was {} and is now {} ".format(len(self.pos_features), len(self.pos_features) + len(pos_examples)))
-        print("Length of neg_features is {}".format(len(self.neg_features)))
+        print("Length of neg_features is {}".format(len(self.neg_ids)))
         for feature, label in pos_examples:
             self.pos_features.append(feature)
             self.pos_labels.append(label)
-        
-        self.combine_data()
 
     def set_neg_examples(self, neg_examples):
         """
@@ -239,16 +275,13 @@ class Subsampled_ElephantDataset(data.Dataset):
 
             Namely, we have a list of each data example as a tuple 
             that includes the feature, the label, and any other things we want!
+
+            These negatives are used as is, rather than resampled each epoch.
         """
-        print("Length of neg_features was {} and is now {} ".format(len(self.neg_features), len(neg_examples)))
+        print("Length of neg_features was {} and is now {} ".format(len(self.neg_ids), len(neg_examples)))
         print("Length of pos_features is {}".format(len(self.pos_features)))
-        self.neg_features = []
-        self.neg_labels = []
-        for feature, label in neg_examples:
-            self.neg_features.append(feature)
-            self.neg_labels.append(label)
-        
-        self.combine_data() 
+        self.neg_ids = self.add_to_neg_table(neg_examples)
+        self.fixed_negatives = True
 
     def add_neg_examples(self, neg_examples):
         """
@@ -261,24 +294,106 @@ class Subsampled_ElephantDataset(data.Dataset):
 
             @TODO comments
         """
-        print("Length of neg_features was {} and is now {} ".format(len(self.neg_features), len(self.neg_features) + len(neg_examples)))
+        print("Length of neg_features was {} and is now {} ".format(len(self.neg_ids), len(self.neg_ids) + len(neg_examples)))
         print("Length of pos_features is {}".format(len(self.pos_features)))
-        for feature, label in pos_examples:
-            self.neg_features.append(feature)
-            self.neg_labels.append(label)
-        
-        self.combine_data()
+        self.neg_ids = np.concatenate((self.neg_ids, self.add_to_neg_table(neg_examples)))
+        self.fixed_negatives = True
+
+    def num_window_ids(self):
+        """
+            Size of the window id space: all positives and
+            all negatives in the table (see Window_Scores)
+        """
+        return len(self.pos_features) + len(self.all_neg_features)
+
+    def example_window_id(self, index):
+        """
+            Window id of the current example at the given index
+        """
+        num_pos = len(self.pos_features)
+        if index < num_pos:
+            return index
+        return num_pos + int(self.neg_ids[index - num_pos])
+
+    def example_ids(self):
+        """
+            Ids of the current examples: all positives, followed
+            by the current negatives
+        """
+        num_pos = len(self.pos_features)
+        return np.concatenate((np.arange(num_pos), num_pos + self.neg_ids))
+
+    def window_paths(self, index):
+        """
+            (feature, label) paths of the window with the given id
+        """
+        num_pos = len(self.pos_features)
+        if index < num_pos:
+            return self.pos_features[index], self.pos_labels[index]
+        return self.neg_window_paths(index - num_pos)
+
+    def neg_window_paths(self, neg_id):
+        """
+            (feature, label) paths of the negative with the given table id
+        """
+        return self.all_neg_features[neg_id], self.neg_label_path(neg_id)
+
+    def neg_window_ids(self, num_pos=None):
+        """
+            Window ids of all the negatives in the table. Window ids
+            recorded while the dataset had another number of positives
+            (e.g. before adding generated ones) are for that num_pos.
+        """
+        if num_pos is None:
+            num_pos = len(self.pos_features)
+        return num_pos + np.arange(len(self.all_neg_features))
+
+    def neg_ids_of(self, window_ids, num_pos=None):
+        """
+            Table ids of the negatives with the given window ids (see neg_window_ids)
+        """
+        if num_pos is None:
+            num_pos = len(self.pos_features)
+        return np.asarray(window_ids) - num_pos
+
+    def use_window_pack(self, window_pack):
+        """
+            Read the windows held by a Window_Pack from the pack,
+            rather than from their files
+        """
+        self.window_pack = window_pack
+
+    def balanced_sampler(self, shuffle=True, seed=8, num_replicas=1, rank=0):
+        """
+            Sampler over the current examples; if shuffle, over
+            freshly sampled negatives in each epoch (see Balanced_Sampler).
+            For distributed training, over the share of the given rank.
+        """
+        return Balanced_Sampler(self, shuffle=shuffle, resample=shuffle, seed=seed,
+                                num_replicas=num_replicas, rank=rank)
 
 
     def __len__(self):
-        return len(self.data)
+        """
+            Number of current examples: all positives and the
+            current negatives, neg_ratio times as many unless set
+            explicitly. See num_window_ids for the window id space.
+        """
+        return len(self.pos_features) + len(self.neg_ids)
 
     """
-    Return a single element at provided index
+    Return a single element at provided index, either a Window_Id
+    (from Balanced_Sampler) or the index of a current example
     """
     def __getitem__(self, index):
-        feature = np.load(self.data[index])
-        label = np.load(self.labels[index])
+        if not isinstance(index, Window_Id):
+            index = self.example_window_id(index)
+        feature_path, label_path = self.window_paths(index)
+        if self.window_pack is not None and feature_path in self.window_pack:
+            feature, label = self.window_pack.window(feature_path)
+        else:
+            feature = np.load(feature_path)
+            label = np.load(label_path)
 
         # This we need to update more!
         feature = self.apply_data_transforms(feature)
@@ -294,7 +409,8 @@ class Subsampled_ElephantDataset(data.Dataset):
             feature = feature.T
         label = torch.from_numpy(label).float()
 
-        return feature, label, (self.data[index], self.labels[index]) # Include the data files!
+        # Include the data files, and the window id for Window_Scores!
+        return feature, label, (feature_path, label_path), int(index)
 
     def apply_label_transforms(self, label):
         # Gaussian smooth the labels!
@@ -321,6 +437,100 @@ class Subsampled_ElephantDataset(data.Dataset):
         return data
 
 
+class Window_Id(int):
+    """
+        Id of a window of a Subsampled_ElephantDataset (see window_paths),
+        as opposed to the index of one of its current examples. The
+        DataLoader passes the sampler's indices to the dataset as they
+        are, so that the dataset can tell the two apart.
+    """
+    __slots__ = ()
+
+
+class Balanced_Sampler(data.Sampler):
+    """
+        Sampler over the current examples of a Subsampled_ElephantDataset,
+        yielding window ids in the dataset's id space: all positives and
+        neg_ratio times as many negatives.
+
+        If resample, the negatives are drawn anew for each epoch from all
+        the negatives of the dataset's data_path, so that training sees
+        new negatives every epoch without rebuilding the dataset. Only
+        integer ids are drawn. Negatives set explicitly on the dataset
+        (e.g. adversarial examples) are never resampled.
+
+        Each epoch's draw is seeded with (seed, epoch) to be repeatable.
+
+        For distributed training, each of num_replicas processes gives
+        its rank. All ranks draw the same ids, since they share the seed
+        and count epochs alike, and each iterates over its own share.
+        When shuffling (training), the ids are padded by repeating the
+        first ones so that all ranks get the same number of batches,
+        as DistributedSampler does. Otherwise every id is in exactly
+        one share, so that evaluation counts each window once.
+    """
+    def __init__(self, dataset, shuffle=True, resample=True, seed=8, num_replicas=1, rank=0):
+        self.dataset = dataset
+        self.shuffle = shuffle
+        self.resample = resample
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def resampling(self):
+        return self.resample and not self.dataset.fixed_negatives
+
+    def epoch_ids(self):
+        """
+            Window ids of the current epoch, over all ranks
+        """
+        # RandomState, since np.random.default_rng needs numpy 1.17
+        rng = np.random.RandomState([self.seed, self.epoch])
+        if self.resampling():
+            num_pos = len(self.dataset.pos_features)
+            neg_ids = self.dataset.sample_negative_ids(self.dataset.num_ratio_negatives(), rng=rng)
+            ids = np.concatenate((np.arange(num_pos), num_pos + neg_ids))
+        else:
+            ids = self.dataset.example_ids()
+
+        if self.shuffle:
+            rng.shuffle(ids)
+        return ids
+
+    def shard(self, ids):
+        """
+            This rank's share of the epoch's ids
+        """
+        if self.num_replicas == 1:
+            return ids
+        if self.shuffle:
+            ids = np.resize(ids, self.num_replicas * -(-len(ids) // self.num_replicas))
+        return ids[self.rank::self.num_replicas]
+
+    def num_epoch_ids(self):
+        num_pos = len(self.dataset.pos_features)
+        if self.resampling():
+            return num_pos + self.dataset.num_ratio_negatives()
+        return num_pos + len(self.dataset.neg_ids)
+
+    def __iter__(self):
+        ids = self.shard(self.epoch_ids())
+        self.epoch += 1
+        return iter([Window_Id(window_id) for window_id in ids.tolist()])
+
+    def __len__(self):
+        num_ids = self.num_epoch_ids()
+        if self.num_replicas == 1:
+            return num_ids
+        if self.shuffle:
+            return -(-num_ids // self.num_replicas)
+        return len(range(self.rank, num_ids, self.num_replicas))
+
+
 # THis class is just for the full dataset!!!!
 class Full_ElephantDataset(data.Dataset):
     """
@@ -410,7 +620,8 @@ class Full_ElephantDataset(data.Dataset):
         feature = torch.from_numpy(feature).float()  
         label = torch.from_numpy(label).float()
 
-        return feature, label, (self.data[index], self.labels[index]) # Include the data files!
+        # Include the data files, and the index for Window_Scores!
+        return feature, label, (self.data[index], self.labels[index]), index
 
     def apply_label_transforms(self, label):
         # Gaussian smooth the labels!
@@ -0,0 +1,148 @@
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+
+
+class Distributed_Utils(object):
+    """
+        Helpers for DistributedDataParallel training with the gloo
+        backend, which runs on cpu-only hosts as well as on gpus.
+
+        A training function is started once per process with launch():
+
+            Distributed_Utils.launch(train, world_size, args)
+
+        which calls train(args) in world_size local processes. When
+        started by torchrun (e.g. across the nodes of a cluster), the
+        process group comes from torchrun's environment instead, and
+        train(args) runs once in each process torchrun starts:
+
+            torchrun --nnodes 2 --nproc_per_node 8 ... main_train.py --ddp 16
+
+        Within train, Model_Utils.get_loader(..., distributed=True) gives
+        each rank its share of the data, Train_Pipeline all-reduces the
+        epoch statistics, and only the main process (rank 0) should
+        write checkpoints and tensorboard scalars.
+    """
+    BACKEND = 'gloo'
+
+    @classmethod
+    def launch(cls, fn, world_size, *args):
+        """
+            Run fn(*args) in each of world_size processes of a process group
+        """
+        if 'RANK' in os.environ and 'WORLD_SIZE' in os.environ:
+            # Started by torchrun
+            cls.setup(int(os.environ['RANK']), int(os.environ['WORLD_SIZE']))
+            try:
+                return fn(*args)
+            finally:
+                cls.cleanup()
+
+        os.environ.setdefault('MASTER_ADDR', 'localhost')
+        os.environ.setdefault('MASTER_PORT', str(cls.free_port()))
+        mp.spawn(cls._run, args=(world_size, fn, args), nprocs=world_size, join=True)
+
+    @classmethod
+    def _run(cls, rank, world_size, fn, args):
+        cls.setup(rank, world_size)
+        try:
+            fn(*args)
+        finally:
+            cls.cleanup()
+
+    @classmethod
+    def setup(cls, rank, world_size):
+        """
+            Join the process group. The cpu cores of the host are split
+            among the local processes, so that they do not compete
+            for the same cores.
+        """
+        dist.init_process_group(cls.BACKEND, rank=rank, world_size=world_size)
+        local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', world_size))
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+        if torch.cuda.is_available():
+            local_rank = int(os.environ.get('LOCAL_RANK', rank))
+            torch.cuda.set_device(local_rank % torch.cuda.device_count())
+
+    @classmethod
+    def cleanup(cls):
+        if dist.is_initialized():
+            dist.destroy_process_group()
+
+    @classmethod
+    def free_port(cls):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(('localhost', 0))
+            return s.getsockname()[1]
+
+    @classmethod
+    def is_distributed(cls):
+        return dist.is_available() and dist.is_initialized()
+
+    @classmethod
+    def rank(cls):
+        return dist.get_rank() if cls.is_distributed() else 0
+
+    @classmethod
+    def world_size(cls):
+        return dist.get_world_size() if cls.is_distributed() else 1
+
+    @classmethod
+    def is_main_process(cls):
+        return cls.rank() == 0
+
+    @classmethod
+    def wrap_model(cls, model):
+        """
+            Wrap a model for distributed training; unchanged if
+            not running distributed. Rank 0's weights are copied
+            to all other ranks.
+        """
+        if not cls.is_distributed():
+            return model
+        if next(model.parameters()).is_cuda:
+            return DistributedDataParallel(model, device_ids=[torch.cuda.current_device()])
+        return DistributedDataParallel(model)
+
+    @classmethod
+    def unwrap_model(cls, model):
+        return model.module if isinstance(model, DistributedDataParallel) else model
+
+    @classmethod
+    def all_reduce_sum(cls, values):
+        """
+            Sum each value of a dict of numbers over all ranks
+        """
+        if not cls.is_distributed():
+            return values
+        names = sorted(values)
+        totals = torch.tensor([float(values[name]) for name in names], dtype=torch.float64)
+        dist.all_reduce(totals, op=dist.ReduceOp.SUM)
+        return dict(zip(names, totals.tolist()))
+
+    @classmethod
+    def all_gather(cls, obj):
+        """
+            List of every rank's obj, in rank order, on all ranks
+        """
+        if not cls.is_distributed():
+            return [obj]
+        objects = [None] * cls.world_size()
+        dist.all_gather_object(objects, obj)
+        return objects
+
+    @classmethod
+    def broadcast(cls, obj):
+        """
+            Rank 0's obj, on all ranks
+        """
+        if not cls.is_distributed():
+            return obj
+        objects = [obj]
+        dist.broadcast_object_list(objects, src=0)
+        return objects[0]
@@ -0,0 +1,67 @@
+import argparse
+import os
+
+# Local file imports
+import parameters
+from models import get_model
+from model_utils import Model_Utils
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('--models', type=str, nargs='+', default=[],
+    help='Paths of trained models (saved with torch.save(model)) to export')
+parser.add_argument('--model_ids', type=int, nargs='+', default=[],
+    help='get_model ids of untrained models to export, e.g. to check that '
+    'an architecture can be quantized and frozen')
+parser.add_argument('--out_dir', type=str, default='.',
+    help='Where to save the exported --model_ids models')
+parser.add_argument('--spect_files', type=str, nargs='+', default=[],
+    help='Saved [time, freq] .npy spectrograms for checking the prediction drift of the exports')
+parser.add_argument('--max_disagreement', type=float, default=0.01,
+    help='Largest acceptable fraction of predictions that change sides of the threshold')
+
+
+"""
+    Export the cpu inference variants of trained models: an int8 dynamically
+    quantized version, and a float32 version, both as frozen TorchScript. eval.py
+    and hierarchical_eval.py load these with --model_variant int8/frozen.
+
+    Example run:
+
+    python export_models.py --models /home/data/elephants/models/Call_model_17/model.pt
+        --spect_files /home/data/elephants/rawdata/Spectrograms/nouabale_test/nn01a_20180126_000000_spec.npy
+"""
+
+
+def export_model(model, model_path, spect_files, max_disagreement):
+    variant_paths = Model_Utils.export_inference_variants(model, model_path)
+    for variant, variant_path in variant_paths.items():
+        print ("Saved", variant, "model to:", variant_path)
+        if len(spect_files) == 0:
+            continue
+
+        variant_model = Model_Utils.load_model(variant_path)
+        drift = Model_Utils.prediction_drift(model, variant_model, spect_files,
+                                chunk_size=parameters.CHUNK_SIZE, threshold=parameters.EVAL_THRESHOLD)
+        print ("Prediction drift of", variant, "model:", drift)
+        if drift['disagreement'] > max_disagreement:
+            print ("WARNING:", variant, "model changes", drift['disagreement'],
+                    "of the binary predictions; more than", max_disagreement)
+
+
+def main():
+    args = parser.parse_args()
+
+    for model_path in args.models:
+        model = Model_Utils.load_model(model_path, device='cpu')
+        export_model(model, model_path, args.spect_files, args.max_disagreement)
+
+    for model_id in args.model_ids:
+        model = get_model(model_id)
+        model_path = os.path.join(args.out_dir, 'model_' + str(model_id) + '.pt')
+        export_model(model, model_path, args.spect_files, args.max_disagreement)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ import sys
 import time
 import os
 import argparse
+import shutil
 
 # Local file imports
 import parameters
@@ -15,8 +16,11 @@ import parameters
 from models import get_model
 from loss import get_loss
 from train import Train_Pipeline
+from window_scores import Window_Scores
 from model_utils import Model_Utils
 from datasets import Subsampled_ElephantDataset, Full_ElephantDataset
+from distributed_utils import Distributed_Utils
+from stage_artifacts import Stage_Artifacts, STAGE_2_PARAMETERS
 
 
 parser = argparse.ArgumentParser()
@@ -51,6 +55,14 @@ parser.add_argument('--pre_train_0', type=str,
 parser.add_argument('--pre_train_1', type=str,
     help='Use a pre-trained model to initialize model 1')
 
+parser.add_argument('--ddp', type=int, default=1,
+    help="Train both stages with DistributedDataParallel in this many processes (gloo backend, so cpu-only "
+    "hosts work too). When started by torchrun, the processes are torchrun's.")
+
+parser.add_argument('--retrain', dest='retrain', action='store_true',
+    help="With --run_type full, run all stages again rather than reusing the saved results (and "
+    "training checkpoints) of stages whose inputs are unchanged")
+
 
 """
     NEW FILE THINKING!!
@@ -98,7 +110,7 @@ class TwoStage_Model(object):
 
     """
     def __init__(self, dataloaders, save_path, stage_one_id=17, stage_two_id=17,
-                    add_generated_data=None, adversarial_neg_ratio=1, run_type="Full"):
+                    add_generated_data=None, adversarial_neg_ratio=1, run_type="Full", retrain=False):
         super(TwoStage_Model, self).__init__()
         
         # Step 1) Unpack the dataloaders
@@ -117,14 +129,21 @@ class TwoStage_Model(object):
         self.train_adversarial_files = os.path.join(self.save_path, adversarial_file_prefix + "Train.txt")
         self.test_adversarial_files = os.path.join(self.save_path, adversarial_file_prefix + "Test.txt")
 
+        # Step 4) Versioned results of the stages of a full run, which
+        # a rerun reuses for the stages whose inputs did not change
+        self.artifacts = Stage_Artifacts(save_path)
+        self.retrain = retrain
+
         # Initialize the actual models
         # NOTE here is where we can consider loading in a pre_defined models
         self.stage_one = None
         self.stage_two = None
+        # Folder of stage 1's run, with the window scores of its training
+        self.stage_one_path = None
         # Figure out the run type! Assume for now that we run the full pipelines
         if run_type == "full":
             # Step 1) Train the first model stage
-            self.train_stage_1()
+            stage_one_key = self.train_stage_1()
 
             # Step 1b) 
             # This is where we would want to add the generated positves!!
@@ -134,15 +153,29 @@ class TwoStage_Model(object):
 
             # Step 2) Do the adversarial discovery. In this we will
             # produce a ranking vector of "how" wrong each example 
-            # was by the first model
+            # was by the first model. In distributed training the main
+            # process does it, and passes the results to the others
+            adversarial_inputs = {'stage_1': stage_one_key,
+                                  'full_train': Stage_Artifacts.dataset_inputs(self.full_train_loader.dataset),
+                                  'full_test': Stage_Artifacts.dataset_inputs(self.full_test_loader.dataset),
+                                  'train': Stage_Artifacts.dataset_inputs(self.train_loader.dataset),
+                                  'test': Stage_Artifacts.dataset_inputs(self.test_loader.dataset),
+                                  'adversarial_neg_ratio': adversarial_neg_ratio,
+                                  'batch_size': parameters.BATCH_SIZE,
+                                  'train_window_scores': self.stage_one_window_scores_path() is not None}
+            adversarial_key = Stage_Artifacts.key(adversarial_inputs)
+            adversarial_results = None
+            if Distributed_Utils.is_main_process():
+                adversarial_results = self.cached_adversarial_discovery(adversarial_key, adversarial_inputs, 
+                                                                        adversarial_neg_ratio)
             self.adversarial_train_weighting, adversarial_train_files, \
-                    self.adversarial_test_weighting, adversarial_test_files = self.adversarial_discovery(adversarial_neg_ratio)
+                    self.adversarial_test_weighting, adversarial_test_files = Distributed_Utils.broadcast(adversarial_results)
             
             # Step 3) Update the datasets by adding the new negative samples!
             self.update_datasets(adversarial_train_files, adversarial_test_files)
 
             # Step 4) Train and save model 1
-            self.train_stage_2()
+            self.train_stage_2(adversarial_key)
 
         elif run_type == "adversarial":
             """
@@ -174,7 +207,7 @@ class TwoStage_Model(object):
             print ("Invalid running mode!")
    
 
-    def create_and_train(self, model_id, save_path):
+    def create_and_train(self, model_id, save_path, checkpoint_path=None):
         """
             This represents the generic process of creating a model given a certain
             model type, getting the optimizer, etc. and then training it on a given 
@@ -187,6 +220,8 @@ class TwoStage_Model(object):
                 - model_type
                 - dataloader
                 - ???
+                - checkpoint_path: where to keep the per epoch training
+                state, to resume from after a crash
 
             # THINGS TO STILL DO
                 - Allow for loading a model or doing the same model etc!!!
@@ -200,12 +235,18 @@ class TwoStage_Model(object):
         # Gonna want to think about how to have the path and such make sense
         print ("Creating model type:", model_id)
         model = get_model(model_id).to(parameters.device)
+        # In distributed training, each process trains on its share of the
+        # data, and only the main process writes the model and scalars
+        is_main_process = Distributed_Utils.is_main_process()
+        model = Distributed_Utils.wrap_model(model)
 
         # Step 2) Setup summary writers - Kinda adhoc for now
         # FIGURE OUT THIS SAVE PATH STUFF!!!!!
-        writer = SummaryWriter(save_path)
-        writer.add_scalar('batch_size', parameters.BATCH_SIZE)
-        writer.add_scalar('weight_decay', parameters.HYPERPARAMETERS[model_id]['l2_reg'])
+        writer = None
+        if is_main_process:
+            writer = SummaryWriter(save_path)
+            writer.add_scalar('batch_size', parameters.BATCH_SIZE)
+            writer.add_scalar('weight_decay', parameters.HYPERPARAMETERS[model_id]['l2_reg'])
 
         # Step 3) Get the model loss function
         loss_func, _ = get_loss()
@@ -216,24 +257,32 @@ class TwoStage_Model(object):
                                                 gamma=parameters.HYPERPARAMETERS[model_id]['lr_decay'])
 
         train_loaders = {'train': self.train_loader, 'valid':self.test_loader}
+        # The window scores of stage 1's training epochs
+        # spare the adversarial discovery a pass over the
+        # full training data (see Window_Scores)
         train_pipeline = Train_Pipeline(train_loaders, model, loss_func, optimizer, 
-                scheduler, writer, save_path, early_stop_criteria=parameters.TRAIN_MODEL_SAVE_CRITERIA.lower())
+                scheduler, writer, save_path, early_stop_criteria=parameters.TRAIN_MODEL_SAVE_CRITERIA.lower(),
+                record_window_scores=True, checkpoint_path=checkpoint_path)
         
         model_wts = train_pipeline.train(parameters.NUM_EPOCHS)
+        model = Distributed_Utils.unwrap_model(model)
 
         # Save our model!
         if model_wts:
+            # All processes hold the same best weights
             model.load_state_dict(model_wts)
-            model_save_path = os.path.join(save_path, "model.pt")
-            torch.save(model, model_save_path)
-            print('Saved best Model 0 based on {} to path {}'.format(parameters.TRAIN_MODEL_SAVE_CRITERIA.upper(), save_path))
+            if is_main_process:
+                model_save_path = os.path.join(save_path, "model.pt")
+                torch.save(model, model_save_path)
+                print('Saved best Model 0 based on {} to path {}'.format(parameters.TRAIN_MODEL_SAVE_CRITERIA.upper(), save_path))
         else:
             print('For some reason I don\'t have a model to save!!')
             quit()
 
         print('Training time: {:10f} minutes'.format((time.time()-start_time)/60))
 
-        writer.close()
+        if writer is not None:
+            writer.close()
 
         return model
 
@@ -247,18 +296,82 @@ class TwoStage_Model(object):
         print ("++==========================++")
         # Step 1a) Update the models save path
         stage_one_path = Model_Utils.join_paths(self.save_path, "Stage_1")
-        self.stage_one = self.create_and_train(self.stage_one_id, stage_one_path)
+        inputs = {'model': Stage_Artifacts.training_inputs(self.stage_one_id),
+                  'train': Stage_Artifacts.dataset_inputs(self.train_loader.dataset),
+                  'test': Stage_Artifacts.dataset_inputs(self.test_loader.dataset)}
+        key = Stage_Artifacts.key(inputs)
+        self.stage_one = self.cached_create_and_train("Stage_1", key, inputs, self.stage_one_id, stage_one_path)
+        self.stage_one_path = self.artifacts.stage_dir("Stage_1", key)
+        # The window ids of the scores depend on the number of positives
+        self.stage_one_num_pos = len(self.train_loader.dataset.pos_features)
+        return key
+
+    def stage_one_window_scores_path(self):
+        """
+            Path of the window scores of stage 1's training epochs,
+            or None if they were not recorded, e.g. for a stage 1
+            trained before they were
+        """
+        if self.stage_one_path is None:
+            return None
+        path = os.path.join(self.stage_one_path, Train_Pipeline.WINDOW_SCORE_FILES['train'])
+        return path if os.path.exists(path) else None
 
-    def train_stage_2(self):
+    def train_stage_2(self, adversarial_key=None):
         """
-            Helper for training stage 2
+            Helper for training stage 2. Given the key of the adversarial
+            discovery it trains on, a model trained before on the same
+            data and settings is reused.
         """
         print ("++===============================++")
         print ("++Training Error Correcting Model++") 
         print ("++===============================++")
         stage_two_path = Model_Utils.stage_2_model_path()
         stage_two_save_path = Model_Utils.join_paths(self.save_path, stage_two_path)
-        self.stage_two = self.create_and_train(self.stage_two_id, stage_two_save_path)
+        if adversarial_key is None:
+            self.stage_two = self.create_and_train(self.stage_two_id, stage_two_save_path)
+            return
+
+        inputs = {'model': Stage_Artifacts.training_inputs(self.stage_two_id, STAGE_2_PARAMETERS),
+                  'adversarial': adversarial_key,
+                  'train': Stage_Artifacts.dataset_inputs(self.train_loader.dataset),
+                  'test': Stage_Artifacts.dataset_inputs(self.test_loader.dataset)}
+        key = Stage_Artifacts.key(inputs)
+        self.stage_two = self.cached_create_and_train(stage_two_path, key, inputs, self.stage_two_id, 
+                                                        stage_two_save_path)
+
+    def cached_create_and_train(self, stage, key, inputs, model_id, latest_path):
+        """
+            Train the model of a stage in the stage's folder for the given
+            key, or load it from there if it was trained before. A stage
+            whose training was interrupted resumes from its last checkpoint.
+            The model is also saved to latest_path, as before.
+        """
+        stage_path = self.artifacts.stage_dir(stage, key)
+        model_path = os.path.join(stage_path, "model.pt")
+        checkpoint_path = os.path.join(stage_path, "checkpoint.pt")
+        # All processes go by what the main process finds
+        is_done = Distributed_Utils.broadcast(self.artifacts.is_done(stage, key))
+
+        if is_done and not self.retrain:
+            print ("Inputs of {} unchanged, loading its model from {}".format(stage, stage_path))
+            model = Model_Utils.load_model(model_path)
+        else:
+            if self.retrain and os.path.exists(checkpoint_path) and Distributed_Utils.is_main_process():
+                os.remove(checkpoint_path)
+            model = self.create_and_train(model_id, stage_path, checkpoint_path=checkpoint_path)
+
+        if Distributed_Utils.is_main_process():
+            artifacts = ["model.pt"] + [file_name for file_name in Train_Pipeline.WINDOW_SCORE_FILES.values()
+                                            if os.path.exists(os.path.join(stage_path, file_name))]
+            if not is_done or self.retrain:
+                self.artifacts.mark_done(stage, key, inputs, artifacts)
+                # Done with, and the size of a few models
+                if os.path.exists(checkpoint_path):
+                    os.remove(checkpoint_path)
+            self.artifacts.publish(stage, key, artifacts, latest_path)
+
+        return model
 
 
     def update_datasets(self, train_adversarial_examples, test_adversarial_examples):
@@ -299,6 +412,42 @@ class TwoStage_Model(object):
 
         return adversarial_examples
 
+    def discover_hard_negatives(self, window_scores, dataset, num_pos, adversarial_neg_ratio):
+        """
+            Like discover_adversarial, but ranks the negatives of the
+            training dataset by the number of slices that stage 1 got
+            wrong in its training epochs, as recorded in window_scores,
+            rather than by running stage 1 over the full training data.
+            num_pos is the number of positives the dataset had while
+            training stage 1.
+
+            The training epochs draw new negatives each epoch, so a
+            negative's score comes from the model of the last epoch that
+            drew it. Only negatives scored in the epoch of the kept (best)
+            stage 1 model or later are ranked, as the full pass over the
+            data with that model would. Returns None if the scores do not
+            know that epoch, or if too few negatives were scored since.
+
+            Otherwise returns the number of wrong slices of each negative
+            (-1 if not ranked), and the hardest (feature_file, label_file).
+        """
+        num_sample = len(dataset.pos_features) * adversarial_neg_ratio
+        if window_scores.best_epoch < 0:
+            return None
+        neg_window_ids = dataset.neg_window_ids(num_pos)
+        candidate_ids = np.intersect1d(window_scores.scored(window_scores.best_epoch), neg_window_ids)
+        if len(candidate_ids) < num_sample:
+            return None
+
+        hardest_ids = window_scores.hardest(num_sample, score='num_errors', candidates=candidate_ids)
+        adversarial_examples = [dataset.neg_window_paths(neg_id) 
+                                    for neg_id in dataset.neg_ids_of(hardest_ids, num_pos).tolist()]
+
+        rankings = np.full(len(neg_window_ids), -1.)
+        rankings[dataset.neg_ids_of(candidate_ids, num_pos)] = window_scores.num_errors[candidate_ids]
+
+        return rankings, adversarial_examples
+
     def adversarial_discovery_helper(self, dataloader, model, threshold=0.5):
         """
             We are now changing this up a bit! Rather than getting the exact files, we are 
@@ -362,19 +511,27 @@ class TwoStage_Model(object):
         print ("++ Running Adversarial Weighting Discovery ++")
         print ('++=========================================++')
         
-        # Step 1) Run stage 1 over the full training data
-        adversarial_train_weighting = self.adversarial_discovery_helper(self.full_train_loader, self.stage_one, threshold=0.5)
-
-        # Step 1a) Later maybe we want to save these rankings???
+        # Step 1) Rank the training data by the window scores of stage 1's
+        # training epochs, or else run stage 1 over the full training data
+        window_scores_path = self.stage_one_window_scores_path()
+        hard_negatives = None
+        if window_scores_path is not None:
+            hard_negatives = self.discover_hard_negatives(Window_Scores.load(window_scores_path), 
+                                                        self.train_loader.dataset, self.stage_one_num_pos, 
+                                                        adversarial_neg_ratio)
+        if hard_negatives is not None:
+            print ("Ranked the training negatives by the window scores in", window_scores_path)
+            adversarial_train_weighting, adversarial_train_files = hard_negatives
+        else:
+            adversarial_train_weighting = self.adversarial_discovery_helper(self.full_train_loader, self.stage_one, threshold=0.5)
+            adversarial_train_files = self.discover_adversarial(self.train_loader, self.full_train_loader, 
+                                                            adversarial_train_weighting, adversarial_neg_ratio)
 
-        # Step 2) Run stage 1 over the full test data
+        # Step 2) Run stage 1 over the full test data. The validation
+        # epochs only score the fixed negatives of the test dataset
         adversarial_test_weighting = self.adversarial_discovery_helper(self.full_test_loader, self.stage_one, threshold=0.5)
 
-        # Step 2a) Later maybe we want to save these rankings???
-
         # Step 3) Use these rankings to extract and save the adversarial examples we will use for training the second stage model
-        adversarial_train_files = self.discover_adversarial(self.train_loader, self.full_train_loader, 
-                                                        adversarial_train_weighting, adversarial_neg_ratio)
         adversarial_test_files = self.discover_adversarial(self.test_loader, self.full_test_loader, 
                                                         adversarial_test_weighting, adversarial_neg_ratio)
 
@@ -393,6 +550,37 @@ class TwoStage_Model(object):
     
         return adversarial_train_weighting, adversarial_train_files, adversarial_test_weighting, adversarial_test_files
 
+    def cached_adversarial_discovery(self, key, inputs, adversarial_neg_ratio=1):
+        """
+            Run the adversarial discovery, or read its rankings and
+            adversarial files from its folder for the given key if
+            it was run before
+        """
+        stage = "Adversarial"
+        stage_path = self.artifacts.stage_dir(stage, key)
+        file_names = [os.path.basename(self.train_adversarial_files), 
+                      os.path.basename(self.test_adversarial_files)]
+        artifacts = ["rankings.npz"] + file_names
+
+        if self.artifacts.is_done(stage, key) and not self.retrain:
+            print ("Inputs of the adversarial discovery unchanged, reading its results from", stage_path)
+            rankings = np.load(os.path.join(stage_path, "rankings.npz"))
+            adversarial_train_weighting, adversarial_test_weighting = rankings['train'], rankings['test']
+            self.artifacts.publish(stage, key, artifacts, self.save_path)
+            adversarial_train_files, adversarial_test_files = self.read_adversarial_files()
+            return adversarial_train_weighting, adversarial_train_files, adversarial_test_weighting, adversarial_test_files
+
+        results = self.adversarial_discovery(adversarial_neg_ratio)
+        adversarial_train_weighting, _, adversarial_test_weighting, _ = results
+        np.savez(os.path.join(stage_path, "rankings.npz"), train=adversarial_train_weighting, 
+                    test=adversarial_test_weighting)
+        for adversarial_files in [self.train_adversarial_files, self.test_adversarial_files]:
+            shutil.copyfile(adversarial_files, os.path.join(stage_path, os.path.basename(adversarial_files)))
+        self.artifacts.mark_done(stage, key, inputs, artifacts)
+        self.artifacts.publish(stage, key, artifacts, self.save_path)
+
+        return results
+
     def generate_adversarial_file_name(self, add_generated_data=None ,adversarial_neg_ratio=1):
         """
             Returns the prefix used for saving the generated adversarial 
@@ -437,9 +625,17 @@ class TwoStage_Model(object):
 
 
 def main():
+    args = parser.parse_args()
+
+    if args.ddp > 1 or 'WORLD_SIZE' in os.environ:
+        Distributed_Utils.launch(train_two_stage, args.ddp, args)
+    else:
+        train_two_stage(args)
+
+
+def train_two_stage(args):
     # What do we need to do across all of the settings!
     # Get the data loaders!
-    args = parser.parse_args()
 
     # Step 1) Get the paths to the training and test datafolders. Note
     # these data folder contain the full 24hr data so we can use them to
@@ -465,9 +661,10 @@ def main():
                                                         log_scale=parameters.SCALE, 
                                                         gaussian_smooth=False, seed=8)
 
-    # Step 4) Get the dataloaders
-    train_loader = Model_Utils.get_loader(train_dataset, parameters.BATCH_SIZE, shuffle=True)
-    test_loader = Model_Utils.get_loader(test_dataset, parameters.BATCH_SIZE, shuffle=False)
+    # Step 4) Get the dataloaders. The adversarial discovery
+    # runs over all of the full datasets, in the main process
+    train_loader = Model_Utils.get_loader(train_dataset, parameters.BATCH_SIZE, shuffle=True, distributed=True)
+    test_loader = Model_Utils.get_loader(test_dataset, parameters.BATCH_SIZE, shuffle=False, distributed=True)
     full_train_loader = Model_Utils.get_loader(full_train_dataset, parameters.BATCH_SIZE, shuffle=False)
     full_test_loader = Model_Utils.get_loader(full_test_dataset, parameters.BATCH_SIZE, shuffle=False)
     dataloaders = {
@@ -480,12 +677,15 @@ def main():
     # Step 5) Create the save path for all of the model information
     if args.path is None:
         save_path = Model_Utils.create_save_path(time.strftime("%Y-%m-%d_%H:%M:%S", time.localtime()), args.save_local, save_prefix='Two-Stage_')
+        # All processes use the main process's time stamp
+        save_path = Distributed_Utils.broadcast(save_path)
     else:
         save_path = args.path
 
     # Step 6) Instantiate the 2_Stage model class and let it do its thing!
     TwoStage_Model(dataloaders, save_path, stage_one_id=parameters.MODEL_ID, stage_two_id=parameters.HIERARCHICAL_MODEL,
-                    add_generated_data=args.generated_path, adversarial_neg_ratio=1, run_type=args.run_type)
+                    add_generated_data=args.generated_path, adversarial_neg_ratio=1, run_type=args.run_type,
+                    retrain=args.retrain)
 
 
 if __name__ == "__main__":
@@ -24,6 +24,7 @@ from loss import get_loss
 from train import Train_Pipeline
 from model_utils import Model_Utils
 from datasets import Subsampled_ElephantDataset
+from distributed_utils import Distributed_Utils
 
 
 parser = argparse.ArgumentParser()
@@ -40,6 +41,9 @@ parser.add_argument('--use_generated', action='store_true',
     help="Use generated positive data in addition to just the positive data")
 parser.add_argument('--generated_path', type=str, default=None,
     help="Path to generated positive data if we want to use it!")
+parser.add_argument('--ddp', type=int, default=1,
+    help="Train with DistributedDataParallel in this many processes (gloo backend, so cpu-only hosts work too). "
+    "When started by torchrun, the processes are torchrun's.")
 
 
 """
@@ -62,6 +66,20 @@ parser.add_argument('--generated_path', type=str, default=None,
 def main():
     args = parser.parse_args()
 
+    if args.ddp > 1 or 'WORLD_SIZE' in os.environ:
+        Distributed_Utils.launch(train_model, args.ddp, args)
+    else:
+        train_model(args)
+
+
+def train_model(args):
+    """
+        Steps 1 - 9 below. In distributed training this runs in each
+        process, each training on its share of the windows; only
+        the main process writes the model and tensorboard scalars.
+    """
+    is_main_process = Distributed_Utils.is_main_process()
+
     # Step 1) Get the paths to the training and test datafolders
     train_data_path, test_data_path = Model_Utils.get_dataset_paths(local_files=args.local_files)
     
@@ -83,24 +101,29 @@ def main():
                                         gaussian_smooth=parameters.LABEL_SMOOTH, seed=8)
 
     # Step 3) Create the dataloaders
-    train_loader = Model_Utils.get_loader(train_dataset, parameters.BATCH_SIZE, shuffle=True)
-    test_loader = Model_Utils.get_loader(test_dataset, parameters.BATCH_SIZE, shuffle=False)
+    train_loader = Model_Utils.get_loader(train_dataset, parameters.BATCH_SIZE, shuffle=True, distributed=True)
+    test_loader = Model_Utils.get_loader(test_dataset, parameters.BATCH_SIZE, shuffle=False, distributed=True)
 
     dataloaders = {'train':train_loader, 'valid':test_loader}
 
     # Step 4) 
     save_path = Model_Utils.create_save_path(time.strftime("%Y-%m-%d_%H:%M:%S", time.localtime()), args.save_local)
+    # All processes use the main process's time stamp
+    save_path = Distributed_Utils.broadcast(save_path)
 
     ## Training - INCLUDE PRE-train later!1
     # Step 5) Create the model!
     model = get_model(parameters.MODEL_ID)
     model.to(parameters.device)
     print(model)
+    model = Distributed_Utils.wrap_model(model)
 
     # Step 6) Set up the tensorboard summary writer
-    writer = SummaryWriter(save_path)
-    writer.add_scalar('batch_size', parameters.BATCH_SIZE)
-    writer.add_scalar('weight_decay', parameters.HYPERPARAMETERS[parameters.MODEL_ID]['l2_reg'])
+    writer = None
+    if is_main_process:
+        writer = SummaryWriter(save_path)
+        writer.add_scalar('batch_size', parameters.BATCH_SIZE)
+        writer.add_scalar('weight_decay', parameters.HYPERPARAMETERS[parameters.MODEL_ID]['l2_reg'])
 
     # Step 7) Get the loss function. The loss.py could be cleaner
     loss_func, _ = get_loss()
@@ -116,9 +139,16 @@ def main():
     # Step 9) Train the model!
     start_time = time.time()
 
+    # The window scores of the epochs are saved with the model, for
+    # curriculum and hard example selection (see Window_Scores)
     train_pipeline = Train_Pipeline(dataloaders, model, loss_func, optimizer, 
-                scheduler, writer, save_path, early_stop_criteria=parameters.TRAIN_MODEL_SAVE_CRITERIA.lower())
+                scheduler, writer, save_path, early_stop_criteria=parameters.TRAIN_MODEL_SAVE_CRITERIA.lower(),
+                record_window_scores=True)
     model_wts = train_pipeline.train(parameters.NUM_EPOCHS)
+    model = Distributed_Utils.unwrap_model(model)
+
+    if not is_main_process:
+        return
 
     if model_wts:
         model.load_state_dict(model_wts)
@@ -5,12 +5,22 @@ import torch.nn as nn
 import sklearn
 from sklearn.metrics import f1_score, precision_recall_fscore_support
 import os
+import copy
+import sys
+from torch.utils.data.distributed import DistributedSampler
+
+from distributed_utils import Distributed_Utils
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from elephant_utils.model_files import model_variant_path, load_model_file
 
 
 class Model_Utils(object):
     """
         General utility functions for training and evaluating the model
     """
+    # Layer types whose weights are stored as int8 in
+    # the quantized inference variant of a model
+    QUANTIZED_LAYER_TYPES = {nn.Linear, nn.GRU, nn.LSTM}
 
     @classmethod
     def join_paths(cls, path, new_dir):
@@ -18,8 +28,8 @@ class Model_Utils(object):
             Basic method for joinging paths and making sure they exits
         """
         combined_path = os.path.join(path, new_dir)
-        if not os.path.exists(combined_path):
-                os.makedirs(combined_path)
+        # Distributed training processes may create it at the same time
+        os.makedirs(combined_path, exist_ok=True)
 
         return combined_path
 
@@ -51,7 +61,8 @@ class Model_Utils(object):
                        random_seed=8,
                        shuffle=True,
                        num_workers=16,
-                       pin_memory=False):
+                       pin_memory=False,
+                       distributed=False):
         """
         Utility function for loading and returning train and valid
         multi-process iterators.
@@ -65,8 +76,12 @@ class Model_Utils(object):
         - num_workers: number of subprocesses to use when loading the dataset.
         - pin_memory: whether to copy tensors into CUDA pinned memory. Set it to
           True if using GPU.
+        - distributed: in distributed training, iterate over just this
+          process's share of the data (see Distributed_Utils)
         - data_file_paths: If you know what particular data file names you want to load, 
           pass them in as a list of strings.
+        Datasets that provide a balanced_sampler (Subsampled_ElephantDataset) are
+        iterated with it; shuffled loaders then draw new negatives each epoch.
         Returns
         -------
         - train_loader: training set iterator.
@@ -74,14 +89,31 @@ class Model_Utils(object):
         """
         # Set the dataloader seed
         Model_Utils.set_seed(parameters.DATA_LOADER_SEED)
-        print('Size of dataset is {} samples'.format(len(dataset)))
-
         # Set the data_loader random seed for reproducibility.
         def _init_fn(worker_id):
             np.random.seed(int(random_seed) + worker_id)
 
+        sampler = None
+        num_replicas, rank = 1, 0
+        if distributed and Distributed_Utils.is_distributed():
+            num_replicas, rank = Distributed_Utils.world_size(), Distributed_Utils.rank()
+
+        if hasattr(dataset, 'balanced_sampler'):
+            sampler = dataset.balanced_sampler(shuffle=shuffle, seed=random_seed, 
+                                               num_replicas=num_replicas, rank=rank)
+            shuffle = False
+            print('Size of dataset is {} samples'.format(len(sampler)))
+        elif num_replicas > 1:
+            sampler = DistributedSampler(dataset, num_replicas=num_replicas, rank=rank, 
+                                         shuffle=shuffle, seed=random_seed)
+            shuffle = False
+            print('Size of dataset is {} samples'.format(len(sampler)))
+        else:
+            print('Size of dataset is {} samples'.format(len(dataset)))
+
         data_loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, 
-            shuffle=shuffle, num_workers=num_workers, pin_memory=pin_memory, worker_init_fn=_init_fn)
+            shuffle=shuffle, sampler=sampler, num_workers=num_workers, pin_memory=pin_memory, 
+            worker_init_fn=_init_fn)
 
         return data_loader
 
@@ -395,10 +427,127 @@ class Model_Utils(object):
         return tp, tp_fp, tp_fn
 
 
+    @classmethod
+    def quantize_model(cls, model):
+        """
+            Return a copy of the model, moved to the cpu, in which
+            the Linear, GRU, and LSTM layers are dynamically quantized
+            to int8. Convolutions stay in float32. The original model
+            is left unchanged.
+        """
+        float_model = copy.deepcopy(model).cpu().eval()
+        return torch.quantization.quantize_dynamic(float_model, 
+                                                   cls.QUANTIZED_LAYER_TYPES, 
+                                                   dtype=torch.qint8)
+
+    @classmethod
+    def freeze_model(cls, model, example_inputs):
+        """
+            Compile the (cpu) model to TorchScript, and freeze it: weights
+            become constants, and e.g. batchnorms are folded into the 
+            preceding convolutions. Models whose forward() cannot be
+            scripted are traced with example_inputs, a batch of windows 
+            of shape [batch, time, freq].
+        """
+        model = model.eval()
+        try:
+            scripted_model = torch.jit.script(model)
+        except Exception:
+            with torch.no_grad():
+                scripted_model = torch.jit.trace(model, example_inputs)
+        return torch.jit.freeze(scripted_model.eval())
+
+    @classmethod
+    def export_inference_variants(cls, model, model_path, example_inputs=None):
+        """
+            Save the cpu inference variants of a trained model next to
+            the model file:
+
+            - <model>_int8.pt: dynamically quantized (int8 Linear/GRU/LSTM)
+              and frozen TorchScript
+            - <model>_frozen.pt: float32 frozen TorchScript
 
+            Both load with Model_Utils.load_model(), or torch.jit.load().
+            Example_inputs default to one normalized random window of
+            shape [1, CHUNK_SIZE, INPUT_SIZE].
 
+            Return a dict mapping each variant name to its path.
+        """
+        if example_inputs is None:
+            example_inputs = torch.randn(1, parameters.CHUNK_SIZE, parameters.INPUT_SIZE)
+        example_inputs = example_inputs.cpu()
 
+        float_model = copy.deepcopy(model).cpu().eval()
+        variants = {'int8'   : cls.freeze_model(cls.quantize_model(float_model), example_inputs),
+                    'frozen' : cls.freeze_model(float_model, example_inputs)
+                    }
+        variant_paths = {}
+        for variant, variant_model in variants.items():
+            variant_paths[variant] = model_variant_path(model_path, variant)
+            torch.jit.save(variant_model, variant_paths[variant])
 
+        return variant_paths
 
+    @classmethod
+    def load_model(cls, model_path, device=None):
+        """
+            Load either a model saved with torch.save(model), or a 
+            TorchScript inference variant saved by export_inference_variants()
+            (see elephant_utils.model_files.load_model_file). Float models
+            go to parameters.device unless given another device.
+        """
+        if device is None:
+            device = parameters.device
 
+        return load_model_file(model_path, device)
 
+    @classmethod
+    def prediction_drift(cls, float_model, variant_model, spectrograms, 
+                            chunk_size=256, batch_size=16, threshold=0.5):
+        """
+            Compare the predictions of an inference variant with those of
+            the float model it was derived from. Each spectrogram (an
+            np.array of shape [time, freq], or path to a saved .npy) is cut
+            into consecutive windows of chunk_size frames, which are 
+            normalized like in eval's sliding window prediction.
+
+            Returns a dict with:
+            - max_abs_diff: largest difference between sigmoid outputs
+            - mean_abs_diff: mean difference between sigmoid outputs
+            - disagreement: fraction of outputs on different sides of threshold
+            - num_windows: number of windows compared
+        """
+        float_model = float_model.cpu().eval()
+        variant_model = variant_model.eval()
+
+        max_abs_diff = 0.
+        total_abs_diff = 0.
+        num_disagreements = 0
+        num_outputs = 0
+        num_windows = 0
+        for spectrogram in spectrograms:
+            if isinstance(spectrogram, str):
+                spectrogram = np.load(spectrogram)
+
+            num_chunks = spectrogram.shape[0] // chunk_size
+            windows = spectrogram[:num_chunks * chunk_size].reshape(num_chunks, chunk_size, -1)
+            windows = (windows - windows.mean(axis=(1, 2), keepdims=True)) / windows.std(axis=(1, 2), keepdims=True)
+            num_windows += num_chunks
+
+            for batch_start in range(0, num_chunks, batch_size):
+                inputs = torch.from_numpy(windows[batch_start: batch_start + batch_size]).float()
+                with torch.no_grad():
+                    float_preds = torch.sigmoid(float_model(inputs)).view(-1)
+                    variant_preds = torch.sigmoid(variant_model(inputs)).view(-1)
+
+                abs_diff = torch.abs(float_preds - variant_preds)
+                max_abs_diff = max(max_abs_diff, abs_diff.max().item())
+                total_abs_diff += abs_diff.sum().item()
+                num_disagreements += torch.sum((float_preds > threshold) != (variant_preds > threshold)).item()
+                num_outputs += float_preds.shape[0]
+
+        return {'max_abs_diff' : max_abs_diff,
+                'mean_abs_diff' : total_abs_diff / max(num_outputs, 1),
+                'disagreement' : num_disagreements / max(num_outputs, 1),
+                'num_windows' : num_windows
+                }
@@ -14,6 +14,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from data_utils import FileFamily
 from data_utils import DATAUtils
 from data_utils import AudioType
+from elephant_utils.raven_labels import RavenLabelTable
 from visualization import visualize
 
 class SpectrogramAugmenter(object):
@@ -50,40 +51,23 @@ class SpectrogramAugmenter(object):
             sr, samples = wavfile.read(wav_file)
             if not os.path.exists(label_file):
                 continue
-            fd = open(label_file, 'r')
-            reader = csv.DictReader(fd, delimiter='\t')
-            #start_end_times = {} # maps (start, end)
-            start_end_times = []
+            labels = RavenLabelTable.load(label_file)
             # get portion of sample where label_mask = 1
-            file_offset_key = 'File Offset (s)'
-            begin_time_key = 'Begin Time (s)'
-            end_time_key   = 'End Time (s)'
-            marginal_key = 'Marginal'
-            num_marginal_calls = 0
+            keep = np.ones(len(labels), dtype=bool)
+            if self.remove_marginals:
+                keep = ~labels.marginal
+                print ("Skipping {} marginal calls".format(np.sum(labels.marginal)))
+            begin_times = labels.file_offset[keep]
+            end_times = begin_times + labels.durations()[keep]
             # preprocess to allow for overlapping calls
-            for label_dict in reader:
-                try:
-                    if self.remove_marginals and label_dict[marginal_key] == "yes":
-                        print ("Skipping marginal call number:", num_marginal_calls)
-                        num_marginal_calls += 1
-                        continue
-                    begin_time = float(label_dict[file_offset_key])
-                    call_length = float(label_dict[end_time_key]) - float(label_dict[begin_time_key])
-                    end_time = begin_time + call_length
-                    start_end_times.append((begin_time, end_time))
-                    begin_index = int(begin_time * sr)
-                    end_index = int(end_time * sr)
-                    if wav_file not in call_indices:
-                        call_indices[wav_file] = [(begin_index, end_index)]
-                    call_indices[wav_file].append((begin_index, end_index))
-
-                except KeyError:
-                    raise IOError(f"Raven label file {label_txt_file} does not contain one "
-                                  f"or both of keys '{begin_time_key}', {end_time_key}'")
+            for begin_index, end_index in zip((begin_times * sr).astype(int).tolist(), 
+                                              (end_times * sr).astype(int).tolist()):
+                if wav_file not in call_indices:
+                    call_indices[wav_file] = [(begin_index, end_index)]
+                call_indices[wav_file].append((begin_index, end_index))
                 
             print(f"finished wav file #{counter}")
             counter += 1
-            fd.close()
         self.valid_wav_files = counter
         return call_indices
 
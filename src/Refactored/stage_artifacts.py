@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import parameters
+from datasets import Subsampled_ElephantDataset
+
+
+# parameters.py settings that change how any stage model is trained
+TRAINING_PARAMETERS = ['NUM_EPOCHS', 'BATCH_SIZE', 'TRAIN_STOP_ITERATIONS', 'TRAIN_MODEL_SAVE_CRITERIA',
+                       'NEG_SAMPLES', 'TEST_NEG_SAMPLES', 'CALL_REPEATS', 'LABEL_SMOOTH', 'EXCLUDE_MARGINALS',
+                       'NORM', 'SCALE', 'SHIFT_WINDOWS', 'CHUNK_SIZE',
+                       'LOSS', 'CHUNK_WEIGHTING', 'FOCAL_WEIGHT_INIT', 'FOCAL_GAMMA', 'FOCAL_ALPHA',
+                       'BOUNDARY_FUDGE_FACTOR', 'INDIVIDUAL_BOUNDARIES', 'BOUNDARY_LOSS', 'BOUNDARY_WEIGHT',
+                       'MODEL_SEED', 'DATASET_SEED', 'DATA_LOADER_SEED']
+# Settings that only change the second stage
+STAGE_2_PARAMETERS = ['HIERARCHICAL_REPEATS', 'HIERARCHICAL_REPEATS_POS', 'HIERARCHICAL_REPEATS_NEG',
+                      'HIERARCHICAL_ADD_FP', 'EXTRA_LABEL', 'MODEL_0_FEATURES', 'HIERARCHICAL_SHIFT_WINDOWS',
+                      'FALSE_POSITIVE_THRESHOLD', 'HIERARCHICAL_PRE_TRAIN']
+
+
+class Stage_Artifacts(object):
+    """
+        Versioned outputs of the stages of TwoStage_Model (stage 1 model,
+        adversarial rankings and file lists, stage 2 model).
+
+        Each run of a stage is keyed by a hash of everything that goes into
+        it: the parameters.py settings it depends on, the window files of its
+        datasets, and the keys of the stages it builds on. Its artifacts are
+        written to a folder of their own, named by the key:
+
+            <save_path>/Stage_1/<key>/model.pt
+            <save_path>/Adversarial/<key>/rankings.npz
+            <save_path>/<stage 2 name>/<key>/model.pt
+
+        A stage is done once its stage.json is written into that folder.
+        A rerun with unchanged inputs finds it and skips the stage, while
+        changing e.g. a stage 2 setting only reruns stage 2. Training
+        checkpoints are kept in the same folder, so an interrupted stage
+        resumes only with the inputs it was started with.
+
+        The save_path's stages.json lists the latest key of each stage.
+    """
+    STAGE_FILE = 'stage.json'
+    MANIFEST_FILE = 'stages.json'
+    # Characters of the key used in folder names
+    KEY_LENGTH = 16
+
+    def __init__(self, save_path):
+        self.save_path = save_path
+
+    @classmethod
+    def key(cls, inputs):
+        """
+            Hash of a json-able description of a stage's inputs
+        """
+        description = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def training_inputs(cls, model_id, stage_parameters=()):
+        """
+            The settings that a stage model of type model_id is trained with
+        """
+        names = TRAINING_PARAMETERS + list(stage_parameters)
+        inputs = {name: getattr(parameters, name, None) for name in names}
+        inputs['model_id'] = model_id
+        inputs['hyperparameters'] = parameters.HYPERPARAMETERS.get(model_id)
+        return inputs
+
+    @classmethod
+    def dataset_inputs(cls, dataset):
+        """
+            Hash of the window files of a dataset and of the negatives it
+            currently uses. Files are known by their path, size and
+            modification time, so that a dataset regenerated under the
+            same file names (e.g. with another NFFT or relabelled calls)
+            changes the key without reading every window.
+        """
+        if isinstance(dataset, Subsampled_ElephantDataset):
+            positives = list(zip(dataset.pos_features, dataset.pos_labels))
+            if dataset.fixed_negatives:
+                negatives = [dataset.neg_window_paths(neg_id) for neg_id in dataset.neg_ids.tolist()]
+            else:
+                # Drawn from all negatives each epoch
+                negatives = [dataset.neg_window_paths(neg_id) 
+                                for neg_id in range(len(dataset.all_neg_features))]
+            windows = [file_stats(positives), file_stats(negatives)]
+            if not dataset.fixed_negatives:
+                windows.append(dataset.neg_ratio)
+        else:
+            windows = file_stats(zip(dataset.data, dataset.labels))
+        return cls.key(windows)
+
+    def stage_dir(self, stage, key):
+        """
+            Folder of the artifacts of a stage's run with the given key
+        """
+        path = os.path.join(self.save_path, stage, key[:Stage_Artifacts.KEY_LENGTH])
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def is_done(self, stage, key):
+        return os.path.exists(os.path.join(self.save_path, stage, key[:Stage_Artifacts.KEY_LENGTH],
+                                            Stage_Artifacts.STAGE_FILE))
+
+    def mark_done(self, stage, key, inputs, artifacts):
+        """
+            Record that the stage's run with this key wrote its
+            artifacts (file names within the stage folder)
+        """
+        record = {'stage': stage, 'key': key, 'inputs': inputs, 'artifacts': artifacts,
+                  'finished': time.strftime("%Y-%m-%d_%H:%M:%S", time.localtime())}
+        _write_json(os.path.join(self.stage_dir(stage, key), Stage_Artifacts.STAGE_FILE), record)
+
+    def publish(self, stage, key, artifacts, latest_dir):
+        """
+            Copy the artifacts of the stage's run with this key to latest_dir,
+            e.g. to <save_path>/Stage_1, where the training scripts always
+            saved them and where the evaluation scripts look for them.
+            The run is noted as the stage's latest in stages.json.
+        """
+        stage_dir = self.stage_dir(stage, key)
+        for artifact in artifacts:
+            shutil.copyfile(os.path.join(stage_dir, artifact), os.path.join(latest_dir, artifact))
+
+        manifest_path = os.path.join(self.save_path, Stage_Artifacts.MANIFEST_FILE)
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        manifest[stage] = {'key': key, 'path': stage_dir}
+        _write_json(manifest_path, manifest)
+
+
+def file_stats(windows):
+    """
+        [[path, size, mtime_ns], ...] of the feature and label files
+        of the (feature, label) windows, sorted by path. Missing files
+        have no size or time.
+    """
+    stats = []
+    for window in windows:
+        for path in window:
+            try:
+                stat = os.stat(path)
+                stats.append([path, stat.st_size, stat.st_mtime_ns])
+            except OSError:
+                stats.append([path, None, None])
+    return sorted(stats)
+
+
+def _write_json(path, obj):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, indent=2, default=str)
+    os.replace(tmp_path, path)
@@ -0,0 +1,316 @@
+"""
+    Run a grid of training settings (seeds, models, negative ratios,
+    learning rates, ...) side by side on one machine, rather than
+    starting main_train.py once per setting by hand.
+
+    Each setting is trained as in main_train.py, in its own process.
+    The jobs are scheduled over the cpu cores, threads_per_job cores
+    each, so that as many run at a time as the machine has room for.
+    All jobs read their windows from one read-only memory-mapped
+    Window_Pack per data folder, built once before the jobs start.
+
+    Each job writes its output to train.log in its own folder of the
+    sweep folder. The best validation results of all jobs are collected
+    into one table, sweep_results.csv, updated as jobs finish.
+
+    Settings are given as lists of values, whose combinations are run:
+
+        python sweep.py --local_files --save_local --seed 8 9 10 --neg_ratio 1 2 --lr 1e-3 3e-4
+
+    or as a json file with a list of settings, or a dict of lists of
+    values. Keys are the short names below, or names of parameters.py:
+
+        python sweep.py --grid sweep.json --threads_per_job 4
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+import parameters
+
+
+# Short names of the settings that are swept most, and where they are
+# set. Learning rate settings go into HYPERPARAMETERS of the model.
+SETTING_NAMES = {'model_id': 'MODEL_ID',
+                 'seed': 'MODEL_SEED',
+                 'data_seed': 'DATASET_SEED',
+                 'neg_ratio': 'NEG_SAMPLES',
+                 'epochs': 'NUM_EPOCHS',
+                 'batch_size': 'BATCH_SIZE',
+                 'loss': 'LOSS'}
+HYPERPARAMETER_NAMES = ['lr', 'lr_decay_step', 'lr_decay', 'l2_reg']
+
+RESULT_COLUMNS = ['best_valid_acc', 'best_valid_fscore', 'best_valid_precision',
+                  'best_valid_recall', 'best_valid_loss', 'minutes', 'save_path', 'error']
+RESULTS_FILE = 'sweep_results.csv'
+PACK_DIR = 'Window_Packs'
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('--local_files', dest='local_files', action='store_true',
+    help='Flag specifying to read data from the local elephant_dataset directory.'
+    'The default is to read from the quatro data directory.')
+parser.add_argument('--save_local', dest='save_local', action='store_true',
+    help='Flag specifying to save model run information to the local models directory.'
+    'The default is to save to the quatro data directory.')
+
+# The grid
+parser.add_argument('--grid', type=str, default=None,
+    help='Json file with a list of settings, or a dict of lists of values to combine')
+parser.add_argument('--model_id', type=int, nargs='+', default=None,
+    help='Model ids to train')
+parser.add_argument('--seed', type=int, nargs='+', default=None,
+    help='Model seeds')
+parser.add_argument('--neg_ratio', type=int, nargs='+', default=None,
+    help='Ratios of negative to positive training windows')
+parser.add_argument('--lr', type=float, nargs='+', default=None,
+    help='Learning rates')
+parser.add_argument('--l2_reg', type=float, nargs='+', default=None,
+    help='Weight decays')
+parser.add_argument('--epochs', type=int, nargs='+', default=None,
+    help='Numbers of epochs')
+
+# Scheduling
+parser.add_argument('--threads_per_job', type=int, default=2,
+    help='Cpu threads of each job')
+parser.add_argument('--jobs', type=int, default=None,
+    help='Jobs run at a time; default: number of cores / threads_per_job')
+parser.add_argument('--loader_workers', type=int, default=0,
+    help='Dataloader worker processes of each job. Windows come from the shared '
+    'memory-mapped pack, so the jobs need few or none.')
+parser.add_argument('--pack_dir', type=str, default=None,
+    help='Folder for the window packs; default: <save path>/Window_Packs')
+parser.add_argument('--path', type=str, default=None,
+    help='Sweep folder; default: a new Sweep_<time> folder in the models directory')
+
+
+def expand_grid(grid):
+    """
+        A list of settings, from either a list of settings or
+        a dict of lists of values to combine
+    """
+    if isinstance(grid, list):
+        return [dict(setting) for setting in grid]
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def grid_from_args(args):
+    if args.grid is not None:
+        with open(args.grid) as f:
+            return expand_grid(json.load(f))
+    grid = {name: getattr(args, name) for name in ['model_id', 'seed', 'neg_ratio', 'lr', 'l2_reg', 'epochs']
+                if getattr(args, name) is not None}
+    return expand_grid(grid)
+
+
+def setting_name(setting):
+    """
+        Folder name of a setting's job, e.g. 'lr-0.001_seed-8'
+    """
+    return '_'.join('{}-{}'.format(name, setting[name]) for name in sorted(setting))
+
+
+def apply_setting(setting):
+    """
+        Set the parameters.py values of a setting. Called in the
+        job's own process, so that jobs do not see each other's settings.
+    """
+    for name, value in setting.items():
+        if name not in HYPERPARAMETER_NAMES:
+            parameter = SETTING_NAMES.get(name, name)
+            if not hasattr(parameters, parameter):
+                raise ValueError("Unknown setting '{}'".format(name))
+            setattr(parameters, parameter, value)
+
+    hyperparameters = dict(parameters.HYPERPARAMETERS[parameters.MODEL_ID])
+    for name in HYPERPARAMETER_NAMES:
+        if name in setting:
+            hyperparameters[name] = setting[name]
+    parameters.HYPERPARAMETERS[parameters.MODEL_ID] = hyperparameters
+
+
+def run_job(setting, job_path, data_paths, pack_dirs, threads, loader_workers):
+    """
+        Train one setting as main_train.py does, and return its
+        best validation results. Runs in a process of its own.
+    """
+    import importlib
+    import torch
+    torch.set_num_threads(threads)
+    # Start from the parameters.py values, whatever job ran in this process before
+    importlib.reload(parameters)
+
+    if not os.path.exists(job_path):
+        os.makedirs(job_path)
+
+    start_time = time.time()
+    result = {'save_path': job_path, 'error': ''}
+    # The pool reuses its worker processes for later jobs, so their
+    # own stdout and stderr are restored, not closed, after each job
+    with open(os.path.join(job_path, 'train.log'), 'w', buffering=1) as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            from tensorboardX import SummaryWriter
+            from models import get_model
+            from loss import get_loss
+            from train import Train_Pipeline
+            from model_utils import Model_Utils
+            from datasets import Subsampled_ElephantDataset
+            from window_pack import Window_Pack
+
+            apply_setting(setting)
+            print ("Sweep setting:", setting)
+
+            # Step 1) The datasets, reading from the shared packs
+            datasets = []
+            for data_path, pack_dir, neg_ratio in zip(data_paths, pack_dirs,
+                                                      [parameters.NEG_SAMPLES, parameters.TEST_NEG_SAMPLES]):
+                dataset = Subsampled_ElephantDataset(data_path, neg_ratio=neg_ratio,
+                                            normalization=parameters.NORM, log_scale=parameters.SCALE,
+                                            gaussian_smooth=parameters.LABEL_SMOOTH, seed=parameters.DATASET_SEED)
+                dataset.use_window_pack(Window_Pack(pack_dir))
+                datasets.append(dataset)
+            train_dataset, test_dataset = datasets
+
+            train_loader = Model_Utils.get_loader(train_dataset, parameters.BATCH_SIZE, random_seed=parameters.DATA_LOADER_SEED,
+                                                  shuffle=True, num_workers=loader_workers)
+            test_loader = Model_Utils.get_loader(test_dataset, parameters.BATCH_SIZE, random_seed=parameters.DATA_LOADER_SEED,
+                                                 shuffle=False, num_workers=loader_workers)
+            dataloaders = {'train': train_loader, 'valid': test_loader}
+
+            # Step 2) The model, initialized by the model seed
+            Model_Utils.set_seed(parameters.MODEL_SEED)
+            model = get_model(parameters.MODEL_ID)
+            model.to(parameters.device)
+
+            writer = SummaryWriter(job_path)
+            writer.add_scalar('batch_size', parameters.BATCH_SIZE)
+            writer.add_scalar('weight_decay', parameters.HYPERPARAMETERS[parameters.MODEL_ID]['l2_reg'])
+
+            loss_func, _ = get_loss()
+            optimizer = torch.optim.Adam(model.parameters(), lr=parameters.HYPERPARAMETERS[parameters.MODEL_ID]['lr'],
+                                         weight_decay=parameters.HYPERPARAMETERS[parameters.MODEL_ID]['l2_reg'])
+            scheduler = torch.optim.lr_scheduler.StepLR(optimizer, parameters.HYPERPARAMETERS[parameters.MODEL_ID]['lr_decay_step'],
+                                                    gamma=parameters.HYPERPARAMETERS[parameters.MODEL_ID]['lr_decay'])
+
+            # Step 3) Train, and save the best model
+            train_pipeline = Train_Pipeline(dataloaders, model, loss_func, optimizer,
+                        scheduler, writer, job_path, early_stop_criteria=parameters.TRAIN_MODEL_SAVE_CRITERIA.lower())
+            model_wts = train_pipeline.train(parameters.NUM_EPOCHS)
+            writer.close()
+
+            if model_wts:
+                model.load_state_dict(model_wts)
+                torch.save(model, os.path.join(job_path, "model.pt"))
+            result.update(train_pipeline.best_valid_stats)
+        except Exception:
+            traceback.print_exc()
+            result['error'] = traceback.format_exc().strip().split('\n')[-1]
+        finally:
+            result['minutes'] = (time.time() - start_time) / 60
+
+    return result
+
+
+def write_results(results_path, names, rows):
+    """
+        The comparison table of the finished jobs, best F-score first
+    """
+    rows = sorted(rows, key=lambda row: -float(row.get('best_valid_fscore') or 0.))
+    tmp_path = results_path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        table = csv.DictWriter(f, fieldnames=names + RESULT_COLUMNS, extrasaction='ignore')
+        table.writeheader()
+        table.writerows(rows)
+    os.replace(tmp_path, results_path)
+
+
+def run_sweep(settings, sweep_path, data_paths, pack_dir, threads_per_job=2, num_jobs=None,
+                loader_workers=0):
+    """
+        Train all settings, num_jobs at a time, and return
+        the comparison table as a list of dicts
+    """
+    from datasets import Subsampled_ElephantDataset
+    from window_pack import Window_Pack
+
+    if num_jobs is None:
+        num_jobs = max(1, (os.cpu_count() or 1) // threads_per_job)
+    if not os.path.exists(sweep_path):
+        os.makedirs(sweep_path)
+
+    # Step 1) Pack the windows of the train and test folders once
+    pack_dirs = []
+    for data_path in data_paths:
+        dataset = Subsampled_ElephantDataset(data_path, neg_ratio=0)
+        pack_dirs.append(os.path.join(pack_dir, os.path.basename(os.path.normpath(data_path))))
+        Window_Pack.build(dataset, pack_dirs[-1])
+
+    # Step 2) Run the jobs. Their math libraries are limited to
+    # threads_per_job threads from the start, since the child
+    # processes inherit the environment
+    for variable in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']:
+        os.environ[variable] = str(threads_per_job)
+    names = sorted(set(name for setting in settings for name in setting))
+    results_path = os.path.join(sweep_path, RESULTS_FILE)
+    rows = []
+    print ("Running {} settings, {} at a time with {} threads each".format(len(settings), num_jobs, threads_per_job))
+
+    with ProcessPoolExecutor(max_workers=num_jobs, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {}
+        for setting in settings:
+            job_path = os.path.join(sweep_path, setting_name(setting))
+            futures[pool.submit(run_job, setting, job_path, data_paths, pack_dirs,
+                                threads_per_job, loader_workers)] = setting
+        for future in as_completed(futures):
+            row = dict(futures[future])
+            row.update(future.result())
+            rows.append(row)
+            print ("Finished {} ({}/{}): F-score {} in {:.1f} minutes{}".format(setting_name(futures[future]),
+                        len(rows), len(settings), row.get('best_valid_fscore'), row['minutes'],
+                        "; FAILED: " + row['error'] if row['error'] else ""))
+            write_results(results_path, names, rows)
+
+    print ("Results of the sweep in", results_path)
+    return rows
+
+
+def main():
+    from model_utils import Model_Utils
+
+    args = parser.parse_args()
+    settings = grid_from_args(args)
+    if len(settings) == 0:
+        parser.error("Give the settings to sweep, with --grid or e.g. --seed 8 9 10")
+
+    data_paths = list(Model_Utils.get_dataset_paths(local_files=args.local_files))
+    if args.path is None:
+        save_root = parameters.LOCAL_SAVE_PATH if args.save_local else parameters.REMOTE_SAVE_PATH
+        sweep_path = os.path.join(save_root, 'Sweep_' + time.strftime("%Y-%m-%d_%H:%M:%S", time.localtime()))
+    else:
+        sweep_path = args.path
+    pack_dir = os.path.join(sweep_path, PACK_DIR) if args.pack_dir is None else args.pack_dir
+
+    rows = run_sweep(settings, sweep_path, data_paths, pack_dir, threads_per_job=args.threads_per_job,
+                     num_jobs=args.jobs, loader_workers=args.loader_workers)
+
+    names = sorted(set(name for setting in settings for name in setting))
+    print ('\t'.join(names + ['acc', 'fscore', 'minutes']))
+    for row in sorted(rows, key=lambda row: -float(row.get('best_valid_fscore') or 0.)):
+        print ('\t'.join([str(row[name]) for name in names] +
+                         ['{:.4f}'.format(row.get('best_valid_acc', float('nan'))),
+                          '{:.4f}'.format(row.get('best_valid_fscore', float('nan'))),
+                          '{:.1f}'.format(row['minutes'])]))
+
+
+if __name__ == '__main__':
+    main()
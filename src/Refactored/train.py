@@ -1,14 +1,23 @@
 import torch
+from torch.utils.data.distributed import DistributedSampler
 import numpy as np
 import time
 import pdb
+import os
 import sys
+import copy
 from collections import deque
 import faulthandler; faulthandler.enable()
 
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
 # Local file imports
 import parameters
 from model_utils import Model_Utils
+from window_scores import Window_Scores
+from distributed_utils import Distributed_Utils
+from elephant_utils.logging_service import Instrumentation
+from elephant_utils.model_files import load_pickled
 
 class Train_Pipeline(object):
     """
@@ -36,6 +45,12 @@ class Train_Pipeline(object):
                                'acc': 'best_valid_acc', 
                                'fscore': 'best_valid_fscore',
                                }
+    # Where train() saves the recorded window scores
+    # within the save path (see Window_Scores)
+    WINDOW_SCORE_FILES = {
+                          'train': 'train_window_scores.npz',
+                          'valid': 'valid_window_scores.npz',
+                          }
 
 
     # FOR NOW DO NOT HAVE AN INIT SINCE THIS CLASS SHOULD NOT BE INSTANTIATED
@@ -49,7 +64,18 @@ class Train_Pipeline(object):
     # but in theory this could allow us to change the data and keep training a model 
     # for example! But for now we should just leave this!!
     def __init__(self, dataloaders, model, loss_func, optimizer, 
-                scheduler, writer, save_path, early_stop_criteria="acc"):
+                scheduler, writer, save_path, early_stop_criteria="acc", record_window_scores=False,
+                checkpoint_path=None):
+        """
+            If checkpoint_path is given, the training state (model, optimizer,
+            scheduler, early stopping and best stats) is saved there after
+            every epoch, and train() resumes from it if it exists, e.g.
+            after a crash.
+
+            If record_window_scores, the epochs score each window they run
+            over (see Window_Scores), and train() saves the scores to the
+            WINDOW_SCORE_FILES in the save_path.
+        """
         super(Train_Pipeline, self).__init__()
 
         # Step 1) Get the dataloaders
@@ -73,22 +99,46 @@ class Train_Pipeline(object):
         # Step 6) Save the early stopping criteria
         self.early_stop_criteria = early_stop_criteria
 
+        # Step 7) Timing of the epoch steps, written to
+        # tensorboard with the epoch metrics
+        self.instrumentation = Instrumentation()
+
+        # Step 8) Optionally keep per window difficulty scores
+        # from each epoch's forward passes (see Window_Scores)
+        self.train_window_scores = None
+        self.valid_window_scores = None
+        if record_window_scores:
+            self.train_window_scores = Window_Scores(self.num_window_ids(self.train_dataloader.dataset))
+            self.valid_window_scores = Window_Scores(self.num_window_ids(self.test_dataloader.dataset))
+
+        # Step 9) Where to keep the per epoch training state
+        self.checkpoint_path = checkpoint_path
+
 
     #-----------------------------
     # run_epoch 
     #--------------
 
     # Try having this essentially be private!
-    def run_epoch(self, dataloader, train=True):
+    def run_epoch(self, dataloader, train=True, window_scores=None, epoch=0):
         """
             Run an epoch! Note let us try combining the logic of training
             and eval epochs with the train flag to change execution!
+
+            If window_scores (a Window_Scores over the dataloader's dataset)
+            is given, record the scores of each window under the epoch
+
+            In distributed training each rank runs over its share of the
+            data, and the epoch statistics are summed over all ranks.
+            Evaluation runs the unwrapped model, since the ranks' shares
+            of the validation data may differ by a batch.
         """
         # Set the model to the corresponding train/test mode
         epoch_name = "Train" if train else "Val"
+        model = self.model if train else Distributed_Utils.unwrap_model(self.model)
 
         # Make sure model is in correct mode!
-        self.model.train(train)
+        model.train(train)
 
         epoch_stats = {
                        'running_loss': 0.0,
@@ -100,38 +150,57 @@ class Train_Pipeline(object):
                         }
 
         print ("Num batches:", len(dataloader))
-        for idx, batch in enumerate(dataloader):
-            # Training specific settings
-            if train:
-                self.optimizer.zero_grad()
-
-            # Help track the training pipeline
-            if (idx % 250 == 0) and parameters.VERBOSE:
-                print ("Batch number {} of {}".format(idx, len(dataloader)))
-
-            # Cast variables to the correct types and put on the correct torch device
-            # clone for now but may remove!!
-            inputs = batch[0].clone().float()
-            labels = batch[1].clone().float()
-            inputs = inputs.to(parameters.device)
-            labels = labels.to(parameters.device)
-
-            # Forward pass
-            logits = self.model(inputs).squeeze(-1)
-            loss = self.loss_func(logits, labels)
-
-            if train:
-                loss.backward()
-                self.optimizer.step()
-
-            self.update_epoch_stats(epoch_stats, loss=loss.item(), logits=logits, labels=labels)
+        # Note that with cuda the steps run asynchronously, so
+        # gpu time shows up in the step that waits for it, 
+        # usually the loss.item() in epoch_stats
+        instrumentation = self.instrumentation
+        with instrumentation.span(epoch_name + '_epoch', memory=True), torch.set_grad_enabled(train):
+            for idx, batch in enumerate(self.timed_batches(dataloader)):
+                # Training specific settings
+                if train:
+                    self.optimizer.zero_grad()
+
+                # Help track the training pipeline
+                if (idx % 250 == 0) and parameters.VERBOSE:
+                    print ("Batch number {} of {}".format(idx, len(dataloader)))
+
+                # Cast variables to the correct types and put on the correct torch device
+                # clone for now but may remove!!
+                with instrumentation.span('to_device'):
+                    inputs = batch[0].clone().float()
+                    labels = batch[1].clone().float()
+                    inputs = inputs.to(parameters.device)
+                    labels = labels.to(parameters.device)
+
+                # Forward pass
+                with instrumentation.span('forward'):
+                    logits = model(inputs).squeeze(-1)
+                    loss = self.loss_func(logits, labels)
+
+                if train:
+                    with instrumentation.span('backward'):
+                        loss.backward()
+                    with instrumentation.span('optimizer_step'):
+                        self.optimizer.step()
+
+                with instrumentation.span('epoch_stats'):
+                    self.update_epoch_stats(epoch_stats, loss=loss.item(), logits=logits, labels=labels)
+                    if window_scores is not None:
+                        window_scores.record(batch[3], logits, labels, epoch)
+                instrumentation.count(epoch_name + '_samples', inputs.shape[0])
      
 
         # Update the schedular
         if train:
             self.scheduler.step()
+
+        num_batches = len(dataloader)
+        if Distributed_Utils.is_distributed():
+            epoch_stats['num_batches'] = num_batches
+            epoch_stats = Distributed_Utils.all_reduce_sum(epoch_stats)
+            num_batches = epoch_stats.pop('num_batches')
         
-        return self.epoch_summary(epoch_stats, len(dataloader), name=epoch_name)
+        return self.epoch_summary(epoch_stats, num_batches, name=epoch_name)
 
     #-----------------------------
     # train 
@@ -156,13 +225,25 @@ class Train_Pipeline(object):
         # Use early stopping module
         early_stopping = EarlyStopping(larger_is_better=True, verbose=True, path=self.save_path)
 
+        first_epoch = 0
+        if self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            first_epoch = self.load_checkpoint(early_stopping, best_valid_stats)
+
         # Include a try catch loop to allow for 'ctrl C' early stopping
         try:
-            for epoch in range(num_epochs):
+            for epoch in range(first_epoch, num_epochs):
+                if early_stopping.early_stop:
+                    # Resumed after stopping early
+                    break
                 print ('Epoch [{}/{}]'.format(epoch + 1, num_epochs))
+                # Balanced_Sampler counts its epochs itself
+                if isinstance(self.train_dataloader.sampler, DistributedSampler):
+                    self.train_dataloader.sampler.set_epoch(epoch)
 
                 # Run a training epoch
-                train_epoch_results = self.run_epoch(self.train_dataloader, train=True)
+                train_epoch_results = self.run_epoch(self.train_dataloader, train=True, 
+                                                    window_scores=self.train_window_scores, epoch=epoch)
+                self.share_window_scores(self.train_window_scores)
 
                 ## Write train metrics to tensorboard
                 self.update_writer(train_epoch_results, epoch, lr=self.scheduler.get_lr())
@@ -170,7 +251,9 @@ class Train_Pipeline(object):
                 # Evaluate the model
                 if Model_Utils.is_eval_epoch(epoch):
 
-                    val_epoch_results = self.run_epoch(self.test_dataloader, train=False)
+                    val_epoch_results = self.run_epoch(self.test_dataloader, train=False, 
+                                                    window_scores=self.valid_window_scores, epoch=epoch)
+                    self.share_window_scores(self.valid_window_scores)
 
                     # Write val metrics to tensorboard
                     self.update_writer(val_epoch_results, epoch)
@@ -178,11 +261,25 @@ class Train_Pipeline(object):
                     self.track_best_performance(val_epoch_results, best_valid_stats)
 
                     # Check if we should stop early!
-                    early_stopping(best_valid_stats[Train_Pipeline.early_stop_criteria_map[self.early_stop_criteria]], self.model)
+                    early_stopping(best_valid_stats[Train_Pipeline.early_stop_criteria_map[self.early_stop_criteria]], 
+                                    Distributed_Utils.unwrap_model(self.model), epoch=epoch)
                     if early_stopping.early_stop:
                         print("Early stopping")
+                        # So that a resumed run stops as well
+                        if self.checkpoint_path is not None:
+                            self.save_checkpoint(epoch, early_stopping, best_valid_stats)
                         break
 
+                # Where the epoch's time went; restart the
+                # timings for the next epoch
+                if self.writer is not None:
+                    self.instrumentation.write_to_tensorboard(self.writer, epoch, reset=True)
+                else:
+                    self.instrumentation.reset()
+
+                if self.checkpoint_path is not None:
+                    self.save_checkpoint(epoch, early_stopping, best_valid_stats)
+
                 print('Finished Epoch [{}/{}] - Total Time: {}.'.format(epoch + 1, num_epochs, (time.time()-train_start_time)/60))
 
         except KeyboardInterrupt:
@@ -193,6 +290,9 @@ class Train_Pipeline(object):
                                                                     best_valid_stats['best_valid_precision'],
                                                                     best_valid_stats['best_valid_recall']))
         print ('Best val Loss: {:6f}'.format(best_valid_stats['best_valid_loss']))
+        # Kept for callers comparing runs, e.g. sweep.py
+        self.best_valid_stats = best_valid_stats
+        self.save_window_scores(early_stopping.best_epoch)
 
         # Return the best model weights stored in the EarlyStopping object
         return early_stopping.best_model_wts
@@ -202,6 +302,107 @@ class Train_Pipeline(object):
     #### Helper Methods ####
     ########################
 
+    def num_window_ids(self, dataset):
+        """
+            Number of window ids the batches of the dataset may
+            carry, e.g. all windows of a Subsampled_ElephantDataset
+            rather than just its current examples
+        """
+        if hasattr(dataset, 'num_window_ids'):
+            return dataset.num_window_ids()
+        return len(dataset)
+
+    def share_window_scores(self, window_scores):
+        """
+            In distributed training each rank scores the windows of its
+            share of the data; give every rank the scores of all windows
+        """
+        if window_scores is None or not Distributed_Utils.is_distributed():
+            return
+        for rank_window_scores in Distributed_Utils.all_gather(window_scores):
+            window_scores.update(rank_window_scores)
+
+    def save_window_scores(self, best_epoch=-1):
+        """
+            Save the recorded window scores, with the epoch of the
+            best model, to the WINDOW_SCORE_FILES in the save path,
+            to be read with Window_Scores.load()
+        """
+        if self.train_window_scores is None or not Distributed_Utils.is_main_process():
+            return
+        self.train_window_scores.best_epoch = best_epoch
+        self.valid_window_scores.best_epoch = best_epoch
+        os.makedirs(self.save_path, exist_ok=True)
+        self.train_window_scores.save(os.path.join(self.save_path, Train_Pipeline.WINDOW_SCORE_FILES['train']))
+        self.valid_window_scores.save(os.path.join(self.save_path, Train_Pipeline.WINDOW_SCORE_FILES['valid']))
+
+    def save_checkpoint(self, epoch, early_stopping, best_valid_stats):
+        """
+            Save the training state after the given epoch, under a
+            temporary name and renamed, so that a crash while saving
+            leaves the previous checkpoint intact
+        """
+        # All processes hold the same state in distributed training
+        if not Distributed_Utils.is_main_process():
+            return
+        checkpoint = {'epoch': epoch,
+                      'model': Distributed_Utils.unwrap_model(self.model).state_dict(),
+                      'optimizer': self.optimizer.state_dict(),
+                      'scheduler': self.scheduler.state_dict(),
+                      'early_stopping': early_stopping.state_dict(),
+                      'best_valid_stats': best_valid_stats,
+                      # Epochs counted by the samplers, which seed their draws
+                      'sampler_epochs': [getattr(dataloader.sampler, 'epoch', None) 
+                                            for dataloader in [self.train_dataloader, self.test_dataloader]],
+                      'torch_rng': torch.get_rng_state(),
+                      'numpy_rng': np.random.get_state(),
+                      'window_scores': [self.train_window_scores, self.valid_window_scores]}
+        tmp_path = self.checkpoint_path + '.tmp'
+        torch.save(checkpoint, tmp_path)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def load_checkpoint(self, early_stopping, best_valid_stats):
+        """
+            Restore the training state saved by save_checkpoint,
+            and return the epoch to continue with
+        """
+        # Loaded to the cpu, since the random number generator states
+        # must stay there. The model and optimizer copy their states
+        # to the devices of the model's parameters
+        checkpoint = load_pickled(self.checkpoint_path, map_location='cpu')
+        Distributed_Utils.unwrap_model(self.model).load_state_dict(checkpoint['model'])
+        self.optimizer.load_state_dict(checkpoint['optimizer'])
+        self.scheduler.load_state_dict(checkpoint['scheduler'])
+        early_stopping.load_state_dict(checkpoint['early_stopping'])
+        best_valid_stats.update(checkpoint['best_valid_stats'])
+        for dataloader, sampler_epoch in zip([self.train_dataloader, self.test_dataloader], 
+                                            checkpoint['sampler_epochs']):
+            if sampler_epoch is not None:
+                dataloader.sampler.set_epoch(sampler_epoch)
+        torch.set_rng_state(checkpoint['torch_rng'])
+        np.random.set_state(checkpoint['numpy_rng'])
+        # Keep the scores of the windows scored before the restart
+        train_window_scores, valid_window_scores = checkpoint['window_scores']
+        if self.train_window_scores is not None and train_window_scores is not None:
+            self.train_window_scores, self.valid_window_scores = train_window_scores, valid_window_scores
+
+        print ("Resuming training after epoch {} from {}".format(checkpoint['epoch'] + 1, self.checkpoint_path))
+        return checkpoint['epoch'] + 1
+
+    def timed_batches(self, dataloader):
+        """
+            Yield the batches of the dataloader, timing
+            how long the model waits for each batch
+        """
+        batches = iter(dataloader)
+        while True:
+            with self.instrumentation.span('load_batch'):
+                try:
+                    batch = next(batches)
+                except StopIteration:
+                    return
+            yield batch
+
     def update_epoch_stats(self, stats, loss, logits, labels):
         """
             Helps to break up the code in running the epoch!
@@ -248,6 +449,10 @@ class Train_Pipeline(object):
 
             @TODO update this
         """
+        # Only the main process writes in distributed training
+        if self.writer is None:
+            return
+
         for key, value in stats.items():
             self.writer.add_scalar(key, value, epoch)
 
@@ -309,9 +514,11 @@ class EarlyStopping:
         self.path = path
         self.trace_func = trace_func
         self.best_model_wts = None
+        # Epoch of the best model, -1 if unknown
+        self.best_epoch = -1
 
 
-    def __call__(self, criteria, model):
+    def __call__(self, criteria, model, epoch=-1):
         """
             Update the best criteria and any counter involved with early stopping
         """
@@ -319,17 +526,20 @@ class EarlyStopping:
         if self.best_criteria is None:
             self.save_checkpoint(criteria, model)
             self.best_criteria = criteria
+            self.best_epoch = epoch
 
         # Want criteria to be smaller (e.g. loss)
         elif (not self.larger_is_better) and (criteria < self.best_criteria - self.delta):
             self.save_checkpoint(criteria, model)
             self.best_criteria = criteria
+            self.best_epoch = epoch
             self.counter = 0
 
         # Want criteria to be larger (e.g. acc)
         elif (self.larger_is_better) and criteria > self.best_criteria + self.delta:
             self.save_checkpoint(criteria, model)
             self.best_criteria = criteria
+            self.best_epoch = epoch
             self.counter = 0
 
         # Criteria did not improve
@@ -345,7 +555,22 @@ class EarlyStopping:
         if self.verbose:
             self.trace_func(f'Validation criteria improved ({self.best_criteria} --> {new_best}).  Saving model ...')
         
-        self.best_model_wts = model.state_dict()
+        # A copy, since the state_dict tensors keep changing with training
+        self.best_model_wts = copy.deepcopy(model.state_dict())
+
+    def state_dict(self):
+        return {'best_criteria': self.best_criteria,
+                'counter': self.counter,
+                'early_stop': self.early_stop,
+                'best_model_wts': self.best_model_wts,
+                'best_epoch': self.best_epoch}
+
+    def load_state_dict(self, state):
+        self.best_criteria = state['best_criteria']
+        self.counter = state['counter']
+        self.early_stop = state['early_stop']
+        self.best_model_wts = state['best_model_wts']
+        self.best_epoch = state.get('best_epoch', -1)
 
 
 
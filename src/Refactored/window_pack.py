@@ -0,0 +1,119 @@
+import json
+import os
+
+import numpy as np
+
+
+class Window_Pack(object):
+    """
+        All windows of a chopped data folder packed into two .npy
+        files, one of the features and one of the labels, which are
+        opened read-only memory-mapped:
+
+            <pack_dir>/features.npy     [num_windows, ...] as saved by the chopper
+            <pack_dir>/labels.npy       [num_windows, ...]
+            <pack_dir>/windows.json     feature path of each window, and
+                                        the sizes of the two .npy files
+
+        Processes that train on the same folder at the same time
+        (e.g. the jobs of sweep.py) then share one copy of the window
+        data in the page cache, rather than each reading every window
+        file anew each epoch.
+
+        A Subsampled_ElephantDataset given a pack (see use_window_pack)
+        reads the windows it holds from the pack by feature path.
+        Windows not in the pack, e.g. generated or adversarial windows
+        added later, are still loaded from their files.
+    """
+    FEATURES_FILE = 'features.npy'
+    LABELS_FILE = 'labels.npy'
+    INDEX_FILE = 'windows.json'
+
+    def __init__(self, pack_dir):
+        self.pack_dir = pack_dir
+        with open(os.path.join(pack_dir, Window_Pack.INDEX_FILE)) as f:
+            index = json.load(f)
+        self.data_path = index['data_path']
+        self.feature_paths = index['feature_paths']
+        # {feature path : window}
+        self.rows = {feature_path: row for row, feature_path in enumerate(self.feature_paths)}
+
+        self.features = np.load(os.path.join(pack_dir, Window_Pack.FEATURES_FILE), mmap_mode='r')
+        self.labels = np.load(os.path.join(pack_dir, Window_Pack.LABELS_FILE), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.feature_paths)
+
+    def __contains__(self, feature_path):
+        return feature_path in self.rows
+
+    def window(self, feature_path):
+        """
+            (feature, label) of a packed window, copied out of the pack
+            so that the dataset transforms may change them
+        """
+        row = self.rows[feature_path]
+        return np.array(self.features[row]), np.array(self.labels[row])
+
+    @classmethod
+    def build(cls, dataset, pack_dir):
+        """
+            Pack the positive windows and the table of all negative windows
+            of a Subsampled_ElephantDataset into pack_dir, and return the pack.
+            An existing pack of the same windows is reused.
+        """
+        feature_paths = list(dataset.pos_features) + list(dataset.all_neg_features)
+        label_paths = list(dataset.pos_labels) + [dataset.neg_label_path(neg_id)
+                                                    for neg_id in range(len(dataset.all_neg_features))]
+        if cls.is_packed(pack_dir, feature_paths):
+            print ("Using the window pack in", pack_dir)
+            return cls(pack_dir)
+
+        if not os.path.exists(pack_dir):
+            os.makedirs(pack_dir)
+        print ("Packing {} windows of {} into {}".format(len(feature_paths), dataset.data_path, pack_dir))
+        # An earlier pack is incomplete from now on
+        index_path = os.path.join(pack_dir, Window_Pack.INDEX_FILE)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+
+        # All windows of a folder have the same shape
+        first_feature = np.load(feature_paths[0])
+        first_label = np.load(label_paths[0])
+        tmp_paths = []
+        for name, first_window, paths in [(Window_Pack.FEATURES_FILE, first_feature, feature_paths),
+                                          (Window_Pack.LABELS_FILE, first_label, label_paths)]:
+            tmp_path = os.path.join(pack_dir, 'tmp_' + name)
+            packed = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=first_window.dtype,
+                                                shape=(len(paths),) + first_window.shape)
+            for row, path in enumerate(paths):
+                packed[row] = np.load(path)
+            packed.flush()
+            del packed
+            tmp_paths.append((tmp_path, os.path.join(pack_dir, name)))
+
+        for tmp_path, path in tmp_paths:
+            os.replace(tmp_path, path)
+        # The index is written last; a pack without it is incomplete
+        sizes = {name: os.path.getsize(os.path.join(pack_dir, name))
+                    for name in [Window_Pack.FEATURES_FILE, Window_Pack.LABELS_FILE]}
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump({'data_path': dataset.data_path, 'feature_paths': feature_paths, 'sizes': sizes}, f)
+        os.replace(index_path + '.tmp', index_path)
+
+        return cls(pack_dir)
+
+    @classmethod
+    def is_packed(cls, pack_dir, feature_paths):
+        """
+            Whether pack_dir holds a complete pack of exactly these windows,
+            whose .npy files have the sizes they were written with
+        """
+        try:
+            with open(os.path.join(pack_dir, Window_Pack.INDEX_FILE)) as f:
+                index = json.load(f)
+            sizes = {name: os.path.getsize(os.path.join(pack_dir, name))
+                        for name in [Window_Pack.FEATURES_FILE, Window_Pack.LABELS_FILE]}
+        except (OSError, ValueError):
+            return False
+        return index.get('sizes') == sizes and index.get('feature_paths') == feature_paths
@@ -0,0 +1,115 @@
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+class Window_Scores(object):
+    """
+        Per window difficulty scores, recorded by Train_Pipeline.run_epoch
+        from the forward pass it already makes, so that curriculum
+        profiling and hard example selection do not need an extra
+        pass of the model over the whole dataset.
+
+        Scores are kept in arrays preallocated to the length of the
+        dataset, and indexed by the dataset index of each window:
+            - loss: mean BCE over the window's slices
+            - num_errors: slices on the wrong side of the threshold
+            - inv_confidence: mean over the slices of 1 - p_t, where p_t
+            is the predicted probability of the correct class (as in
+            focal loss); hard windows have high values
+            - epoch: epoch in which the window was last scored, -1 if never
+
+        best_epoch is the epoch whose model training kept (set by
+        Train_Pipeline.train), -1 if unknown. Windows last scored before
+        it were scored by a less trained model than the one kept.
+
+        NOTE: During training epochs the scores come from the model in
+        train mode (e.g. with dropout), before the batch's weight update.
+    """
+
+    SCORES = ['loss', 'num_errors', 'inv_confidence']
+
+    def __init__(self, num_windows, threshold=0.5):
+        self.threshold = threshold
+        self.loss = np.full(num_windows, np.nan, dtype=np.float32)
+        self.num_errors = np.zeros(num_windows, dtype=np.int32)
+        self.inv_confidence = np.full(num_windows, np.nan, dtype=np.float32)
+        self.epoch = np.full(num_windows, -1, dtype=np.int32)
+        self.best_epoch = -1
+
+        self.bce = nn.BCEWithLogitsLoss(reduction='none')
+
+    def __len__(self):
+        return len(self.epoch)
+
+    def record(self, indices, logits, labels, epoch):
+        """
+            Score the windows of one batch.
+
+            @param indices: dataset indices of the batch's windows
+            @param logits: model outputs - Shape (batch_size, seq_len)
+            @param labels: slice labels - Shape (batch_size, seq_len)
+            @param epoch: current epoch
+        """
+        indices = np.asarray(indices)
+        with torch.no_grad():
+            bce_loss = self.bce(logits, labels)
+            binary_preds = torch.sigmoid(logits) > self.threshold
+            num_errors = torch.sum(binary_preds != (labels > 0.5), dim=1)
+            inv_confidence = torch.mean(1 - torch.exp(-bce_loss), dim=1)
+
+            self.loss[indices] = torch.mean(bce_loss, dim=1).cpu().numpy()
+            self.num_errors[indices] = num_errors.cpu().numpy()
+            self.inv_confidence[indices] = inv_confidence.cpu().numpy()
+        self.epoch[indices] = epoch
+
+    def update(self, other):
+        """
+            Take over the scores of the windows that other (over
+            the same dataset) scored in a later epoch, e.g. those
+            of another rank's share of the data
+        """
+        newer = other.epoch > self.epoch
+        for name in Window_Scores.SCORES + ['epoch']:
+            getattr(self, name)[newer] = getattr(other, name)[newer]
+
+    def scored(self, min_epoch=0):
+        """
+            Dataset indices of the windows scored so far, or
+            of those last scored in min_epoch or later
+        """
+        return np.flatnonzero(self.epoch >= max(min_epoch, 0))
+
+    def hardest(self, num_windows, score='num_errors', candidates=None, min_epoch=0):
+        """
+            Return the dataset indices of the num_windows windows
+            with the highest score, hardest first. Only windows scored
+            in min_epoch or later are considered, and if given only
+            those in candidates (e.g. the indices of the negative windows).
+        """
+        if score not in Window_Scores.SCORES:
+            raise ValueError("Score must be one of {}, not '{}'".format(Window_Scores.SCORES, score))
+
+        indices = self.scored(min_epoch)
+        if candidates is not None:
+            indices = np.intersect1d(indices, candidates)
+
+        values = getattr(self, score)[indices]
+        # Stable sort, so that ties keep dataset order
+        order = np.argsort(-values.astype(np.float64), kind='stable')
+        return indices[order[:num_windows]]
+
+    def save(self, path):
+        np.savez(path, threshold=self.threshold, loss=self.loss, num_errors=self.num_errors,
+                    inv_confidence=self.inv_confidence, epoch=self.epoch, best_epoch=self.best_epoch)
+
+    @classmethod
+    def load(cls, path):
+        saved = np.load(path)
+        window_scores = cls(len(saved['epoch']), threshold=float(saved['threshold']))
+        for name in Window_Scores.SCORES + ['epoch']:
+            getattr(window_scores, name)[:] = saved[name]
+        # Saved before the best epoch was kept
+        if 'best_epoch' in saved.files:
+            window_scores.best_epoch = int(saved['best_epoch'])
+        return window_scores
@@ -0,0 +1,90 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+import torch
+
+import eval as evaluation
+from energy_prefilter import EnergyPrefilter, SKIPPED_LOGIT, window_starts
+from utils import ModelEnsemble, sigmoid
+from toy_models import Frame_Model
+
+TEST_ALL = True
+#TEST_ALL = False
+
+CHUNK_SIZE = 256
+
+
+class TestEnergyPrefilter(unittest.TestCase):
+
+    def setUp(self):
+        # Background noise, and a loud infrasonic call in the
+        # third of four whole windows; the final, shorter
+        # window starts at frame 1024
+        rng = np.random.default_rng(3)
+        self.spectrogram = rng.normal(0., 1., size=(1100, 77))
+        self.spectrogram[600:700, 5:22] += 20.
+        self.models = [Frame_Model(seed).eval() for seed in (8, 9)]
+
+    def prefilter(self):
+        return EnergyPrefilter(threshold_db=6., smooth_frames=15)
+
+    def check_filled(self, filtered, unfiltered, keep):
+        # Windows do not overlap, so each frame is
+        # predicted by the one window it is in
+        for start, kept in zip(window_starts(self.spectrogram.shape[0], CHUNK_SIZE, CHUNK_SIZE), keep):
+            window = slice(start, start + CHUNK_SIZE)
+            if kept:
+                np.testing.assert_allclose(filtered[window], unfiltered[window], rtol=1e-5)
+            else:
+                np.testing.assert_allclose(filtered[window], sigmoid(SKIPPED_LOGIT))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_keep_windows(self):
+        prefilter = self.prefilter()
+        starts = window_starts(self.spectrogram.shape[0], CHUNK_SIZE, CHUNK_SIZE)
+        self.assertEqual(starts.tolist(), [0, 256, 512, 768, 1024])
+        keep = prefilter.keep_windows(self.spectrogram, starts, CHUNK_SIZE)
+        self.assertEqual(keep.tolist(), [False, False, True, False, False])
+        self.assertEqual((prefilter.num_windows, prefilter.num_skipped), (5, 4))
+        self.assertEqual(np.flatnonzero(~prefilter.skipped_frames).tolist(), list(range(512, 768)))
+
+        # The frames of the call are all covered
+        labels = np.zeros(self.spectrogram.shape[0])
+        labels[600:700] = 1
+        prefilter.record_recall(labels)
+        self.assertEqual((prefilter.num_call_frames, prefilter.num_call_frames_lost), (100, 0))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_single_model(self):
+        with torch.no_grad():
+            unfiltered = evaluation.predict_spec_sliding_window(self.spectrogram, self.models[0],
+                                                                chunk_size=CHUNK_SIZE, jump=CHUNK_SIZE)
+            prefilter = self.prefilter()
+            filtered = evaluation.predict_spec_sliding_window(self.spectrogram, self.models[0],
+                                                              chunk_size=CHUNK_SIZE, jump=CHUNK_SIZE,
+                                                              prefilter=prefilter)
+        self.assertEqual(prefilter.num_skipped, 4)
+        self.check_filled(filtered, unfiltered, [False, False, True, False, False])
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_ensemble(self):
+        ensemble = ModelEnsemble(self.models)
+        unfiltered = evaluation.predict_ensemble_sliding_window(self.spectrogram, ensemble,
+                                                                chunk_size=CHUNK_SIZE, jump=CHUNK_SIZE)
+        prefilter = self.prefilter()
+        filtered = evaluation.predict_ensemble_sliding_window(self.spectrogram, ensemble,
+                                                              chunk_size=CHUNK_SIZE, jump=CHUNK_SIZE,
+                                                              prefilter=prefilter)
+        self.assertEqual(filtered.shape, (2, self.spectrogram.shape[0]))
+        self.assertEqual(prefilter.num_skipped, 4)
+        for model_filtered, model_unfiltered in zip(filtered, unfiltered):
+            self.check_filled(model_filtered, model_unfiltered, [False, False, True, False, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+import torch
+
+import eval as evaluation
+from utils import ModelEnsemble
+from toy_models import Frame_Model, Recurrent_Model
+
+TEST_ALL = True
+#TEST_ALL = False
+
+
+class TestModelEnsemble(unittest.TestCase):
+
+    def setUp(self):
+        # Overlapping windows, and a final, shorter window
+        rng = np.random.default_rng(4)
+        self.spectrogram = rng.uniform(1., 10., size=(1100, 77))
+
+    def check_ensemble(self, models, jump, batch_size=4):
+        ensemble = ModelEnsemble(models)
+        with torch.no_grad():
+            predictions = evaluation.predict_ensemble_sliding_window(self.spectrogram, ensemble, chunk_size=256,
+                                                                     jump=jump, batch_size=batch_size)
+            self.assertEqual(predictions.shape, (len(models), self.spectrogram.shape[0]))
+            for model, model_predictions in zip(models, predictions):
+                expected = evaluation.predict_spec_sliding_window(self.spectrogram, model, chunk_size=256, jump=jump)
+                np.testing.assert_allclose(model_predictions, expected, rtol=1e-4, atol=1e-6)
+        return ensemble
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_vectorized(self):
+        models = [Frame_Model(seed).eval() for seed in (8, 9, 10)]
+        self.assertTrue(ModelEnsemble(models).vectorized)
+        for jump in (128, 100, 256):
+            ensemble = self.check_ensemble(models, jump)
+            # Still vectorized after running
+            self.assertTrue(ensemble.vectorized)
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_recurrent(self):
+        # vmap has no batching rule for LSTMs, which is known before the first call
+        models = [Recurrent_Model(seed).eval() for seed in (8, 9)]
+        self.assertFalse(ModelEnsemble(models).vectorized)
+        self.check_ensemble(models, 128)
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_mixed(self):
+        models = [Frame_Model(8).eval(), Recurrent_Model(8).eval()]
+        self.assertFalse(ModelEnsemble(models).vectorized)
+        self.check_ensemble(models, 128)
+
+
+if __name__ == '__main__':
+    unittest.main()
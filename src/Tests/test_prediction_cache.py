@@ -0,0 +1,106 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from prediction_cache import PredictionCache, model_hash, MANIFEST_FILE
+
+TEST_ALL = True
+#TEST_ALL = False
+
+
+def linear_model(seed):
+    torch.manual_seed(seed)
+    return nn.Sequential(nn.Linear(77, 1)).eval()
+
+
+def frozen_model(model):
+    return torch.jit.freeze(torch.jit.script(model))
+
+
+def int8_model(model):
+    quantized = torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    return frozen_model(quantized)
+
+
+class TestPredictionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='prediction_cache_test')
+        self.spect_path = os.path.join(self.tmp_dir.name, 'nn01a_20180126_spec.npy')
+        np.save(self.spect_path, np.random.default_rng(5).normal(size=(600, 77)))
+        self.params = {'sliding_window': True, 'chunk_size': 256, 'jump': 128}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def cache(self, model, **params):
+        return PredictionCache(self.tmp_dir.name, [model], **dict(self.params, **params))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_hit(self):
+        model = linear_model(8)
+        cache = self.cache(model)
+        self.assertFalse(cache.is_cached('nn01a_20180126', self.spect_path))
+        cache.record('nn01a_20180126', self.spect_path)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, MANIFEST_FILE)))
+
+        # A later run, with the same weights in another model object
+        self.assertTrue(self.cache(linear_model(8)).is_cached('nn01a_20180126', self.spect_path))
+        self.assertFalse(self.cache(linear_model(8)).is_cached('nn05e_20180504', self.spect_path))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_miss_after_change(self):
+        self.cache(linear_model(8)).record('nn01a_20180126', self.spect_path)
+
+        # Another model
+        self.assertFalse(self.cache(linear_model(9)).is_cached('nn01a_20180126', self.spect_path))
+        # Other parameters
+        self.assertFalse(self.cache(linear_model(8), jump=64).is_cached('nn01a_20180126', self.spect_path))
+        self.assertFalse(self.cache(linear_model(8), preprocess='norm').is_cached('nn01a_20180126',
+                                                                                  self.spect_path))
+        # Another spectrogram under the same name
+        np.save(self.spect_path, np.random.default_rng(6).normal(size=(600, 77)))
+        self.assertFalse(self.cache(linear_model(8)).is_cached('nn01a_20180126', self.spect_path))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_overwrite(self):
+        self.cache(linear_model(8)).record('nn01a_20180126', self.spect_path)
+
+        # Recomputing with another model replaces the entry, so
+        # the first model's inputs no longer match the saved file
+        cache = self.cache(linear_model(9))
+        cache.drop('nn01a_20180126')
+        self.assertFalse(self.cache(linear_model(8)).is_cached('nn01a_20180126', self.spect_path))
+        cache.record('nn01a_20180126', self.spect_path)
+        self.assertFalse(self.cache(linear_model(8)).is_cached('nn01a_20180126', self.spect_path))
+        self.assertTrue(self.cache(linear_model(9)).is_cached('nn01a_20180126', self.spect_path))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_frozen_models(self):
+        # Frozen modules have no state dict; their weights are graph constants
+        (frozen_8, frozen_9) = (frozen_model(linear_model(8)), frozen_model(linear_model(9)))
+        self.assertEqual(frozen_8.state_dict(), {})
+        self.assertNotEqual(model_hash(frozen_8), model_hash(frozen_9))
+        self.assertEqual(model_hash(frozen_8), model_hash(frozen_8))
+        self.assertNotEqual(model_hash(int8_model(linear_model(8))), model_hash(int8_model(linear_model(9))))
+
+        # Re-exporting a retrained model to the same path is a miss
+        model_path = os.path.join(self.tmp_dir.name, 'model_17_frozen.pt')
+        torch.jit.save(frozen_8, model_path)
+        self.cache(torch.jit.load(model_path)).record('nn01a_20180126', self.spect_path)
+        self.assertTrue(self.cache(torch.jit.load(model_path)).is_cached('nn01a_20180126', self.spect_path))
+
+        torch.jit.save(frozen_9, model_path)
+        self.assertFalse(self.cache(torch.jit.load(model_path)).is_cached('nn01a_20180126', self.spect_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
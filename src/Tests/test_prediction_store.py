@@ -0,0 +1,162 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+import torch
+
+import eval as evaluation
+from prediction_store import PredictionStore, PredictionStoreWriter, STORE_FILE, PRELUDE, ALIGNMENT
+from prediction_store import open_prediction_store, load_predictions
+from toy_models import Frame_Model
+
+TEST_ALL = True
+#TEST_ALL = False
+
+
+class Spectrogram_Dataset(object):
+    """
+        The parts of ElephantDatasetFull that predicting uses
+    """
+    preprocess = 'norm'
+    scale = True
+
+    def __init__(self, spectrograms):
+        self.spectrograms = spectrograms
+        self.specs = ['{}_spec.npy'.format(data_id) for data_id in spectrograms]
+        self.gt_calls = ['/calls/{}_gt.txt'.format(data_id) for data_id in spectrograms]
+
+    def __len__(self):
+        return len(self.spectrograms)
+
+    def __getitem__(self, index):
+        return list(self.spectrograms.values())[index], None, self.gt_calls[index]
+
+
+class TestPredictionStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='prediction_store_test')
+        rng = np.random.default_rng(5)
+        self.predictions = {'nn01a_20180126': rng.uniform(size=1000),
+                            'nn05e_20180504': rng.uniform(size=333),
+                            'nn10b_20180604': np.array([0., 1., 0.5])}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_store(self, dtype):
+        path = os.path.join(self.tmp_dir.name, dtype + '.store')
+        with PredictionStoreWriter(path, 'Model17_seed8', dtype=dtype, chunk_size=256, jump=128) as writer:
+            for data_id, predictions in self.predictions.items():
+                writer.add(data_id, predictions)
+        return path
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_round_trip(self):
+        for dtype, tolerance in [('float16', 1e-3), ('uint8', 0.5 / 255 + 1e-6)]:
+            store = PredictionStore(self.write_store(dtype))
+            self.assertEqual(store.model_id, 'Model17_seed8')
+            self.assertEqual(store.dtype, dtype)
+            self.assertEqual(store.spectrogram_params, {'chunk_size': 256, 'jump': 128})
+            self.assertTrue(store.made_with(jump=128, chunk_size=256))
+            self.assertFalse(store.made_with(chunk_size=256, jump=64))
+            # Stores from before NFFT and hop were recorded are stale
+            self.assertFalse(store.made_with(NFFT=4096, hop=800, chunk_size=256, jump=128))
+            self.assertEqual(len(store), 3)
+            self.assertIn('nn05e_20180504', store)
+            self.assertNotIn('nn01a_20180127', store)
+
+            # In the order they were added
+            self.assertEqual([data_id for data_id, _ in store.items()], list(self.predictions))
+            for data_id, predictions in self.predictions.items():
+                self.assertEqual(store[data_id].dtype, np.float32)
+                np.testing.assert_allclose(store[data_id], predictions, atol=tolerance)
+                self.assertEqual(store.raw(data_id).dtype, np.dtype(dtype))
+            self.assertEqual(store['nn10b_20180604'].tolist(), [0., 1., 0.5] if dtype == 'float16'
+                                                                else [0., 1., np.float32(128 / 255)])
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_index(self):
+        path = self.write_store('uint8')
+        with open(path, 'rb') as fd:
+            _magic, index_offset = PRELUDE.unpack(fd.read(PRELUDE.size))
+            fd.seek(index_offset)
+            index = json.loads(fd.read().decode('utf-8'))
+        self.assertEqual(index['model_id'], 'Model17_seed8')
+        self.assertEqual(index['dtype'], 'uint8')
+        self.assertEqual(index['spectrogram_params'], {'chunk_size': 256, 'jump': 128})
+
+        recordings = index['recordings']
+        self.assertEqual(list(recordings), list(self.predictions))
+        end = PRELUDE.size
+        for data_id, (offset, length) in recordings.items():
+            self.assertEqual(offset % ALIGNMENT, 0)
+            self.assertGreaterEqual(offset, end)
+            self.assertEqual(length, len(self.predictions[data_id]))
+            end = offset + length
+        self.assertLessEqual(end, index_offset)
+
+        # An unfinished store is refused
+        unfinished = PredictionStoreWriter(os.path.join(self.tmp_dir.name, 'unfinished.store'), 'Model17')
+        unfinished.add('nn01a_20180126', self.predictions['nn01a_20180126'])
+        with self.assertRaises(ValueError):
+            unfinished.add('nn01a_20180126', self.predictions['nn01a_20180126'])
+        unfinished.fd.flush()
+        with self.assertRaises(ValueError):
+            PredictionStore(unfinished.path)
+        unfinished.close()
+        self.assertEqual(len(PredictionStore(unfinished.path)), 1)
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_from_npy_dir(self):
+        model_dir = os.path.join(self.tmp_dir.name, 'Model17_seed8')
+        os.makedirs(model_dir)
+        for data_id, predictions in self.predictions.items():
+            np.save(os.path.join(model_dir, data_id + '.npy'), predictions)
+        self.assertIsNone(open_prediction_store('Model17_seed8', self.tmp_dir.name))
+
+        params = dict(NFFT=4096, hop=800, sliding_window=True, chunk_size=256, jump=128)
+        PredictionStore.from_npy_dir(model_dir, 'Model17_seed8', **params)
+        store = open_prediction_store('Model17_seed8', self.tmp_dir.name)
+        self.assertEqual(sorted(store.keys()), sorted(self.predictions))
+        # Evaluation with the same parameters reads the converted store
+        self.assertTrue(store.made_with(**params))
+        self.assertFalse(store.made_with(**dict(params, jump=64)))
+        for data_id, predictions in self.predictions.items():
+            np.testing.assert_allclose(load_predictions(data_id, 'Model17_seed8', self.tmp_dir.name, store=store),
+                                       predictions, atol=1e-3)
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_npy_predictions_replace_store(self):
+        rng = np.random.default_rng(6)
+        dataset = Spectrogram_Dataset({'nn01a_20180126': rng.normal(size=(600, 77)),
+                                       'nn05e_20180504': rng.normal(size=(400, 77))})
+        predictions_path = self.tmp_dir.name
+
+        with torch.no_grad():
+            evaluation.generate_predictions_full_spectrograms(dataset, Frame_Model(8), 'Model17', predictions_path,
+                                                             store_dtype='float16', use_cache=False)
+            store = open_prediction_store('Model17', predictions_path)
+            self.assertEqual(sorted(store.keys()), ['nn01a_20180126', 'nn05e_20180504'])
+            self.assertEqual(store.spectrogram_params, {'NFFT': 4096, 'hop': 800, 'sliding_window': True,
+                                                        'chunk_size': 256, 'jump': 128})
+
+            # Rerun without a store, with another model
+            evaluation.generate_predictions_full_spectrograms(dataset, Frame_Model(9), 'Model17', predictions_path,
+                                                             use_cache=False)
+            self.assertFalse(os.path.exists(os.path.join(predictions_path, 'Model17', STORE_FILE)))
+            store = open_prediction_store('Model17', predictions_path)
+            self.assertIsNone(store)
+            expected = evaluation.predict_spec_sliding_window(dataset.spectrograms['nn01a_20180126'], Frame_Model(9))
+        np.testing.assert_allclose(load_predictions('nn01a_20180126', 'Model17', predictions_path, store=store),
+                                   expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import glob
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+import window_index
+from window_index import WindowIndex
+
+TEST_ALL = True
+#TEST_ALL = False
+
+
+class TestWindowIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='window_index_test')
+        self.data_path = self.tmp_dir.name
+        window = np.zeros(4)
+        for data_id, num_pos, num_neg in [('nn01a_20180126', 3, 2), ('nn05e_20180504', 12, 1)]:
+            for i in range(num_pos):
+                for kind in ['features', 'labels', 'boundary-masks']:
+                    np.save(os.path.join(self.data_path, '{}_{}_{}'.format(data_id, kind, i)), window)
+            for i in range(num_neg):
+                for kind in ['neg-features', 'neg-labels']:
+                    np.save(os.path.join(self.data_path, '{}_{}_{}'.format(data_id, kind, i)), window)
+        # Files that are not windows
+        for name in ['files.txt', 'nn01a_20180126_features.npy', 'nn01a_20180126_spec.npy']:
+            with open(os.path.join(self.data_path, name), 'w') as f:
+                f.write('')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def globbed(self):
+        """
+            The window files as data.py listed them before the index
+        """
+        pos_features = glob.glob(self.data_path + "/" + "*_features_*", recursive=True)
+        neg_features = glob.glob(self.data_path + "/" + "*_neg-features_*", recursive=True)
+        partners = {}
+        for kind in ['labels', 'boundary-masks']:
+            features = pos_features + neg_features if kind == 'labels' else pos_features
+            partners[kind] = {}
+            for feature_path in features:
+                feature_parts = feature_path.split("features")
+                partners[kind][feature_path] = glob.glob(feature_parts[0] + kind + feature_parts[1])[0]
+        return pos_features, neg_features, partners
+
+    def check_index(self, index):
+        pos_features, neg_features, partners = self.globbed()
+        self.assertEqual(len(pos_features), 15)
+        self.assertEqual(len(neg_features), 3)
+
+        index_pos = index.features(self.data_path, neg=False)
+        index_neg = index.features(self.data_path, neg=True)
+        self.assertEqual(sorted(index_pos), sorted(pos_features))
+        self.assertEqual(sorted(index_neg), sorted(neg_features))
+
+        features = index_pos + index_neg
+        labels = index.partners(features, 'labels')
+        self.assertEqual(labels, [partners['labels'][path] for path in features])
+        boundary_masks = index.partners(index_pos, 'boundary-masks')
+        self.assertEqual(boundary_masks, [partners['boundary-masks'][path] for path in index_pos])
+        with self.assertRaises(FileNotFoundError):
+            index.partners(index_neg, 'boundary-masks')
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_listing(self):
+        self.check_index(WindowIndex(self.data_path, use_manifest=False))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_manifest(self):
+        manifest_path = window_index.write_manifest(self.data_path)
+        self.assertEqual(manifest_path, os.path.join(self.data_path, window_index.MANIFEST_FILE))
+        self.assertIsNotNone(window_index.read_manifest(self.data_path))
+        self.check_index(WindowIndex(self.data_path))
+
+        # The manifest is ignored once the folder changes
+        np.save(os.path.join(self.data_path, 'nn01a_20180126_features_3'), np.zeros(4))
+        later = time.time() + 10
+        os.utime(self.data_path, (later, later))
+        self.assertIsNone(window_index.read_manifest(self.data_path))
+        index = WindowIndex(self.data_path)
+        self.assertEqual(len(index.features(self.data_path)), 16)
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_lists_changed_in_place(self):
+        _pos_features, _neg_features, partners = self.globbed()
+        index = WindowIndex(self.data_path, use_manifest=False)
+        features = index.features(self.data_path)
+
+        # Reordered or replaced in place
+        features.reverse()
+        self.assertEqual(index.partners(features, 'labels'), [partners['labels'][path] for path in features])
+        features[0] = features[-1]
+        self.assertEqual(index.partners(features, 'labels'), [partners['labels'][path] for path in features])
+
+        # A copy pairs like the issued list
+        copied = list(index.features(self.data_path, neg=True))
+        self.assertEqual(index.partners(copied, 'labels'), [partners['labels'][path] for path in copied])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+import torch
+
+import eval as evaluation
+from utils import WindowNormalizer, DeviceWindowNormalizer, sigmoid
+from toy_models import Frame_Model
+
+TEST_ALL = True
+#TEST_ALL = False
+
+
+def z_scored(window):
+    return (window - np.mean(window)) / np.std(window)
+
+
+class TestWindowNormalizer(unittest.TestCase):
+
+    def setUp(self):
+        # Spectrogram-like values far from zero, with a loud stretch
+        rng = np.random.default_rng(7)
+        self.spectrogram = rng.uniform(20., 90., size=(1100, 77))
+        self.spectrogram[300:420, 5:20] += 40.
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_normalized_window(self):
+        normalizer = WindowNormalizer(self.spectrogram)
+        for jump in (1, 64, 128, 256, 333):
+            for start in range(0, self.spectrogram.shape[0], jump):
+                window = self.spectrogram[start:start + 256]
+                np.testing.assert_allclose(normalizer.normalized_window(start, 256), z_scored(window),
+                                           rtol=1e-7, atol=1e-9)
+
+        # The shorter final window
+        np.testing.assert_allclose(normalizer.normalized_window(1024, 76), z_scored(self.spectrogram[1024:]),
+                                   rtol=1e-7, atol=1e-9)
+
+        means, stds = normalizer.window_stats([0, 128, 1000], 256)
+        for mean, std, start in zip(means, stds, [0, 128, 1000]):
+            self.assertAlmostEqual(mean, np.mean(self.spectrogram[start:start + 256]))
+            self.assertAlmostEqual(std, np.std(self.spectrogram[start:start + 256]))
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_normalized_windows(self):
+        starts = np.array([0, 100, 128, 256, 700, 844])
+        expected = np.stack([z_scored(self.spectrogram[start:start + 256]) for start in starts])
+        np.testing.assert_allclose(WindowNormalizer(self.spectrogram).normalized_windows(starts, 256), expected,
+                                   rtol=1e-7, atol=1e-9)
+
+        # In float32 on the device
+        device_normalizer = DeviceWindowNormalizer(self.spectrogram, torch.device('cpu'))
+        windows = device_normalizer.normalized_windows(starts, 256)
+        self.assertEqual(windows.dtype, torch.float32)
+        np.testing.assert_allclose(windows.numpy(), expected, atol=1e-4)
+        np.testing.assert_allclose(device_normalizer.normalized_windows([1024], 76)[0].numpy(),
+                                   z_scored(self.spectrogram[1024:]), atol=1e-4)
+
+    @unittest.skipIf(not TEST_ALL, "Temporarily skipping")
+    def test_predict_batched(self):
+        # Whole windows at every jump, so that both paths
+        # predict the same windows
+        num_frames = evaluation.TIME_STEPS_IN_WINDOW * (evaluation.BATCH_SIZE + 3) + 128
+        spectrogram = np.random.default_rng(8).uniform(20., 90., size=(num_frames, 77))
+        model = Frame_Model(8).eval()
+        with torch.no_grad():
+            batched = evaluation.predict_batched(spectrogram, model, jump=128)
+            unbatched = evaluation.predict_spec_sliding_window(spectrogram, model, chunk_size=256, jump=128)
+        np.testing.assert_allclose(batched, unbatched, rtol=1e-5)
+
+        # Unnormalized frame scores would differ
+        with torch.no_grad():
+            raw = sigmoid(model(torch.from_numpy(spectrogram).float()).squeeze(-1).numpy())
+        self.assertFalse(np.allclose(batched, raw, rtol=1e-3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import torch
+import torch.nn as nn
+
+
+class Frame_Model(nn.Module):
+    """
+        Scores each frame from its spectrum alone
+    """
+    def __init__(self, seed):
+        super(Frame_Model, self).__init__()
+        torch.manual_seed(seed)
+        self.linear = nn.Linear(77, 1)
+
+    def forward(self, inputs):
+        return self.linear(inputs)
+
+
+class Recurrent_Model(nn.Module):
+    """
+        Scores each frame with a small LSTM, like the
+        recurrent models of model.py
+    """
+    def __init__(self, seed):
+        super(Recurrent_Model, self).__init__()
+        torch.manual_seed(seed)
+        self.lstm = nn.LSTM(77, 8, batch_first=True)
+        self.linear = nn.Linear(8, 1)
+
+    def forward(self, inputs):
+        outputs, _ = self.lstm(inputs)
+        return self.linear(outputs)
@@ -0,0 +1,115 @@
+import csv
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+from scipy.io import wavfile
+
+from pipeline_benchmark import PipelineBenchmark, run_stage
+from synthetic_data import SyntheticRecording
+
+TEST_ALL = True
+#TEST_ALL = False
+
+class TestPipelineBenchmark(unittest.TestCase):
+
+    #------------------------------------
+    # setUp
+    #-------------------
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='benchmark_test')
+
+    #------------------------------------
+    # tearDown
+    #-------------------
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    #------------------------------------
+    # testSyntheticRecording
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testSyntheticRecording(self):
+        recording = SyntheticRecording(600, calls_per_hour=60, seed=3)
+        (wav_path, label_path) = recording.write(self.tmp_dir.name, 'synth01_20200101_000000')
+
+        (framerate, samples) = wavfile.read(wav_path)
+        self.assertEqual(framerate, 8000)
+        self.assertEqual(len(samples), 600 * 8000)
+
+        with open(label_path, 'r') as fd:
+            rows = list(csv.DictReader(fd, delimiter='\t'))
+        self.assertEqual(len(rows), len(recording.calls))
+        self.assertTrue(len(rows) > 0)
+        for (row, (start, end)) in zip(rows, recording.calls):
+            self.assertAlmostEqual(float(row['Begin Time (s)']), start, places=3)
+            self.assertAlmostEqual(float(row['End Time (s)']), end, places=3)
+            self.assertEqual(row['File Offset (s)'], row['Begin Time (s)'])
+
+        # Calls are louder than the noise around them:
+        (start, end) = recording.calls[0]
+        call_rms  = np.sqrt(np.mean(samples[int(start * 8000):int(end * 8000)].astype(float)**2))
+        noise_rms = np.sqrt(np.mean(samples[:int(start * 8000)].astype(float)**2))
+        self.assertTrue(call_rms > 2 * noise_rms)
+
+        # Excerpts do not depend on how audio is
+        # split into blocks:
+        self.assertTrue(np.array_equal(recording.samples(1000, 500)[:100],
+                                       recording.samples(1000, 100)))
+
+    #------------------------------------
+    # testRunStages
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testRunStages(self):
+        benchmark = PipelineBenchmark(self.tmp_dir.name, durations=[300])
+        (recording_dir, file_root) = benchmark.prepare_recording(300)
+
+        # Run in this process; the later stages
+        # create the spectrogram they need:
+        for stage in ('call_extraction', 'pr_eval', 'spectrogram'):
+            result = run_stage(stage, recording_dir, file_root, benchmark.options)
+            self.assertEqual(result['stage'], stage)
+            self.assertTrue(result['wall_secs'] >= 0)
+            self.assertTrue(result['peak_rss_mb'] > 0)
+
+        self.assertEqual(result['details']['freqs'], 77)
+        self.assertTrue(os.path.exists(os.path.join(recording_dir, file_root + '_spec.npy')))
+
+    #------------------------------------
+    # testCompare
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testCompare(self):
+        def result(stage, wall_secs, peak_rss_mb):
+            return {'stage' : stage, 'duration_secs' : 3600,
+                    'wall_secs' : wall_secs, 'peak_rss_mb' : peak_rss_mb}
+        baseline = {'run_info' : {'commit' : 'abc'},
+                    'results'  : [result('spectrogram', 10, 100), result('gating', 5, 100)]}
+        current  = {'run_info' : {'commit' : 'def'},
+                    'results'  : [result('spectrogram', 10.5, 100), result('gating', 5, 150)]}
+        baseline_file = os.path.join(self.tmp_dir.name, 'baseline.json')
+        current_file  = os.path.join(self.tmp_dir.name, 'current.json')
+        with open(baseline_file, 'w') as fd:
+            json.dump(baseline, fd)
+        with open(current_file, 'w') as fd:
+            json.dump(current, fd)
+
+        regressions = PipelineBenchmark.compare(baseline_file, current_file, max_slowdown=0.1)
+        self.assertEqual(regressions, [(3600, 'gating')])
+
+# -------------------- Main --------------
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,709 @@
+#!/usr/bin/env python
+'''
+Times each stage of the processing pipeline on
+synthetic recordings (see synthetic_data.py), and
+records the peak memory each stage needs. Results
+are written as JSON, so that the numbers of two
+commits can be compared:
+
+    pipeline_benchmark.py -d 3600 86400 -o before.json /tmp/bench
+    <check out the other commit>
+    pipeline_benchmark.py -d 3600 86400 -o after.json /tmp/bench
+    pipeline_benchmark.py --compare before.json after.json
+
+Stages:
+
+    o spectrogram:     24-hr style spectrogram of the .wav file
+                       (generate_spectrograms.generate_spectogram),
+                       plus the frame labels from the Raven table
+    o gating:          AmplitudeGater on the .wav file
+    o chopping:        SpectrogramDataset chops the spectrogram
+                       into snippets, and fills the Samples db
+    o dataset:         reading every sample of that dataset
+    o inference:       eval.predict_spec_sliding_window over the
+                       whole spectrogram
+    o call_extraction: thresholding, and eval.find_elephant_calls
+    o pr_eval:         eval.call_prec_recall in both directions,
+                       f-score, and accuracy
+
+Each stage runs in a fresh process, so that stages
+do not share caches or memory high-water marks. Inputs
+that a stage needs, such as the spectrogram for chopping,
+are created before the clock starts. The peak RSS
+is measured from the start of the timed part (Linux);
+elsewhere it is the peak of the whole stage process.
+
+Unless a trained model is given, inference uses an
+untrained model, whose predictions say nothing about
+calls. Call extraction and PR evaluation therefore
+always run on synthetic detector output derived from
+the labels, so that their work load resembles that
+of a trained detector.
+'''
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import wave
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from synthetic_data import SyntheticRecording
+from elephant_utils.logging_service import memory_usage
+
+
+# ---------------------------- Class PipelineBenchmark ------------
+
+class PipelineBenchmark(object):
+    '''
+    Runs the stage benchmarks for recordings of
+    one or more durations, and collects the results.
+    '''
+
+    STAGES = ['spectrogram',
+              'gating',
+              'chopping',
+              'dataset',
+              'inference',
+              'call_extraction',
+              'pr_eval'
+              ]
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self,
+                 workdir,
+                 durations=(3600,),
+                 stages=None,
+                 model_path=None,
+                 model_id=17,
+                 gate_block_size=None,
+                 calls_per_hour=40,
+                 seed=8
+                 ):
+        '''
+        @param workdir: where recordings and stage outputs
+            are kept. Recordings are reused by later runs
+            with the same duration and seed.
+        @type workdir: str
+        @param durations: recording lengths in seconds
+        @type durations: [{int | float}]
+        @param stages: stages to run; default: all, in
+            pipeline order
+        @type stages: {None | [str]}
+        @param model_path: trained model for the inference stage
+        @type model_path: {None | str}
+        @param model_id: id of an untrained model from models.py,
+            used if model_path is None
+        @type model_id: int
+        @param gate_block_size: if not None, gate in blocks of
+            this many samples (see AmplitudeGater)
+        @type gate_block_size: {None | int}
+        @param calls_per_hour: call density of the recordings
+        @type calls_per_hour: {int | float}
+        @param seed: random seed for the recordings
+        @type seed: int
+        '''
+        if stages is None:
+            stages = self.STAGES
+        unknown = set(stages) - set(self.STAGES)
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown stage(s): {unknown}; must be among {self.STAGES}")
+
+        self.workdir   = workdir
+        self.durations = durations
+        # Always run stages in pipeline order:
+        self.stages    = [stage for stage in self.STAGES if stage in stages]
+        self.calls_per_hour = calls_per_hour
+        self.seed      = seed
+        self.options   = {'model_path'      : model_path,
+                          'model_id'        : model_id,
+                          'gate_block_size' : gate_block_size,
+                          'seed'            : seed
+                          }
+
+    #------------------------------------
+    # run
+    #-------------------
+
+    def run(self):
+        '''
+        Run all stages for all durations.
+
+        @return: run information and a list of
+            per-stage results
+        @rtype: {str : any}
+        '''
+        results = []
+        for duration in self.durations:
+            (recording_dir, file_root) = self.prepare_recording(duration)
+            for stage in self.stages:
+                print(f"Benchmarking {stage} on {duration} seconds of audio...")
+                result = self.run_stage_process(stage, recording_dir, file_root)
+                result['duration_secs'] = duration
+                results.append(result)
+                print(f"    {result['wall_secs']:.2f} secs, peak RSS {result['peak_rss_mb']:.1f} MB")
+        return {'run_info' : self.run_info(),
+                'options'  : dict(self.options, calls_per_hour=self.calls_per_hour),
+                'results'  : results
+                }
+
+    #------------------------------------
+    # prepare_recording
+    #-------------------
+
+    def prepare_recording(self, duration):
+        '''
+        Create the synthetic recording of the given
+        duration, unless it exists from an earlier run.
+
+        @param duration: length in seconds
+        @type duration: {int | float}
+        @return: directory of the recording, and its file root
+        @rtype: (str, str)
+        '''
+        recording_dir = os.path.join(self.workdir,
+                                     f"rec_{duration:g}s_{self.calls_per_hour:g}cph_seed{self.seed}")
+        file_root = 'synth01_20200101_000000'
+        if not os.path.exists(os.path.join(recording_dir, file_root + '.txt')):
+            print(f"Creating {duration} second recording in {recording_dir}...")
+            recording = SyntheticRecording(duration,
+                                           calls_per_hour=self.calls_per_hour,
+                                           seed=self.seed)
+            recording.write(recording_dir, file_root)
+        return (recording_dir, file_root)
+
+    #------------------------------------
+    # run_stage_process
+    #-------------------
+
+    def run_stage_process(self, stage, recording_dir, file_root):
+        '''
+        Run one stage in a new process, and return
+        its result dict.
+        '''
+        ctx = multiprocessing.get_context('spawn')
+        (recv_conn, send_conn) = ctx.Pipe(duplex=False)
+        process = ctx.Process(target=stage_process_main,
+                              args=(stage, recording_dir, file_root, self.options, send_conn))
+        process.start()
+        send_conn.close()
+        try:
+            (status, result) = recv_conn.recv()
+        except EOFError:
+            status = 'error'
+            result = f"Stage process died with exit code {process.exitcode}"
+        process.join()
+        if status != 'ok':
+            raise RuntimeError(f"Stage {stage} failed (log in {recording_dir}): {result}")
+        return result
+
+    #------------------------------------
+    # run_info
+    #-------------------
+
+    def run_info(self):
+        '''
+        Where and on what code the benchmark ran.
+        '''
+        src_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=src_dir,
+                                    capture_output=True, text=True, check=True).stdout.strip()
+            dirty = len(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                       cwd=src_dir, capture_output=True, text=True,
+                                       check=True).stdout.strip()) > 0
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+            dirty = None
+        return {'commit'   : commit,
+                'dirty'    : dirty,
+                'date'     : datetime.datetime.now().isoformat(timespec='seconds'),
+                'host'     : platform.node(),
+                'platform' : platform.platform(),
+                'cpus'     : os.cpu_count(),
+                'python'   : platform.python_version(),
+                'numpy'    : np.__version__
+                }
+
+    #------------------------------------
+    # save
+    #-------------------
+
+    @classmethod
+    def save(cls, benchmark_results, outfile):
+        with open(outfile, 'w') as fd:
+            json.dump(benchmark_results, fd, indent=2)
+
+    #------------------------------------
+    # compare
+    #-------------------
+
+    @classmethod
+    def compare(cls, baseline_file, current_file, max_slowdown=0.1):
+        '''
+        Print the per-stage time and memory of two
+        result files side by side. Returns the
+        (duration, stage) pairs whose time or peak
+        RSS grew by more than max_slowdown (a fraction).
+
+        @param baseline_file: earlier results
+        @type baseline_file: str
+        @param current_file: new results
+        @type current_file: str
+        @param max_slowdown: tolerated relative increase
+        @type max_slowdown: float
+        @return: regressed (duration, stage) pairs
+        @rtype: [(float, str)]
+        '''
+        with open(baseline_file, 'r') as fd:
+            baseline = json.load(fd)
+        with open(current_file, 'r') as fd:
+            current = json.load(fd)
+
+        baseline_results = {(res['duration_secs'], res['stage']) : res
+                            for res in baseline['results']}
+        regressions = []
+        print(f"Baseline: {baseline['run_info']['commit']}, current: {current['run_info']['commit']}")
+        print(f"{'duration':>10} {'stage':<16} {'secs before':>12} {'secs after':>11} {'ratio':>6} "
+              f"{'MB before':>10} {'MB after':>9} {'ratio':>6}")
+        for res in current['results']:
+            key = (res['duration_secs'], res['stage'])
+            try:
+                old = baseline_results[key]
+            except KeyError:
+                continue
+            time_ratio = res['wall_secs'] / max(old['wall_secs'], 1e-9)
+            mem_ratio  = res['peak_rss_mb'] / max(old['peak_rss_mb'], 1e-9)
+            regressed  = time_ratio > 1 + max_slowdown or mem_ratio > 1 + max_slowdown
+            if regressed:
+                regressions.append(key)
+            print(f"{key[0]:>10g} {key[1]:<16} {old['wall_secs']:>12.2f} {res['wall_secs']:>11.2f} "
+                  f"{time_ratio:>6.2f} {old['peak_rss_mb']:>10.1f} {res['peak_rss_mb']:>9.1f} "
+                  f"{mem_ratio:>6.2f}{'  <--' if regressed else ''}")
+        return regressions
+
+# ---------------------------- Stage process ------------
+
+def stage_process_main(stage, recording_dir, file_root, options, conn):
+    '''
+    Entry point of the process that runs one stage.
+    Output of the pipeline code goes to
+    <recording_dir>/benchmark.log. Sends ('ok', result)
+    or ('error', message) through conn.
+    '''
+    log_path = os.path.join(recording_dir, 'benchmark.log')
+    with open(log_path, 'a') as log_fd:
+        # Redirect at the file descriptor level, so that
+        # output of extension modules is captured as well:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(log_fd.fileno(), 1)
+        os.dup2(log_fd.fileno(), 2)
+        print(f"---------- {stage} ({datetime.datetime.now().isoformat()}) ----------")
+        try:
+            result = run_stage(stage, recording_dir, file_root, options)
+            conn.send(('ok', result))
+        except Exception as e:
+            conn.send(('error', repr(e)))
+            raise
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+#------------------------------------
+# run_stage
+#-------------------
+
+def run_stage(stage, recording_dir, file_root, options):
+    '''
+    Prepare the inputs of a stage, then time it.
+
+    @return: stage, wall and cpu seconds, RSS at the start
+        of the timed part, peak RSS and its growth over the
+        start RSS, and stage specific details
+    @rtype: {str : any}
+    '''
+    runner = StageRunner(recording_dir, file_root, options)
+    getattr(runner, 'setup_' + stage)()
+
+    memory = MemoryProbe()
+    memory.reset_peak()
+    start_rss = memory.rss_mb()
+    start_wall = time.perf_counter()
+    start_cpu  = time.process_time()
+
+    details = getattr(runner, 'run_' + stage)()
+
+    wall_secs = time.perf_counter() - start_wall
+    cpu_secs  = time.process_time() - start_cpu
+    peak_rss  = memory.peak_rss_mb()
+    return {'stage'          : stage,
+            'wall_secs'      : wall_secs,
+            'cpu_secs'       : cpu_secs,
+            'start_rss_mb'   : start_rss,
+            'peak_rss_mb'    : peak_rss,
+            'peak_growth_mb' : None if start_rss is None else peak_rss - start_rss,
+            'details'        : details
+            }
+
+# ---------------------------- Class StageRunner ------------
+
+class StageRunner(object):
+    '''
+    Setup and timed part of each stage. The
+    setup_<stage>() methods create missing inputs
+    without timing them; the run_<stage>() methods
+    are timed, and return a dict of details for
+    the results.
+    '''
+
+    NFFT       = 4096
+    HOP        = 800
+    MAX_FREQ   = 150
+    CHUNK_SIZE = 256
+    JUMP       = 128
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self, recording_dir, file_root, options):
+        self.options = options
+        self.recording_dir = recording_dir
+        self.file_root = file_root
+        path_root = os.path.join(recording_dir, file_root)
+        self.wav_path       = path_root + '.wav'
+        self.label_path     = path_root + '.txt'
+        # [time, freq] as generate_spectrograms makes them:
+        self.spect_path     = path_root + '_spec.npy'
+        self.frame_labels_path = path_root + '_label.npy'
+        self.spect_df_path  = path_root + '_spectrogram.pickle'
+        self.snippet_dir    = os.path.join(recording_dir, 'snippets')
+        self.db_path        = os.path.join(recording_dir, 'snippets.sqlite')
+        self.gated_dir      = os.path.join(recording_dir, 'gated')
+        self.predictions_path = path_root + '_preds.npy'
+
+    #------------------------------------
+    # spectrogram
+    #-------------------
+
+    def setup_spectrogram(self):
+        from scipy.io import wavfile
+        import generate_spectrograms
+        self.generate_spectrograms = generate_spectrograms
+        (self.framerate, self.samples) = wavfile.read(self.wav_path)
+
+    def run_spectrogram(self):
+        spectrogram_info = {'NFFT'       : self.NFFT,
+                            'hop'        : self.HOP,
+                            'max_freq'   : self.MAX_FREQ,
+                            'pad_to'     : self.NFFT,
+                            'samplerate' : self.framerate
+                            }
+        spectrogram = self.generate_spectrograms.generate_spectogram(self.samples,
+                                                                     spectrogram_info,
+                                                                     self.file_root)
+        labels = self.generate_spectrograms.generate_labels(self.label_path,
+                                                            spectrogram_info,
+                                                            spectrogram.shape[0])
+        np.save(self.spect_path, spectrogram)
+        np.save(self.frame_labels_path, labels)
+        return {'frames' : spectrogram.shape[0],
+                'freqs'  : spectrogram.shape[1],
+                'labeled_frames' : int(labels.sum())
+                }
+
+    def ensure_spectrogram(self):
+        if not (os.path.exists(self.spect_path) and os.path.exists(self.frame_labels_path)):
+            self.setup_spectrogram()
+            self.run_spectrogram()
+            self.samples = None
+
+    #------------------------------------
+    # gating
+    #-------------------
+
+    def setup_gating(self):
+        from DSP.amplitude_gating import AmplitudeGater
+        self.AmplitudeGater = AmplitudeGater
+        os.makedirs(self.gated_dir, exist_ok=True)
+
+    def run_gating(self):
+        gater = self.AmplitudeGater(self.wav_path,
+                               outdir=self.gated_dir,
+                               block_size=self.options['gate_block_size'])
+        return {'percent_zeroed' : gater.percent_zeroed}
+
+    #------------------------------------
+    # chopping
+    #-------------------
+
+    def setup_chopping(self):
+        import pandas as pd
+        from CNN.spectrogram_dataset import SpectrogramDataset
+        self.SpectrogramDataset = SpectrogramDataset
+        self.ensure_spectrogram()
+        # SpectrogramDataset chops DataFrame spectrograms
+        # with frequency rows, and time columns in seconds:
+        with wave.open(self.wav_path, 'rb') as wav_fd:
+            framerate = wav_fd.getframerate()
+        spectrogram = np.load(self.spect_path)
+        freqs = np.fft.rfftfreq(self.NFFT, 1. / framerate)[:spectrogram.shape[1]]
+        times = np.arange(spectrogram.shape[0]) * self.HOP / framerate
+        pd.DataFrame(spectrogram.T, index=freqs, columns=times).to_pickle(self.spect_df_path)
+        # Start from an empty db:
+        if os.path.exists(self.db_path):
+            os.remove(self.db_path)
+        shutil.rmtree(self.snippet_dir, ignore_errors=True)
+        os.makedirs(self.snippet_dir)
+
+    def run_chopping(self):
+        dataset = self.SpectrogramDataset(dirs_or_spect_files=[self.spect_df_path],
+                                     sqlite_db_path=self.db_path,
+                                     chop=True,
+                                     snippet_outdir=self.snippet_dir)
+        return {'snippets' : len(dataset)}
+
+    #------------------------------------
+    # dataset
+    #-------------------
+
+    def setup_dataset(self):
+        from CNN.spectrogram_dataset import SpectrogramDataset
+        self.SpectrogramDataset = SpectrogramDataset
+        if not os.path.exists(self.db_path):
+            self.setup_chopping()
+            self.run_chopping()
+
+    def run_dataset(self):
+        dataset = self.SpectrogramDataset(sqlite_db_path=self.db_path)
+        # Sample ids are the db's row ids, which
+        # need not start at zero:
+        sample_ids = [row['sample_id'] for row in
+                      dataset.db.execute('SELECT sample_id FROM Samples')]
+        positives = 0
+        for sample_id in sample_ids:
+            positives += dataset[sample_id]['label']
+        return {'samples'   : len(dataset),
+                'positives' : int(positives)
+                }
+
+    #------------------------------------
+    # inference
+    #-------------------
+
+    def setup_inference(self):
+        import torch
+        import parameters
+        import eval as evaluation
+        self.evaluation = evaluation
+        self.ensure_spectrogram()
+        if self.options['model_path'] is not None:
+            (self.model, _model_id) = evaluation.loadModel(self.options['model_path'])
+        else:
+            from models import get_model
+            self.model = get_model(self.options['model_id']).to(parameters.device)
+        self.model.eval()
+        # As ElephantDatasetFull transforms them:
+        self.spectrogram = 10 * np.log10(np.load(self.spect_path))
+        self.torch = torch
+
+    def run_inference(self):
+        with self.torch.no_grad():
+            predictions = self.evaluation.predict_spec_sliding_window(self.spectrogram,
+                                                      self.model,
+                                                      chunk_size=self.CHUNK_SIZE,
+                                                      jump=self.JUMP)
+        np.save(self.predictions_path, predictions)
+        return {'frames'  : self.spectrogram.shape[0],
+                'windows' : max(0, (self.spectrogram.shape[0] - self.CHUNK_SIZE) // self.JUMP + 1)
+                }
+
+    #------------------------------------
+    # call_extraction
+    #-------------------
+
+    def setup_call_extraction(self):
+        import eval as evaluation
+        self.evaluation = evaluation
+        self.ensure_spectrogram()
+        self.labels = np.load(self.frame_labels_path)
+        self.predictions = self.detector_predictions(self.labels)
+
+    def run_call_extraction(self):
+        (binary_preds, _smoothed) = self.evaluation.get_binary_predictions(self.predictions)
+        (predicted_calls, _processed) = self.evaluation.find_elephant_calls(binary_preds)
+        (gt_calls, _processed) = self.evaluation.find_elephant_calls(self.labels, min_call_length=0)
+        return {'predicted_calls' : len(predicted_calls),
+                'gt_calls'        : len(gt_calls)
+                }
+
+    #------------------------------------
+    # pr_eval
+    #-------------------
+
+    def setup_pr_eval(self):
+        self.setup_call_extraction()
+        evaluation = self.evaluation
+        (self.binary_preds, _smoothed) = evaluation.get_binary_predictions(self.predictions)
+        (self.predicted_calls, _processed) = evaluation.find_elephant_calls(self.binary_preds)
+        (self.gt_calls, _processed) = evaluation.find_elephant_calls(self.labels, min_call_length=0)
+
+    def run_pr_eval(self):
+        evaluation = self.evaluation
+        (true_pos, false_pos) = evaluation.call_prec_recall(self.predicted_calls, self.gt_calls,
+                                                            threshold=0.1, is_truth=False)
+        (_true_pos_recall, false_neg) = evaluation.call_prec_recall(self.gt_calls, self.predicted_calls,
+                                                                    threshold=0.1, is_truth=True)
+        f_score  = evaluation.get_f_score(self.binary_preds, self.labels)
+        accuracy = evaluation.calc_accuracy(self.binary_preds, self.labels)
+        return {'true_pos'  : len(true_pos),
+                'false_pos' : len(false_pos),
+                'false_neg' : len(false_neg),
+                'f_score'   : float(f_score),
+                'accuracy'  : float(accuracy)
+                }
+
+    #------------------------------------
+    # detector_predictions
+    #-------------------
+
+    def detector_predictions(self, labels):
+        '''
+        Fake frame-level detector output: high on most
+        labeled frames, with noise, missed stretches,
+        and spurious short detections.
+        '''
+        rng = np.random.RandomState(self.options['seed'])
+        predictions = 0.75 * labels + rng.uniform(0, 0.35, len(labels))
+        # Spurious detections, about one per minute
+        # (600 frames at the 0.1 sec hop):
+        num_frames = len(labels)
+        for start in rng.randint(0, num_frames, num_frames // 600):
+            predictions[start:start + rng.randint(5, 30)] += 0.4
+        return np.clip(predictions, 0, 1)
+
+# ---------------------------- Class MemoryProbe ------------
+
+class MemoryProbe(object):
+    '''
+    Current and peak resident set size of this
+    process, as reported by memory_usage(). On Linux
+    the peak can be reset, so that it covers only the
+    code that follows the reset. Elsewhere, the peak
+    is that of the whole process.
+    '''
+
+    def reset_peak(self):
+        '''
+        Reset the high-water mark to the current RSS.
+        Returns whether that was possible.
+        '''
+        try:
+            with open('/proc/self/clear_refs', 'w') as fd:
+                fd.write('5')
+            return True
+        except OSError:
+            return False
+
+    def rss_mb(self):
+        return memory_usage()[0]
+
+    def peak_rss_mb(self):
+        return memory_usage()[1]
+
+# --------------------------- Main ----------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     description="Time the pipeline stages on synthetic recordings."
+                                     )
+
+    parser.add_argument('-d', '--durations',
+                        type=float,
+                        nargs='+',
+                        default=[3600],
+                        help='Repeatable: recording lengths in seconds; default: 3600'
+                        );
+    parser.add_argument('-s', '--stages',
+                        nargs='+',
+                        choices=PipelineBenchmark.STAGES,
+                        default=PipelineBenchmark.STAGES,
+                        help='Repeatable: stages to run; default: all'
+                        );
+    parser.add_argument('-o', '--outfile',
+                        default=None,
+                        help='JSON file for the results; default: <workdir>/benchmark_<commit>.json'
+                        );
+    parser.add_argument('-m', '--model',
+                        default=None,
+                        help='trained model for the inference stage; default: untrained --model_id'
+                        );
+    parser.add_argument('--model_id',
+                        type=int,
+                        default=17,
+                        help='models.py id of the untrained model; default: 17'
+                        );
+    parser.add_argument('-b', '--gate_block_size',
+                        type=int,
+                        default=None,
+                        help='gate in blocks of this many samples; default: all at once'
+                        );
+    parser.add_argument('-c', '--calls_per_hour',
+                        type=float,
+                        default=40,
+                        help='call density of the synthetic recordings; default: 40'
+                        );
+    parser.add_argument('--compare',
+                        nargs=2,
+                        metavar=('BASELINE', 'CURRENT'),
+                        default=None,
+                        help='only compare two result files; exit status 1 if a stage regressed'
+                        );
+    parser.add_argument('--max_slowdown',
+                        type=float,
+                        default=0.1,
+                        help='relative time or memory increase counted as regression; default: 0.1'
+                        );
+    parser.add_argument('workdir',
+                        nargs='?',
+                        default=None,
+                        help='Directory for recordings and stage outputs')
+
+    args = parser.parse_args();
+
+    if args.compare is not None:
+        regressions = PipelineBenchmark.compare(*args.compare, max_slowdown=args.max_slowdown)
+        sys.exit(1 if len(regressions) > 0 else 0)
+
+    if args.workdir is None:
+        parser.error("A workdir is required unless --compare is given.")
+
+    benchmark = PipelineBenchmark(args.workdir,
+                                  durations=args.durations,
+                                  stages=args.stages,
+                                  model_path=args.model,
+                                  model_id=args.model_id,
+                                  gate_block_size=args.gate_block_size,
+                                  calls_per_hour=args.calls_per_hour
+                                  )
+    benchmark_results = benchmark.run()
+    outfile = args.outfile
+    if outfile is None:
+        commit = benchmark_results['run_info']['commit'] or 'unknown'
+        outfile = os.path.join(args.workdir, f"benchmark_{commit[:10]}.json")
+    PipelineBenchmark.save(benchmark_results, outfile)
+    print(f"Results in {outfile}")
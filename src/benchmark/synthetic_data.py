@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+'''
+Creates synthetic recordings with matching Raven
+label tables, so that the processing pipeline can
+be benchmarked on recordings of any length without
+access to the field data.
+
+Recordings are 16 bit .wav files at 8kHz by default.
+They contain low level noise, elephant-like rumbles
+(harmonic stacks with a fundamental between 10Hz and
+25Hz, and a slight frequency sweep), and short, high
+pitched bird-like chirps that the front end filters
+are meant to remove. Only the rumbles are labeled.
+
+Audio is generated and written block by block, so
+full day recordings need little memory.
+'''
+import argparse
+import csv
+import os
+import sys
+import wave
+
+import numpy as np
+
+
+class SyntheticRecording(object):
+    '''
+    One synthetic recording: places calls at random,
+    non-overlapping times, and writes the .wav file
+    and the Raven selection table.
+    '''
+
+    RAVEN_COLUMNS = ['Selection', 'View', 'Channel',
+                     'Begin Time (s)', 'End Time (s)',
+                     'Low Freq (Hz)', 'High Freq (Hz)',
+                     'Begin Path', 'File Offset (s)', 'Begin File',
+                     'site', 'hour', 'file date', 'date(raven)',
+                     'Tag 1', 'Tag 2', 'notes', 'analyst'
+                     ]
+
+    # Call and chirp lengths in seconds:
+    CALL_SECS  = (2., 7.)
+    CHIRP_SECS = (0.1, 0.4)
+
+    # Seconds of audio per written block:
+    BLOCK_SECS = 60
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self,
+                 duration_secs,
+                 framerate=8000,
+                 calls_per_hour=40,
+                 chirps_per_hour=120,
+                 noise_level=0.02,
+                 seed=8
+                 ):
+        '''
+        @param duration_secs: length of the recording
+        @type duration_secs: {int | float}
+        @param framerate: samples per second
+        @type framerate: int
+        @param calls_per_hour: average number of labeled rumbles
+        @type calls_per_hour: {int | float}
+        @param chirps_per_hour: average number of unlabeled,
+            high frequency chirps
+        @type chirps_per_hour: {int | float}
+        @param noise_level: standard deviation of the background
+            noise, relative to full scale
+        @type noise_level: float
+        @param seed: random seed; equal arguments give
+            identical recordings
+        @type seed: int
+        '''
+        self.duration_secs = duration_secs
+        self.framerate     = framerate
+        self.noise_level   = noise_level
+        self.seed          = seed
+        self.num_samples   = int(duration_secs * framerate)
+
+        rng = np.random.RandomState(seed)
+        hours = duration_secs / 3600.
+        self.calls  = self._place_events(rng, int(round(calls_per_hour * hours)), self.CALL_SECS)
+        self.chirps = self._place_events(rng, int(round(chirps_per_hour * hours)), self.CHIRP_SECS)
+
+        # Per call: fundamental, sweep (Hz/sec), peak amplitude:
+        self.call_params = [(rng.uniform(10, 25), rng.uniform(-1.5, 1.5), rng.uniform(0.1, 0.5))
+                            for _call in self.calls]
+        # Per chirp: frequency and peak amplitude:
+        self.chirp_params = [(rng.uniform(1000, 3000), rng.uniform(0.05, 0.3))
+                             for _chirp in self.chirps]
+
+    #------------------------------------
+    # write
+    #-------------------
+
+    def write(self, outdir, file_root='synth01_20200101_000000'):
+        '''
+        Write <file_root>.wav and the label table
+        <file_root>.txt to outdir.
+
+        @param outdir: destination directory; created if needed
+        @type outdir: str
+        @param file_root: name of both files without extension
+        @type file_root: str
+        @return: paths of the .wav file and the label table
+        @rtype: (str, str)
+        '''
+        os.makedirs(outdir, exist_ok=True)
+        wav_path   = os.path.join(outdir, file_root + '.wav')
+        label_path = os.path.join(outdir, file_root + '.txt')
+        self.write_wav(wav_path)
+        self.write_label_table(label_path, os.path.basename(wav_path))
+        return (wav_path, label_path)
+
+    #------------------------------------
+    # write_wav
+    #-------------------
+
+    def write_wav(self, wav_path):
+        '''
+        Write the recording as 16 bit mono .wav,
+        one block at a time.
+
+        @param wav_path: destination
+        @type wav_path: str
+        '''
+        block_len = int(self.BLOCK_SECS * self.framerate)
+        with wave.open(wav_path, 'wb') as wav_fd:
+            wav_fd.setnchannels(1)
+            wav_fd.setsampwidth(2)
+            wav_fd.setframerate(self.framerate)
+            for block_start in range(0, self.num_samples, block_len):
+                num = min(block_len, self.num_samples - block_start)
+                block = self.samples(block_start, num)
+                np.clip(block, -1, 1, out=block)
+                block *= 32767
+                wav_fd.writeframes(block.astype('<i2').tobytes())
+
+    #------------------------------------
+    # write_label_table
+    #-------------------
+
+    def write_label_table(self, label_path, wav_name):
+        '''
+        Write a Raven selection table with one
+        row per rumble.
+
+        @param label_path: destination
+        @type label_path: str
+        @param wav_name: recording the labels refer to
+        @type wav_name: str
+        '''
+        site = wav_name.split('_')[0]
+        with open(label_path, 'w', newline='') as fd:
+            writer = csv.writer(fd, delimiter='\t')
+            writer.writerow(self.RAVEN_COLUMNS)
+            for (selection, ((start, end), (f0, _sweep, _amplitude))) in \
+                    enumerate(zip(self.calls, self.call_params), start=1):
+                writer.writerow([selection, 'Spectrogram 1', 1,
+                                 f"{start:.3f}", f"{end:.3f}",
+                                 f"{f0 * 0.8:.1f}", f"{f0 * 4.2:.1f}",
+                                 wav_name, f"{start:.3f}", wav_name,
+                                 site, int(start // 3600), '1-Jan-2020', '1-Jan-2020',
+                                 '', '', '', 'synthetic'
+                                 ])
+
+    #------------------------------------
+    # samples
+    #-------------------
+
+    def samples(self, start, num):
+        '''
+        Return num samples of the recording, beginning
+        at sample start, as float64 in [-1, 1]. The
+        noise is seeded by the block position, so that
+        any excerpt is reproducible.
+
+        @param start: index of the first sample
+        @type start: int
+        @param num: number of samples
+        @type num: int
+        @return: samples
+        @rtype: np.array
+        '''
+        rng = np.random.RandomState((self.seed, start))
+        block = rng.normal(0, self.noise_level, num)
+        block_start_secs = start / self.framerate
+        block_end_secs   = (start + num) / self.framerate
+
+        for ((call_start, call_end), (f0, sweep, amplitude)) in zip(self.calls, self.call_params):
+            if call_end <= block_start_secs or call_start >= block_end_secs:
+                continue
+            (indices, times) = self._overlap(call_start, call_end, start, num)
+            # Phase of a linear sweep starting at f0:
+            phase = 2 * np.pi * (f0 * times + 0.5 * sweep * times**2)
+            call = np.zeros(len(times))
+            for (harmonic, weight) in ((1, 1.), (2, 0.6), (3, 0.3), (4, 0.15)):
+                call += weight * np.sin(harmonic * phase)
+            block[indices] += amplitude * self._envelope(times, call_end - call_start) * call
+
+        for ((chirp_start, chirp_end), (freq, amplitude)) in zip(self.chirps, self.chirp_params):
+            if chirp_end <= block_start_secs or chirp_start >= block_end_secs:
+                continue
+            (indices, times) = self._overlap(chirp_start, chirp_end, start, num)
+            block[indices] += amplitude * self._envelope(times, chirp_end - chirp_start) * \
+                              np.sin(2 * np.pi * freq * times)
+        return block
+
+    #------------------------------------
+    # _overlap
+    #-------------------
+
+    def _overlap(self, event_start, event_end, start, num):
+        '''
+        Return the slice of a block that an event
+        covers, and the times within the event (secs)
+        of the samples in that slice.
+        '''
+        first = max(int(np.ceil(event_start * self.framerate)), start)
+        last  = min(int(event_end * self.framerate), start + num)
+        sample_nums = np.arange(first, last)
+        return (slice(first - start, last - start),
+                sample_nums / self.framerate - event_start)
+
+    #------------------------------------
+    # _envelope
+    #-------------------
+
+    def _envelope(self, times, length):
+        # Hann shaped rise and fall:
+        return np.sin(np.pi * np.clip(times / length, 0, 1))**2
+
+    #------------------------------------
+    # _place_events
+    #-------------------
+
+    def _place_events(self, rng, num_events, length_range):
+        '''
+        Return sorted, non-overlapping (start, end) times
+        of num_events events with lengths in length_range.
+        Fewer events are returned if they do not fit.
+        '''
+        events = []
+        max_length = length_range[1]
+        if self.duration_secs <= max_length:
+            return events
+        for start in np.sort(rng.uniform(0, self.duration_secs - max_length, num_events)):
+            # Keep a gap of one max length between events:
+            if events and start < events[-1][1] + max_length:
+                continue
+            events.append((float(start), float(start + rng.uniform(*length_range))))
+        return events
+
+# --------------------------- Main ----------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     description="Create a synthetic recording and its Raven label table."
+                                     )
+
+    parser.add_argument('-d', '--duration',
+                        type=float,
+                        default=86400,
+                        help='length of the recording in seconds; default: 86400 (one day)'
+                        );
+    parser.add_argument('-c', '--calls_per_hour',
+                        type=float,
+                        default=40,
+                        help='average number of labeled calls per hour; default: 40'
+                        );
+    parser.add_argument('-s', '--seed',
+                        type=int,
+                        default=8,
+                        help='random seed; default: 8'
+                        );
+    parser.add_argument('-r', '--file_root',
+                        default='synth01_20200101_000000',
+                        help='name of the .wav and label files without extension'
+                        );
+    parser.add_argument('outdir',
+                        help='Directory for the .wav and label files')
+
+    args = parser.parse_args();
+
+    recording = SyntheticRecording(args.duration,
+                                   calls_per_hour=args.calls_per_hour,
+                                   seed=args.seed)
+    (wav_path, label_path) = recording.write(args.outdir, args.file_root)
+    print(f"Wrote {wav_path} with {len(recording.calls)} calls; labels in {label_path}")
@@ -74,10 +74,12 @@ def model_statistics(model, full_dataloaders, threshold=0.5):
     """
     # Used for computing the avg of 1 - correct class pred probabilities
     bce = nn.BCEWithLogitsLoss(reduction='none')
-    total_window_errors = {'train': np.zeros(0), 'valid': np.zeros(0)}
-    total_window_inv_avg_predictions = {'train': np.zeros(0), 'valid': np.zeros(0)}
+    # Preallocate rather than growing the arrays batch by batch
+    total_window_errors = {phase: np.zeros(len(full_dataloaders[phase].dataset)) for phase in ['train', 'valid']}
+    total_window_inv_avg_predictions = {phase: np.zeros(len(full_dataloaders[phase].dataset)) for phase in ['train', 'valid']}
     for phase in ['train', 'valid']:
         dataloader = full_dataloaders[phase]
+        num_windows = 0
         # Run the model over the data
         print ("Num batches:", len(dataloader))
         for idx, batch in enumerate(dataloader):
@@ -100,7 +102,8 @@ def model_statistics(model, full_dataloaders, threshold=0.5):
             binary_preds = torch.where(predictions > threshold, torch.tensor(1.0).to(parameters.device), torch.tensor(0.0).to(parameters.device))
             
             window_errors = torch.sum(binary_preds != labels, axis = 1).cpu().detach().numpy()
-            total_window_errors[phase] = np.concatenate((total_window_errors[phase], window_errors))
+            batch_size = window_errors.shape[0]
+            total_window_errors[phase][num_windows: num_windows + batch_size] = window_errors
 
             # Get for each chunk the pred prob for the correct class
             bce_loss = bce(logits, labels)    
@@ -110,7 +113,8 @@ def model_statistics(model, full_dataloaders, threshold=0.5):
             # the model is not confident for many slices (low pts)
             # so (1-low) = high
             window_inv_avg_predictions = torch.mean(1 - pts, axis = 1).cpu().detach().numpy()
-            total_window_inv_avg_predictions[phase] = np.concatenate((total_window_inv_avg_predictions[phase], window_inv_avg_predictions))
+            total_window_inv_avg_predictions[phase][num_windows: num_windows + batch_size] = window_inv_avg_predictions
+            num_windows += batch_size
 
         #total_window_errors[phase] = np.expand_dims(total_window_errors[phase], axis=0)
         #total_window_inv_avg_predictions[phase] = np.expand_dims(total_window_inv_avg_predictions[phase], axis=0)
@@ -130,6 +134,9 @@ def curriculum_profiling(model, train_dataloaders, full_dataloaders, loss_func,
         Trains a model for 5 then 10 then 15 then ... epochs 
         and at each time calls a helper method that runs through the
         full training data to compute statistics based on the full training data.
+
+        Refactored/curriculum_learning.py profiles Train_Pipeline runs from
+        the window scores of their epochs instead, without the extra pass.
     """
     # Things to profile
     curriculum_file = '../Curriculum_profiling/'
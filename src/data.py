@@ -12,6 +12,7 @@ import glob
 import parameters
 
 from utils import set_seed
+from window_index import WindowIndex
 
 Noise_Stats_Directory = "../elephant_dataset/eleph_dataset/Noise_Stats/"
 
@@ -172,8 +173,11 @@ class ElephantDatasetFuzzy(data.Dataset):
         self.initialize_labels()
         '''
 
-        self.pos_features = glob.glob(data_path + "/" + "*_features_*", recursive=True)
-        self.neg_features = glob.glob(data_path + "/" + "*_neg-features_*", recursive=True)
+        # Lists the folder once (or reads its manifest), and
+        # pairs each window with its label and boundary mask
+        self.window_index = WindowIndex(data_path)
+        self.pos_features = self.window_index.features(data_path, neg=False)
+        self.neg_features = self.window_index.features(data_path, neg=True)
         self.intialize_data(init_pos=True, init_neg=True)
 
         assert len(self.features) == len(self.labels)
@@ -184,13 +188,10 @@ class ElephantDatasetFuzzy(data.Dataset):
         print('Normalizing with {} and scaling {}'.format(preprocess, scale))
 
     def initialize_labels(self):
-        self.labels = []
+        self.labels = self.window_index.partners(self.features, 'labels')
         self.boundary_masks = []
-        for feature_path in self.features:
-            feature_parts = feature_path.split("features")
-            self.labels.append(glob.glob(feature_parts[0] + "labels" + feature_parts[1])[0])
-            if self.include_boundaries:
-                self.boundary_masks.append(glob.glob(feature_parts[0] + "boundary-masks" + feature_parts[1])[0])
+        if self.include_boundaries:
+            self.boundary_masks = self.window_index.partners(self.features, 'boundary-masks')
 
 
     def set_pos_features(self, pos_features):
@@ -332,24 +333,18 @@ class ElephantDatasetFuzzy(data.Dataset):
         """
         # Initialize the positive examples
         if init_pos:
-            self.pos_labels = []
+            self.pos_labels = self.window_index.partners(self.pos_features, 'labels')
             self.pos_boundary_masks = []
-            for feature_path in self.pos_features:
-                feature_parts = feature_path.split("features")
-                self.pos_labels.append(glob.glob(feature_parts[0] + "labels" + feature_parts[1])[0])
-                if self.include_boundaries:
-                    self.pos_boundary_masks.append(glob.glob(feature_parts[0] + "boundary-masks" + feature_parts[1])[0])
+            if self.include_boundaries:
+                self.pos_boundary_masks = self.window_index.partners(self.pos_features, 'boundary-masks')
 
 
         # Initialize the negative examples
         if init_neg:
-            self.neg_labels = []
+            self.neg_labels = self.window_index.partners(self.neg_features, 'labels')
             self.neg_boundary_masks = []
-            for feature_path in self.neg_features:
-                feature_parts = feature_path.split("features")
-                self.neg_labels.append(glob.glob(feature_parts[0] + "labels" + feature_parts[1])[0])
-                if self.include_boundaries:
-                    self.neg_boundary_masks.append(glob.glob(feature_parts[0] + "boundary-masks" + feature_parts[1])[0])
+            if self.include_boundaries:
+                self.neg_boundary_masks = self.window_index.partners(self.neg_features, 'boundary-masks')
 
         # Combine the positive and negative examples!
         self.features = self.pos_features + self.neg_features
@@ -502,7 +497,9 @@ class ElephantDataset(data.Dataset):
 
         # Probably should not have + "**/" after data_path? It seems like 
         # we are passing the exact datapths anyways! Also why recursive?
-        self.features = glob.glob(data_path + "/" + "*features*", recursive=False)
+        self.window_index = WindowIndex(data_path)
+        self.features = self.window_index.features(data_path, neg=False) + \
+                            self.window_index.features(data_path, neg=True)
         self.initialize_labels()
 
         assert len(self.features) == len(self.labels)
@@ -513,10 +510,7 @@ class ElephantDataset(data.Dataset):
         print("Shape of a feature is {} and a label is {}".format(self[0][0].shape, self[0][1].shape))
 
     def initialize_labels(self):
-        self.labels = []
-        for feature_path in self.features:
-            feature_parts = feature_path.split("features")
-            self.labels.append(glob.glob(feature_parts[0] + "labels" + feature_parts[1])[0])
+        self.labels = self.window_index.partners(self.features, 'labels')
 
 
     def __len__(self):
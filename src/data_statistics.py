@@ -1,12 +1,12 @@
 from matplotlib import pyplot as plt
 from matplotlib import mlab as ml
 import numpy as np
-import csv
 import os
 import librosa
 import time
 import multiprocessing
 from scipy.io import wavfile
+from elephant_utils.raven_labels import RavenLabelTable
 
 dataDir = '../elephant_dataset/New_Data/Truth_Logs/'
 
@@ -33,7 +33,7 @@ def get_call_stats(label_file_path):
         a call by a volunteer
     '''
 
-    labelFile = csv.DictReader(open(label_file_path,'rt'), delimiter='\t')
+    labels = RavenLabelTable.load(label_file_path)
 
     num_calls = 0
     num_overlap = 0
@@ -49,13 +49,12 @@ def get_call_stats(label_file_path):
     # latest ending time seen so far
     last_call_ending = 0
 
-    for row in labelFile:
+    for start_time, call_length, low_freq, high_freq in zip(labels.file_offset.tolist(), 
+                                                            labels.durations().tolist(),
+                                                            labels.low_freq.tolist(), 
+                                                            labels.high_freq.tolist()):
         # Get basic information about the call
-        start_time = float(row['File Offset (s)'])
-        call_length = float(row['End Time (s)']) - float(row['Begin Time (s)'])
         end_time = start_time + call_length
-        low_freq = float(row['Low Freq (Hz)'])
-        high_freq = float(row['High Freq (Hz)'])
 
         # Update statistics
         num_calls += 1
@@ -119,6 +118,9 @@ def main():
             # Iterate through the files only analyzing the .txt label files
             data_pairs = {}
             for eachFile in filenames:
+                # Skip the parsed-label caches next to the tables:
+                if eachFile.endswith('.labels.npz'):
+                    continue
                 file_type = eachFile.split('.')[1]
                 
                 if (file_type == 'txt'):
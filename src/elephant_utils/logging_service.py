@@ -18,11 +18,33 @@ Constructor:
 
 Easily specify rotating logs. See __init__() for all option.
 
+The service also collects timings, counters, and memory
+use of hot paths (see class Instrumentation):
+
+        with self.log.span('chop'):
+            ...
+        self.log.count('snippets_written')
+        self.log.memory_snapshot('after chopping')
+        self.log.save_trace('/tmp/chop_trace.json')
+
+Functions and methods are timed with a decorator that
+does not need a LoggingService instance:
+
+        @timed()
+        def make_spectrogram(self, data):
+            ...
+
 '''
+import contextlib
+import functools
+import json
 import logging
 from logging.handlers import RotatingFileHandler
 import os
+import resource
 import sys
+import threading
+import time
 
 
 # ----------------------------- Metaclass ---------------------
@@ -229,6 +251,401 @@ class LoggingService(metaclass=MetaLoggingSingleton):
     def err(self, msg):
         LoggingService.logger.error(msg)
 
+    #-------------------------
+    # Instrumentation 
+    #--------------
+
+    @property
+    def instrumentation(self):
+        return Instrumentation()
+
+    def span(self, name, memory=False, **attrs):
+        return Instrumentation().span(name, memory=memory, **attrs)
+
+    def count(self, name, value=1):
+        Instrumentation().count(name, value)
+
+    def memory_snapshot(self, label):
+        return Instrumentation().memory_snapshot(label)
+
+    def save_trace(self, path):
+        Instrumentation().save_trace(path)
+        self.info(f"Saved timing trace to {path}")
+
+    def write_to_tensorboard(self, writer, step, reset=False):
+        Instrumentation().write_to_tensorboard(writer, step, reset=reset)
+
+    def log_timing_summary(self):
+        '''
+        Log one line per span name, slowest first,
+        and one per counter.
+        '''
+        summary = Instrumentation().summary()
+        spans = sorted(summary['spans'].items(), 
+                       key=lambda name_stats: name_stats[1]['total_secs'],
+                       reverse=True)
+        for (name, stats) in spans:
+            self.info(f"{name}: {stats['total_secs']:.3f} secs in {stats['count']} calls "
+                      f"(mean {stats['mean_secs']:.4f}, max {stats['max_secs']:.4f})")
+        for (name, value) in summary['counters'].items():
+            self.info(f"{name}: {value}")
+
+# ----------------------------- Instrumentation Class ---------------------
+
+class Instrumentation(metaclass=MetaLoggingSingleton):
+    '''
+    Singleton that collects timing spans, counters, 
+    and memory snapshots for the whole process.
+    
+    Spans nest: a span opened while another is open
+    in the same thread is recorded under the path 
+    'outer/inner'. For each path the number of calls, 
+    and total, min, and max seconds are kept. These 
+    aggregates cost a few microseconds per span, and 
+    are always collected. 
+    
+    With tracing enabled, each span is in addition 
+    recorded as an event, up to max_events. Events are 
+    saved in the Chrome trace format (load the file in 
+    chrome://tracing, or ui.perfetto.dev) by save_trace().
+    '''
+
+    #-------------------------
+    # Constructor 
+    #--------------
+
+    def __init__(self, tracing=False, max_events=1000000):
+        '''
+        @param tracing: whether to record individual span events
+        @type tracing: bool
+        @param max_events: most events kept; later ones are counted
+            as dropped
+        @type max_events: int
+        '''
+        self.tracing = tracing
+        self.max_events = max_events
+        self.lock = threading.Lock()
+        # Stack of open span paths, per thread:
+        self.thread_state = threading.local()
+        self.origin = time.perf_counter()
+        self.origin_epoch = time.time()
+        self.reset()
+
+    #-------------------------
+    # reset 
+    #--------------
+
+    def reset(self):
+        '''
+        Discard all spans, counters, snapshots, and events.
+        '''
+        with self.lock:
+            self.span_stats = {}
+            self.counters = {}
+            self.memory_snapshots = []
+            self.events = []
+            self.dropped_events = 0
+
+    #-------------------------
+    # enable_tracing 
+    #--------------
+
+    def enable_tracing(self, tracing=True, max_events=None):
+        self.tracing = tracing
+        if max_events is not None:
+            self.max_events = max_events
+
+    #-------------------------
+    # span 
+    #--------------
+
+    def span(self, name, memory=False, **attrs):
+        '''
+        Return a context manager that times the code
+        it encloses. Also usable as a decorator.
+        
+        @param name: name of the span
+        @type name: str
+        @param memory: if True, take a memory snapshot
+            when the span ends
+        @type memory: bool
+        @param attrs: added to the span's trace event
+        '''
+        return Span(self, name, memory, attrs)
+
+    #-------------------------
+    # count 
+    #--------------
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            if self.tracing:
+                self._add_event({'name' : name,
+                                 'ph'   : 'C',
+                                 'ts'   : self._micros(time.perf_counter()),
+                                 'pid'  : os.getpid(),
+                                 'args' : {name : self.counters[name]}
+                                 })
+
+    #-------------------------
+    # memory_snapshot 
+    #--------------
+
+    def memory_snapshot(self, label):
+        '''
+        Record current and peak resident memory of the
+        process, and for cuda the peak allocated by torch.
+        
+        @param label: name of the snapshot
+        @type label: str
+        @return: the snapshot
+        @rtype: {str : any}
+        '''
+        (rss_mb, peak_rss_mb) = memory_usage()
+        snapshot = {'label'       : label,
+                    'time_secs'   : time.perf_counter() - self.origin,
+                    'rss_mb'      : rss_mb,
+                    'peak_rss_mb' : peak_rss_mb
+                    }
+        # Only look at cuda if the caller uses torch:
+        torch = sys.modules.get('torch')
+        if torch is not None and torch.cuda.is_available():
+            snapshot['cuda_peak_mb'] = torch.cuda.max_memory_allocated() / 2**20
+        with self.lock:
+            self.memory_snapshots.append(snapshot)
+            if self.tracing:
+                self._add_event({'name' : 'memory',
+                                 'ph'   : 'C',
+                                 'ts'   : self._micros(time.perf_counter()),
+                                 'pid'  : os.getpid(),
+                                 'args' : {'rss_mb' : rss_mb}
+                                 })
+        return snapshot
+
+    #-------------------------
+    # summary 
+    #--------------
+
+    def summary(self):
+        '''
+        Return the span aggregates, counters, and
+        memory snapshots:
+        
+           {'spans'    : {path : {'count', 'total_secs', 'mean_secs', 
+                                  'min_secs', 'max_secs'}},
+            'counters' : {name : value},
+            'memory'   : [snapshot]
+            }
+        '''
+        with self.lock:
+            spans = {path : dict(stats, mean_secs=stats['total_secs'] / stats['count'])
+                     for (path, stats) in self.span_stats.items()}
+            return {'spans'    : spans,
+                    'counters' : dict(self.counters),
+                    'memory'   : list(self.memory_snapshots)
+                    }
+
+    #-------------------------
+    # save_trace 
+    #--------------
+
+    def save_trace(self, path):
+        '''
+        Write recorded events in Chrome trace format.
+        The summary is included under 'otherData', so
+        the file is useful even if tracing was off.
+        
+        @param path: destination .json file
+        @type path: str
+        '''
+        summary = self.summary()
+        with self.lock:
+            trace = {'traceEvents'     : list(self.events),
+                     'displayTimeUnit' : 'ms',
+                     'otherData'       : {'start_time'     : self.origin_epoch,
+                                          'dropped_events' : self.dropped_events,
+                                          'summary'        : summary
+                                          }
+                     }
+        with open(path, 'w') as fd:
+            json.dump(trace, fd)
+
+    #-------------------------
+    # write_to_tensorboard 
+    #--------------
+
+    def write_to_tensorboard(self, writer, step, reset=False, prefix='instrumentation'):
+        '''
+        Add span totals and call counts, counters, and
+        the latest memory snapshot as scalars to a
+        SummaryWriter (tensorboardX or torch).
+        
+        @param writer: the summary writer
+        @type writer: SummaryWriter
+        @param step: global step, such as the epoch
+        @type step: int
+        @param reset: if True, reset() after writing, so
+            that the next step only shows its own numbers
+        @type reset: bool
+        @param prefix: tag prefix
+        @type prefix: str
+        '''
+        summary = self.summary()
+        for (path, stats) in summary['spans'].items():
+            writer.add_scalar(f"{prefix}/secs/{path}", stats['total_secs'], step)
+            writer.add_scalar(f"{prefix}/calls/{path}", stats['count'], step)
+        for (name, value) in summary['counters'].items():
+            writer.add_scalar(f"{prefix}/counters/{name}", value, step)
+        if len(summary['memory']) > 0:
+            snapshot = summary['memory'][-1]
+            for key in ('rss_mb', 'peak_rss_mb', 'cuda_peak_mb'):
+                if key in snapshot:
+                    writer.add_scalar(f"{prefix}/memory/{key}", snapshot[key], step)
+        if reset:
+            self.reset()
+
+    #-------------------------
+    # open_spans 
+    #--------------
+
+    def open_spans(self):
+        '''
+        Stack of paths of the spans that are open
+        in the calling thread.
+        '''
+        try:
+            return self.thread_state.stack
+        except AttributeError:
+            self.thread_state.stack = []
+            return self.thread_state.stack
+
+    #-------------------------
+    # _record_span 
+    #--------------
+
+    def _record_span(self, path, name, start, end, attrs):
+        duration = end - start
+        with self.lock:
+            try:
+                stats = self.span_stats[path]
+                stats['count'] += 1
+                stats['total_secs'] += duration
+                stats['min_secs'] = min(stats['min_secs'], duration)
+                stats['max_secs'] = max(stats['max_secs'], duration)
+            except KeyError:
+                self.span_stats[path] = {'count'      : 1,
+                                         'total_secs' : duration,
+                                         'min_secs'   : duration,
+                                         'max_secs'   : duration
+                                         }
+            if self.tracing:
+                self._add_event({'name' : name,
+                                 'ph'   : 'X',
+                                 'ts'   : self._micros(start),
+                                 'dur'  : duration * 1e6,
+                                 'pid'  : os.getpid(),
+                                 'tid'  : threading.get_ident(),
+                                 'args' : dict(attrs, path=path)
+                                 })
+
+    def _add_event(self, event):
+        # Caller holds the lock
+        if len(self.events) < self.max_events:
+            self.events.append(event)
+        else:
+            self.dropped_events += 1
+
+    def _micros(self, perf_time):
+        return (perf_time - self.origin) * 1e6
+
+# ----------------------------- Span Class ---------------------
+
+class Span(contextlib.ContextDecorator):
+    '''
+    One timed section of code; created by
+    Instrumentation.span().
+    '''
+
+    def __init__(self, instrumentation, name, memory, attrs):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.memory = memory
+        self.attrs = attrs
+
+    def _recreate_cm(self):
+        # When used as a decorator, give each call
+        # its own span, so that recursion and threads
+        # do not share start times:
+        return Span(self.instrumentation, self.name, self.memory, self.attrs)
+
+    def __enter__(self):
+        open_spans = self.instrumentation.open_spans()
+        self.path = f"{open_spans[-1]}/{self.name}" if open_spans else self.name
+        open_spans.append(self.path)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        self.instrumentation.open_spans().pop()
+        self.instrumentation._record_span(self.path, self.name, self.start, end, self.attrs)
+        if self.memory:
+            self.instrumentation.memory_snapshot(self.path)
+        return False
+
+# ----------------------------- Functions ---------------------
+
+def timed(name=None, memory=False):
+    '''
+    Decorator that runs a function in a span. 
+    The span name defaults to the function's 
+    qualified name, such as 'DSPUtils.save_spectrogram'.
+    For classmethods and staticmethods, put @timed() 
+    below the @classmethod line.
+    
+    @param name: span name
+    @type name: {None | str}
+    @param memory: whether to take a memory snapshot
+        when the function returns
+    @type memory: bool
+    '''
+    def decorator(func):
+        span_name = func.__qualname__ if name is None else name
+        @functools.wraps(func)
+        def timed_func(*args, **kwargs):
+            with Instrumentation().span(span_name, memory=memory):
+                return func(*args, **kwargs)
+        return timed_func
+    return decorator
+
+def memory_usage():
+    '''
+    Return current and peak resident set size of
+    this process in MB. Where /proc is not available
+    the current size is None.
+    
+    @return: (rss_mb, peak_rss_mb)
+    @rtype: ({float | None}, float)
+    '''
+    rss_mb = None
+    peak_rss_mb = None
+    try:
+        with open('/proc/self/status', 'r') as fd:
+            for line in fd:
+                # Like 'VmHWM:     806364 kB'
+                if line.startswith('VmRSS:'):
+                    rss_mb = int(line.split()[1]) / 2**10
+                elif line.startswith('VmHWM:'):
+                    peak_rss_mb = int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    if peak_rss_mb is None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, KB elsewhere:
+        peak_rss_mb = max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+    return (rss_mb, peak_rss_mb)
+
 # ------------------------- Main ---------------
 
 # For testing only; this module is intended for import.
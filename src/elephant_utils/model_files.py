@@ -0,0 +1,119 @@
+'''
+Loading of saved models and of their cpu inference
+variants, shared by the evaluation scripts and by
+the training code in Refactored.
+
+Refactored/export_models.py saves the variants next
+to the model file:
+
+    model_17.pt         torch.save(model)
+    model_17_int8.pt    int8 quantized, frozen TorchScript
+    model_17_frozen.pt  float32 frozen TorchScript
+'''
+import inspect
+import os
+import zipfile
+
+import torch
+
+# Suffixes of the cpu inference variants of a saved model
+MODEL_VARIANTS = ['int8', 'frozen']
+
+#------------------------------------
+# model_variant_path
+#-------------------
+
+def model_variant_path(model_path, variant):
+    '''
+    Path of the given inference variant of a saved model:
+    /foo/model_17.pt --> /foo/model_17_int8.pt
+
+    @param model_path: path of the saved float model
+    @type model_path: str
+    @param variant: one of MODEL_VARIANTS
+    @type variant: str
+    @return: path of the variant
+    @rtype: str
+    '''
+    (root, ext) = os.path.splitext(model_path)
+    return root + '_' + variant + (ext if ext else '.pt')
+
+#------------------------------------
+# model_variant_of
+#-------------------
+
+def model_variant_of(model_path):
+    '''
+    Return the inference variant that the model path
+    refers to, or None for a regular saved model.
+
+    @param model_path: path of a saved model or variant
+    @type model_path: str
+    @rtype: {None|str}
+    '''
+    (root, _ext) = os.path.splitext(model_path)
+    for variant in MODEL_VARIANTS:
+        if root.endswith('_' + variant):
+            return variant
+    return None
+
+#------------------------------------
+# is_torchscript_file
+#-------------------
+
+def is_torchscript_file(model_path):
+    '''
+    TorchScript archives are zip files that contain compiled
+    code; files from torch.save(model) only hold pickled data.
+
+    @param model_path: path of a saved model or variant
+    @type model_path: str
+    @rtype: bool
+    '''
+    if not zipfile.is_zipfile(model_path):
+        return False
+    with zipfile.ZipFile(model_path) as archive:
+        return any(name.endswith('constants.pkl') for name in archive.namelist())
+
+#------------------------------------
+# load_model_file
+#-------------------
+
+def load_model_file(model_path, device):
+    '''
+    Load either a model saved with torch.save(model), or one of
+    its TorchScript inference variants. Variants are always loaded
+    onto the cpu, since the quantized kernels only exist there.
+
+    @param model_path: path of a saved model or variant
+    @type model_path: str
+    @param device: where to load a float model
+    @type device: {str|torch.device}
+    @return: the model
+    @rtype: {torch.nn.Module|torch.jit.ScriptModule}
+    '''
+    if is_torchscript_file(model_path):
+        return torch.jit.load(model_path, map_location='cpu')
+
+    return load_pickled(model_path, map_location=device)
+
+#------------------------------------
+# load_pickled
+#-------------------
+
+def load_pickled(path, map_location=None):
+    '''
+    torch.load of a file that holds whole pickled objects,
+    e.g. models or training checkpoints, which torch 2.6 and
+    later no longer load by default. Torch versions before
+    1.13 have no weights_only argument and always unpickle.
+
+    @param path: file saved with torch.save
+    @type path: str
+    @param map_location: where to load tensors
+    @type map_location: {None|str|torch.device}
+    @return: the saved object
+    '''
+    if 'weights_only' in inspect.signature(torch.load).parameters:
+        return torch.load(path, map_location=map_location, weights_only=False)
+    return torch.load(path, map_location=map_location)
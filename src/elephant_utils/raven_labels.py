@@ -0,0 +1,418 @@
+'''
+Parsed Raven selection tables, shared by all code
+that reads elephant call labels.
+
+A table is parsed once into typed numpy columns:
+
+    selection, file_offset, begin, end,
+    low_freq, high_freq, marginal
+
+and the result is cached in a binary sidecar file
+next to the table, together with the table's mtime
+and size. The sidecar replaces the table's extension
+(nn01a_20180126.txt -> nn01a_20180126.labels.npz), so
+scans that pair files by their first dotted part
+never take it for a 'txt' table; such scans should
+still skip '*.labels.npz' to ignore sidecars that
+older versions wrote as <table>.txt.labels.npz. Later loads of the same,
+unchanged table read the sidecar instead of parsing;
+within a process, tables are also kept in memory.
+
+Conversions to spectrogram frames, .wav samples, and
+label masks are vectorized over all calls:
+
+    table = RavenLabelTable.load('nn01a_20180126.txt')
+    (start_frames, end_frames) = table.frame_indices(num_frames=len(mask))
+    mask = table.frame_mask(num_frames)
+'''
+import csv
+import math
+import os
+import threading
+
+import numpy as np
+
+
+class RavenLabelTable(object):
+    '''
+    The calls of one Raven selection table, as numpy
+    columns. Times are in seconds, frequencies in Hz.
+    Tables without a 'File Offset (s)' column use the
+    begin times as offsets; missing frequency columns
+    are NaN; calls are marginal if the table has a
+    'Marginal' column with value 'yes'.
+    '''
+
+    BEGIN_TIME_KEY  = 'Begin Time (s)'
+    END_TIME_KEY    = 'End Time (s)'
+    FILE_OFFSET_KEY = 'File Offset (s)'
+    LOW_FREQ_KEY    = 'Low Freq (Hz)'
+    HIGH_FREQ_KEY   = 'High Freq (Hz)'
+    SELECTION_KEY   = 'Selection'
+    MARGINAL_KEY    = 'Marginal'
+
+    COLUMNS = ['selection', 'file_offset', 'begin', 'end',
+               'low_freq', 'high_freq', 'marginal']
+
+    SIDECAR_SUFFIX = '.labels.npz'
+    # Bump when the parsed columns change, so that
+    # old sidecars are re-created:
+    SIDECAR_VERSION = 1
+
+    # In-process cache: {abs path : ((mtime_ns, size), table)}
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self, columns, path=None):
+        '''
+        @param columns: one equal length array per
+            name in COLUMNS
+        @type columns: {str : np.array}
+        @param path: table the columns came from
+        @type path: {None | str}
+        '''
+        self.path = path
+        self.selection   = np.asarray(columns['selection'], dtype=np.int64)
+        self.file_offset = np.asarray(columns['file_offset'], dtype=np.float64)
+        self.begin       = np.asarray(columns['begin'], dtype=np.float64)
+        self.end         = np.asarray(columns['end'], dtype=np.float64)
+        self.low_freq    = np.asarray(columns['low_freq'], dtype=np.float64)
+        self.high_freq   = np.asarray(columns['high_freq'], dtype=np.float64)
+        self.marginal    = np.asarray(columns['marginal'], dtype=bool)
+
+    #------------------------------------
+    # load
+    #-------------------
+
+    @classmethod
+    def load(cls, label_path, use_sidecar=True):
+        '''
+        Return the parsed table, from the in-process
+        cache, the sidecar file, or by parsing, in that
+        order. A sidecar is written after parsing if
+        the table's directory is writable.
+
+        @param label_path: Raven selection table
+        @type label_path: str
+        @param use_sidecar: whether to read and write
+            the binary sidecar file
+        @type use_sidecar: bool
+        @return: the table
+        @rtype: RavenLabelTable
+        '''
+        label_path = os.path.abspath(label_path)
+        signature = cls._cache_signature(label_path)
+
+        with cls._cache_lock:
+            cached = cls._cache.get(label_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        table = None
+        sidecar_path = cls.sidecar_path(label_path)
+        if use_sidecar:
+            table = cls._read_sidecar(sidecar_path, label_path, signature)
+        if table is None:
+            with open(label_path, 'r') as fd:
+                table = cls.from_fd(fd, path=label_path)
+            if use_sidecar:
+                table._write_sidecar(sidecar_path, signature)
+
+        with cls._cache_lock:
+            cls._cache[label_path] = (signature, table)
+        return table
+
+    #------------------------------------
+    # sidecar_path
+    #-------------------
+
+    @classmethod
+    def sidecar_path(cls, label_path):
+        '''
+        Return the path of the sidecar for the given
+        table: the table's path with its extension
+        replaced by SIDECAR_SUFFIX.
+
+        @param label_path: Raven selection table
+        @type label_path: str
+        @return: sidecar path
+        @rtype: str
+        '''
+        return os.path.splitext(label_path)[0] + cls.SIDECAR_SUFFIX
+
+    #------------------------------------
+    # from_fd
+    #-------------------
+
+    @classmethod
+    def from_fd(cls, fd, path=None):
+        '''
+        Parse a table from an open file, without
+        any caching.
+
+        @param fd: tab separated Raven selection table
+        @type fd: file-like
+        @param path: name used in error messages
+        @type path: {None | str}
+        @return: the table
+        @rtype: RavenLabelTable
+        @raise IOError: if begin or end time columns are missing
+        '''
+        reader = csv.reader(fd, delimiter='\t')
+        try:
+            header = next(reader)
+        except StopIteration:
+            header = []
+        col_idx = {name : idx for (idx, name) in enumerate(header)}
+        if cls.BEGIN_TIME_KEY not in col_idx or cls.END_TIME_KEY not in col_idx:
+            if len(header) == 0:
+                return cls.empty(path)
+            raise IOError(f"Raven label file {path} does not contain one "
+                          f"or both of keys '{cls.BEGIN_TIME_KEY}', {cls.END_TIME_KEY}'")
+
+        rows = [row for row in reader if len(row) > 0]
+
+        def column(key, default=None):
+            try:
+                idx = col_idx[key]
+            except KeyError:
+                return default
+            return [row[idx] if idx < len(row) else '' for row in rows]
+
+        begin = np.array(column(cls.BEGIN_TIME_KEY), dtype=np.float64)
+        end   = np.array(column(cls.END_TIME_KEY), dtype=np.float64)
+        offsets = column(cls.FILE_OFFSET_KEY)
+        selections = column(cls.SELECTION_KEY)
+        marginals = column(cls.MARGINAL_KEY)
+        columns = {
+            'selection'   : np.arange(1, len(rows) + 1) if selections is None
+                                else np.array(selections, dtype=np.int64),
+            'file_offset' : begin.copy() if offsets is None else np.array(offsets, dtype=np.float64),
+            'begin'       : begin,
+            'end'         : end,
+            'low_freq'    : cls._float_column(column(cls.LOW_FREQ_KEY), len(rows)),
+            'high_freq'   : cls._float_column(column(cls.HIGH_FREQ_KEY), len(rows)),
+            'marginal'    : np.zeros(len(rows), dtype=bool) if marginals is None
+                                else np.array([value.strip().lower() == 'yes' for value in marginals],
+                                              dtype=bool)
+            }
+        return cls(columns, path=path)
+
+    #------------------------------------
+    # empty
+    #-------------------
+
+    @classmethod
+    def empty(cls, path=None):
+        return cls({name : [] for name in cls.COLUMNS}, path=path)
+
+    #------------------------------------
+    # __len__
+    #-------------------
+
+    def __len__(self):
+        return len(self.begin)
+
+    #------------------------------------
+    # durations
+    #-------------------
+
+    def durations(self):
+        '''
+        Call lengths in seconds
+        '''
+        return self.end - self.begin
+
+    #------------------------------------
+    # valid
+    #-------------------
+
+    def valid(self):
+        '''
+        Mask of calls whose end is not before their begin
+        '''
+        return self.end >= self.begin
+
+    #------------------------------------
+    # frame_indices
+    #-------------------
+
+    def frame_indices(self,
+                      samplerate=8000,
+                      NFFT=4096,
+                      hop=800,
+                      num_frames=None,
+                      use_file_offset=True):
+        '''
+        Spectrogram frame range [start, end) of each call:
+
+            ceil((time * samplerate - NFFT / 2) / hop)
+
+        clipped at 0, and at num_frames if given. With
+        use_file_offset, calls start at their file offset
+        and last for end - begin.
+
+        @return: start and end frames
+        @rtype: (np.array(int), np.array(int))
+        '''
+        if use_file_offset:
+            start_times = self.file_offset
+            end_times   = self.file_offset + self.durations()
+        else:
+            start_times = self.begin
+            end_times   = self.end
+        start_frames = np.ceil((start_times * samplerate - NFFT / 2.) / hop).astype(np.int64)
+        end_frames   = np.ceil((end_times * samplerate - NFFT / 2.) / hop).astype(np.int64)
+        np.maximum(start_frames, 0, out=start_frames)
+        if num_frames is not None:
+            np.minimum(end_frames, num_frames, out=end_frames)
+        return (start_frames, end_frames)
+
+    #------------------------------------
+    # frame_mask
+    #-------------------
+
+    def frame_mask(self,
+                   num_frames,
+                   samplerate=8000,
+                   NFFT=4096,
+                   hop=800,
+                   use_file_offset=True,
+                   exclude_marginals=False):
+        '''
+        0/1 int mask over num_frames spectrogram frames,
+        with 1s in the frames of any call.
+
+        @return: label mask
+        @rtype: np.array(int)
+        '''
+        (start_frames, end_frames) = self.frame_indices(samplerate, NFFT, hop,
+                                                        num_frames=num_frames,
+                                                        use_file_offset=use_file_offset)
+        keep = start_frames < end_frames
+        if exclude_marginals:
+            keep &= ~self.marginal
+        return self.ranges_to_mask(start_frames[keep], end_frames[keep], num_frames)
+
+    #------------------------------------
+    # sample_indices
+    #-------------------
+
+    def sample_indices(self, framerate):
+        '''
+        Range of .wav samples of each call, from begin
+        and end times. The end is made exclusive by
+        adding one sample:
+
+            [ceil(framerate * begin), ceil(1 + framerate * end))
+
+        @return: array of [start, end] rows
+        @rtype: np.array(int)
+        '''
+        starts = np.ceil(framerate * self.begin)
+        ends   = np.ceil(1 + framerate * self.end)
+        return np.stack((starts, ends), axis=1).astype(np.int64)
+
+    #------------------------------------
+    # bin_indices
+    #-------------------
+
+    def bin_indices(self, label_times):
+        '''
+        For spectrogram time labels (frame times in
+        seconds, ascending), return for each call the
+        last bin at or before its begin time, and the
+        first bin after its end time (len(label_times)
+        if none). Calls that end before they begin, or
+        lie outside the time labels, are flagged invalid.
+
+        @param label_times: time of each spectrogram frame
+        @type label_times: np.array(float)
+        @return: start bins, end bins, and valid mask
+        @rtype: (np.array(int), np.array(int), np.array(bool))
+        '''
+        label_times = np.asarray(label_times, dtype=np.float64)
+        start_bins = np.searchsorted(label_times, self.begin, side='right') - 1
+        np.maximum(start_bins, 0, out=start_bins)
+        end_bins = np.searchsorted(label_times, self.end, side='right')
+        valid = self.valid() & \
+                (self.begin <= label_times[-1]) & \
+                (self.end >= label_times[0])
+        return (start_bins, end_bins, valid)
+
+    #------------------------------------
+    # ranges_to_mask
+    #-------------------
+
+    @classmethod
+    def ranges_to_mask(cls, starts, ends, length):
+        '''
+        0/1 int mask of the given length with 1s in
+        each [start, end) range; ranges may overlap.
+        '''
+        change = np.zeros(length + 1, dtype=np.int64)
+        np.add.at(change, np.clip(starts, 0, length), 1)
+        np.add.at(change, np.clip(ends, 0, length), -1)
+        return (np.cumsum(change[:-1]) > 0).astype(int)
+
+    #------------------------------------
+    # _float_column
+    #-------------------
+
+    @classmethod
+    def _float_column(cls, values, num_rows):
+        if values is None:
+            return np.full(num_rows, np.nan)
+        return np.array([float(value) if value.strip() != '' else math.nan
+                         for value in values])
+
+    #------------------------------------
+    # _cache_signature
+    #-------------------
+
+    @classmethod
+    def _cache_signature(cls, label_path):
+        # Tables are re-parsed when either changes:
+        stat = os.stat(label_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    #------------------------------------
+    # _read_sidecar
+    #-------------------
+
+    @classmethod
+    def _read_sidecar(cls, sidecar_path, label_path, signature):
+        try:
+            with np.load(sidecar_path) as saved:
+                if int(saved['version']) != cls.SIDECAR_VERSION or \
+                        tuple(saved['signature']) != signature:
+                    return None
+                return cls({name : saved[name] for name in cls.COLUMNS}, path=label_path)
+        except (OSError, KeyError, ValueError):
+            # Missing, stale, or unreadable sidecar:
+            return None
+
+    #------------------------------------
+    # _write_sidecar
+    #-------------------
+
+    def _write_sidecar(self, sidecar_path, signature):
+        tmp_path = f"{sidecar_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as fd:
+                np.savez(fd,
+                         version=self.SIDECAR_VERSION,
+                         signature=np.array(signature, dtype=np.int64),
+                         **{name : getattr(self, name) for name in self.COLUMNS})
+            # Readers never see a partial sidecar:
+            os.replace(tmp_path, sidecar_path)
+        except OSError:
+            # Read-only data directories just go without
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
@@ -0,0 +1,550 @@
+#!/usr/bin/env python
+'''
+Work queue shared by the gnu parallel copies of
+wave_maker.py and chop_spectrograms.py, as an
+alternative to each worker taking a fixed, contiguous
+share of the infiles.
+
+All workers add the same files to a queue kept in an
+Sqlite db in the output directory. Each worker then
+repeatedly claims the largest remaining file, so that
+no worker is left with a share of long recordings
+while the others are idle:
+
+    queue = WorkQueue(os.path.join(outdir, WorkQueue.QUEUE_FILE),
+                      worker='wave_maker#3')
+    queue.add(infiles)
+    for infile in queue.claimed():
+        try:
+            ...
+            queue.done(infile)
+        except Exception as e:
+            queue.failed(infile, repr(e))
+
+While a worker holds a claim, a background thread
+renews the claim's lease. Claims whose lease expired,
+because their worker crashed, are claimed again by
+other workers. So that a crash does not leave files
+unprocessed until the next run, the claimed() loop
+only ends once no other worker holds a live claim;
+until then it polls, and takes over claims whose
+lease runs out. Files that changed since they were
+done, or that are re-added with different processing
+parameters, are queued again:
+
+    queue.add(infiles, params={'threshold_db' : -40})
+
+Files that failed max_attempts times stay failed
+across runs. After fixing the cause, queue them
+again with retry_failed(), or from the command line:
+
+    work_queue.py --retry_failed <outdir>/work_queue.sqlite
+
+Per-worker throughput is available from throughput(),
+or from the command line:
+
+    work_queue.py <outdir>/work_queue.sqlite
+'''
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+
+class WorkQueue(object):
+    '''
+    Sqlite claim table of files to process.
+    '''
+
+    QUEUE_FILE = 'work_queue.sqlite'
+
+    # Task states:
+    TODO    = 'todo'
+    CLAIMED = 'claimed'
+    DONE    = 'done'
+    FAILED  = 'failed'
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self,
+                 db_path,
+                 worker=None,
+                 lease_secs=600,
+                 max_attempts=2,
+                 timeout=60,
+                 poll_secs=10):
+        '''
+        @param db_path: Sqlite file of the queue;
+            created if it does not exist
+        @type db_path: str
+        @param worker: name of this worker in the
+            throughput report; default: host:pid
+        @type worker: {None|str}
+        @param lease_secs: claims not renewed for this
+            long are given to other workers
+        @type lease_secs: {int|float}
+        @param max_attempts: number of times a file is
+            tried before it remains failed
+        @type max_attempts: int
+        @param timeout: seconds to wait for other
+            workers' writes to finish
+        @type timeout: {int|float}
+        @param poll_secs: when nothing is left to claim,
+            seconds between checks for claims of other
+            workers that expired
+        @type poll_secs: {int|float}
+        '''
+        self.db_path = db_path
+        self.worker = f"{socket.gethostname()}:{os.getpid()}" if worker is None else worker
+        self.lease_secs = lease_secs
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.poll_secs = poll_secs
+
+        # Transactions are begun explicitly, so that
+        # claims can lock the db before reading:
+        self.db = self._connect()
+        self._create_tables()
+
+        self.current = None
+        self.num_reclaimed = 0
+        self._heartbeat_stop = None
+        self._heartbeat_thread = None
+
+    #------------------------------------
+    # add
+    #-------------------
+
+    def add(self, paths, params=None):
+        '''
+        Queue files. Files already in the queue are
+        left alone, unless they changed size or mtime
+        since they were queued, or were queued with
+        other params; those are queued anew. All workers
+        may add the same files.
+
+        @param paths: files to process
+        @type paths: [str]
+        @param params: processing parameters that the
+            results depend on, such as thresholds
+        @type params: {None|{str : object}}
+        '''
+        params = None if params is None else json.dumps(params, sort_keys=True)
+        rows = []
+        for path in paths:
+            stat = os.stat(path)
+            rows.append((path, stat.st_size, stat.st_mtime_ns, params))
+        with self._transaction():
+            self.db.executemany(f'''
+                INSERT INTO Tasks (path, size, mtime_ns, params, state, attempts)
+                VALUES (?, ?, ?, ?, '{self.TODO}', 0)
+                ON CONFLICT (path) DO UPDATE
+                   SET size = excluded.size,
+                       mtime_ns = excluded.mtime_ns,
+                       params = excluded.params,
+                       state = '{self.TODO}',
+                       attempts = 0
+                 WHERE size != excluded.size OR mtime_ns != excluded.mtime_ns
+                    OR params IS NOT excluded.params''',
+                rows)
+
+    #------------------------------------
+    # retry_failed
+    #-------------------
+
+    def retry_failed(self):
+        '''
+        Queue all failed files again, with a 
+        fresh count of attempts.
+
+        @return: number of files queued again
+        @rtype: int
+        '''
+        with self._transaction():
+            cursor = self.db.execute(f'''
+                UPDATE Tasks
+                   SET state = '{self.TODO}', attempts = 0, error = NULL
+                 WHERE state = '{self.FAILED}'
+                ''')
+        return cursor.rowcount
+
+    #------------------------------------
+    # claim
+    #-------------------
+
+    def claim(self):
+        '''
+        Claim the largest file that is neither done nor
+        claimed by a live worker. Files whose claim
+        expired count as not claimed, unless they were
+        already tried max_attempts times; those are
+        marked failed.
+
+        @return: path of the claimed file, or None if
+            no work is left
+        @rtype: {None|str}
+        '''
+        now = time.time()
+        with self._transaction():
+            # Files whose workers died on each of their
+            # attempts are not tried again:
+            self.db.execute(f'''
+                UPDATE Tasks
+                   SET state = '{self.FAILED}', finished_at = ?,
+                       error = 'lease expired on last attempt'
+                 WHERE state = '{self.CLAIMED}' AND heartbeat < ?
+                   AND attempts >= ?''', (now, now - self.lease_secs, self.max_attempts))
+            row = self.db.execute(f'''
+                SELECT path, state FROM Tasks
+                 WHERE state = '{self.TODO}'
+                    OR (state = '{self.CLAIMED}' AND heartbeat < ?)
+                 ORDER BY size DESC, path
+                 LIMIT 1''', (now - self.lease_secs,)).fetchone()
+            if row is None:
+                return None
+            (path, state) = row
+            self.db.execute(f'''
+                UPDATE Tasks
+                   SET state = '{self.CLAIMED}', worker = ?,
+                       claimed_at = ?, heartbeat = ?,
+                       attempts = attempts + 1
+                 WHERE path = ?''', (self.worker, now, now, path))
+
+        if state == self.CLAIMED:
+            # Its worker died:
+            self.num_reclaimed += 1
+        self.current = path
+        self._start_heartbeat(path)
+        return path
+
+    #------------------------------------
+    # claimed
+    #-------------------
+
+    def claimed(self, items=None):
+        '''
+        Generator of claims, for use in a for loop.
+        The caller must mark each yielded claim done()
+        or failed(). A claim left unfinished when
+        the loop ends (e.g. via break) is released to
+        other workers.
+
+        When nothing is left to claim, but other workers
+        still hold claims, the loop waits until they
+        finish, or until their leases expire and the
+        files can be claimed again; so the loop only
+        ends when all files are done or failed.
+
+        @param items: if provided, yield items[path]
+            instead of the claimed paths
+        @type items: {None|{str : object}}
+        '''
+        try:
+            while True:
+                path = self.claim()
+                if path is None:
+                    lease_left = self.others_lease_left()
+                    if lease_left is None:
+                        return
+                    time.sleep(min(self.poll_secs, lease_left))
+                    continue
+                yield path if items is None else items[path]
+        finally:
+            if self.current is not None:
+                self.release(self.current)
+
+    #------------------------------------
+    # done
+    #-------------------
+
+    def done(self, path):
+        '''
+        Mark a claim done.
+
+        @return: False if the claim's lease had expired
+            and the file was claimed by another worker;
+            the outcome is then left to that worker
+        @rtype: bool
+        '''
+        return self._finish(path, self.DONE)
+
+    #------------------------------------
+    # failed
+    #-------------------
+
+    def failed(self, path, reason=None):
+        '''
+        Mark a claim failed. The file is queued again
+        until it has been tried max_attempts times.
+
+        @return: False if the claim's lease had expired
+            and the file was claimed by another worker
+        @rtype: bool
+        '''
+        return self._finish(path, self.FAILED, reason)
+
+    #------------------------------------
+    # release
+    #-------------------
+
+    def release(self, path):
+        '''
+        Return an unfinished claim to the queue.
+        '''
+        self._stop_heartbeat()
+        with self._transaction():
+            self.db.execute(f'''
+                UPDATE Tasks
+                   SET state = '{self.TODO}', worker = NULL,
+                       attempts = attempts - 1
+                 WHERE path = ? AND worker = ?''', (path, self.worker))
+        self.current = None
+
+    #------------------------------------
+    # others_lease_left
+    #-------------------
+
+    def others_lease_left(self):
+        '''
+        Seconds until the first of the claims that
+        other workers hold expires, or None if they
+        hold none.
+
+        @rtype: {None|float}
+        '''
+        (heartbeat,) = self.db.execute(f'''
+            SELECT MIN(heartbeat) FROM Tasks
+             WHERE state = '{self.CLAIMED}' AND worker != ?''',
+            (self.worker,)).fetchone()
+        if heartbeat is None:
+            return None
+        return max(heartbeat + self.lease_secs - time.time(), 0.)
+
+    #------------------------------------
+    # remaining
+    #-------------------
+
+    def remaining(self):
+        '''
+        Number of files not yet done, including
+        claimed ones.
+        '''
+        return self.db.execute(f'''
+            SELECT COUNT(*) FROM Tasks
+             WHERE state IN ('{self.TODO}', '{self.CLAIMED}')''').fetchone()[0]
+
+    #------------------------------------
+    # throughput
+    #-------------------
+
+    def throughput(self):
+        '''
+        Work finished per worker.
+
+        @return: one dict per worker, with keys worker,
+            files, failed, bytes, busy_secs, MB_per_sec
+        @rtype: [{str : object}]
+        '''
+        rows = self.db.execute(f'''
+            SELECT worker,
+                   SUM(state = '{self.DONE}'),
+                   SUM(state = '{self.FAILED}'),
+                   SUM(CASE WHEN state = '{self.DONE}' THEN size ELSE 0 END),
+                   SUM(finished_at - claimed_at)
+              FROM Tasks
+             WHERE state IN ('{self.DONE}', '{self.FAILED}')
+             GROUP BY worker
+             ORDER BY worker''').fetchall()
+        report = []
+        for (worker, files, failed, num_bytes, busy_secs) in rows:
+            report.append({'worker'     : worker,
+                           'files'      : files,
+                           'failed'     : failed,
+                           'bytes'      : num_bytes,
+                           'busy_secs'  : busy_secs,
+                           'MB_per_sec' : num_bytes / 1e6 / busy_secs if busy_secs > 0 else 0.
+                           })
+        return report
+
+    #------------------------------------
+    # log_throughput
+    #-------------------
+
+    def log_throughput(self, log):
+        '''
+        Log the throughput of all workers, and the
+        number of files still to do.
+
+        @param log: where to log
+        @type log: LoggingService
+        '''
+        for stats in self.throughput():
+            log.info(f"{stats['worker']}: {stats['files']} files "
+                     f"({stats['bytes'] / 1e6:.1f}MB) in {stats['busy_secs']:.1f}s, "
+                     f"{stats['MB_per_sec']:.2f}MB/s; {stats['failed']} failed")
+        log.info(f"{self.remaining()} files remaining in {self.db_path}")
+
+    #------------------------------------
+    # close
+    #-------------------
+
+    def close(self):
+        self._stop_heartbeat()
+        self.db.close()
+
+    #------------------------------------
+    # _finish
+    #-------------------
+
+    def _finish(self, path, state, reason=None):
+        self._stop_heartbeat()
+        if state == self.FAILED:
+            # Retried by whoever claims next:
+            state = f'''CASE WHEN attempts < {self.max_attempts}
+                             THEN '{self.TODO}' ELSE '{self.FAILED}' END'''
+        else:
+            state = f"'{state}'"
+        with self._transaction():
+            # Only while this worker still holds the claim:
+            cursor = self.db.execute(f'''
+                UPDATE Tasks
+                   SET state = {state}, finished_at = ?, error = ?
+                 WHERE state = '{self.CLAIMED}' AND path = ? AND worker = ?''',
+                (time.time(), reason, path, self.worker))
+        if path == self.current:
+            self.current = None
+        return cursor.rowcount > 0
+
+    #------------------------------------
+    # _start_heartbeat
+    #-------------------
+
+    def _start_heartbeat(self, path):
+        self._stop_heartbeat()
+        self._heartbeat_stop = threading.Event()
+        self._heartbeat_thread = threading.Thread(target=self._renew_lease,
+                                                  args=(path, self._heartbeat_stop),
+                                                  daemon=True)
+        self._heartbeat_thread.start()
+
+    #------------------------------------
+    # _stop_heartbeat
+    #-------------------
+
+    def _stop_heartbeat(self):
+        if self._heartbeat_thread is None:
+            return
+        self._heartbeat_stop.set()
+        self._heartbeat_thread.join()
+        self._heartbeat_thread = None
+
+    #------------------------------------
+    # _renew_lease
+    #-------------------
+
+    def _renew_lease(self, path, stop):
+        # Sqlite connections may not be shared
+        # among threads:
+        db = self._connect()
+        try:
+            while not stop.wait(self.lease_secs / 3.):
+                try:
+                    with db:
+                        db.execute('UPDATE Tasks SET heartbeat = ? WHERE path = ? AND worker = ?',
+                                   (time.time(), path, self.worker))
+                except sqlite3.OperationalError:
+                    # Db busy; try again next beat
+                    pass
+        finally:
+            db.close()
+
+    #------------------------------------
+    # _transaction
+    #-------------------
+
+    def _transaction(self):
+        return _ImmediateTransaction(self.db)
+
+    #------------------------------------
+    # _connect
+    #-------------------
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+    #------------------------------------
+    # _create_tables
+    #-------------------
+
+    def _create_tables(self):
+        with self._transaction():
+            self.db.execute('''CREATE TABLE IF NOT EXISTS Tasks(
+                                 path TEXT PRIMARY KEY,
+                                 size INTEGER,
+                                 mtime_ns INTEGER,
+                                 params TEXT,
+                                 state TEXT,
+                                 worker TEXT,
+                                 claimed_at REAL,
+                                 heartbeat REAL,
+                                 finished_at REAL,
+                                 attempts INTEGER,
+                                 error TEXT
+                                 )''')
+            self.db.execute('CREATE INDEX IF NOT EXISTS Tasks_state ON Tasks(state, size)')
+            # Queues from before params were kept:
+            columns = [row[1] for row in self.db.execute('PRAGMA table_info(Tasks)')]
+            if 'params' not in columns:
+                self.db.execute('ALTER TABLE Tasks ADD COLUMN params TEXT')
+
+# ---------------------------- Class _ImmediateTransaction
+
+class _ImmediateTransaction(object):
+    '''
+    Write-locks the db on entry, so that no two
+    workers read the same unclaimed file. Commits
+    on normal exit, else rolls back.
+    '''
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.db.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        return False
+
+# ---------------- Main -------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     description="Show per-worker throughput of a work queue."
+                                     )
+    parser.add_argument('--retry_failed',
+                        action='store_true',
+                        help='queue files that failed on all their attempts again')
+    parser.add_argument('queue_file',
+                        help='work queue sqlite file, usually <outdir>/work_queue.sqlite')
+
+    args = parser.parse_args();
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from elephant_utils.logging_service import LoggingService
+
+    queue = WorkQueue(args.queue_file, worker='report')
+    log = LoggingService()
+    if args.retry_failed:
+        log.info(f"Queued {queue.retry_failed()} failed files again")
+    queue.log_throughput(log)
+    queue.close()
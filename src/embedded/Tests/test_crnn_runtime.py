@@ -0,0 +1,133 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../Refactored'))
+
+from matplotlib import mlab
+import numpy as np
+
+from crnn_runtime import CRNNRuntime, StreamingSpectrogram, StreamingDetector
+
+try:
+    import torch
+    from export_crnn import CRNNExporter
+    from models import Model21, Model22
+except ImportError:
+    torch = None
+
+TEST_ALL = True
+#TEST_ALL = False
+
+class TestCRNNRuntime(unittest.TestCase):
+
+    #------------------------------------
+    # setUp
+    #-------------------
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='crnn_test')
+        self.weights_file = os.path.join(self.tmp_dir.name, 'model.crnn')
+
+    #------------------------------------
+    # tearDown
+    #-------------------
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    #------------------------------------
+    # testForwardMatchesTorch
+    #-------------------
+
+    @unittest.skipIf(torch is None, 'torch or the Refactored models are not available')
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testForwardMatchesTorch(self):
+        torch.manual_seed(0)
+        for model_class in (Model21, Model22):
+            model = model_class(77, 1).eval()
+            CRNNExporter(model, input_size=77).save(self.weights_file)
+            runtime = CRNNRuntime(self.weights_file)
+
+            window = np.random.default_rng(1).standard_normal((256, 77)).astype(np.float32)
+            with torch.no_grad():
+                expected = model(torch.from_numpy(window).unsqueeze(0)).numpy()[0]
+            logits = runtime.forward(window)
+            self.assertEqual(logits.shape, (256, 1))
+            self.assertTrue(np.allclose(logits, expected, atol=1e-4),
+                            f"{model_class.__name__} differs by {np.abs(logits - expected).max()}")
+
+            # Buffers are reused between calls:
+            self.assertIs(runtime.forward(window), logits)
+            del runtime
+
+    #------------------------------------
+    # testWrongInputSize
+    #-------------------
+
+    @unittest.skipIf(torch is None, 'torch or the Refactored models are not available')
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testWrongInputSize(self):
+        model = Model22(77, 1)
+        with self.assertRaises(ValueError):
+            CRNNExporter(model, input_size=100)
+
+    #------------------------------------
+    # testStreamingSpectrogram
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testStreamingSpectrogram(self):
+        samples = np.random.default_rng(2).standard_normal(8000 * 12).astype(np.float32)
+        expected, freqs, _times = mlab.specgram(samples, NFFT=4096, Fs=8000,
+                                                noverlap=4096 - 800, pad_to=4096,
+                                                window=mlab.window_hanning)
+        expected = 10 * np.log10(expected[freqs <= 150]).T
+
+        spectrogram = StreamingSpectrogram(capacity=len(expected))
+        self.assertTrue(np.array_equal(spectrogram.freq_labels, freqs[freqs <= 150]))
+        # Uneven block sizes:
+        num_frames = 0
+        for block_start in range(0, len(samples), 1234):
+            num_frames += spectrogram.push(samples[block_start:block_start + 1234])
+        self.assertEqual(num_frames, len(expected))
+
+        frames = spectrogram.latest(num_frames, np.empty_like(expected, dtype=np.float32))
+        self.assertTrue(np.allclose(frames, expected, atol=1e-2))
+
+    #------------------------------------
+    # testStreamingDetector
+    #-------------------
+
+    @unittest.skipIf(torch is None, 'torch or the Refactored models are not available')
+    @unittest.skipIf(not TEST_ALL, 'Temporarily skip this test.')
+    def testStreamingDetector(self):
+        torch.manual_seed(0)
+        model = Model22(77, 1).eval()
+        CRNNExporter(model, input_size=77).save(self.weights_file)
+        runtime = CRNNRuntime(self.weights_file, time_steps=32)
+        detector = StreamingDetector(runtime, jump=16)
+
+        # Enough audio for 32 + 16 frames:
+        num_samples = 4096 + 47 * 800
+        samples = np.random.default_rng(3).standard_normal(num_samples).astype(np.float32)
+        results = [(start, logits.copy()) for (start, logits) in detector.push(samples)]
+        self.assertEqual([start for (start, _logits) in results], [0, 16])
+
+        spectro, freqs, _times = mlab.specgram(samples, NFFT=4096, Fs=8000,
+                                               noverlap=4096 - 800, pad_to=4096,
+                                               window=mlab.window_hanning)
+        spectro = 10 * np.log10(spectro[freqs <= 150]).T
+        window = spectro[16:48]
+        window = (window - window.mean()) / window.std()
+        with torch.no_grad():
+            expected = model(torch.from_numpy(window.astype(np.float32)).unsqueeze(0)).numpy()[0]
+        self.assertTrue(np.allclose(results[1][1], expected, atol=1e-3))
+
+# -------------------- Main --------------
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
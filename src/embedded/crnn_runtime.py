@@ -0,0 +1,613 @@
+'''
+Numpy-only inference for the small CRNN models of the
+model zoo (conv + layer norm + GRU + linear, as in Model21
+and Model22), for recorders on which torch is too heavy.
+
+The weights come from a flat binary file written by
+export_crnn.py. The file is memory-mapped, so instances
+start without copying weights. All intermediate results
+live in buffers that are allocated once in the constructor;
+forward passes and spectrogram frames are computed into
+those buffers. Memory use is therefore fixed by the window
+length, and does not change while running (apart from
+numpy's small, fixed-size ufunc scratch buffers).
+
+Usage:
+    runtime  = CRNNRuntime('model_22.crnn')
+    detector = StreamingDetector(runtime)
+    for block in audio_blocks:
+        for window_start_frame, logits in detector.push(block):
+            ...
+
+File format (little endian):
+
+    8 bytes   magic: b'ELECRNN1'
+    uint32    length of the JSON header in bytes
+    JSON      header: {'input_size', 'output_size', 'layers'};
+              each layer is a dict with 'type' and the offsets/shapes
+              of its parameters within the float32 data
+    padding   to the next multiple of 16 bytes
+    float32   all parameters, in the layouts used by the runtime
+'''
+import json
+
+import numpy as np
+
+MAGIC = b'ELECRNN1'
+DATA_ALIGNMENT = 16
+
+class CRNNRuntime(object):
+    '''
+    Forward pass of a CRNN over one window of
+    [time_steps, input_size] spectrogram frames.
+    '''
+
+    LAYER_NORM_EPS = 1e-5
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self, weights_file, time_steps=256):
+        '''
+        @param weights_file: flat binary written by export_crnn.py
+        @type weights_file: str
+        @param time_steps: number of spectrogram frames in each window
+        @type time_steps: int
+        '''
+        (self.header, self.params) = self.load_weights(weights_file)
+        self.time_steps  = time_steps
+        self.input_size  = self.header['input_size']
+        self.output_size = self.header['output_size']
+
+        # Input window; callers fill this buffer,
+        # then call forward():
+        self.window = np.zeros((time_steps, self.input_size), dtype=np.float32)
+        self.layers = self._allocate_layers(self.header['layers'])
+
+    #------------------------------------
+    # load_weights
+    #-------------------
+
+    @classmethod
+    def load_weights(cls, weights_file):
+        '''
+        Read the header of a weights file, and memory-map
+        its parameters.
+
+        @param weights_file: flat binary written by export_crnn.py
+        @type weights_file: str
+        @return: the header dict, and a dict mapping
+            '<layer index>.<param name>' to float32 arrays
+        @rtype: ({str : any}, {str : np.array})
+        @raise ValueError: if the file is not a weights file
+        '''
+        with open(weights_file, 'rb') as fd:
+            magic = fd.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError(f"File {weights_file} is not a CRNN weights file.")
+            header_len = int(np.frombuffer(fd.read(4), dtype='<u4')[0])
+            header = json.loads(fd.read(header_len).decode('utf-8'))
+
+        data_offset = cls.data_offset(header_len)
+        data = np.memmap(weights_file, dtype='<f4', mode='r', offset=data_offset)
+
+        params = {}
+        for (layer_idx, layer) in enumerate(header['layers']):
+            for (param_name, (offset, shape)) in layer.get('params', {}).items():
+                size = int(np.prod(shape))
+                params[f"{layer_idx}.{param_name}"] = data[offset:offset + size].reshape(shape)
+        return (header, params)
+
+    #------------------------------------
+    # data_offset
+    #-------------------
+
+    @classmethod
+    def data_offset(cls, header_len):
+        '''
+        Byte offset of the parameter data in a weights
+        file whose JSON header has header_len bytes.
+        '''
+        header_end = len(MAGIC) + 4 + header_len
+        return -(-header_end // DATA_ALIGNMENT) * DATA_ALIGNMENT
+
+    #------------------------------------
+    # forward
+    #-------------------
+
+    def forward(self, window=None):
+        '''
+        Run the model on one window. If window is None,
+        the window is taken from self.window, which callers
+        may fill directly to avoid a copy.
+
+        The returned logits are a buffer that is overwritten
+        by the next call; copy it to keep it.
+
+        @param window: spectrogram window
+        @type window: {None | np.array([time_steps, input_size])}
+        @return: logits for each frame
+        @rtype: np.array([time_steps, output_size])
+        '''
+        if window is not None:
+            np.copyto(self.window, window)
+
+        # Conv stack: input has one channel:
+        features = self.window.reshape(1, self.time_steps, self.input_size)
+        for layer in self.layers:
+            features = layer(features)
+        return features
+
+    #------------------------------------
+    # _allocate_layers
+    #-------------------
+
+    def _allocate_layers(self, layer_specs):
+        '''
+        Create the callables for each layer, together
+        with their output buffers.
+        '''
+        layers = []
+        # Shape of the features between layers:
+        # [channels, time, freq] in the conv stack,
+        # [time, features] afterwards:
+        shape = (1, self.time_steps, self.input_size)
+        for (layer_idx, spec) in enumerate(layer_specs):
+            params = {name : self.params[f"{layer_idx}.{name}"]
+                      for name in spec.get('params', {})}
+            layer_type = spec['type']
+            if layer_type == 'conv2d':
+                layer = _Conv2d(shape, spec, params)
+            elif layer_type == 'layer_norm':
+                layer = _LayerNorm(shape, params, self.LAYER_NORM_EPS)
+            elif layer_type == 'relu':
+                layer = _relu
+            elif layer_type == 'max_pool_freq':
+                layer = _MaxPoolFreq(shape, spec['kernel'])
+            elif layer_type == 'flatten_channels':
+                layer = _FlattenChannels(shape)
+            elif layer_type == 'gru':
+                layer = _GRU(shape, spec, params)
+            elif layer_type == 'linear':
+                layer = _Linear(shape, params)
+            else:
+                raise ValueError(f"Unknown layer type in weights file: {layer_type}")
+            layers.append(layer)
+            shape = getattr(layer, 'out_shape', shape)
+        return layers
+
+# ---------------------------- Layers ------------
+
+#------------------------------------
+# _relu
+#-------------------
+
+def _relu(features):
+    return np.maximum(features, 0, out=features)
+
+class _Conv2d(object):
+    '''
+    3x3 convolution, stride (1, freq_stride), padding 1, no
+    bias, computed as a single matrix product over a
+    strided view of the zero-padded input.
+    '''
+    def __init__(self, in_shape, spec, params):
+        (in_channels, time_steps, in_freqs) = in_shape
+        (kernel_t, kernel_f) = spec['kernel']
+        (pad_t, pad_f) = spec['padding']
+        self.stride_f = spec['stride'][1]
+        # Stored as [out_channels, in_channels * kernel_t * kernel_f]:
+        self.weight = params['weight']
+        out_channels = self.weight.shape[0]
+        out_freqs = (in_freqs + 2 * pad_f - kernel_f) // self.stride_f + 1
+        self.out_shape = (out_channels, time_steps, out_freqs)
+
+        # Borders of the padded input stay zero:
+        self.padded = np.zeros((in_channels, time_steps + 2 * pad_t, in_freqs + 2 * pad_f),
+                               dtype=np.float32)
+        self.interior = self.padded[:, pad_t:pad_t + time_steps, pad_f:pad_f + in_freqs]
+
+        # View of all kernel positions: [in_c, k_t, k_f, time, out_freq]:
+        (s_c, s_t, s_f) = self.padded.strides
+        self.patches = np.lib.stride_tricks.as_strided(
+            self.padded,
+            shape=(in_channels, kernel_t, kernel_f, time_steps, out_freqs),
+            strides=(s_c, s_t, s_f, s_t, s_f * self.stride_f),
+            writeable=False)
+        self.columns = np.empty((in_channels, kernel_t, kernel_f, time_steps, out_freqs),
+                                dtype=np.float32)
+        self.columns_2d = self.columns.reshape(in_channels * kernel_t * kernel_f,
+                                               time_steps * out_freqs)
+        self.out = np.empty((out_channels, time_steps * out_freqs), dtype=np.float32)
+
+    def __call__(self, features):
+        np.copyto(self.interior, features)
+        np.copyto(self.columns, self.patches)
+        np.matmul(self.weight, self.columns_2d, out=self.out)
+        return self.out.reshape(self.out_shape)
+
+class _LayerNorm(object):
+    '''
+    Normalization over the last dimension,
+    with learned scale and shift; in place.
+    '''
+    def __init__(self, in_shape, params, eps):
+        self.weight = params['weight']
+        self.bias   = params['bias']
+        self.eps    = eps
+        self.inv_size = np.float32(1. / in_shape[-1])
+        stats_shape = in_shape[:-1] + (1,)
+        self.mean    = np.empty(stats_shape, dtype=np.float32)
+        self.var     = np.empty(stats_shape, dtype=np.float32)
+        self.squares = np.empty(in_shape, dtype=np.float32)
+
+    def __call__(self, features):
+        # np.mean() allocates temporaries; sum and scale instead:
+        np.add.reduce(features, axis=-1, keepdims=True, out=self.mean)
+        self.mean *= self.inv_size
+        features -= self.mean
+        np.multiply(features, features, out=self.squares)
+        np.add.reduce(self.squares, axis=-1, keepdims=True, out=self.var)
+        self.var *= self.inv_size
+        self.var += self.eps
+        np.sqrt(self.var, out=self.var)
+        features /= self.var
+        features *= self.weight
+        features += self.bias
+        return features
+
+class _MaxPoolFreq(object):
+    '''
+    Max pooling along frequencies with kernel
+    and stride [1, kernel]
+    '''
+    def __init__(self, in_shape, kernel):
+        (channels, time_steps, in_freqs) = in_shape
+        self.kernel = kernel
+        out_freqs = in_freqs // kernel
+        self.out_shape = (channels, time_steps, out_freqs)
+        self.out = np.empty(self.out_shape, dtype=np.float32)
+
+    def __call__(self, features):
+        (channels, time_steps, out_freqs) = self.out_shape
+        pooled = features[:, :, :out_freqs * self.kernel]
+        np.max(pooled.reshape(channels, time_steps, out_freqs, self.kernel),
+               axis=-1, out=self.out)
+        return self.out
+
+class _FlattenChannels(object):
+    '''
+    [channels, time, freq] to [time, channels * freq],
+    like the permute and view in the models' forward().
+    '''
+    def __init__(self, in_shape):
+        (channels, time_steps, freqs) = in_shape
+        self.out = np.empty((time_steps, channels, freqs), dtype=np.float32)
+        self.out_shape = (time_steps, channels * freqs)
+
+    def __call__(self, features):
+        np.copyto(self.out, features.transpose(1, 0, 2))
+        return self.out.reshape(self.out_shape)
+
+class _Linear(object):
+    '''
+    features @ weight + bias; weight stored as [in, out]
+    '''
+    def __init__(self, in_shape, params):
+        self.weight = params['weight']
+        self.bias   = params['bias']
+        self.out_shape = (in_shape[0], self.weight.shape[1])
+        self.out = np.empty(self.out_shape, dtype=np.float32)
+
+    def __call__(self, features):
+        np.matmul(features, self.weight, out=self.out)
+        self.out += self.bias
+        return self.out
+
+class _GRU(object):
+    '''
+    Single layer GRU, optionally bidirectional, with
+    PyTorch's gate equations:
+
+        r  = sigmoid(W_ir x + b_ir + W_hr h + b_hr)
+        z  = sigmoid(W_iz x + b_iz + W_hz h + b_hz)
+        n  = tanh(W_in x + b_in + r * (W_hn h + b_hn))
+        h' = (1 - z) * n + z * h
+
+    The input projections of all time steps are computed
+    with one matrix product per direction.
+    '''
+    def __init__(self, in_shape, spec, params):
+        time_steps = in_shape[0]
+        self.hidden_size = spec['hidden_size']
+        self.directions = ['forward', 'reverse'] if spec['bidirectional'] else ['forward']
+        hidden = self.hidden_size
+
+        # Per direction: weight_ih stored as [in, 3*hidden],
+        # weight_hh as [3*hidden, hidden]:
+        self.weights = {direction : (params[f"{direction}.weight_ih"],
+                                     params[f"{direction}.bias_ih"],
+                                     params[f"{direction}.weight_hh"],
+                                     params[f"{direction}.bias_hh"])
+                        for direction in self.directions}
+
+        self.input_gates  = np.empty((time_steps, 3 * hidden), dtype=np.float32)
+        self.hidden_gates = np.empty(3 * hidden, dtype=np.float32)
+        self.h            = np.empty(hidden, dtype=np.float32)
+        self.scratch      = np.empty(hidden, dtype=np.float32)
+        self.out_shape    = (time_steps, hidden * len(self.directions))
+        self.out          = np.empty(self.out_shape, dtype=np.float32)
+
+    def __call__(self, features):
+        hidden = self.hidden_size
+        time_steps = features.shape[0]
+        for (direction_idx, direction) in enumerate(self.directions):
+            (weight_ih, bias_ih, weight_hh, bias_hh) = self.weights[direction]
+            np.matmul(features, weight_ih, out=self.input_gates)
+            self.input_gates += bias_ih
+
+            out = self.out[:, direction_idx * hidden:(direction_idx + 1) * hidden]
+            steps = range(time_steps) if direction == 'forward' else range(time_steps - 1, -1, -1)
+            self.h.fill(0)
+
+            gh = self.hidden_gates
+            gh_rz = gh[:2 * hidden]
+            (gh_r, gh_z, gh_n) = (gh[:hidden], gh[hidden:2 * hidden], gh[2 * hidden:])
+            for t in steps:
+                (gi_r, gi_z, gi_n) = (self.input_gates[t, :hidden],
+                                      self.input_gates[t, hidden:2 * hidden],
+                                      self.input_gates[t, 2 * hidden:])
+                np.matmul(weight_hh, self.h, out=gh)
+                gh += bias_hh
+                # r and z, in place in gh:
+                gh_r += gi_r
+                gh_z += gi_z
+                _sigmoid(gh_rz)
+                # n, in gh_n:
+                gh_n *= gh_r
+                gh_n += gi_n
+                np.tanh(gh_n, out=gh_n)
+                # h' = n + z * (h - n):
+                np.subtract(self.h, gh_n, out=self.scratch)
+                self.scratch *= gh_z
+                np.add(gh_n, self.scratch, out=self.h)
+                out[t] = self.h
+        return self.out
+
+#------------------------------------
+# _sigmoid
+#-------------------
+
+def _sigmoid(values):
+    '''
+    In place logistic function
+    '''
+    np.negative(values, out=values)
+    np.exp(values, out=values)
+    values += 1
+    np.reciprocal(values, out=values)
+    return values
+
+# ---------------------------- Class StreamingSpectrogram ------------
+
+class StreamingSpectrogram(object):
+    '''
+    Computes spectrogram frames from audio that arrives
+    in blocks of any size. The values are those of
+    matplotlib's mlab.specgram with window_hanning, as
+    used to create the training spectrograms, optionally
+    in dB (10 * log10). Only the frequencies up to
+    freq_cap are computed, via a precomputed DFT matrix
+    rather than a full FFT.
+
+    The most recent capacity frames are kept in a ring
+    buffer; latest() copies them out in time order.
+    '''
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self,
+                 framerate=8000,
+                 nfft=4096,
+                 hop=800,
+                 freq_cap=150,
+                 pad_to=4096,
+                 scale=True,
+                 capacity=256):
+        '''
+        @param framerate: samples per second
+        @type framerate: int
+        @param nfft: samples per FFT window
+        @type nfft: int
+        @param hop: samples between windows
+        @type hop: int
+        @param freq_cap: highest frequency computed
+        @type freq_cap: float
+        @param pad_to: FFT length after zero-padding windows
+        @type pad_to: int
+        @param scale: whether to return dB values
+        @type scale: bool
+        @param capacity: number of frames kept
+        @type capacity: int
+        '''
+        self.nfft  = nfft
+        self.hop   = hop
+        self.scale = scale
+        self.capacity = capacity
+
+        freqs = np.fft.rfftfreq(pad_to, 1. / framerate)
+        self.freq_labels = freqs[freqs <= freq_cap]
+        num_bins = len(self.freq_labels)
+
+        # One-sided PSD scaling; doubled for all
+        # but the DC and Nyquist bins:
+        window = np.hanning(nfft)
+        bin_scales = np.full(num_bins, 1. / (framerate * (window**2).sum()))
+        bin_scales[1:] *= 2
+        if pad_to % 2 == 0 and pad_to // 2 < num_bins:
+            bin_scales[pad_to // 2] /= 2
+        # Fold window and scaling into the DFT matrix:
+        angles = -2 * np.pi * np.outer(np.arange(num_bins), np.arange(nfft)) / pad_to
+        bin_roots = np.sqrt(bin_scales)[:, np.newaxis]
+        self.dft_real = (np.cos(angles) * window * bin_roots).astype(np.float32)
+        self.dft_imag = (np.sin(angles) * window * bin_roots).astype(np.float32)
+
+        # Ring of the last nfft samples. Every sample is
+        # written twice, nfft apart, so that the current window
+        # is always the contiguous slice starting at write_pos:
+        self.ring = np.zeros(2 * nfft, dtype=np.float32)
+        self.write_pos = 0
+        # Samples needed before the next frame is complete:
+        self.samples_needed = nfft
+
+        self.real   = np.empty(num_bins, dtype=np.float32)
+        self.imag   = np.empty(num_bins, dtype=np.float32)
+        self.frames = np.zeros((capacity, num_bins), dtype=np.float32)
+        self.num_frames = 0
+
+    #------------------------------------
+    # push
+    #-------------------
+
+    def push(self, samples):
+        '''
+        Add audio samples. Returns the number of frames
+        completed by these samples.
+
+        @param samples: audio
+        @type samples: np.array
+        @return: number of new frames
+        @rtype: int
+        '''
+        new_frames = 0
+        pos = 0
+        num_in = len(samples)
+        while pos < num_in:
+            # Up to the next frame, or the end of the ring:
+            take = min(self.samples_needed, 
+                       num_in - pos, 
+                       self.nfft - self.write_pos)
+            chunk = samples[pos:pos + take]
+            self.ring[self.write_pos:self.write_pos + take] = chunk
+            self.ring[self.nfft + self.write_pos:self.nfft + self.write_pos + take] = chunk
+            self.write_pos = (self.write_pos + take) % self.nfft
+            self.samples_needed -= take
+            pos += take
+            if self.samples_needed == 0:
+                self._compute_frame()
+                new_frames += 1
+                self.samples_needed = self.hop
+        return new_frames
+
+    #------------------------------------
+    # latest
+    #-------------------
+
+    def latest(self, num_frames, out):
+        '''
+        Copy the num_frames most recent frames into out,
+        oldest first.
+
+        @param num_frames: number of frames; at most capacity
+        @type num_frames: int
+        @param out: destination, with at least num_frames rows
+        @type out: np.array([>= num_frames, num_bins])
+        @return: out
+        @rtype: np.array
+        '''
+        end = self.num_frames % self.capacity
+        start = end - num_frames
+        if start >= 0:
+            out[:num_frames] = self.frames[start:end]
+        else:
+            out[:-start] = self.frames[start:]
+            out[-start:num_frames] = self.frames[:end]
+        return out
+
+    #------------------------------------
+    # _compute_frame
+    #-------------------
+
+    def _compute_frame(self):
+        frame = self.frames[self.num_frames % self.capacity]
+        window = self.ring[self.write_pos:self.write_pos + self.nfft]
+        np.matmul(self.dft_real, window, out=self.real)
+        np.matmul(self.dft_imag, window, out=self.imag)
+        np.multiply(self.real, self.real, out=frame)
+        np.multiply(self.imag, self.imag, out=self.imag)
+        frame += self.imag
+        if self.scale:
+            np.log10(frame, out=frame)
+            frame *= 10
+        self.num_frames += 1
+
+# ---------------------------- Class StreamingDetector ------------
+
+class StreamingDetector(object):
+    '''
+    Runs a CRNNRuntime on the spectrogram of streaming
+    audio: once a full window of frames is available,
+    and then after every jump frames, the latest window
+    is normalized to zero mean and unit variance (as in
+    eval's sliding window prediction), and passed
+    through the model.
+    '''
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self, runtime, jump=128, **spectrogram_kwargs):
+        '''
+        @param runtime: the model
+        @type runtime: CRNNRuntime
+        @param jump: frames between windows
+        @type jump: int
+        @param spectrogram_kwargs: arguments for StreamingSpectrogram
+        '''
+        self.runtime = runtime
+        self.jump = jump
+        self.spectrogram = StreamingSpectrogram(capacity=runtime.time_steps,
+                                                **spectrogram_kwargs)
+        if len(self.spectrogram.freq_labels) != runtime.input_size:
+            raise ValueError(f"Spectrogram has {len(self.spectrogram.freq_labels)} frequencies, "
+                             f"but the model expects {runtime.input_size}.")
+        self.frames_since_window = 0
+
+    #------------------------------------
+    # push
+    #-------------------
+
+    def push(self, samples):
+        '''
+        Add audio; yield (first frame index, logits) for
+        every window that was completed. Logits are
+        overwritten by the next window.
+
+        @param samples: audio
+        @type samples: np.array
+        '''
+        window_len = self.runtime.time_steps
+        # Feed at most one hop at a time, so that
+        # no window is skipped within a long block:
+        hop = self.spectrogram.hop
+        for block_start in range(0, len(samples), hop):
+            new_frames = self.spectrogram.push(samples[block_start:block_start + hop])
+            if new_frames == 0:
+                continue
+            self.frames_since_window += new_frames
+            num_frames = self.spectrogram.num_frames
+            if num_frames < window_len:
+                continue
+            if num_frames > window_len and self.frames_since_window < self.jump:
+                continue
+            self.frames_since_window = 0
+
+            window = self.spectrogram.latest(window_len, self.runtime.window)
+            values = window.reshape(-1)
+            values -= values.mean()
+            values /= np.sqrt(np.dot(values, values) / values.size)
+            yield (num_frames - window_len, self.runtime.forward())
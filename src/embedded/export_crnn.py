@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+'''
+Writes the weights of a trained CRNN (conv + layer norm +
+GRU + linear, as Model21 and Model22) to the flat binary
+file read by crnn_runtime.CRNNRuntime. This is the only
+part of the embedded package that needs torch; it runs
+on the training machines, not on the recorders.
+
+Weights are written in the layouts in which the runtime
+uses them, so that the runtime can memory-map them
+without any conversion:
+
+    o conv weights:  [out_channels, in_channels * k_t * k_f]
+    o linear:        [in, out]
+    o GRU weight_ih: [in, 3 * hidden]; weight_hh: [3 * hidden, hidden]
+'''
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+
+from crnn_runtime import MAGIC, CRNNRuntime
+
+
+class CRNNExporter(object):
+    '''
+    Collect the layers of a CRNN model, and write
+    them to a runtime weights file.
+    '''
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self, model, input_size=77):
+        '''
+        @param model: a model with attributes conv_layers,
+            gru, linear_1, and out, as Model21 and Model22
+        @type model: nn.Module
+        @param input_size: number of frequencies the model
+            was trained on; the models do not record it
+        @type input_size: int
+        @raise ValueError: if the model has a different structure
+        '''
+        if not all(hasattr(model, attr) for attr in ('conv_layers', 'gru', 'linear_1', 'out')):
+            raise ValueError(f"Model {type(model).__name__} is not a conv + GRU + linear CRNN.")
+        self.model = model.cpu().eval()
+        self.layers = []
+        self.param_arrays = []
+        self.num_floats = 0
+        self.input_size = input_size
+        self._collect_layers()
+
+    #------------------------------------
+    # save
+    #-------------------
+
+    def save(self, dest):
+        '''
+        Write the weights file.
+
+        @param dest: destination path
+        @type dest: str
+        '''
+        header = {'input_size'  : self.input_size,
+                  'output_size' : self.model.out.out_features,
+                  'layers'      : self.layers
+                  }
+        header_bytes = json.dumps(header).encode('utf-8')
+        data_offset = CRNNRuntime.data_offset(len(header_bytes))
+        with open(dest, 'wb') as fd:
+            fd.write(MAGIC)
+            fd.write(np.array([len(header_bytes)], dtype='<u4').tobytes())
+            fd.write(header_bytes)
+            fd.write(b'\0' * (data_offset - fd.tell()))
+            for param_array in self.param_arrays:
+                fd.write(param_array.astype('<f4').tobytes())
+
+    #------------------------------------
+    # _collect_layers
+    #-------------------
+
+    def _collect_layers(self):
+        # Track the number of frequencies, to check
+        # that the layer norms fit the input size:
+        freqs = self.input_size
+        for module in self.model.conv_layers:
+            if isinstance(module, nn.Conv2d):
+                if module.kernel_size[0] != 3 or module.stride[0] != 1 or module.bias is not None:
+                    raise ValueError("Only 3x3 convolutions with time stride 1 and no bias are supported.")
+                weight = module.weight.detach().numpy()
+                self._add_layer({'type'     : 'conv2d',
+                                 'kernel'   : list(module.kernel_size),
+                                 'stride'   : list(module.stride),
+                                 'padding'  : list(module.padding)
+                                 },
+                                weight=weight.reshape(weight.shape[0], -1))
+                freqs = (freqs + 2 * module.padding[1] - module.kernel_size[1]) // module.stride[1] + 1
+            elif isinstance(module, nn.LayerNorm):
+                if tuple(module.normalized_shape) != (freqs,):
+                    raise ValueError(f"Layer norm over {module.normalized_shape} does not fit "
+                                     f"{freqs} frequencies; wrong input_size?")
+                self._add_layer({'type' : 'layer_norm'},
+                                weight=module.weight.detach().numpy(),
+                                bias=module.bias.detach().numpy())
+            elif isinstance(module, nn.ReLU):
+                self._add_layer({'type' : 'relu'})
+            elif isinstance(module, nn.MaxPool2d):
+                kernel = module.kernel_size
+                if isinstance(kernel, int) or kernel[0] != 1:
+                    raise ValueError("Only max pooling along frequencies is supported.")
+                self._add_layer({'type' : 'max_pool_freq', 'kernel' : kernel[1]})
+                freqs = freqs // kernel[1]
+            elif isinstance(module, nn.Dropout):
+                # No-op at inference
+                continue
+            else:
+                raise ValueError(f"Unsupported conv stack layer: {type(module).__name__}")
+
+        self._add_layer({'type' : 'flatten_channels'})
+        self._add_gru(self.model.gru)
+        self._add_linear(self.model.linear_1)
+        self._add_layer({'type' : 'relu'})
+        self._add_linear(self.model.out)
+
+    #------------------------------------
+    # _add_gru
+    #-------------------
+
+    def _add_gru(self, gru):
+        if gru.num_layers != 1 or not gru.batch_first:
+            raise ValueError("Only single layer, batch first GRUs are supported.")
+        spec = {'type'          : 'gru',
+                'hidden_size'   : gru.hidden_size,
+                'bidirectional' : gru.bidirectional
+                }
+        params = {}
+        directions = [('forward', ''), ('reverse', '_reverse')] if gru.bidirectional else [('forward', '')]
+        for (direction, suffix) in directions:
+            params[f"{direction}.weight_ih"] = getattr(gru, 'weight_ih_l0' + suffix).detach().numpy().T
+            params[f"{direction}.bias_ih"]   = getattr(gru, 'bias_ih_l0' + suffix).detach().numpy()
+            params[f"{direction}.weight_hh"] = getattr(gru, 'weight_hh_l0' + suffix).detach().numpy()
+            params[f"{direction}.bias_hh"]   = getattr(gru, 'bias_hh_l0' + suffix).detach().numpy()
+        self._add_layer(spec, **params)
+
+    #------------------------------------
+    # _add_linear
+    #-------------------
+
+    def _add_linear(self, linear):
+        self._add_layer({'type' : 'linear'},
+                        weight=linear.weight.detach().numpy().T,
+                        bias=linear.bias.detach().numpy())
+
+    #------------------------------------
+    # _add_layer
+    #-------------------
+
+    def _add_layer(self, spec, **params):
+        '''
+        Append a layer spec; params are recorded
+        as [offset, shape] within the float data.
+        '''
+        if params:
+            spec['params'] = {}
+        for (name, values) in params.items():
+            values = np.ascontiguousarray(values, dtype=np.float32)
+            spec['params'][name] = [self.num_floats, list(values.shape)]
+            self.param_arrays.append(values)
+            self.num_floats += values.size
+        self.layers.append(spec)
+
+# --------------------------- Main ----------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     description="Export a trained CRNN for the numpy runtime."
+                                     )
+
+    parser.add_argument('model',
+                        help='Model saved with torch.save(model)')
+    parser.add_argument('dest',
+                        help='Weights file to create')
+    parser.add_argument('-i', '--input_size',
+                        type=int,
+                        default=77,
+                        help='number of spectrogram frequencies the model was trained on; default 77'
+                        );
+
+    args = parser.parse_args();
+
+    model = torch.load(args.model, map_location='cpu')
+    CRNNExporter(model, input_size=args.input_size).save(args.dest)
@@ -0,0 +1,259 @@
+"""
+    Cheap pre-filter for the sliding window predictors of eval.py and
+    hierarchical_eval.py. Most windows of a 24hr recording hold only
+    background noise. The pre-filter finds windows whose infrasonic
+    band energy never rises above the recording's noise floor, and
+    those windows are not run through the model.
+
+    As in AmplitudeGater.amplitude_gate, the threshold is relative to
+    the recording itself: the noise floor is the median band energy of
+    the recording's frames, and a window is kept if somewhere in it the
+    band energy, averaged over call length stretches of frames, lies at
+    least threshold_db above that floor. Band energies are the mean
+    power over the band's frequency bins, as SpectrogramDataset.mean_magnitudes
+    computes for its frequency bands.
+
+    Frames covered only by skipped windows are predicted as negative.
+
+    To choose threshold_db, run the pre-filter over labelled days, which
+    reports for each threshold the fraction of windows skipped and the
+    fraction of calls (and call frames) that would be lost:
+
+        python energy_prefilter.py --test_files <files.txt> --spect_path <spectrogram folder>
+"""
+import argparse
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.ndimage import uniform_filter1d
+
+# Logit given to frames that only skipped windows cover;
+# sigmoid(-10) is about 5e-5
+SKIPPED_LOGIT = -10.
+
+# Frequency resolution of the spectrograms made by generate_spectrograms.py
+# (8000 samples/sec, padded to 4096 points)
+FREQ_BIN_HZ = 8000. / 4096
+
+class EnergyPrefilter(object):
+    """
+        Decides which windows of a spectrogram to run the model on.
+        Also counts the windows it skipped and, for labelled
+        spectrograms, the call frames that skipping cost.
+    """
+
+    def __init__(self, threshold_db=3., low_freq=10., high_freq=40., smooth_frames=15,
+                    log_scaled=True, freq_bin_hz=FREQ_BIN_HZ):
+        """
+            @param threshold_db: dB above the noise floor that the band
+            energy of a window must reach for the window to be kept
+            @param low_freq, high_freq: infrasonic band in Hz
+            @param smooth_frames: frames over which the band energy is
+            averaged, e.g. the minimum call length
+            @param log_scaled: whether the spectrograms are in dB
+            (10 * log10 of the power), as given by ElephantDatasetFull
+            @param freq_bin_hz: width of a frequency bin
+        """
+        self.threshold_db = threshold_db
+        self.low_bin = int(np.floor(low_freq / freq_bin_hz))
+        self.high_bin = int(np.ceil(high_freq / freq_bin_hz)) + 1
+        self.smooth_frames = smooth_frames
+        self.log_scaled = log_scaled
+
+        self.num_windows = 0
+        self.num_skipped = 0
+        self.num_call_frames = 0
+        self.num_call_frames_lost = 0
+        # Frames of the last filtered spectrogram that
+        # no kept window covers
+        self.skipped_frames = None
+
+    def frame_energies(self, spectrogram):
+        """
+            Band energy in dB above the noise floor of each frame of a
+            [time, freq] spectrogram, averaged over smooth_frames frames
+        """
+        band = spectrogram[:, self.low_bin:self.high_bin].astype(np.float64)
+        if self.log_scaled:
+            band = 10 ** (band / 10.)
+        energies = band.mean(axis=1)
+        noise_floor = max(np.median(energies), np.finfo(np.float64).tiny)
+        if self.smooth_frames > 1:
+            energies = uniform_filter1d(energies, self.smooth_frames, mode='nearest')
+        return 10 * np.log10(np.maximum(energies, np.finfo(np.float64).tiny) / noise_floor)
+
+    def window_energies(self, spectrogram, starts, length):
+        """
+            Highest smoothed band energy (dB above the noise floor) within
+            each window of the given length that begins at starts. Windows
+            that run past the end of the spectrogram are cut short there.
+        """
+        energies = self.frame_energies(spectrogram)
+        starts = np.asarray(starts)
+        window_energies = np.empty(len(starts))
+        whole = starts + length <= len(energies)
+        if np.any(whole):
+            # View of all frame windows of the given length, without copying
+            # (np.lib.stride_tricks.sliding_window_view needs numpy 1.20)
+            window = min(length, len(energies))
+            windows = as_strided(energies, shape=(len(energies) - window + 1, window),
+                                    strides=(energies.strides[0], energies.strides[0]), writeable=False)
+            window_energies[whole] = windows[starts[whole]].max(axis=1)
+        for i in np.flatnonzero(~whole):
+            window_energies[i] = energies[starts[i]:].max()
+        return window_energies
+
+    def keep_windows(self, spectrogram, starts, length):
+        """
+            Boolean array that tells for each window beginning at starts
+            whether to run the model on it
+        """
+        keep = self.window_energies(spectrogram, starts, length) >= self.threshold_db
+        self.num_windows += len(keep)
+        self.num_skipped += int(np.sum(~keep))
+        self.skipped_frames = ~covered_frames(np.asarray(starts)[keep], length, spectrogram.shape[0])
+        return keep
+
+    def fill_skipped(self, overlap_counts, *predictions):
+        """
+            Predict the frames covered by no kept window as negative in
+            each of the predictions, before they are averaged over
+            overlap_counts
+        """
+        uncovered = overlap_counts == 0
+        for model_predictions in predictions:
+            model_predictions[uncovered] = SKIPPED_LOGIT
+        overlap_counts[uncovered] = 1
+
+    def record_recall(self, labels):
+        """
+            Count the call frames of the last filtered spectrogram,
+            and those that skipping windows predicted as negative
+        """
+        calls = np.asarray(labels) > 0.5
+        self.num_call_frames += int(np.sum(calls))
+        self.num_call_frames_lost += int(np.sum(calls & self.skipped_frames))
+
+    def params(self):
+        """
+            The settings that decide which windows are skipped
+        """
+        return {'threshold_db': self.threshold_db, 'low_bin': self.low_bin, 'high_bin': self.high_bin,
+                'smooth_frames': self.smooth_frames, 'log_scaled': self.log_scaled}
+
+    def summary(self):
+        summary = "Pre-filter at {} dB skipped {} of {} windows ({:.1%})".format(self.threshold_db,
+                        self.num_skipped, self.num_windows, self.num_skipped / max(self.num_windows, 1))
+        if self.num_call_frames > 0:
+            summary += "; lost {} of {} call frames ({:.2%})".format(self.num_call_frames_lost,
+                        self.num_call_frames, self.num_call_frames_lost / self.num_call_frames)
+        return summary
+
+
+def window_starts(num_frames, chunk_size=256, jump=128):
+    """
+        Starts of the windows visited by the sliding window predictors:
+        every jump frames, plus a final window cut short at the end of
+        the spectrogram if the last full window does not end there
+    """
+    starts = np.arange(0, num_frames - chunk_size + 1, jump)
+    final_start = starts[-1] + jump if len(starts) > 0 else 0
+    if final_start - jump + chunk_size != num_frames:
+        starts = np.append(starts, final_start)
+    return starts
+
+
+def covered_frames(starts, length, num_frames):
+    """
+        Boolean array telling which frames the windows
+        of the given length beginning at starts cover
+    """
+    changes = np.zeros(num_frames + 1, dtype=np.int64)
+    np.add.at(changes, starts, 1)
+    np.add.at(changes, np.minimum(np.asarray(starts) + length, num_frames), -1)
+    return np.cumsum(changes[:-1]) > 0
+
+
+def call_segments(labels):
+    """
+        (begin, end) frames of the contiguous calls of a label mask
+    """
+    calls = np.concatenate(([0], (np.asarray(labels) > 0.5).astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(calls))
+    return edges.reshape(-1, 2)
+
+
+def calibrate(dataset, thresholds, chunk_size=256, jump=128, **prefilter_args):
+    """
+        For each threshold, the fraction of windows the pre-filter
+        skips over the labelled spectrograms of the dataset, and the
+        fractions of calls and of call frames lost by doing so. A call
+        counts as lost if no kept window covers any of its frames.
+
+        Returns a list of dicts, one per threshold
+    """
+    totals = {threshold : {'threshold_db': threshold, 'windows': 0, 'skipped': 0,
+                            'calls': 0, 'calls_lost': 0, 'call_frames': 0, 'call_frames_lost': 0}
+                for threshold in thresholds}
+    for data in dataset:
+        spectrogram, labels = data[0], data[1]
+        starts = window_starts(spectrogram.shape[0], chunk_size, jump)
+        prefilter = EnergyPrefilter(**prefilter_args)
+        # Energies do not depend on the threshold
+        window_energies = prefilter.window_energies(spectrogram, starts, chunk_size)
+        calls = call_segments(labels)
+        call_frames = np.asarray(labels) > 0.5
+
+        for threshold in thresholds:
+            keep = window_energies >= threshold
+            skipped_frames = ~covered_frames(starts[keep], chunk_size, spectrogram.shape[0])
+            total = totals[threshold]
+            total['windows'] += len(keep)
+            total['skipped'] += int(np.sum(~keep))
+            total['calls'] += len(calls)
+            total['calls_lost'] += sum(1 for begin, end in calls if np.all(skipped_frames[begin:end]))
+            total['call_frames'] += int(np.sum(call_frames))
+            total['call_frames_lost'] += int(np.sum(call_frames & skipped_frames))
+
+    results = []
+    for threshold in thresholds:
+        total = totals[threshold]
+        results.append({'threshold_db': threshold,
+                        'skipped': total['skipped'] / max(total['windows'], 1),
+                        'calls_lost': total['calls_lost'] / max(total['calls'], 1),
+                        'call_frames_lost': total['call_frames_lost'] / max(total['call_frames'], 1)})
+    return results
+
+
+# ---------------- Main -------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tune the energy pre-filter threshold on labelled days")
+    parser.add_argument('--test_files', type=str, required=True,
+        help='File with the ids of the labelled spectrograms, as used by eval.py')
+    parser.add_argument('--spect_path', type=str, required=True,
+        help='Path to the processed spectrogram files')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0., 1., 2., 3., 4., 6., 8.],
+        help='Thresholds in dB above the noise floor to try')
+    parser.add_argument('--low_freq', type=float, default=10., help='Low end of the band in Hz')
+    parser.add_argument('--high_freq', type=float, default=40., help='High end of the band in Hz')
+    parser.add_argument('--max_calls_lost', type=float, default=0.01,
+        help='Suggest the highest threshold that loses at most this fraction of calls')
+    args = parser.parse_args()
+
+    import parameters
+    from data import ElephantDatasetFull
+    from eval import get_spectrogram_paths
+
+    paths = get_spectrogram_paths(args.test_files, args.spect_path, exclude_marginals=parameters.EXCLUDE_MARGINALS)
+    dataset = ElephantDatasetFull(paths['specs'], paths['labels'], paths['gts'])
+    results = calibrate(dataset, args.thresholds, chunk_size=parameters.CHUNK_SIZE,
+                        jump=parameters.PREDICTION_SLIDE_LENGTH, low_freq=args.low_freq,
+                        high_freq=args.high_freq, smooth_frames=parameters.MIN_CALL_LENGTH)
+
+    print ("Threshold (dB)\tWindows skipped\tCalls lost\tCall frames lost")
+    for result in results:
+        print ("{:.1f}\t\t{:.1%}\t\t{:.2%}\t\t{:.2%}".format(result['threshold_db'], result['skipped'],
+                                                            result['calls_lost'], result['call_frames_lost']))
+    suggested = [result['threshold_db'] for result in results if result['calls_lost'] <= args.max_calls_lost]
+    if len(suggested) > 0:
+        print ("Suggested --prefilter_db:", max(suggested))
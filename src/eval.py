@@ -24,6 +24,12 @@ import matplotlib.patches as patches
 from mpl_toolkits.axes_grid1 import make_axes_locatable, axes_size
 import parameters
 from model import num_correct
+from elephant_utils.model_files import load_model_file, model_variant_path, model_variant_of, is_torchscript_file
+from utils import WindowNormalizer, DeviceWindowNormalizer, ModelEnsemble
+from prediction_store import PredictionStore, PredictionStoreWriter, STORE_FILE
+from prediction_store import open_prediction_store, load_predictions, remove_prediction_store
+from energy_prefilter import EnergyPrefilter, window_starts
+from prediction_cache import PredictionCache
 from model import Model0, Model1, Model2, Model3, Model4, Model5, Model6, Model7, Model8, Model9, Model10, Model11, Model14, Model16, Model17
 from process_rawdata_new import generate_labels
 from visualization import visualize, visualize_predictions
@@ -36,6 +42,8 @@ from scipy.ndimage import gaussian_filter1d
 import csv
 import os
 import argparse
+from elephant_utils.logging_service import Instrumentation, timed
+from elephant_utils.raven_labels import RavenLabelTable
 
 
 # these can be made configurable through argparse if necessary.
@@ -75,6 +83,22 @@ parser.add_argument('--visualize', action='store_true',
 
 parser.add_argument('--model', type=str,
     help = 'Path to the model to test on') # Now is path
+parser.add_argument('--model_variant', type=str, choices=['int8', 'frozen'], default=None,
+    help='Use the cpu inference variant of the model exported by Refactored/export_models.py')
+parser.add_argument('--store_dtype', type=str, choices=['float16', 'uint8'], default=None,
+    help='Save the full predictions of all spectrograms into one prediction store of this type, rather than one .npy per spectrogram')
+parser.add_argument('--ensemble', type=str, nargs='+', default=None,
+    help='Paths to several models (e.g. one per seed) to use instead of --model. With --make_full_preds ' \
+    + 'the predictions of each model and their average are made in one pass; other modes use the average')
+parser.add_argument('--ensemble_id', type=str, default=None,
+    help='Model id of the averaged ensemble predictions; default: Ensemble<N>_<common prefix of the model ids>')
+parser.add_argument('--prefilter_db', type=float, default=None,
+    help='Skip windows whose infrasonic band energy stays less than this many dB above the noise floor ' \
+    + '(see energy_prefilter.py for choosing the threshold)')
+parser.add_argument('--recompute', action='store_true',
+    help='Predict all spectrograms, even those whose cached predictions match the model, spectrogram and parameters')
+parser.add_argument('--trace_file', type=str, default=None,
+    help='Save timings of the prediction and evaluation steps as a chrome://tracing json file')
 #parser.add_argument('--model_id', type=str, default='17')
 
 
@@ -85,6 +109,9 @@ Example runs
 # To customize change the model flag!
 python eval.py --model /home/data/elephants/models/selected_runs/Adversarial_training_17_nouab_and_bai_0.25_sampling_one_model/Call_model_17_norm_Negx1_Seed_8_2020-04-28_01:58:26/model_adversarial_iteration_9_.pt --make_full_pred
 
+# Make the predictions of several seeds and their average in one pass
+python eval.py --ensemble <seed 8 model.pt> <seed 9 model.pt> <seed 10 model.pt> --make_full_pred
+
 # Calculate Stats 
 python eval.py --test_files /home/data/elephants/processed_data/Test_nouab/Neg_Samples_x1/files.txt --spect_path /home/data/elephants/rawdata/Spectrograms/nouabale\ ele\ general\ test\ sounds/ --model /home/data/elephants/models/selected_runs/Adversarial_training_17_nouab_and_bai_0.25_sampling_one_model/Call_model_17_norm_Negx1_Seed_8_2020-04-28_01:58:26/model_adversarial_iteration_9_.pt --full_stats
 '''
@@ -98,13 +125,30 @@ predictions_path = '../Predictions'
 call_predictions_path = '../Call_Predictions'
 spectrogram_path = '../elephant_dataset/New_Data/Spectrograms'
 
-def loadModel(model_path):
+def loadModel(model_path, variant=None):
+    """
+        Load a saved model, or with variant 'int8' / 'frozen' the
+        cpu inference variant exported next to it by
+        Refactored/export_models.py. Variant files may also be
+        given directly as model_path.
+    """
+    if variant is not None:
+        model_path = model_variant_path(model_path, variant)
+    else:
+        variant = model_variant_of(model_path)
+
     #model = torch.load(parameters.MODEL_SAVE_PATH + parameters.DATASET + '_model_' + model_path + ".pt", map_location=parameters.device)
-    model = torch.load(model_path, map_location=parameters.device)
+    model = load_model_file(model_path, parameters.device)
+    if is_torchscript_file(model_path):
+        # Inference variants only run on the cpu
+        parameters.device = torch.device('cpu')
     print (model)
     # Get the model name from the path
     tokens = model_path.split('/')
     model_id = tokens[-2]
+    # Keep the predictions of variants apart from those of the float model
+    if variant is not None:
+        model_id += "_" + variant
     # Let us also save_predictions based on some of the slide length 
     # when sliding the window for model predictions
     # For now to allow for backward compatability do this which is bit hacky
@@ -310,28 +354,20 @@ def process_ground_truth(label_path, in_seconds=False, samplerate=8000, NFFT=409
 
         Otherwise convert to the corresponding spectrogram "slice"
     """
-    labelFile = csv.DictReader(open(label_path,'rt'), delimiter='\t')
-    calls = []
+    labels = RavenLabelTable.load(label_path)
 
-    for row in labelFile:
+    if in_seconds:
         # Use the file offset to determine the start of the call
-        start_time = float(row['File Offset (s)'])
-        call_length = float(row['End Time (s)']) - float(row['Begin Time (s)'])
-        end_time = start_time + call_length
-        
-        if in_seconds:
-            calls.append((start_time, end_time, call_length))
-        else: 
-            # Figure out which spectrogram slices we are on
-            # to get columns that we want to span with the given
-            # slice. This math transforms .wav indeces to spectrogram
-            # indices
-            start_spec = max(math.ceil((start_time * samplerate - NFFT / 2.) / hop), 0)
-            end_spec = min(math.ceil((end_time * samplerate - NFFT / 2.) / hop), labelMatrix.shape[0])
-            len_spec = end_spec - start_spec 
-            calls.append((start_spec, end_spec, len_spec))
+        start_times = labels.file_offset
+        call_lengths = labels.durations()
+        return list(zip(start_times.tolist(), (start_times + call_lengths).tolist(), call_lengths.tolist()))
 
-    return calls
+    # Figure out which spectrogram slices we are on
+    # to get columns that we want to span with the given
+    # slice. This math transforms .wav indeces to spectrogram
+    # indices
+    start_specs, end_specs = labels.frame_indices(samplerate=samplerate, NFFT=NFFT, hop=hop)
+    return list(zip(start_specs.tolist(), end_specs.tolist(), (end_specs - start_specs).tolist()))
 
 
 def find_elephant_calls(binary_preds, min_call_length=10, in_seconds=False, samplerate=8000., NFFT=4096., hop=800.): # Was 3208, 641
@@ -448,25 +484,38 @@ def predict_spec_full(spectrogram, model):
 
     return predictions
 
-def predict_spec_sliding_window(spectrogram, model, chunk_size=256, jump=128):
+@timed()
+def predict_spec_sliding_window(spectrogram, model, chunk_size=256, jump=128, prefilter=None):
     """
         Generate the prediction sequence for a full audio sequence
         using a sliding window. Slide the window by one spectrogram frame
         and pass each window through the given model. Compute the average
         over overlapping window predictions to get the final prediction.
+
+        With an EnergyPrefilter, windows it skips are not passed through
+        the model, and frames no other window covers are predicted negative.
     """
     # Get the number of frames in the full audio clip
     predictions = np.zeros(spectrogram.shape[0])
     overlap_counts = np.zeros(spectrogram.shape[0])
 
+    keep = None
+    if prefilter is not None:
+        keep = prefilter.keep_windows(spectrogram, window_starts(spectrogram.shape[0], chunk_size, jump), chunk_size)
+
     # This is a bit janky but we will manually transform
     # each spectrogram chunk
     #spectrogram = torch.from_numpy(spectrogram).float()
     # Add a batch dim for the model!
     #spectrogram = torch.unsqueeze(spectrogram, 0) # Shape - (1, time, freq)
 
+    # Window means and stds from cumulative sums,
+    # rather than from each window's values
+    normalizer = WindowNormalizer(spectrogram)
+
     # Added!
     spectrogram = np.expand_dims(spectrogram,axis=0)
+    instrumentation = Instrumentation()
 
     # For the sliding window we slide the window by one spectrogram
     # frame, determined by the hop size.
@@ -476,30 +525,35 @@ def predict_spec_sliding_window(spectrogram, model, chunk_size=256, jump=128):
     while  spect_idx + chunk_size <= spectrogram.shape[1]:
         #if (i % 1000 == 0):
         #    print ("Chunk number " + str(i))
+        if keep is not None and not keep[i]:
+            spect_idx += jump
+            i += 1
+            continue
 
-        spect_slice = spectrogram[:, spect_idx: spect_idx + chunk_size, :]
         # Transform the slice 
-        spect_slice = (spect_slice - np.mean(spect_slice)) / np.std(spect_slice)
-        spect_slice = torch.from_numpy(spect_slice).float()
-        spect_slice = Variable(spect_slice.to(parameters.device))
+        with instrumentation.span('normalize_window'):
+            spect_slice = normalizer.normalized_window(spect_idx, chunk_size)[np.newaxis]
+            spect_slice = torch.from_numpy(spect_slice).float()
+            spect_slice = Variable(spect_slice.to(parameters.device))
 
-        outputs = model(spect_slice) # Shape - (1, chunk_size, 1)
-        compressed_out = outputs.view(-1, 1)
-        compressed_out = outputs.squeeze()
+        with instrumentation.span('forward'):
+            outputs = model(spect_slice) # Shape - (1, chunk_size, 1)
+            compressed_out = outputs.view(-1, 1)
+            compressed_out = outputs.squeeze()
 
-        overlap_counts[spect_idx: spect_idx + chunk_size] += 1
-        predictions[spect_idx: spect_idx + chunk_size] += compressed_out.cpu().detach().numpy()
+            overlap_counts[spect_idx: spect_idx + chunk_size] += 1
+            predictions[spect_idx: spect_idx + chunk_size] += compressed_out.cpu().detach().numpy()
+        instrumentation.count('prediction_windows')
 
         spect_idx += jump
         i += 1
 
     # Do the last one if it was not covered
-    if (spect_idx - jump + chunk_size != spectrogram.shape[1]):
+    if (spect_idx - jump + chunk_size != spectrogram.shape[1]) and (keep is None or keep[i]):
         #print ('One final chunk!')
-        spect_slice = spectrogram[:, spect_idx: , :]
         # Transform the slice 
         # Should use the function from the dataset!!
-        spect_slice = (spect_slice - np.mean(spect_slice)) / np.std(spect_slice)
+        spect_slice = normalizer.normalized_window(spect_idx, spectrogram.shape[1] - spect_idx)[np.newaxis]
         spect_slice = torch.from_numpy(spect_slice).float()
         spect_slice = Variable(spect_slice.to(parameters.device))
 
@@ -511,6 +565,8 @@ def predict_spec_sliding_window(spectrogram, model, chunk_size=256, jump=128):
         overlap_counts[spect_idx: ] += 1
         predictions[spect_idx: ] += compressed_out.cpu().detach().numpy()
 
+    if prefilter is not None:
+        prefilter.fill_skipped(overlap_counts, predictions)
 
     # Average the predictions on overlapping frames
     predictions = predictions / overlap_counts
@@ -539,20 +595,24 @@ def predict_batched(data, model, jump=TIME_STEPS_IN_WINDOW//2):
     predictions = np.zeros(clean_end_time)
     overlap_counts = np.zeros(clean_end_time)
 
+    # Copies the data to the device once, and normalizes
+    # the windows there
+    normalizer = DeviceWindowNormalizer(data[:clean_end_time], parameters.device)
+
     while time_idx + TIME_STEPS_IN_WINDOW*BATCH_SIZE + (k - 1)*jump <= clean_end_time:
-        forward_inference_on_batch(model, data, time_idx, jump, BATCH_SIZE, predictions, overlap_counts, k)
+        forward_inference_on_batch(model, data, time_idx, jump, BATCH_SIZE, predictions, overlap_counts, k, normalizer)
         time_idx += TIME_STEPS_IN_WINDOW*BATCH_SIZE
 
     # final batch (if size < BATCH_SIZE)
     final_full_batch_size = (clean_end_time - time_idx - (k - 1)*jump)//TIME_STEPS_IN_WINDOW
     if final_full_batch_size > 0:
-        forward_inference_on_batch(model, data, time_idx, jump, final_full_batch_size, predictions, overlap_counts, k)
+        forward_inference_on_batch(model, data, time_idx, jump, final_full_batch_size, predictions, overlap_counts, k, normalizer)
         time_idx += TIME_STEPS_IN_WINDOW*final_full_batch_size
 
     # remaining jumps (less than k)
     if time_idx + TIME_STEPS_IN_WINDOW <= clean_end_time:
         remaining_jumps = (clean_end_time - time_idx - TIME_STEPS_IN_WINDOW)//jump + 1
-        forward_inference_on_batch(model, data, time_idx, jump, 1, predictions, overlap_counts, remaining_jumps)
+        forward_inference_on_batch(model, data, time_idx, jump, 1, predictions, overlap_counts, remaining_jumps, normalizer)
 
     # Average the predictions on overlapping frames
     predictions = predictions / overlap_counts
@@ -574,10 +634,14 @@ def forward_inference_on_batch(
 
         # the number of different offsets that should be used. This method will process this many batches of input.
         # If this number is 1, no 'jumps' will actually be evaluated, just the standard start of the array (the offset of 0).
-        max_jumps):
+        max_jumps,
 
-    # select the region of the data to perform inference on
-    input_batch = data[time_idx:(time_idx + batchsize * TIME_STEPS_IN_WINDOW + (max_jumps - 1) * jump), :]
+        # DeviceWindowNormalizer of the data; made here if not given. Share one across
+        # calls so that the data is only copied to the device once.
+        normalizer=None):
+
+    if normalizer is None:
+        normalizer = DeviceWindowNormalizer(data, parameters.device)
 
     # one batch of spectrogram 'frames' (each representing a full input to the model) to be processed in parallel are consecutive and non-overlapping.
     # each iteration of this loop performs this approach with a different offset into the first frame, allowing the evaluation
@@ -591,18 +655,10 @@ def forward_inference_on_batch(
         global_begin_idx = local_begin_idx + time_idx
         global_end_idx = local_end_idx + time_idx
 
-        reshaped_input_batch = input_batch[local_begin_idx:local_end_idx, :].reshape(batchsize, TIME_STEPS_IN_WINDOW, FREQS)
-
-        # apply per-frame normalization
-        # TODO: figure out how to apply per-frame normalization on the GPU/device so we can get rid of this annoying perf hit
-        # TODO: If we can do this, we won't have to copy the same data to the GPU/device 'max_jumps' times...
-        means = np.mean(reshaped_input_batch, axis=(1,2)).reshape(-1, 1, 1)
-        stds = np.std(reshaped_input_batch, axis=(1,2)).reshape(-1, 1, 1)
-
-        reshaped_input_batch -= means
-        reshaped_input_batch /= stds
-
-        reshaped_input_batch_var = Variable(torch.from_numpy(reshaped_input_batch).float().to(parameters.device))
+        # apply per-frame normalization on the device; the frames
+        # are cut out of the data already copied there
+        frame_starts = global_begin_idx + np.arange(batchsize) * TIME_STEPS_IN_WINDOW
+        reshaped_input_batch_var = normalizer.normalized_windows(frame_starts, TIME_STEPS_IN_WINDOW)
 
         raw_outputs = model(reshaped_input_batch_var)
         outputs = raw_outputs.view(batchsize, TIME_STEPS_IN_WINDOW)
@@ -613,13 +669,11 @@ def forward_inference_on_batch(
         relevant_predictions += outputs.cpu().detach().numpy()
         relevant_overlap_counts += 1
 
-        # now we restore the segment of the input data
-        reshaped_input_batch *= stds
-        reshaped_input_batch += means
-
 
+@timed()
 def generate_predictions_full_spectrograms(dataset, model, model_id, predictions_path, 
-    sliding_window=True, chunk_size=256, jump=128):
+    sliding_window=True, chunk_size=256, jump=128, store_dtype=None, prefilter=None, use_cache=True,
+    NFFT=parameters.SPECTROGRAM_NFFT, hop=parameters.SPECTROGRAM_HOP):
     """
         For each full test spectrogram, run a trained model to get the model
         prediction and save these predictions to the predictions folder. Namely,
@@ -628,36 +682,259 @@ def generate_predictions_full_spectrograms(dataset, model, model_id, predictions
         them based on the negative factor that they were trained on. This will
         come based on the negative factor being included in the model_id
 
+        If store_dtype ('float16' or 'uint8') is given, all predictions are
+        saved into one PredictionStore in the model's folder instead. Its
+        header records the NFFT and hop of the spectrograms, and the window
+        parameters.
+
+        With an EnergyPrefilter, silent windows are skipped (see
+        predict_spec_sliding_window), and the skipped windows and the
+        call frames lost on labelled spectrograms are reported.
+
+        With use_cache, spectrograms whose saved predictions were made by
+        the same model weights, from the same spectrogram file, with the
+        same parameters are not predicted again (see prediction_cache.py).
+        Without it, all spectrograms are predicted again; the cache manifest
+        is still updated to describe the new predictions.
+
         Status:
         - works without saving with negative factor
     """
-    for data in dataset:
-        spectrogram = data[0]
-        gt_call_path = data[2]
+    # Save for now to a folder determined by the model id
+    path = predictions_path + '/' + model_id
+    if not os.path.isdir(path):
+        os.mkdir(path)
+
+    cache = PredictionCache(path, [model], sliding_window=sliding_window, chunk_size=chunk_size,
+                    jump=jump, preprocess=dataset.preprocess, scale=dataset.scale, store_dtype=store_dtype,
+                    prefilter=None if prefilter is None else prefilter.params(), NFFT=NFFT, hop=hop)
+
+    store_writer = None
+    cached_store = None
+    stored = []
+    if store_dtype is not None:
+        store_path = path + '/' + STORE_FILE
+        store_params = dict(NFFT=NFFT, hop=hop, sliding_window=sliding_window, chunk_size=chunk_size, jump=jump)
+        if use_cache and os.path.exists(store_path):
+            # Cached predictions are copied over from the previous store,
+            # unless it was made from other spectrograms or windows
+            cached_store = PredictionStore(store_path)
+            if not cached_store.made_with(**store_params):
+                print ("Not reusing the predictions in {}, made with {}".format(store_path,
+                                                                    cached_store.spectrogram_params))
+                cached_store = None
+        store_writer = PredictionStoreWriter(store_path + '.tmp', model_id, dtype=store_dtype, **store_params)
+    else:
+        remove_prediction_store(path)
 
+    for index in range(len(dataset)):
+        spect_path = dataset.specs[index]
         # Get the spec id
-        tags = gt_call_path.split('/')
+        tags = dataset.gt_calls[index].split('/')
         tags = tags[-1].split('_')
         data_id = tags[0] + '_' + tags[1]
+
+        if use_cache and cache.is_cached(data_id, spect_path):
+            if store_writer is None and os.path.exists(path + '/' + data_id  + '.npy'):
+                cache.hit(data_id)
+                continue
+            if cached_store is not None and data_id in cached_store:
+                store_writer.add(data_id, cached_store[data_id])
+                cache.hit(data_id)
+                continue
+
         print ("Generating Prediction for:", data_id)
+        data = dataset[index]
+        spectrogram = data[0]
 
         if sliding_window:
             # the method 'predict_batched' can be used for speedup once predictions for trailing data have been implemented.
-            predictions = predict_spec_sliding_window(spectrogram, model, chunk_size=chunk_size, jump=jump)
+            predictions = predict_spec_sliding_window(spectrogram, model, chunk_size=chunk_size, jump=jump, 
+                                                        prefilter=prefilter)
+            if prefilter is not None and data[1] is not None:
+                prefilter.record_recall(data[1])
         else:
             predictions = predict_spec_full(spectrogram, model)
 
         # Save preditions
-        # Save for now to a folder determined by the model id
+        # The data id associates predictions with a particular spectrogram
+        if store_writer is not None:
+            store_writer.add(data_id, predictions)
+            stored.append((data_id, spect_path))
+        else:
+            cache.drop(data_id)
+            np.save(path + '/' + data_id  + '.npy', predictions)
+            cache.record(data_id, spect_path)
+
+    if store_writer is not None:
+        store_writer.close()
+        for data_id, _spect_path in stored:
+            cache.drop(data_id)
+        os.replace(store_writer.path, store_path)
+        # Only now are the new predictions in the store
+        for data_id, spect_path in stored:
+            cache.record(data_id, spect_path)
+    if prefilter is not None:
+        print (prefilter.summary())
+    print (cache.summary())
+
+
+@timed()
+def predict_ensemble_sliding_window(spectrogram, ensemble, chunk_size=256, jump=128, batch_size=BATCH_SIZE,
+                                    prefilter=None):
+    """
+        predict_spec_sliding_window for all models of a ModelEnsemble.
+        The same windows are visited, but z-scored on the device in
+        batches of batch_size, and each batch is run through all of
+        the models at once. With an EnergyPrefilter, the windows it
+        skips are left out of the batches.
+
+        Return:
+        Sigmoid predictions of each model - Shape (num_models, time)
+    """
+    num_frames = spectrogram.shape[0]
+    predictions = np.zeros((len(ensemble), num_frames))
+    overlap_counts = np.zeros(num_frames)
+
+    normalizer = DeviceWindowNormalizer(spectrogram, parameters.device)
+    instrumentation = Instrumentation()
+
+    # Window starts, and the start of the final window that
+    # is cut short at the end of the spectrogram, if needed
+    starts = np.arange(0, num_frames - chunk_size + 1, jump)
+    final_start = starts[-1] + jump if len(starts) > 0 else 0
+    keep_final = True
+    if prefilter is not None:
+        keep = prefilter.keep_windows(spectrogram, window_starts(num_frames, chunk_size, jump), chunk_size)
+        # The final window, if any, is the last one
+        keep_final = keep[-1]
+        starts = starts[keep[:len(starts)]]
+
+    with torch.no_grad():
+        for batch_begin in range(0, len(starts), batch_size):
+            batch_starts = starts[batch_begin:batch_begin + batch_size]
+            with instrumentation.span('normalize_window'):
+                windows = normalizer.normalized_windows(batch_starts, chunk_size)
+
+            with instrumentation.span('forward'):
+                outputs = ensemble(windows).view(len(ensemble), len(batch_starts), chunk_size).cpu().numpy()
+                # Windows of a batch may overlap
+                for i, start in enumerate(batch_starts):
+                    predictions[:, start:start + chunk_size] += outputs[:, i]
+                    overlap_counts[start:start + chunk_size] += 1
+            instrumentation.count('prediction_windows', len(batch_starts))
+
+        # Do the last one if it was not covered
+        if final_start - jump + chunk_size != num_frames and keep_final:
+            final_length = num_frames - final_start
+            windows = normalizer.normalized_windows([final_start], final_length)
+            # In the case of ResNet the output is forced to the chunk size
+            outputs = ensemble(windows).reshape(len(ensemble), -1)[:, :final_length].cpu().numpy()
+            predictions[:, final_start:] += outputs
+            overlap_counts[final_start:] += 1
+
+    if prefilter is not None:
+        prefilter.fill_skipped(overlap_counts, *predictions)
+
+    # Average the predictions on overlapping frames
+    predictions = predictions / overlap_counts
+
+    # Get squashed [0, 1] predictions
+    return sigmoid(predictions)
+
+
+@timed()
+def generate_ensemble_predictions_full_spectrograms(dataset, ensemble, model_ids, ensemble_id, 
+    predictions_path, chunk_size=256, jump=128, store_dtype=None, prefilter=None,
+    NFFT=parameters.SPECTROGRAM_NFFT, hop=parameters.SPECTROGRAM_HOP):
+    """
+        generate_predictions_full_spectrograms for all models of a
+        ModelEnsemble, in one pass over the dataset. Each spectrogram
+        is loaded and its windows normalized once for all models.
+        The predictions of each model are saved under its model_id,
+        as for a single model, and the average of the models'
+        predictions under the ensemble_id. An EnergyPrefilter
+        skips the same windows for all of the models.
+
+        All spectrograms are predicted again, but each folder's cache
+        manifest is updated (see prediction_cache.py), so that later
+        single model runs reuse these predictions rather than stale ones.
+    """
+    ids = list(model_ids) + [ensemble_id]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Ensemble model ids must be distinct: {}".format(ids))
+
+    # The averaged predictions are made by all of the models
+    cache_models = [[model] for model in ensemble.models] + [list(ensemble.models)]
+    paths = []
+    caches = []
+    store_writers = []
+    for model_id, models in zip(ids, cache_models):
         path = predictions_path + '/' + model_id
         if not os.path.isdir(path):
             os.mkdir(path)
-        # The data id associates predictions with a particular spectrogram
-        np.save(path + '/' + data_id  + '.npy', predictions)
+        paths.append(path)
+        caches.append(PredictionCache(path, models, sliding_window=True, chunk_size=chunk_size,
+                        jump=jump, preprocess=dataset.preprocess, scale=dataset.scale, store_dtype=store_dtype,
+                        prefilter=None if prefilter is None else prefilter.params(), NFFT=NFFT, hop=hop))
+        if store_dtype is not None:
+            store_writers.append(PredictionStoreWriter(path + '/' + STORE_FILE + '.tmp', model_id, 
+                                    dtype=store_dtype, NFFT=NFFT, hop=hop, sliding_window=True, 
+                                    chunk_size=chunk_size, jump=jump))
+        else:
+            remove_prediction_store(path)
 
+    stored = []
+    for index, data in enumerate(dataset):
+        spect_path = dataset.specs[index]
+        spectrogram = data[0]
+        gt_call_path = data[2]
 
+        # Get the spec id
+        tags = gt_call_path.split('/')
+        tags = tags[-1].split('_')
+        data_id = tags[0] + '_' + tags[1]
+        print ("Generating Ensemble Prediction for:", data_id)
+
+        model_predictions = predict_ensemble_sliding_window(spectrogram, ensemble, chunk_size=chunk_size, jump=jump,
+                                                            prefilter=prefilter)
+        if prefilter is not None and data[1] is not None:
+            prefilter.record_recall(data[1])
+        all_predictions = list(model_predictions) + [np.mean(model_predictions, axis=0)]
+
+        for i, predictions in enumerate(all_predictions):
+            if store_dtype is not None:
+                store_writers[i].add(data_id, predictions)
+            else:
+                caches[i].drop(data_id)
+                np.save(paths[i] + '/' + data_id  + '.npy', predictions)
+                caches[i].record(data_id, spect_path)
+        stored.append((data_id, spect_path))
+
+    for path, cache, store_writer in zip(paths, caches, store_writers):
+        store_writer.close()
+        for data_id, _spect_path in stored:
+            cache.drop(data_id)
+        os.replace(store_writer.path, path + '/' + STORE_FILE)
+        # Only now are the new predictions in the store
+        for data_id, spect_path in stored:
+            cache.record(data_id, spect_path)
+
+    if prefilter is not None:
+        print (prefilter.summary())
+
+
+def ensemble_model_id(model_ids):
+    """
+        Default id of the averaged predictions of several models
+    """
+    common_prefix = os.path.commonprefix(list(model_ids)).rstrip('_')
+    return 'Ensemble' + str(len(model_ids)) + ('_' + common_prefix if common_prefix else '')
+
+
+@timed()
 def eval_full_spectrograms(dataset, model_id, predictions_path, pred_threshold=0.5, overlap_threshold=0.1, smooth=True, 
-            in_seconds=False, use_call_bounds=False, min_call_length=10, visualize=False):
+            in_seconds=False, use_call_bounds=False, min_call_length=10, visualize=False, store=None):
     """
 
         After saving predictions for the test set of full spectrograms, we
@@ -680,7 +957,11 @@ def eval_full_spectrograms(dataset, model_id, predictions_path, pred_threshold=0
         - Old Call Precision --- To be implemented
         - Old Call Recall --- To be implemented
 
+        Predictions are read from the given PredictionStore, or else from
+        the model's store or .npy files under predictions_path.
     """
+    if store is None:
+        store = open_prediction_store(model_id, predictions_path)
     # Maps spectrogram ids to dictionary of results for each spect
     # Additionally includes a key "summary" that computes aggregated
     # statistics over the entire test set of spectrograms
@@ -707,7 +988,7 @@ def eval_full_spectrograms(dataset, model_id, predictions_path, pred_threshold=0
         data_id = tags[0] + '_' + tags[1]
         print ("Generating Prediction for:", data_id)
         
-        predictions = np.load(predictions_path + '/' + model_id + "/" + data_id + '.npy')
+        predictions = load_predictions(data_id, model_id, predictions_path, store=store)
 
         binary_preds, smoothed_predictions = get_binary_predictions(predictions, threshold=pred_threshold, smooth=smooth)
 
@@ -773,13 +1054,16 @@ def eval_full_spectrograms(dataset, model_id, predictions_path, pred_threshold=0
 
     return results
 
+@timed()
 def extract_call_predictions(dataset, model_id, predictions_path, pred_threshold=0.5, smooth=True, 
-            in_seconds=False, min_call_length=10, visualize=False):
+            in_seconds=False, min_call_length=10, visualize=False, store=None):
     """
         Extract model predictions as calls of the form (start, end, length) 
         and save each call for with its given audio file
 
     """
+    if store is None:
+        store = open_prediction_store(model_id, predictions_path)
     # Maps spectrogram ids to dictionary of results for each spect
     results = {} 
     
@@ -795,7 +1079,7 @@ def extract_call_predictions(dataset, model_id, predictions_path, pred_threshold
         data_id = tags[0] + '_' + tags[1]
         print ("Generating Prediction for:", data_id)
         
-        predictions = np.load(predictions_path + '/' + model_id + "/" + data_id + '.npy')
+        predictions = load_predictions(data_id, model_id, predictions_path, store=store)
 
         binary_preds, smoothed_predictions = get_binary_predictions(predictions, threshold=pred_threshold, smooth=smooth)
 
@@ -964,13 +1248,16 @@ def precision_recall_curve_pred_threshold(dataset, model_id, pred_path, num_poin
     # and the threshold = 0 since then precision is messed up, in that it should be around 0
     thresholds = thresholds[1:-1]
 
+    # Open once for all thresholds
+    store = open_prediction_store(model_id, pred_path)
+
     for overlap in overlaps:
         precisions = [0]
         recalls = [1]
         for threshold in thresholds:
             print ("threshold:", threshold)
             results = eval_full_spectrograms(dataset, model_id, pred_path, pred_threshold=threshold, 
-                            overlap_threshold=overlap, min_call_length=min_call_length)
+                            overlap_threshold=overlap, min_call_length=min_call_length, store=store)
 
             TP_truth = results['summary']['true_pos_recall']
             FN = results['summary']['false_neg']
@@ -1005,11 +1292,26 @@ def main(args):
 
     """
     
-    model, model_id = loadModel(args.model)
-    print ("Using Model with ID:", model_id)
+    if args.trace_file is not None:
+        Instrumentation().enable_tracing()
+
+    ensemble = None
+    if args.ensemble is not None:
+        # Several models share one pass over the data
+        models, model_ids = zip(*[loadModel(model_path, variant=args.model_variant) 
+                                    for model_path in args.ensemble])
+        for model in models:
+            model.eval()
+        ensemble = ModelEnsemble(list(models))
+        model_id = args.ensemble_id if args.ensemble_id is not None else ensemble_model_id(model_ids)
+        print ("Using Ensemble with ID:", model_id)
+        print ("Vectorized:", ensemble.vectorized)
+    else:
+        model, model_id = loadModel(args.model, variant=args.model_variant)
+        print ("Using Model with ID:", model_id)
 
-    # Put in eval mode!
-    model.eval()
+        # Put in eval mode!
+        model.eval()
     print (model_id)
     
     full_test_spect_paths = get_spectrogram_paths(args.test_files, args.spect_path, exclude_marginals=parameters.EXCLUDE_MARGINALS)
@@ -1017,9 +1319,18 @@ def main(args):
     full_dataset = ElephantDatasetFull(full_test_spect_paths['specs'],
                  full_test_spect_paths['labels'], full_test_spect_paths['gts'])    
 
-    if args.make_full_preds:
+    prefilter = None
+    if args.prefilter_db is not None:
+        prefilter = EnergyPrefilter(threshold_db=args.prefilter_db, smooth_frames=parameters.MIN_CALL_LENGTH)
+
+    if args.make_full_preds and ensemble is not None:
+        generate_ensemble_predictions_full_spectrograms(full_dataset, ensemble, model_ids, model_id, 
+             args.predictions_path, chunk_size=parameters.CHUNK_SIZE, jump=parameters.PREDICTION_SLIDE_LENGTH,
+             store_dtype=args.store_dtype, prefilter=prefilter)
+    elif args.make_full_preds:
         generate_predictions_full_spectrograms(full_dataset, model, model_id, args.predictions_path,
-             sliding_window=True, chunk_size=parameters.CHUNK_SIZE, jump=parameters.PREDICTION_SLIDE_LENGTH)         
+             sliding_window=True, chunk_size=parameters.CHUNK_SIZE, jump=parameters.PREDICTION_SLIDE_LENGTH,
+             store_dtype=args.store_dtype, prefilter=prefilter, use_cache=not args.recompute)
     elif args.full_stats:
         # Now we have to decide what to do with these stats
         results = eval_full_spectrograms(full_dataset, model_id, args.predictions_path, 
@@ -1069,6 +1380,9 @@ def main(args):
         # Save the predictions
         create_predictions_csv(full_dataset, predictions, save_path)
 
+    if args.trace_file is not None:
+        Instrumentation().save_trace(args.trace_file)
+
     '''
     assert(len(sys.argv) > 2)
 
@@ -1,5 +1,4 @@
 from matplotlib import pyplot as plt
-from matplotlib import mlab as ml
 import numpy as np
 import csv
 import os
@@ -7,7 +6,8 @@ import time
 import multiprocessing
 from scipy.io import wavfile
 from visualization import visualize
-import math
+from DSP.dsp_utils import DSPUtils
+from elephant_utils.raven_labels import RavenLabelTable
 import argparse
 
 parser = argparse.ArgumentParser()
@@ -45,23 +45,14 @@ def generate_labels(labels, spectrogram_info, len_labels):
     if labels is None:
         return labelMatrix
 
-    labelFile = csv.DictReader(open(labels,'rt'), delimiter='\t')
-    
-    samplerate = spectrogram_info['samplerate']
-    # Iterates through labels and marks the segments with elephant calls
-    for row in labelFile:
-        # Use the file offset to determine the start of the call
-        start_time = float(row['File Offset (s)'])
-        call_length = float(row['End Time (s)']) - float(row['Begin Time (s)'])
-        end_time = start_time + call_length
-        
-        # Figure out for a given start and end time
-        # the corresponding spectrogram columns / frames.
-        # This math transforms .wav indeces to spectrogram
-        # indices
-        start_spec = max(math.ceil((start_time * samplerate - spectrogram_info['NFFT'] / 2.) / spectrogram_info['hop']), 0)
-        end_spec = min(math.ceil((end_time * samplerate - spectrogram_info['NFFT'] / 2.) / spectrogram_info['hop']), labelMatrix.shape[0])
-        labelMatrix[start_spec : end_spec] = 1
+    # Marks the segments with elephant calls. The file offset
+    # determines the start of each call, and the math
+    # transforms .wav indeces to the corresponding
+    # spectrogram columns / frames
+    labelMatrix = RavenLabelTable.load(labels).frame_mask(labelMatrix.shape[0],
+                                                          samplerate=spectrogram_info['samplerate'],
+                                                          NFFT=spectrogram_info['NFFT'],
+                                                          hop=spectrogram_info['hop'])
 
     print("Finished making label files.")
     return labelMatrix
@@ -74,7 +65,10 @@ def generate_spectogram(raw_audio, spectrogram_info, id, chunk_size=1000):
         spectrograms at a time, limiting the max frequency to save
         on memory and cut out uneeded information. We generate in chunks
         to deal with memory issues and efficiency involved with doing
-        the complete DFT at once
+        the complete DFT at once. Frequencies above max_freq are
+        dropped from each chunk as it is computed (see
+        DSPUtils.band_limited_spectrogram), and chunks are written
+        into one preallocated float32 matrix.
     """
     
     NFFT = spectrogram_info['NFFT']
@@ -83,36 +77,17 @@ def generate_spectogram(raw_audio, spectrogram_info, id, chunk_size=1000):
     pad_to = spectrogram_info['pad_to']
     samplerate = spectrogram_info['samplerate']
 
-    # Generate the spectogram in chunks
-    # of 1000 frames.
-    len_chunk = (chunk_size - 1) * hop + NFFT
-
-    final_spec = None
-    start_chunk = 0
-    i = 0
-    while start_chunk + len_chunk < raw_audio.shape[0]:
-        if (i % 100 == 0):
-            print ("Chunk number " + str(i) + ": " + id)
-        [spectrum, freqs, t] = ml.specgram(raw_audio[start_chunk: start_chunk + len_chunk], 
-                NFFT=NFFT, Fs=samplerate, noverlap=(NFFT - hop), window=ml.window_hanning, pad_to=pad_to)
-        # Cutout the high frequencies that are not of interest
-        spectrum = spectrum[(freqs <= max_freq)]
-
-        if i == 0:
-            final_spec = spectrum
-        else:
-            final_spec = np.concatenate((final_spec, spectrum), axis=1)
-
-        # Remember that we want to start as if we are doing one continuous sliding window
-        start_chunk += len_chunk - NFFT + hop 
-        i += 1
-
-    # Do one final chunk for whatever remains at the end
-    [spectrum, freqs, t] = ml.specgram(raw_audio[start_chunk: start_chunk + len_chunk], 
-            NFFT=NFFT, Fs=samplerate, noverlap=(NFFT - hop), window=ml.window_hanning, pad_to=pad_to)
-    # Cutout the high frequencies that are not of interest
-    spectrum = spectrum[(freqs <= max_freq)]
-    final_spec = np.concatenate((final_spec, spectrum), axis=1)
+    print ("Generating spectrogram for: " + id)
+    # Same values as running ml.specgram with window_hanning 
+    # over the recording as one continuous sliding window:
+    (_freqs, _t, final_spec) = DSPUtils.band_limited_spectrogram(raw_audio, 
+                                                                 samplerate,
+                                                                 nfft=NFFT,
+                                                                 hop=hop,
+                                                                 freq_cap=max_freq,
+                                                                 pad_to=pad_to,
+                                                                 mode='psd',
+                                                                 frames_per_chunk=chunk_size)
 
     print("Finished making one 24 hour spectogram")
     return final_spec.T
@@ -186,6 +161,9 @@ if __name__ == '__main__':
             # pairs (i.e. (.wav, .txt))
             data_pairs = {}
             for eachFile in filenames:
+                # Skip the parsed-label caches next to the tables:
+                if eachFile.endswith('.labels.npz'):
+                    continue
                 # Strip off the location and time tags
                 tags = eachFile.split('_')
                 data_id = tags[0] + '_' + tags[1]
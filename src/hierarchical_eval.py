@@ -19,6 +19,12 @@ import parameters
 from data import get_loader, ElephantDatasetFull
 from visualization import visualize, visualize_predictions
 from utils import sigmoid, calc_accuracy, get_f_score, hierarchical_model_1_path
+from elephant_utils.model_files import load_model_file, model_variant_path, model_variant_of, is_torchscript_file
+from utils import WindowNormalizer
+from elephant_utils.raven_labels import RavenLabelTable
+from energy_prefilter import EnergyPrefilter, window_starts
+from prediction_cache import PredictionCache
+from prediction_store import open_prediction_store, load_predictions, remove_prediction_store
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--preds_path', type=str, dest='predictions_path', default='../Predictions',
@@ -57,6 +63,13 @@ parser.add_argument('--model_0', type=str,
     help='Path to Model_0')
 parser.add_argument('--model_1', type=str,
     help='Path to Model_1')
+parser.add_argument('--model_variant', type=str, choices=['int8', 'frozen'], default=None,
+    help='Use the cpu inference variants of both models exported by Refactored/export_models.py')
+parser.add_argument('--prefilter_db', type=float, default=None,
+    help='Skip windows whose infrasonic band energy stays less than this many dB above the noise floor ' \
+    + '(see energy_prefilter.py for choosing the threshold)')
+parser.add_argument('--recompute', action='store_true',
+    help='Predict all spectrograms, even those whose cached predictions match the models, spectrogram and parameters')
 
 
 '''
@@ -71,8 +84,22 @@ python eval.py --test_files /home/data/elephants/processed_data/Test_nouab/Neg_S
 '''
 
 
-def loadModel(model_path):
-    model = torch.load(model_path, map_location=parameters.device)
+def loadModel(model_path, variant=None):
+    """
+        Load a saved model, or with variant 'int8' / 'frozen' the
+        cpu inference variant exported next to it by
+        Refactored/export_models.py. Variant files may also be
+        given directly as model_path.
+    """
+    if variant is not None:
+        model_path = model_variant_path(model_path, variant)
+    else:
+        variant = model_variant_of(model_path)
+
+    model = load_model_file(model_path, parameters.device)
+    if is_torchscript_file(model_path):
+        # Inference variants only run on the cpu
+        parameters.device = torch.device('cpu')
     print (model)
     # Get the model name from the path
     tokens = model_path.split('/')
@@ -85,6 +112,9 @@ def loadModel(model_path):
         model_id = tokens[-3] + "_" + tokens[-2]
     else:
         model_id = tokens[-2]
+    # Keep the predictions of variants apart from those of the float model
+    if variant is not None:
+        model_id += "_" + variant
 
     # Let us also save_predictions based on some of the slide length 
     # when sliding the window for model predictions
@@ -163,6 +193,10 @@ def multi_class_predict_spec_sliding_window(spectrogram, model, chunk_size=256,
     # Add a batch dim for the model!
     #spectrogram = torch.unsqueeze(spectrogram, 0) # Shape - (1, time, freq)
 
+    # Window means and stds from cumulative sums,
+    # rather than from each window's values
+    normalizer = WindowNormalizer(spectrogram)
+
     # Added!
     spectrogram = np.expand_dims(spectrogram,axis=0)
 
@@ -172,9 +206,8 @@ def multi_class_predict_spec_sliding_window(spectrogram, model, chunk_size=256,
     i = 0
     # How can I parallelize this shit??????
     while  spect_idx + chunk_size <= spectrogram.shape[1]:
-        spect_slice = spectrogram[:, spect_idx: spect_idx + chunk_size, :]
         # Transform the slice - this is definitely sketchy!!!! 
-        spect_slice = (spect_slice - np.mean(spect_slice)) / np.std(spect_slice)
+        spect_slice = normalizer.normalized_window(spect_idx, chunk_size)[np.newaxis]
         spect_slice = torch.from_numpy(spect_slice).float()
         spect_slice = spect_slice.to(parameters.device)
 
@@ -205,10 +238,9 @@ def multi_class_predict_spec_sliding_window(spectrogram, model, chunk_size=256,
     # Do the last one if it was not covered
     if (spect_idx - jump + chunk_size != spectrogram.shape[1]):
         #print ('One final chunk!')
-        spect_slice = spectrogram[:, spect_idx: , :]
         # Transform the slice 
         # Should use the function from the dataset!!
-        spect_slice = (spect_slice - np.mean(spect_slice)) / np.std(spect_slice)
+        spect_slice = normalizer.normalized_window(spect_idx, spectrogram.shape[1] - spect_idx)[np.newaxis]
         spect_slice = torch.from_numpy(spect_slice).float()
         spect_slice = spect_slice.to(parameters.device)
 
@@ -250,7 +282,8 @@ def multi_class_predict_spec_sliding_window(spectrogram, model, chunk_size=256,
 
     return predictions
 
-def predict_spec_sliding_window(spectrogram, model, chunk_size=256, jump=128, hierarchical_model=None, hierarchy_threshold=15):
+def predict_spec_sliding_window(spectrogram, model, chunk_size=256, jump=128, hierarchical_model=None, hierarchy_threshold=15,
+                                prefilter=None):
     """
         Generate the prediction sequence for a full audio sequence
         using a sliding window. Slide the window by one spectrogram frame
@@ -259,6 +292,9 @@ def predict_spec_sliding_window(spectrogram, model, chunk_size=256, jump=128, hi
         Allow for having a hierarchical model! If using a hierarchical model
         also save the model_0 predictions!
 
+        With an EnergyPrefilter, windows it skips are passed through neither
+        model, and frames no other window covers are predicted negative.
+
         Return:
         With Hierarchical Model - hierarchical predictions, model_0 predictions
         Solo Model - predictions
@@ -271,6 +307,10 @@ def predict_spec_sliding_window(spectrogram, model, chunk_size=256, jump=128, hi
     # Keeps track of the number of predictions made for a given
     # slice for final averaging!
     overlap_counts = np.zeros(spectrogram.shape[0])
+
+    keep = None
+    if prefilter is not None:
+        keep = prefilter.keep_windows(spectrogram, window_starts(spectrogram.shape[0], chunk_size, jump), chunk_size)
     
 
     # This is a bit janky but we will manually transform
@@ -279,6 +319,10 @@ def predict_spec_sliding_window(spectrogram, model, chunk_size=256, jump=128, hi
     # Add a batch dim for the model!
     #spectrogram = torch.unsqueeze(spectrogram, 0) # Shape - (1, time, freq)
 
+    # Window means and stds from cumulative sums,
+    # rather than from each window's values
+    normalizer = WindowNormalizer(spectrogram)
+
     # Added!
     spectrogram = np.expand_dims(spectrogram,axis=0)
 
@@ -288,9 +332,13 @@ def predict_spec_sliding_window(spectrogram, model, chunk_size=256, jump=128, hi
     i = 0
     # How can I parallelize this shit??????
     while  spect_idx + chunk_size <= spectrogram.shape[1]:
-        spect_slice = spectrogram[:, spect_idx: spect_idx + chunk_size, :]
+        if keep is not None and not keep[i]:
+            spect_idx += jump
+            i += 1
+            continue
+
         # Transform the slice - this is definitely sketchy!!!! 
-        spect_slice = (spect_slice - np.mean(spect_slice)) / np.std(spect_slice)
+        spect_slice = normalizer.normalized_window(spect_idx, chunk_size)[np.newaxis]
         spect_slice = torch.from_numpy(spect_slice).float()
         spect_slice = spect_slice.to(parameters.device)
 
@@ -319,12 +367,11 @@ def predict_spec_sliding_window(spectrogram, model, chunk_size=256, jump=128, hi
         i += 1
 
     # Do the last one if it was not covered
-    if (spect_idx - jump + chunk_size != spectrogram.shape[1]):
+    if (spect_idx - jump + chunk_size != spectrogram.shape[1]) and (keep is None or keep[i]):
         #print ('One final chunk!')
-        spect_slice = spectrogram[:, spect_idx: , :]
         # Transform the slice 
         # Should use the function from the dataset!!
-        spect_slice = (spect_slice - np.mean(spect_slice)) / np.std(spect_slice)
+        spect_slice = normalizer.normalized_window(spect_idx, spectrogram.shape[1] - spect_idx)[np.newaxis]
         spect_slice = torch.from_numpy(spect_slice).float()
         spect_slice = spect_slice.to(parameters.device)
 
@@ -352,6 +399,12 @@ def predict_spec_sliding_window(spectrogram, model, chunk_size=256, jump=128, hi
         predictions[spect_idx: ] += compressed_out.cpu().detach().numpy()
 
 
+    if prefilter is not None:
+        if hierarchical_model is not None:
+            prefilter.fill_skipped(overlap_counts, predictions, hierarchical_predictions)
+        else:
+            prefilter.fill_skipped(overlap_counts, predictions)
+
     # Average the predictions on overlapping frames
     predictions = predictions / overlap_counts
     if hierarchical_model is not None:
@@ -368,7 +421,8 @@ def predict_spec_sliding_window(spectrogram, model, chunk_size=256, jump=128, hi
 
 
 def generate_predictions_full_spectrograms(dataset, model, model_id, predictions_path, 
-    sliding_window=True, chunk_size=256, jump=128, hierarchical_model=None, hierarchy_threshold=15):
+    sliding_window=True, chunk_size=256, jump=128, hierarchical_model=None, hierarchy_threshold=15,
+    prefilter=None, use_cache=True):
     """
         For each full test spectrogram, run a trained model to get the model
         prediction and save these predictions to the predictions folder. Namely,
@@ -377,18 +431,51 @@ def generate_predictions_full_spectrograms(dataset, model, model_id, predictions
         them based on the negative factor that they were trained on. This will
         come based on the negative factor being included in the model_id
 
+        With an EnergyPrefilter, silent windows are skipped (see
+        predict_spec_sliding_window), and the skipped windows and the
+        call frames lost on labelled spectrograms are reported.
+
+        With use_cache, spectrograms whose saved predictions were made by
+        the same weights of both models, from the same spectrogram file,
+        with the same parameters are not predicted again (see prediction_cache.py).
+        Without it, all spectrograms are predicted again; the cache manifest
+        is still updated to describe the new predictions.
+
         Status:
         - works without saving with negative factor
     """
-    for data in dataset:
-        spectrogram = data[0]
-        gt_call_path = data[2]
+    # Save for now to a folder determined by the model id
+    path = os.path.join(predictions_path,model_id)
+    if not os.path.isdir(path):
+        os.mkdir(path)
+    remove_prediction_store(path)
+    if hierarchical_model is not None:
+        remove_prediction_store(os.path.join(path, "Model_0"))
+
+    models = [model] if hierarchical_model is None else [model, hierarchical_model]
+    cache = PredictionCache(path, models, sliding_window=sliding_window, chunk_size=chunk_size,
+                    jump=jump, hierarchy_threshold=None if hierarchical_model is None else hierarchy_threshold,
+                    preprocess=dataset.preprocess, scale=dataset.scale,
+                    prefilter=None if prefilter is None else prefilter.params())
 
+    for index in range(len(dataset)):
+        spect_path = dataset.specs[index]
         # Get the spec id
-        tags = gt_call_path.split('/')
+        tags = dataset.gt_calls[index].split('/')
         tags = tags[-1].split('_')
         data_id = tags[0] + '_' + tags[1]
+
+        if use_cache and cache.is_cached(data_id, spect_path):
+            saved = [os.path.join(path, data_id + '.npy')]
+            if hierarchical_model is not None:
+                saved.append(os.path.join(path, "Model_0", data_id + '.npy'))
+            if all(os.path.exists(saved_path) for saved_path in saved):
+                cache.hit(data_id)
+                continue
+
         print ("Generating Prediction for:", data_id)
+        data = dataset[index]
+        spectrogram = data[0]
 
         if sliding_window:
             # May want to play around with the threhold for which we use the second model!
@@ -399,17 +486,16 @@ def generate_predictions_full_spectrograms(dataset, model, model_id, predictions
             predictions = predict_spec_sliding_window(spectrogram, model, 
                                         chunk_size=chunk_size, jump=jump, 
                                         hierarchical_model=hierarchical_model, 
-                                        hierarchy_threshold=hierarchy_threshold)
+                                        hierarchy_threshold=hierarchy_threshold,
+                                        prefilter=prefilter)
+            if prefilter is not None and data[1] is not None:
+                prefilter.record_recall(data[1])
         else:
             # Just leave out for now!
             predictions = predict_spec_full(spectrogram, model)
 
         # Save preditions
-        # Save for now to a folder determined by the model id
-        path = os.path.join(predictions_path,model_id)
-        if not os.path.isdir(path):
-            os.mkdir(path)
-
+        cache.drop(data_id)
         if hierarchical_model is not None:
             hierarchical_predictions, model_0_predictions = predictions
             # Create a folder for the model 0 predictions
@@ -423,6 +509,12 @@ def generate_predictions_full_spectrograms(dataset, model, model_id, predictions
             # The data id associates predictions with a particular spectrogram
             np.save(os.path.join(path, data_id  + '.npy'), predictions)
 
+        cache.record(data_id, spect_path)
+
+    if prefilter is not None:
+        print (prefilter.summary())
+    print (cache.summary())
+
 def test_overlap(s1, e1, s2, e2, threshold=0.1, is_truth=False):
     """
         Test is the source call defined by [s1: e1 + 1] 
@@ -575,28 +667,20 @@ def process_ground_truth(label_path, in_seconds=False, samplerate=8000, NFFT=409
 
         Otherwise convert to the corresponding spectrogram "slice"
     """
-    labelFile = csv.DictReader(open(label_path,'rt'), delimiter='\t')
-    calls = []
+    labels = RavenLabelTable.load(label_path)
 
-    for row in labelFile:
+    if in_seconds:
         # Use the file offset to determine the start of the call
-        start_time = float(row['File Offset (s)'])
-        call_length = float(row['End Time (s)']) - float(row['Begin Time (s)'])
-        end_time = start_time + call_length
-        
-        if in_seconds:
-            calls.append((start_time, end_time, call_length))
-        else: 
-            # Figure out which spectrogram slices we are on
-            # to get columns that we want to span with the given
-            # slice. This math transforms .wav indeces to spectrogram
-            # indices
-            start_spec = max(math.ceil((start_time * samplerate - NFFT / 2.) / hop), 0)
-            end_spec = min(math.ceil((end_time * samplerate - NFFT / 2.) / hop), labelMatrix.shape[0])
-            len_spec = end_spec - start_spec 
-            calls.append((start_spec, end_spec, len_spec))
+        start_times = labels.file_offset
+        call_lengths = labels.durations()
+        return list(zip(start_times.tolist(), (start_times + call_lengths).tolist(), call_lengths.tolist()))
 
-    return calls
+    # Figure out which spectrogram slices we are on
+    # to get columns that we want to span with the given
+    # slice. This math transforms .wav indeces to spectrogram
+    # indices
+    start_specs, end_specs = labels.frame_indices(samplerate=samplerate, NFFT=NFFT, hop=hop)
+    return list(zip(start_specs.tolist(), end_specs.tolist(), (end_specs - start_specs).tolist()))
 
 
 def find_elephant_calls(binary_preds, min_call_length=10, in_seconds=False, samplerate=8000., NFFT=4096., hop=800.): # Was 3208, 641
@@ -717,6 +801,9 @@ def eval_full_spectrograms(dataset, model_id, predictions_path, pred_threshold=0
     # Used to track the number of total calls for averaging
     # aggregated statistics
     num_preds = 0
+    # Predictions converted to a prediction store are read from it
+    store = open_prediction_store(model_id, predictions_path)
+    model_0_store = open_prediction_store(model_id + '/Model_0', predictions_path) if hierarchical_model else None
     num_gt = 0
     for data in dataset:
         spectrogram = data[0]
@@ -729,7 +816,7 @@ def eval_full_spectrograms(dataset, model_id, predictions_path, pred_threshold=0
         data_id = tags[0] + '_' + tags[1]
         print ("Generating Prediction for:", data_id)
          
-        predictions = np.load(os.path.join(predictions_path, model_id, data_id + '.npy'))
+        predictions = load_predictions(data_id, model_id, predictions_path, store=store)
 
         binary_preds, smoothed_predictions = get_binary_predictions(predictions, threshold=pred_threshold, smooth=smooth)
 
@@ -785,7 +872,7 @@ def eval_full_spectrograms(dataset, model_id, predictions_path, pred_threshold=0
         # If doing hierarchical modeling, save the model_0 predictions 
         # specifically for visualization!
         if hierarchical_model:
-            model_0_predictions = np.load(os.path.join(predictions_path, model_id, 'Model_0', data_id + '.npy'))
+            model_0_predictions = load_predictions(data_id, model_id + '/Model_0', predictions_path, store=model_0_store)
             _, model_0_smoothed_predictions = get_binary_predictions(model_0_predictions, threshold=pred_threshold, smooth=smooth)
             results[data_id]['model_0_predictions'] = model_0_smoothed_predictions
 
@@ -857,6 +944,7 @@ def extract_call_predictions(dataset, model_id, predictions_path, pred_threshold
     """
     # Maps spectrogram ids to dictionary of results for each spect
     results = {} 
+    store = open_prediction_store(model_id, predictions_path)
     
     num_preds = 0
     for data in dataset:
@@ -870,7 +958,7 @@ def extract_call_predictions(dataset, model_id, predictions_path, pred_threshold
         data_id = tags[0] + '_' + tags[1]
         print ("Generating Prediction for:", data_id)
         
-        predictions = np.load(predictions_path + '/' + model_id + "/" + data_id + '.npy')
+        predictions = load_predictions(data_id, model_id, predictions_path, store=store)
 
         binary_preds, smoothed_predictions = get_binary_predictions(predictions, threshold=pred_threshold, smooth=smooth)
 
@@ -942,8 +1030,6 @@ def create_predictions_csv(dataset, predictions, save_path, in_seconds=False):
         Params:
         in_seconds - signifies that predictions are already converted to seconds
     """
-    dummy_low_freq = 5
-    dummy_high_freq = 100
     for data in dataset:
         spectrogram = data[0]
         labels = data[1]
@@ -966,25 +1052,43 @@ def create_predictions_csv(dataset, predictions, save_path, in_seconds=False):
 
         # Save preditions
         with open(save_path + '/' + data_id + '.txt', 'w') as f:
-            # Create the hedding
-            f.write('Selection\tView\tChannel\tBegin Time (s)\tEnd Time (s)\tLow Freq (Hz)\tHigh Freq (Hz)\tBegin Path\tFile Offset (s)\tBegin File\tSite\thour\tfileDate\tdate(raven)\tTag 1\tTag 2\tnotes\tAnalyst\n')
-
-            # Get the site name
-            site_tags = data_id.split('_')
-            site = site_tags[0]
-            # Output the individual predictions
-            i = 1
-            for prediction in predictions[data_id]:
-                # Get the time in seconds
-                if in_seconds:
-                    pred_start, pred_end, length = prediction
-                else:
-                    pred_start, pred_end, length = spect_call_to_time(prediction)
-                # Convert to hours and minutes as well
-                Hs = math.floor(pred_start / 3600.)
-
-                f.write('{}\tSpectrogram 1\t1\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t\t\t\t\t\t{}\n'.format(i, pred_start, pred_end, dummy_low_freq, dummy_high_freq, begin_path, pred_start, data_id+'.wav', site, Hs, "AI"))
-                i += 1
+            write_predictions_csv(f, predictions[data_id], data_id, begin_path, in_seconds=in_seconds)
+
+
+def write_predictions_csv(f, predicted_calls, data_id, begin_path="Dummy_Path", 
+                            begin_file=None, in_seconds=False):
+    """
+        Write the predicted calls of one recording to the open file f,
+        in the form of the ground truth label files. begin_file
+        defaults to data_id + '.wav'
+
+        Params:
+        in_seconds - signifies that predictions are already converted to seconds
+    """
+    dummy_low_freq = 5
+    dummy_high_freq = 100
+    if begin_file is None:
+        begin_file = data_id + '.wav'
+
+    # Create the hedding
+    f.write('Selection\tView\tChannel\tBegin Time (s)\tEnd Time (s)\tLow Freq (Hz)\tHigh Freq (Hz)\tBegin Path\tFile Offset (s)\tBegin File\tSite\thour\tfileDate\tdate(raven)\tTag 1\tTag 2\tnotes\tAnalyst\n')
+
+    # Get the site name
+    site_tags = data_id.split('_')
+    site = site_tags[0]
+    # Output the individual predictions
+    i = 1
+    for prediction in predicted_calls:
+        # Get the time in seconds
+        if in_seconds:
+            pred_start, pred_end, length = prediction
+        else:
+            pred_start, pred_end, length = spect_call_to_time(prediction)
+        # Convert to hours and minutes as well
+        Hs = math.floor(pred_start / 3600.)
+
+        f.write('{}\tSpectrogram 1\t1\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t\t\t\t\t\t{}\n'.format(i, pred_start, pred_end, dummy_low_freq, dummy_high_freq, begin_path, pred_start, begin_file, site, Hs, "AI"))
+        i += 1
 
 
 def get_spectrogram_paths(test_files_path, spectrogram_path, exclude_marginals=False):
@@ -1034,8 +1138,8 @@ def main(args):
     model_1_path = args.model_1
 
     # Want the model id to match that of the second model! Then 
-    model_0, _ = loadModel(model_0_path)
-    model_1, model_id = loadModel(model_1_path)
+    model_0, _ = loadModel(model_0_path, variant=args.model_variant)
+    model_1, model_id = loadModel(model_1_path, variant=args.model_variant)
     print ("Using Model with ID:", model_id)
     
     # Put in eval mode!
@@ -1055,9 +1159,13 @@ def main(args):
                  full_test_spect_paths['labels'], full_test_spect_paths['gts'], only_preds=args.only_predictions)    
 
     if args.make_full_preds:
+        prefilter = None
+        if args.prefilter_db is not None:
+            prefilter = EnergyPrefilter(threshold_db=args.prefilter_db, smooth_frames=parameters.MIN_CALL_LENGTH)
         generate_predictions_full_spectrograms(full_dataset, model_0, model_id, args.predictions_path,
              sliding_window=True, chunk_size=parameters.CHUNK_SIZE, jump=parameters.PREDICTION_SLIDE_LENGTH, 
-             hierarchical_model=model_1, hierarchy_threshold=parameters.FALSE_POSITIVE_THRESHOLD)   
+             hierarchical_model=model_1, hierarchy_threshold=parameters.FALSE_POSITIVE_THRESHOLD,
+             prefilter=prefilter, use_cache=not args.recompute)
     elif args.full_stats:
         # Now we have to decide what to do with these stats
         results = eval_full_spectrograms(full_dataset, model_id, args.predictions_path, 
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+
+"""
+Long-running variant of Inference_pipeline.py. Rather than starting
+new processes for each batch of recordings, which re-import torch and
+re-load both stage models, the daemon loads model_0 and model_1 once and
+then watches an inbox directory for arriving .wav files.
+
+Each arrived file is run through spectrogram generation, 2-stage
+model prediction and call extraction by a bounded pool of worker
+threads, all sharing the resident models. The call predictions are
+written to the outbox as <recording>.txt, in the form of the ground
+truth label files. Output files are written under a temporary name and
+then renamed, so that a file in the outbox is always complete.
+
+Processed recordings are moved to <inbox>/processed, or to
+<inbox>/failed if processing raised an error, so that restarting the
+daemon does not redo them.
+
+A .wav file counts as arrived once its size and modification time did
+not change between two polls, so that files still being copied into
+the inbox are left alone.
+
+The daemon keeps a status file (default <outbox>/daemon_status.json)
+with the queue depth, the files in progress, and the latency of the
+recently processed files, broken down by processing step.
+
+Example run:
+
+python inference_daemon.py --inbox <incoming .wav dir> --outbox <call predictions dir> --model_0 2_Stage_Model/first_stage.pt --model_1 2_Stage_Model/second_stage.pt
+
+Process the files now in the inbox, then exit:
+
+python inference_daemon.py --inbox <incoming .wav dir> --outbox <call predictions dir> --once
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import shutil
+import signal
+import sys
+import threading
+import time
+
+import numpy as np
+from scipy.io import wavfile
+import torch
+
+import parameters
+import generate_spectrograms
+from hierarchical_eval import loadModel, predict_spec_sliding_window, get_binary_predictions
+from hierarchical_eval import find_elephant_calls, write_predictions_csv
+
+
+class Inference_Daemon(object):
+    """
+        Watches an inbox directory, and predicts the elephant calls of
+        arriving .wav files with models loaded once
+    """
+
+    STATUS_FILE = 'daemon_status.json'
+    PROCESSED_DIR = 'processed'
+    FAILED_DIR = 'failed'
+    # Number of recent files whose latencies are kept in the status
+    NUM_RECENT = 50
+
+    def __init__(self, inbox, outbox, model_0, model_1, model_variant=None,
+                    num_workers=2, max_pending=None, poll_secs=2., status_path=None,
+                    spectrogram_info=None):
+        """
+        @param inbox: Directory watched for .wav files
+        @param outbox: Directory the call prediction files are written to
+        @param model_0: Path to the stage_1 model
+        @param model_1: Path to the stage_2 model
+        @param model_variant: None, or 'int8' / 'frozen' for the cpu
+        inference variants of both models
+        @param num_workers: Number of files processed at the same time
+        @param max_pending: Most files handed to the workers at a time,
+        including those in progress. Defaults to twice num_workers
+        @param poll_secs: Seconds between looks at the inbox
+        @param status_path: Path of the status file. If None, it is
+        'daemon_status.json' in the outbox
+        @param spectrogram_info: Spectrogram parameters as used by
+        temp_spectrogramer.py (NFFT, hop, max_freq, window, pad_to)
+        """
+        super(Inference_Daemon, self).__init__()
+        self.inbox = inbox
+        self.outbox = outbox
+        self.num_workers = num_workers
+        self.max_pending = 2 * num_workers if max_pending is None else max_pending
+        self.poll_secs = poll_secs
+        self.status_path = os.path.join(outbox, Inference_Daemon.STATUS_FILE) \
+                            if status_path is None else status_path
+        self.spectrogram_info = {'NFFT': 4096,
+                                 'hop': 800,
+                                 'max_freq': 150,
+                                 'window': 256,
+                                 'pad_to': 4096}
+        if spectrogram_info is not None:
+            self.spectrogram_info.update(spectrogram_info)
+
+        for directory in [outbox, os.path.join(inbox, Inference_Daemon.PROCESSED_DIR),
+                            os.path.join(inbox, Inference_Daemon.FAILED_DIR)]:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        # Load the models once, as in hierarchical_eval.py
+        load_start = time.time()
+        self.model_0, _ = loadModel(model_0, variant=model_variant)
+        self.model_1, self.model_id = loadModel(model_1, variant=model_variant)
+        self.model_0.eval()
+        self.model_1.eval()
+        self.model_load_secs = time.time() - load_start
+        print ("Using Model with ID:", self.model_id)
+
+        # {wav path : (size, mtime)} at the last poll, for files not yet queued
+        self.sightings = {}
+        # {wav path : future} of the files handed to the workers
+        self.pending = {}
+        self.in_progress = {}
+        self.recent = []
+        self.num_processed = 0
+        self.num_failed = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def run(self, once=False):
+        """
+            Poll the inbox until stop() is called (e.g. by SIGTERM),
+            or with once, until the files now in the inbox are done
+        """
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            while not self.stop_event.is_set():
+                self.reap()
+                arrived = self.poll()
+                for wav_path in arrived:
+                    if len(self.pending) >= self.max_pending:
+                        break
+                    del self.sightings[wav_path]
+                    self.pending[wav_path] = pool.submit(self.process, wav_path)
+                self.write_status()
+
+                if once and len(self.pending) == 0 and len(self.sightings) == 0:
+                    break
+                self.stop_event.wait(self.poll_secs)
+
+            # Let the workers finish the files they have
+            for future in list(self.pending.values()):
+                future.result()
+        self.reap()
+        self.write_status()
+
+    def stop(self, *_args):
+        print ("Stopping after the files in progress")
+        self.stop_event.set()
+
+    def poll(self):
+        """
+            Return the .wav files of the inbox that did not change since
+            the last poll, oldest first
+        """
+        seen = {}
+        with os.scandir(self.inbox) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.wav') or not entry.is_file():
+                    continue
+                if entry.path in self.pending:
+                    continue
+                stat = entry.stat()
+                seen[entry.path] = (stat.st_size, stat.st_mtime_ns)
+
+        arrived = [wav_path for wav_path, signature in seen.items()
+                        if self.sightings.get(wav_path) == signature]
+        self.sightings = seen
+        return sorted(arrived, key=lambda wav_path: seen[wav_path][1])
+
+    def reap(self):
+        """
+            Forget the files the workers are done with
+        """
+        for wav_path in [wav_path for wav_path, future in self.pending.items() if future.done()]:
+            del self.pending[wav_path]
+
+    def process(self, wav_path):
+        """
+            Predict the calls of one recording and write them to
+            the outbox. Runs in a worker thread.
+        """
+        wav_name = os.path.basename(wav_path)
+        recording = os.path.splitext(wav_name)[0]
+        tags = recording.split('_')
+        data_id = '_'.join(tags[:2])
+        timings = {}
+        start = time.time()
+        with self.lock:
+            self.in_progress[wav_name] = start
+
+        try:
+            # Step 1) Spectrogram, transformed as by ElephantDatasetFull
+            step_start = time.time()
+            samplerate, raw_audio = wavfile.read(wav_path)
+            spectrogram_info = dict(self.spectrogram_info, samplerate=samplerate)
+            spectrogram = generate_spectrograms.generate_spectogram(raw_audio, spectrogram_info, data_id)
+            spectrogram = 10 * np.log10(spectrogram)
+            timings['spectrogram'] = time.time() - step_start
+
+            # Step 2) 2-stage model prediction
+            step_start = time.time()
+            with torch.no_grad():
+                predictions, _ = predict_spec_sliding_window(spectrogram, self.model_0,
+                                            chunk_size=parameters.CHUNK_SIZE,
+                                            jump=parameters.PREDICTION_SLIDE_LENGTH,
+                                            hierarchical_model=self.model_1,
+                                            hierarchy_threshold=parameters.FALSE_POSITIVE_THRESHOLD)
+            timings['predict'] = time.time() - step_start
+
+            # Step 3) Calls, written under a temporary name and renamed
+            step_start = time.time()
+            binary_preds, _ = get_binary_predictions(predictions, threshold=parameters.EVAL_THRESHOLD)
+            predicted_calls, _ = find_elephant_calls(binary_preds, min_call_length=parameters.MIN_CALL_LENGTH)
+            out_path = os.path.join(self.outbox, recording + '.txt')
+            tmp_path = out_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                write_predictions_csv(f, predicted_calls, data_id, begin_file=wav_name)
+            os.replace(tmp_path, out_path)
+            timings['calls'] = time.time() - step_start
+
+            done_dir = Inference_Daemon.PROCESSED_DIR
+            error = None
+            print ("Predicted {} calls for {} in {:.1f}s".format(len(predicted_calls), wav_name, time.time() - start))
+        except Exception as e:
+            done_dir = Inference_Daemon.FAILED_DIR
+            error = repr(e)
+            print ("FILE Failed", wav_name, error)
+
+        shutil.move(wav_path, os.path.join(self.inbox, done_dir, wav_name))
+
+        with self.lock:
+            del self.in_progress[wav_name]
+            if error is None:
+                self.num_processed += 1
+            else:
+                self.num_failed += 1
+            self.recent.append({'file': wav_name,
+                                'finished': time.time(),
+                                'latency_secs': time.time() - start,
+                                'step_secs': timings,
+                                'error': error})
+            self.recent = self.recent[-Inference_Daemon.NUM_RECENT:]
+
+    def write_status(self):
+        """
+            Write the status file, under a temporary name and renamed
+        """
+        with self.lock:
+            latencies = [done['latency_secs'] for done in self.recent if done['error'] is None]
+            status = {'pid': os.getpid(),
+                      'started': self.started,
+                      'updated': time.time(),
+                      'model_id': self.model_id,
+                      'model_load_secs': self.model_load_secs,
+                      'inbox': self.inbox,
+                      'outbox': self.outbox,
+                      # Files arrived or arriving, and not yet done
+                      'queue_depth': len(self.pending) + len(self.sightings),
+                      'in_progress': {wav_name : time.time() - start
+                                        for wav_name, start in self.in_progress.items()},
+                      'num_processed': self.num_processed,
+                      'num_failed': self.num_failed,
+                      'mean_latency_secs': float(np.mean(latencies)) if len(latencies) > 0 else None,
+                      'recent': self.recent}
+        tmp_path = self.status_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(status, f, indent=2)
+        os.replace(tmp_path, self.status_path)
+
+
+# ---------------- Main -------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     description="Predict elephant calls of .wav files arriving in an inbox directory."
+                                     )
+    parser.add_argument('--inbox', type=str, required=True,
+        help='Directory watched for .wav files')
+    parser.add_argument('--outbox', type=str, default='./Call_Predictions',
+        help='Directory the call prediction files are written to')
+    parser.add_argument('--model_0', type=str, default="./Model/first_stage.pt",
+        help='Path to the model provided called "first_stage.pt"')
+    parser.add_argument('--model_1', type=str, default="./Model/second_stage.pt",
+        help='Path to the model provided called "second_stage.pt"')
+    parser.add_argument('--model_variant', type=str, choices=['int8', 'frozen'], default=None,
+        help='Use the cpu inference variants of both models exported by Refactored/export_models.py')
+    parser.add_argument('--workers', type=int, default=2,
+        help='Number of files processed at the same time')
+    parser.add_argument('--poll', type=float, default=2.,
+        help='Seconds between looks at the inbox')
+    parser.add_argument('--status', type=str, default=None,
+        help='Path of the status file; default: <outbox>/daemon_status.json')
+    parser.add_argument('--once', action='store_true',
+        help='Process the files now in the inbox, then exit')
+
+    args = parser.parse_args();
+
+    daemon = Inference_Daemon(args.inbox, args.outbox, args.model_0, args.model_1,
+                              model_variant=args.model_variant, num_workers=args.workers,
+                              poll_secs=args.poll, status_path=args.status)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run(once=args.once)
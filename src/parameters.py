@@ -29,6 +29,10 @@ EVAL_THRESHOLD = 0.5
 ''' Hop/stride length of model window when predicting over full spectrogram '''
 PREDICTION_SLIDE_LENGTH = 128
 
+''' FFT length and hop (in samples) the full test spectrograms were made with '''
+SPECTROGRAM_NFFT = 4096
+SPECTROGRAM_HOP = 800
+
 ##############################
 #### Model_0 / Solo Model ####
 ##############################
@@ -12,6 +12,7 @@ from matplotlib.text import Text
 from scipy.signal.filter_design import freqz, sosfreqz
 
 from DSP.dsp_utils import DSPUtils
+from DSP.dsp_utils import SpectrogramPyramid
 import matplotlib.gridspec as grd
 import matplotlib.pyplot as plt
 import numpy as np
@@ -70,7 +71,8 @@ class Plotter(object):
                          spectro,
                          time_intervals_to_cover=None,
                          title='Spectrogram (secs)',
-                         block=False
+                         block=False,
+                         pixel_width=None
                          ):
         '''
         Given a long spectrogram (frequency strengths (rows) and time (columns)),
@@ -93,64 +95,54 @@ class Plotter(object):
         Result is a matrix of plots, with the true labels
         for frequencies and times.
         
+        Each snippet is plotted with no more time frames than 
+        about twice the pixels it is wide: longer snippets are 
+        max-pooled in time. Given a SpectrogramPyramid, the pooled
+        frames are read from the matching pyramid level, so that
+        even whole-day spectrograms plot without being read in full. 
+        
         @param spectro: datagrame whose rows are frequency energy,
-            and whose columns are time
-        @type spectro: pd.Dataframe
+            and whose columns are time; or the pyramid of a spectrogram
+        @type spectro: {pd.Dataframe | SpectrogramPyramid}
         @param time_intervals_to_cover: a list of 2-tuples whose values are  
              time intervals in seconds.
         @type time_intervals_to_cover: [({int | float}, {int | float})]
         @param block: whether or not to wait with return
             till user dismisses the figure window.
         @type block: bool
+        @param pixel_width: width of each snippet's plot in pixels.
+            Default: the figure width divided among the snippets
+            of a row.
+        @type pixel_width: {None | int}
         '''
 
-        time_labels = spectro.columns
+        if type(spectro) == pd.DataFrame:
+            min_spectrogram_time = spectro.columns[0]
+            max_spectrogram_time = spectro.columns[-1]
+        else:
+            # A SpectrogramPyramid:
+            min_spectrogram_time = spectro.start_secs
+            max_spectrogram_time = spectro.end_secs
         
         # Define the grid of spectrogram plots:
         
         default_spectrogram_segment_secs = 30 # seconds
 
-        max_spectrogram_time = time_labels[-1]
-        
         if type(time_intervals_to_cover) == list \
             and len(time_intervals_to_cover) == 0:
             # Show the whole spectrogram:
-            time_intervals_to_cover = [(0, max_spectrogram_time)]
-            time_label_indices_to_cover = [(0,len(time_labels)-1)]
-            time_indices = np.arange(0,len(time_labels))
+            time_intervals_to_cover = [(min_spectrogram_time, max_spectrogram_time)]
             plot_grid_width = 1
             plot_grid_height = 1
-            num_plots = 1
 
         elif time_intervals_to_cover is not None:
         
-            # Find index pairs into time_labels that contain 
-            # the passed-in time intervals. We'll fill the following
-            # with start-stop index pairs:
-            time_indices = []
-        
             # Case 1: caller specified particular time intervals:
             num_spectrograms = len(time_intervals_to_cover)
             plot_grid_width = 3
             # Number of 3-column spectrogram rows we'll need:
             plot_grid_height = int(np.ceil(num_spectrograms / plot_grid_width))
-            num_plots = plot_grid_height * plot_grid_width
 
-            # Find the requested times in the time labels:
-            for (min_sec, max_sec) in time_intervals_to_cover:
-                # Get a two-el array with indices into
-                # time labels for which spectrogram is to 
-                # be constructed. First, find all the indices
-                # that point to values within the min/max time:
-                time_interval_indices = np.nonzero(np.logical_and(time_labels >= min_sec,
-                                                                  time_labels < max_sec)
-                )
-                # Remember the first and last index:
-                time_indices.append((time_interval_indices[0], time_interval_indices[-1]))
-                
-            # To match datatype of time_indices in the else 
-            # branch:
-            time_indices = np.array(time_indices)
         else:
             # No time intervals given, spread 30-second spectrogram
             # excerpts equally across the full width of the total
@@ -158,50 +150,33 @@ class Plotter(object):
             plot_grid_width = 3
             plot_grid_height = 6
             num_plots = plot_grid_height * plot_grid_width
-            time_indices = []
-            plot_mid_point_every = time_labels[-1] / default_spectrogram_segment_secs
+            time_intervals_to_cover = []
+            plot_mid_point_every = max_spectrogram_time / default_spectrogram_segment_secs
             half_interval        = default_spectrogram_segment_secs / 2.
             curr_mid_point = plot_mid_point_every
             while curr_mid_point < max_spectrogram_time:
                 min_sec = max(0, curr_mid_point - half_interval)
                 max_sec = min(max_spectrogram_time, curr_mid_point + half_interval)
-                # Get a two-el array with indices into
-                # time labels for which spectrogram is to 
-                # be constructed. np.nonzero() returns a 
-                # *tuple* of arrays; therefore the [0]:
-                time_interval_indices = np.nonzero(np.logical_and(time_labels >= min_sec,
-                                                                  time_labels < max_sec)
-                )[0]
-                # Record the first and last time index
-                # to cover in this window:
-                time_indices.append((time_interval_indices[0], 
-                                                    time_interval_indices[-1]))
+                time_intervals_to_cover.append((min_sec, max_sec))
                 curr_mid_point += plot_mid_point_every
            
-            # Now we have indices into the times for many 
-            # adjacent 30-sec  segments. But we only want num_plots
-            # spectrograms. Pick segments evenly spaced:
-            num_30sec_segments = len(time_indices)
+            # Now we have many adjacent 30-sec segments. But
+            # we only want num_plots spectrograms. Pick segments 
+            # evenly spaced:
+            num_30sec_segments = len(time_intervals_to_cover)
             num_30sec_segments_wanted = int(np.ceil(num_30sec_segments / num_plots))
-            # For convenient selection using range(), make
-            # time_indices into a numpy array:
-            time_indices = np.array(time_indices)
-            time_label_indices_to_cover = time_indices[range(0,
-                                                       num_30sec_segments,
-                                                       num_30sec_segments_wanted
-                                                       )
-                                                      ]
+            time_intervals_to_cover = time_intervals_to_cover[0:num_30sec_segments:num_30sec_segments_wanted]
             
-        # We now have an array of start-top *indices* into
-        # the time labels array. We create a spectrogram
+        # We now have start-stop times. We create a spectrogram
         # plot for each of them, placing each plot into a
         # matrix of plots:
 
         self._plot_spectrogram_excerpts(spectro,
-                                        time_label_indices_to_cover, 
+                                        time_intervals_to_cover, 
                                         plot_grid_width,
                                         plot_grid_height,
-                                        title=title)
+                                        title=title,
+                                        pixel_width=pixel_width)
         
         if block:
             self.block_till_figs_dismissed()
@@ -265,15 +240,17 @@ class Plotter(object):
                                              **kwargs
                                              ):
         '''
-        Read spectrogram dataframe from file, and
-        call plot_spectrogram_from_magnitudes().
+        Plot a spectrogram file (.pickle or .npy) via
+        plot_spectrogram_from_magnitudes(). The plots are 
+        made from the spectrogram's pyramid, which is built 
+        next to the file first if needed (see SpectrogramPyramid).
         Additional args and kwargs are passed through
-        to that latter method.
+        to plot_spectrogram_from_magnitudes().
          
         @param dff_file:
         @type dff_file:
         '''
-        spectro = DSPUtils.load_spectrogram(dff_file)
+        spectro = SpectrogramPyramid.for_spectrogram(dff_file)
         
         self.plot_spectrogram_from_magnitudes(spectro,
                                               *args,
@@ -291,7 +268,9 @@ class Plotter(object):
                                             binary_preds=None, 
                                             title=None, 
                                             vert_lines=None,
-                                            filters=[]
+                                            filters=[],
+                                            time_interval=None,
+                                            pixel_width=None
                                             ):
         '''
         Visualizes the spectogram and associated predictions/label_mask. 
@@ -301,13 +280,20 @@ class Plotter(object):
         when they're not passed in. 
     
         Inputs are numpy arrays
+        
+        Spans with more time frames than pixels are max-pooled in time,
+        the predictions and label mask along with the spectrogram, so 
+        that calls remain visible. Given a SpectrogramPyramid, the
+        pooled frames are read from the matching pyramid level. Filters
+        are applied after pooling.
     
-        @param spectrogram:
-        @type spectrogram:
-        @param predictions:
-        @type predictions:
-        @param label_mask:
-        @type label_mask:
+        @param spectrogram: the spectrogram, or its pyramid
+        @type spectrogram: {pd.DataFrame | SpectrogramPyramid}
+        @param predictions: one value for each frame of the
+            (entire) spectrogram
+        @type predictions: np.array
+        @param label_mask: 1/0 for each frame of the spectrogram
+        @type label_mask: np.array
         @param binary_preds:
         @type binary_preds:
         @param title:
@@ -316,7 +302,37 @@ class Plotter(object):
         @type vert_lines:
         @param filters:
         @type filters:
+        @param time_interval: start and end second of the
+            part to show. Default: the entire spectrogram
+        @type time_interval: {None | ({int | float}, {int | float})}
+        @param pixel_width: width of the plot in pixels. Default:
+            the width of the default figure
+        @type pixel_width: {None | int}
         '''
+        if pixel_width is None:
+            pixel_width = self.default_pixel_width()
+        (start_sec, end_sec) = (None, None) if time_interval is None else time_interval
+        
+        if type(spectrogram) == pd.DataFrame:
+            time_labels = spectrogram.columns.to_numpy(dtype=float)
+            frames = slice(0 if start_sec is None else int(np.searchsorted(time_labels, start_sec, side='left')),
+                           len(time_labels) if end_sec is None else int(np.searchsorted(time_labels, end_sec, side='right')))
+            spectrogram = spectrogram.iloc[:, frames]
+            level = SpectrogramPyramid.level_for_span(spectrogram.shape[1], pixel_width)
+            spectrogram = self._decimate_dataframe(spectrogram, level)
+        else:
+            # A SpectrogramPyramid:
+            (level, start_frame, end_frame) = spectrogram.level_frames(start_sec, 
+                                                                       end_sec, 
+                                                                       pixel_width)
+            spectrogram = spectrogram.excerpt(level, start_frame, end_frame)
+            # The spectrogram frames pooled into the excerpt:
+            frames = slice(start_frame * 2**level, end_frame * 2**level)
+        
+        if predictions is not None:
+            predictions = SpectrogramPyramid.decimate(predictions[frames], level)
+        if label_mask is not None:
+            label_mask = SpectrogramPyramid.decimate(label_mask[frames], level)
         
         spectro_magnitudes_copy = np.copy(spectrogram.to_numpy())
         if filters is not None:
@@ -330,10 +346,12 @@ class Plotter(object):
                    {}                        # No additional func needed
                    )
         
-        self._plot_truth(spectro_magnitudes_copy,
-                         outputs=predictions,
-                         labels=label_mask,
-                         binary_preds=binary_preds,
+        self._plot_truth(pd.DataFrame(spectro_magnitudes_copy,
+                                      index=spectrogram.index,
+                                      columns=spectrogram.columns
+                                      ),
+                         predictions=predictions,
+                         label_mask=label_mask,
                          title=title,
                          vert_lines=vert_lines
                          )
@@ -420,7 +438,8 @@ class Plotter(object):
         # hz_per_row = max(freq_labels) / len(freq_labels)
         keep_every_nth_y    = int(len(freq_labels) / 10)
         sparse_freq_labels  = freq_labels[1::keep_every_nth_y]
-        sparse_freq_indices = range(1,int(max(freq_labels)),keep_every_nth_y)
+        # Row indices of those labels:
+        sparse_freq_indices = range(1,len(freq_labels),keep_every_nth_y)
         
         plt.yticks(sparse_freq_indices,
                    sparse_freq_labels,
@@ -582,39 +601,37 @@ class Plotter(object):
     
     def _plot_spectrogram_excerpts(self,
              spectro,
-             time_label_indices_to_cover,
+             time_intervals_to_cover,
              plot_grid_width=3,
              plot_grid_height=6,
-             title='Spectrogram'
+             title='Spectrogram',
+             pixel_width=None
              ):
         '''
         Workhorse for plotting pieces from
         one spectgrogram. Used by plot_spectrogram_from_magnitudes() 
         
-        @param time_label_indices_to_cover:
-        @type time_label_indices_to_cover:
-        @param freq_time:
-        @type freq_time:
-        @param time_labels:
-        @type time_labels:
-        @param freq_labels:
-        @type freq_labels:
+        @param spectro: spectrogram, or its pyramid
+        @type spectro: {pd.DataFrame | SpectrogramPyramid}
+        @param time_intervals_to_cover: start and end second
+            of each piece
+        @type time_intervals_to_cover: [({int | float}, {int | float})]
         @param plot_grid_width:
         @type plot_grid_width:
         @param plot_grid_height:
         @type plot_grid_height:
         @param title:
         @type title:
+        @param pixel_width: width of each plot in pixels
+        @type pixel_width: {None | int}
         '''
 
-        freq_time = spectro.to_numpy()
-        time_labels = spectro.columns
-        freq_labels = spectro.index
-        
         fig, axes = plt.subplots(ncols=plot_grid_width,
                                  nrows=plot_grid_height,
                                  constrained_layout=True)
         fig.suptitle(title)
+        if pixel_width is None:
+            pixel_width = int(fig.get_figwidth() * fig.dpi / plot_grid_width)
 
         fig.show()
         
@@ -625,11 +642,15 @@ class Plotter(object):
         else:
             flat_axes = [axes]
         plot_position = 0
-        for (min_sec_index, max_sec_index) in time_label_indices_to_cover:
+        for (min_sec, max_sec) in time_intervals_to_cover:
             
             # Take next segment to be displayed from spectrogram:
-            # i.e. all frequencies (y-axis), and the time interval:
-            matrix_excerpt = freq_time[0:, min_sec_index:max_sec_index]
+            # i.e. all frequencies (y-axis), and the time interval,
+            # pooled down to about the width of the plot:
+            excerpt = self._spectrogram_excerpt(spectro, min_sec, max_sec, pixel_width)
+            matrix_excerpt = excerpt.to_numpy()
+            time_labels = excerpt.columns
+            freq_labels = excerpt.index
             ax = flat_axes[plot_position]
             ax.set_autoscaley_on(True)
             
@@ -639,8 +660,8 @@ class Plotter(object):
             highest_freq = np.ceil(freq_labels[-1])
             lowest_freq = np.floor(freq_labels[0])
 
-            lowest_time  = np.floor(time_labels[min_sec_index])
-            highest_time = np.ceil(time_labels[max_sec_index])
+            lowest_time  = np.floor(time_labels[0])
+            highest_time = np.ceil(time_labels[-1])
             
             #lowest_time_smpte = str(timedelta(seconds=lowest_time))
             #highest_time_smpte = str(timedelta(seconds=highest_time))
@@ -684,6 +705,64 @@ class Plotter(object):
                 new_xticklabels.append(xtick_text)
             ax.set_xticklabels(new_xticklabels)
 
+    #------------------------------------
+    # _spectrogram_excerpt
+    #-------------------
+    
+    def _spectrogram_excerpt(self, spectro, min_sec, max_sec, pixel_width):
+        '''
+        The part of a spectrogram between min_sec and max_sec,
+        max-pooled in time down to no fewer than pixel_width frames.
+        
+        @param spectro: spectrogram, or its pyramid
+        @type spectro: {pd.DataFrame | SpectrogramPyramid}
+        @param min_sec: start of the excerpt
+        @type min_sec: {int | float}
+        @param max_sec: end of the excerpt
+        @type max_sec: {int | float}
+        @param pixel_width: width of the plot in pixels
+        @type pixel_width: int
+        @return: excerpt, with the times of the pooled frames as columns
+        @rtype: pd.DataFrame
+        '''
+        if type(spectro) != pd.DataFrame:
+            # A SpectrogramPyramid:
+            return spectro.to_dataframe(min_sec, max_sec, pixel_width)
+        
+        time_labels = spectro.columns
+        excerpt = spectro.loc[:, np.logical_and(time_labels >= min_sec,
+                                                time_labels <= max_sec)]
+        level = SpectrogramPyramid.level_for_span(excerpt.shape[1], pixel_width)
+        return self._decimate_dataframe(excerpt, level)
+
+    #------------------------------------
+    # _decimate_dataframe
+    #-------------------
+    
+    def _decimate_dataframe(self, spectro, level):
+        '''
+        Max-pool the time frames of a spectrogram DataFrame
+        as level level of a SpectrogramPyramid would. 
+        '''
+        if level == 0:
+            return spectro
+        return pd.DataFrame(SpectrogramPyramid.decimate(spectro.to_numpy(), level, 'max'),
+                            index=spectro.index,
+                            columns=SpectrogramPyramid.decimate(spectro.columns.to_numpy(dtype=float), 
+                                                                level, 
+                                                                'mean')
+                            )
+
+    #------------------------------------
+    # default_pixel_width
+    #-------------------
+    
+    def default_pixel_width(self):
+        '''
+        Width in pixels of a figure of default size
+        '''
+        return int(plt.rcParams['figure.figsize'][0] * plt.rcParams['figure.dpi'])
+
     #------------------------------------
     # plot_frequency_response
     #-------------------
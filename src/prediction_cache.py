@@ -0,0 +1,211 @@
+"""
+    Cache of the full spectrogram predictions made by
+    eval.generate_predictions_full_spectrograms and
+    hierarchical_eval.generate_predictions_full_spectrograms.
+
+    Predictions are keyed by the content of what made them: a hash of
+    the model weights (both models of a hierarchical model), a hash of
+    the spectrogram file, and the prediction parameters (window size,
+    jump, normalization, pre-filter, ...). The keys of the saved
+    predictions are kept in a manifest (cache_manifest.json) in the
+    model's predictions folder:
+
+        {'version': 1,
+         'spectrograms': {spectrogram path : [size, mtime_ns, hash]},
+         'predictions': {data_id : {'key': ..., 'model': ..., 'spectrogram': ..., 'params': ...}}
+        }
+
+    Predictions whose key still matches are not made again. Changing the
+    model, a spectrogram or a parameter changes the key, so stale
+    predictions are not reused even though the folder is named only by
+    the model id. Re-running after adding a few recordings only predicts
+    the new ones.
+
+    Spectrogram files are hashed again only when their size or
+    modification time changed since they were last hashed.
+
+    Every write of predictions into the folder must go through drop()
+    and record(), also when the cache is not consulted (--recompute):
+    otherwise the manifest keeps the keys of the overwritten predictions,
+    and a later run with those older inputs would take the new
+    predictions for its own.
+"""
+import hashlib
+import io
+import json
+import os
+import zipfile
+
+import torch
+
+MANIFEST_FILE = 'cache_manifest.json'
+MANIFEST_VERSION = 1
+
+# Bytes read at a time when hashing files
+READ_SIZE = 1 << 20
+
+class PredictionCache(object):
+    """
+        Manifest of the predictions saved in one model's predictions folder
+    """
+
+    def __init__(self, path, models, **params):
+        """
+            path - the model's predictions folder
+            models - the models making the predictions, e.g. [model_0, model_1]
+            params - everything else the predictions depend on,
+            e.g. chunk_size, jump, preprocess
+        """
+        self.path = path
+        self.manifest_path = os.path.join(path, MANIFEST_FILE)
+        self.model_hash = combined_hash([model_hash(model) for model in models])
+        self.params = params
+        self.num_cached = 0
+        self.num_computed = 0
+
+        self.manifest = read_manifest(self.manifest_path)
+        if self.manifest is None:
+            self.manifest = {'version': MANIFEST_VERSION, 'spectrograms': {}, 'predictions': {}}
+
+    def spectrogram_hash(self, spect_path):
+        """
+            Hash of a spectrogram file, from the manifest
+            unless the file changed since it was hashed
+        """
+        stat = os.stat(spect_path)
+        known = self.manifest['spectrograms'].get(spect_path)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        spect_hash = file_hash(spect_path)
+        self.manifest['spectrograms'][spect_path] = [stat.st_size, stat.st_mtime_ns, spect_hash]
+        return spect_hash
+
+    def key(self, spect_path):
+        return combined_hash([self.model_hash, self.spectrogram_hash(spect_path),
+                                json.dumps(self.params, sort_keys=True)])
+
+    def is_cached(self, data_id, spect_path):
+        """
+            Whether the saved predictions of data_id were made by these
+            models, from this spectrogram, with these parameters. The
+            caller still has to check that the saved predictions exist.
+        """
+        entry = self.manifest['predictions'].get(data_id)
+        return entry is not None and entry['key'] == self.key(spect_path)
+
+    def hit(self, data_id):
+        self.num_cached += 1
+        print ("Cached Prediction for:", data_id)
+
+    def record(self, data_id, spect_path):
+        """
+            Note that the predictions of data_id were just saved.
+            The manifest is written each time, so that an interrupted
+            run keeps the predictions it made.
+        """
+        self.num_computed += 1
+        self.manifest['predictions'][data_id] = {'key': self.key(spect_path),
+                                                 'model': self.model_hash,
+                                                 'spectrogram': self.spectrogram_hash(spect_path),
+                                                 'params': self.params}
+        self.save()
+
+    def drop(self, data_id):
+        """
+            Note that the saved predictions of data_id are about to
+            be overwritten, so that an interrupted write is not taken
+            for predictions made with the previous key.
+        """
+        if self.manifest['predictions'].pop(data_id, None) is not None:
+            self.save()
+
+    def save(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def summary(self):
+        return "Prediction cache: {} spectrograms cached, {} predicted".format(self.num_cached,
+                                                                              self.num_computed)
+
+
+def read_manifest(manifest_path):
+    """
+        Return the manifest saved at manifest_path, or None if
+        there is none or it was written by another version
+    """
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def model_hash(model):
+    """
+        Hash of a model's class and weights. Models saved with
+        torch.save(model) are hashed from their state dict. Frozen
+        TorchScript inference variants have an empty state dict, since
+        freezing inlines the weights into the graph as constants, so
+        they are hashed from their serialized archive instead.
+    """
+    if isinstance(model, torch.jit.ScriptModule):
+        return script_module_hash(model)
+    sha = hashlib.sha256(type(model).__name__.encode('utf-8'))
+    for name, value in sorted(model.state_dict().items()):
+        sha.update(name.encode('utf-8'))
+        _update_hash(sha, value)
+    return sha.hexdigest()
+
+
+def script_module_hash(model):
+    """
+        Hash of the code and constants of a TorchScript module, from
+        the records that torch.jit.save writes. The archive's
+        serialization id differs from save to save, so it is skipped.
+    """
+    buffer = io.BytesIO()
+    torch.jit.save(model, buffer)
+    buffer.seek(0)
+    sha = hashlib.sha256(b'ScriptModule')
+    with zipfile.ZipFile(buffer) as archive:
+        for name in sorted(archive.namelist()):
+            if name.endswith('serialization_id'):
+                continue
+            # Records are stored under a folder named after the
+            # archive, which is not part of the model
+            sha.update(name.split('/', 1)[-1].encode('utf-8'))
+            sha.update(archive.read(name))
+    return sha.hexdigest()
+
+
+def _update_hash(sha, value):
+    # Quantized models hold some of their weights in packed
+    # (tuples of) tensors rather than plain tensors
+    if isinstance(value, torch.Tensor):
+        if value.is_quantized:
+            value = value.dequantize()
+        value = value.detach().cpu().contiguous()
+        sha.update("{}{}".format(value.dtype, tuple(value.shape)).encode('utf-8'))
+        sha.update(value.reshape(-1).view(torch.uint8).numpy().tobytes())
+    elif isinstance(value, (tuple, list)):
+        for element in value:
+            _update_hash(sha, element)
+    else:
+        sha.update(repr(value).encode('utf-8'))
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def combined_hash(hashes):
+    return hashlib.sha256('|'.join(hashes).encode('utf-8')).hexdigest()
@@ -0,0 +1,251 @@
+"""
+    Compact storage for the frame predictions of a model over the full
+    test spectrograms. Rather than one float64 .npy file per recording,
+    all recordings go into one file:
+
+        magic (8 bytes) | index offset (uint64) | predictions ... | json index
+
+    The predictions of each recording are stored one after the other
+    as float16, or as uint8 probabilities quantized to 1/255. The json
+    index at the end holds the model id, the spectrogram (NFFT, hop) and
+    window parameters the predictions were made with, and for each
+    recording the offset and length of its predictions.
+
+    Readers memmap the whole file once, so that evaluating the same
+    predictions for many thresholds does no further file opens or reads
+    beyond the page cache.
+
+    Evaluation reads the store of a model's folder if there is one, and
+    the .npy files otherwise. Saving .npy predictions into a folder
+    removes its store.
+
+    Convert an existing folder of .npy predictions with:
+
+        python prediction_store.py ../Predictions/<model_id> --model_id <model_id> \
+            --NFFT 4096 --hop 800 --chunk_size 256 --jump 128
+
+    giving the parameters the predictions were made with (the defaults
+    are those of parameters.py). Evaluation only reads stores whose
+    parameters match its own.
+"""
+import argparse
+import glob
+import json
+import os
+import struct
+
+import numpy as np
+
+import parameters
+
+# Name of the store in the folder of a model's predictions
+STORE_FILE = 'predictions.store'
+
+MAGIC = b'ELEPRED1'
+PRELUDE = struct.Struct('<8sQ')
+# Each recording's predictions start at a multiple of this
+ALIGNMENT = 64
+
+DTYPES = ['float16', 'uint8']
+
+
+class PredictionStoreWriter(object):
+    """
+        Writes predictions of one model, one recording at a time.
+        Use as a context manager, or call close() when done.
+    """
+
+    def __init__(self, path, model_id, dtype='float16', **spectrogram_params):
+        """
+            path - store file to create (overwritten if it exists)
+            model_id - id of the model that made the predictions
+            dtype - 'float16', or 'uint8' for probabilities quantized to 1/255
+            spectrogram_params - recorded in the index, e.g. NFFT, hop, chunk_size, jump
+        """
+        if dtype not in DTYPES:
+            raise ValueError("Prediction store dtype must be one of {}, not '{}'".format(DTYPES, dtype))
+
+        self.path = path
+        self.index = {'model_id': model_id,
+                      'dtype': dtype,
+                      'spectrogram_params': spectrogram_params,
+                      'recordings': {}
+                      }
+        self.fd = open(path, 'wb')
+        # Patched with the index offset on close
+        self.fd.write(PRELUDE.pack(MAGIC, 0))
+
+    def add(self, data_id, predictions):
+        """
+            Append the sigmoid (0, 1) predictions of one recording
+        """
+        if data_id in self.index['recordings']:
+            raise ValueError("Predictions for {} were already added".format(data_id))
+
+        predictions = np.asarray(predictions)
+        if self.index['dtype'] == 'uint8':
+            encoded = np.rint(np.clip(predictions, 0., 1.) * 255).astype(np.uint8)
+        else:
+            encoded = predictions.astype(np.float16)
+
+        offset = self.fd.tell()
+        padding = -offset % ALIGNMENT
+        self.fd.write(b'\0' * padding)
+        self.index['recordings'][data_id] = [offset + padding, len(encoded)]
+        self.fd.write(encoded.tobytes())
+
+    def close(self):
+        if self.fd is None:
+            return
+        index_offset = self.fd.tell()
+        self.fd.write(json.dumps(self.index).encode('utf-8'))
+        self.fd.seek(0)
+        self.fd.write(PRELUDE.pack(MAGIC, index_offset))
+        self.fd.close()
+        self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class PredictionStore(object):
+    """
+        Read access to a store written by PredictionStoreWriter:
+
+            store = PredictionStore(path)
+            predictions = store['nn01a_20180126']
+            for data_id, predictions in store.items():
+                ...
+
+        Predictions are returned as float32 probabilities.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fd:
+            magic, index_offset = PRELUDE.unpack(fd.read(PRELUDE.size))
+            if magic != MAGIC or index_offset == 0:
+                raise ValueError("{} is not a complete prediction store".format(path))
+            fd.seek(index_offset)
+            self.index = json.loads(fd.read().decode('utf-8'))
+
+        self.model_id = self.index['model_id']
+        self.dtype = self.index['dtype']
+        self.spectrogram_params = self.index['spectrogram_params']
+        self.recordings = self.index['recordings']
+        self.data = np.memmap(path, dtype=np.uint8, mode='r', shape=(index_offset,))
+
+    def raw(self, data_id):
+        """
+            The stored float16 or uint8 values of a recording,
+            as a read-only view into the memmapped file
+        """
+        offset, length = self.recordings[data_id]
+        dtype = np.dtype(self.dtype)
+        return self.data[offset: offset + length * dtype.itemsize].view(dtype)
+
+    def __getitem__(self, data_id):
+        raw = self.raw(data_id)
+        if self.dtype == 'uint8':
+            return raw * np.float32(1. / 255)
+        return raw.astype(np.float32)
+
+    def __contains__(self, data_id):
+        return data_id in self.recordings
+
+    def __len__(self):
+        return len(self.recordings)
+
+    def keys(self):
+        return self.recordings.keys()
+
+    def made_with(self, **spectrogram_params):
+        """
+            Whether the predictions were made with these spectrogram
+            and window parameters, e.g. NFFT, hop, chunk_size, jump.
+            Stores written without some of them do not match.
+        """
+        # Compare as the index stores them
+        return self.spectrogram_params == json.loads(json.dumps(spectrogram_params))
+
+    def items(self):
+        """
+            (data_id, predictions) in the order they were stored
+        """
+        for data_id in self.recordings:
+            yield data_id, self[data_id]
+
+    @classmethod
+    def from_npy_dir(cls, predictions_dir, model_id, dtype='float16', **spectrogram_params):
+        """
+            Write the <data_id>.npy predictions in predictions_dir
+            into a store in that same folder, and return the store
+        """
+        path = os.path.join(predictions_dir, STORE_FILE)
+        with PredictionStoreWriter(path, model_id, dtype=dtype, **spectrogram_params) as writer:
+            for npy_file in sorted(glob.glob(os.path.join(predictions_dir, '*.npy'))):
+                data_id = os.path.splitext(os.path.basename(npy_file))[0]
+                writer.add(data_id, np.load(npy_file))
+        return cls(path)
+
+
+def open_prediction_store(model_id, predictions_path):
+    """
+        The PredictionStore of the model's predictions, or
+        None if they were saved as one .npy per spectrogram
+    """
+    store_path = predictions_path + '/' + model_id + '/' + STORE_FILE
+    if os.path.exists(store_path):
+        return PredictionStore(store_path)
+    return None
+
+
+def load_predictions(data_id, model_id, predictions_path, store=None):
+    """
+        Load the saved predictions of one spectrogram
+    """
+    if store is not None:
+        return store[data_id]
+    return np.load(predictions_path + '/' + model_id + "/" + data_id + '.npy')
+
+
+def remove_prediction_store(predictions_dir):
+    """
+        Remove the store of a model's predictions folder before new
+        predictions are saved there as .npy files. Readers use the
+        store whenever there is one, and would read its old predictions.
+    """
+    store_path = os.path.join(predictions_dir, STORE_FILE)
+    if os.path.exists(store_path):
+        print ("Removing the prediction store {}, since .npy predictions replace it".format(store_path))
+        os.remove(store_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert a folder of .npy predictions into a prediction store')
+    parser.add_argument('predictions_dir', type=str,
+        help='Folder with the <data_id>.npy predictions of one model')
+    parser.add_argument('--model_id', type=str, required=True,
+        help='Id of the model that made the predictions')
+    parser.add_argument('--dtype', type=str, choices=DTYPES, default='float16',
+        help='Storage type of the predictions')
+    parser.add_argument('--NFFT', type=int, default=parameters.SPECTROGRAM_NFFT,
+        help='FFT length of the spectrograms the predictions were made from')
+    parser.add_argument('--hop', type=int, default=parameters.SPECTROGRAM_HOP,
+        help='Hop length of the spectrograms the predictions were made from')
+    parser.add_argument('--chunk_size', type=int, default=parameters.CHUNK_SIZE,
+        help='Length of the sliding windows')
+    parser.add_argument('--jump', type=int, default=parameters.PREDICTION_SLIDE_LENGTH,
+        help='Frames between the starts of the sliding windows')
+    parser.add_argument('--full', dest='sliding_window', action='store_false',
+        help='The predictions were made on whole spectrograms rather than sliding windows')
+    args = parser.parse_args()
+
+    store = PredictionStore.from_npy_dir(args.predictions_dir, args.model_id, dtype=args.dtype,
+                                    NFFT=args.NFFT, hop=args.hop, sliding_window=args.sliding_window,
+                                    chunk_size=args.chunk_size, jump=args.jump)
+    print ("Stored predictions for {} recordings in {}".format(len(store), store.path))
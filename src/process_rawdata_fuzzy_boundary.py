@@ -14,6 +14,7 @@ from random import shuffle
 import random
 from functools import partial
 import generate_spectrograms
+import window_index
 
 """
 Example Runs Locally:
@@ -460,6 +461,9 @@ if __name__ == '__main__':
             # Create data/label 
             # pairs (i.e. (.wav, .txt))
             for eachFile in filenames:
+                # Skip the parsed-label caches next to the tables:
+                if eachFile.endswith('.labels.npz'):
+                    continue
                 # Strip off the location and time tags
                 tags = eachFile.split('_')
                 data_id = tags[0] + '_' + tags[1]
@@ -714,3 +718,5 @@ if __name__ == '__main__':
 
             f.write(data_id)
 
+    # Lets datasets pair the windows without listing the folder
+    window_index.write_manifest(out_dir)
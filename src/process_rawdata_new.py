@@ -14,6 +14,8 @@ from random import shuffle
 import random
 from functools import partial
 import generate_spectrograms
+import window_index
+from elephant_utils.raven_labels import RavenLabelTable
 
 
 parser = argparse.ArgumentParser()
@@ -79,25 +81,13 @@ def generate_labels(labels, spectrogram_info, len_wav):
     if labels is None:
         return labelMatrix
 
-    labelFile = csv.DictReader(open(labels,'rt'), delimiter='\t')
-    
-    samplerate = spectrogram_info['samplerate']
-    # Iterates through labels and marks the segments with elephant calls
-    for row in labelFile:
-        # Use the file offset to determine the start of the call
-        start_time = float(row['File Offset (s)'])
-        call_length = float(row['End Time (s)']) - float(row['Begin Time (s)'])
-        end_time = start_time + call_length
-        
-        # Figure out which spectrogram slices we are on
-        # to get columns that we want to span with the given
-        # slice. This math transforms .wav indeces to spectrogram
-        # indices
-        start_spec = max(math.ceil((start_time * samplerate - spectrogram_info['NFFT'] / 2.) / spectrogram_info['hop']), 0)
-        end_spec = min(math.ceil((end_time * samplerate - spectrogram_info['NFFT'] / 2.) / spectrogram_info['hop']), labelMatrix.shape[0])
-        labelMatrix[start_spec : end_spec] = 1
-
-    return labelMatrix
+    # Marks the segments with elephant calls. The file offset
+    # determines the start of each call, and the math
+    # transforms .wav indeces to spectrogram indices
+    return RavenLabelTable.load(labels).frame_mask(labelMatrix.shape[0],
+                                                   samplerate=spectrogram_info['samplerate'],
+                                                   NFFT=spectrogram_info['NFFT'],
+                                                   hop=spectrogram_info['hop'])
 
 def generate_empty_chunks(n, raw_audio, label_vec, spectrogram_info):
     """
@@ -365,6 +355,9 @@ if __name__ == '__main__':
             # Create data/label 
             # pairs (i.e. (.wav, .txt))
             for eachFile in filenames:
+                # Skip the parsed-label caches next to the tables:
+                if eachFile.endswith('.labels.npz'):
+                    continue
                 # Strip off the location and time tags
                 tags = eachFile.split('_')
                 data_id = tags[0] + '_' + tags[1]
@@ -552,3 +545,5 @@ if __name__ == '__main__':
 
             f.write(path)
 
+    # Lets datasets pair the windows without listing the folder
+    window_index.write_manifest(out_dir)
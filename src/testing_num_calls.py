@@ -31,6 +31,9 @@ for currentDir in data_dirs:
         # Create data/label 
         # pairs (i.e. (.wav, .txt))
         for eachFile in filenames:
+            # Skip the parsed-label caches next to the tables:
+            if eachFile.endswith('.labels.npz'):
+                continue
             # Strip off the location and time tags
             tags = eachFile.split('_')
             data_id = tags[0] + '_' + tags[1]
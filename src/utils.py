@@ -5,6 +5,7 @@ import torch.nn as nn
 import sklearn
 from sklearn.metrics import f1_score, precision_recall_fscore_support
 import os
+import copy
 
 def set_seed(seed):
     """
@@ -168,6 +169,175 @@ def is_eval_epoch(cur_epoch):
 def sigmoid(x):                                        
     return 1 / (1 + np.exp(-x))
 
+
+class WindowNormalizer(object):
+    """
+        Per-window z-scoring of a [time, freq] spectrogram, as done
+        before each model call of the sliding window predictors:
+
+            (window - np.mean(window)) / np.std(window)
+
+        Cumulative sums over time of the frame sums and of the squared
+        frame sums are computed once, so the mean and std of any window
+        cost O(1) rather than a pass over its time x freq values, however
+        much the windows overlap. The sums are kept in float64 about
+        the overall mean of the spectrogram, so that E[x^2] - E[x]^2 does
+        not lose precision even for day long spectrograms.
+    """
+
+    # Frames per block when building the sums; bounds the
+    # size of the temporary float64 copy
+    BLOCK_FRAMES = 8192
+
+    def __init__(self, spectrogram):
+        self.spectrogram = spectrogram
+        self.num_frames, self.num_freqs = spectrogram.shape
+        self.offset = float(np.mean(spectrogram))
+
+        # sums[i] holds the sum over frames [0, i)
+        self.sums = np.zeros(self.num_frames + 1)
+        self.squared_sums = np.zeros(self.num_frames + 1)
+        for block_start in range(0, self.num_frames, self.BLOCK_FRAMES):
+            block_end = min(block_start + self.BLOCK_FRAMES, self.num_frames)
+            block = spectrogram[block_start:block_end].astype(np.float64) - self.offset
+            self.sums[block_start + 1:block_end + 1] = block.sum(axis=1)
+            self.squared_sums[block_start + 1:block_end + 1] = np.einsum('ij,ij->i', block, block)
+        np.cumsum(self.sums, out=self.sums)
+        np.cumsum(self.squared_sums, out=self.squared_sums)
+
+    def window_stats(self, starts, length):
+        """
+            Mean and (population) std of the windows of the given
+            length that begin at frames starts. Windows that run
+            past the end of the spectrogram are cut short there.
+
+            Returns (means, stds) with the shape of starts
+        """
+        starts = np.asarray(starts)
+        ends = np.minimum(starts + length, self.num_frames)
+        num_values = (ends - starts) * self.num_freqs
+        means = (self.sums[ends] - self.sums[starts]) / num_values
+        variances = (self.squared_sums[ends] - self.squared_sums[starts]) / num_values - means ** 2
+        # Rounding can make the variance of constant windows
+        # slightly negative:
+        stds = np.sqrt(np.maximum(variances, 0.))
+        return means + self.offset, stds
+
+    def normalized_window(self, start, length):
+        """
+            The z-scored window [start, start + length) of the
+            spectrogram, cut short at its end
+        """
+        mean, std = self.window_stats(start, length)
+        return (self.spectrogram[start:start + length] - mean) / std
+
+    def normalized_windows(self, starts, length):
+        """
+            Array [len(starts), length, freq] of the z-scored
+            windows beginning at starts. All windows must lie
+            within the spectrogram.
+        """
+        means, stds = self.window_stats(starts, length)
+        windows = np.empty((len(starts), length, self.num_freqs))
+        for i, start in enumerate(starts):
+            np.subtract(self.spectrogram[start:start + length], means[i], out=windows[i])
+            windows[i] /= stds[i]
+        return windows
+
+
+class DeviceWindowNormalizer(WindowNormalizer):
+    """
+        WindowNormalizer that copies the spectrogram to the torch
+        device once, and cuts out and z-scores batches of windows
+        there. Only the per-window means and stds, computed from
+        the cumulative sums, are sent for each batch.
+    """
+
+    def __init__(self, spectrogram, device):
+        super(DeviceWindowNormalizer, self).__init__(spectrogram)
+        self.device = device
+        # Stored about the overall mean, which keeps
+        # more float32 digits for the z-scores
+        self.device_spectrogram = torch.from_numpy(
+                                    (spectrogram - self.offset).astype(np.float32)).to(device)
+
+    def normalized_windows(self, starts, length):
+        """
+            Float tensor [len(starts), length, freq] on the device
+            with the z-scored windows beginning at starts
+        """
+        means, stds = self.window_stats(starts, length)
+        means = torch.from_numpy((means - self.offset).astype(np.float32)).to(self.device).view(-1, 1, 1)
+        stds = torch.from_numpy(stds.astype(np.float32)).to(self.device).view(-1, 1, 1)
+
+        indices = torch.as_tensor(np.asarray(starts)[:, np.newaxis] + np.arange(length),
+                                    device=self.device)
+        windows = self.device_spectrogram[indices]
+        windows -= means
+        windows /= stds
+        return windows
+
+class ModelEnsemble(object):
+    """
+        Runs several models, e.g. the models trained with different
+        seeds, on the same batches of windows, so that the windows are
+        prepared once for all of them.
+
+        When all models are nn.Modules of the same architecture, their
+        parameters and buffers are stacked, and the models run as one
+        vectorized call (torch.func.vmap). Otherwise, e.g. for TorchScript
+        variants, or for layers vmap has no batching rule for (the LSTMs
+        and GRUs of the recurrent models), the models run one after another.
+    """
+
+    # Layers that vmap cannot batch over stacked weights
+    UNBATCHABLE_LAYERS = (nn.RNNBase,)
+
+    def __init__(self, models):
+        self.models = models
+        self.vectorized = self.same_architecture(models) and self.vmap_supported(models[0])
+        if self.vectorized:
+            self.params, self.buffers = torch.func.stack_module_state(models)
+            # Stateless copy; the stacked tensors are passed in each call
+            self.base_model = copy.deepcopy(models[0]).to('meta')
+
+    def __len__(self):
+        return len(self.models)
+
+    @staticmethod
+    def same_architecture(models):
+        if len(models) < 2:
+            return False
+        first = models[0]
+        if isinstance(first, torch.jit.ScriptModule) or not isinstance(first, nn.Module):
+            return False
+        shapes = [(name, tensor.shape) for name, tensor in first.state_dict().items()]
+        return all(type(model) == type(first) and 
+                    [(name, tensor.shape) for name, tensor in model.state_dict().items()] == shapes
+                    for model in models[1:])
+
+    @classmethod
+    def vmap_supported(cls, model):
+        return not any(isinstance(module, cls.UNBATCHABLE_LAYERS) for module in model.modules())
+
+    def __call__(self, inputs):
+        """
+            Outputs of all models for the inputs, stacked
+            along a new first dimension
+        """
+        if self.vectorized:
+            try:
+                return torch.func.vmap(self.call_model, in_dims=(0, 0, None))(self.params, self.buffers, inputs)
+            except RuntimeError as e:
+                print ("Running the ensemble's models one by one:", e)
+                self.vectorized = False
+                del self.params, self.buffers
+        return torch.stack([model(inputs) for model in self.models])
+
+    def call_model(self, params, buffers, inputs):
+        return torch.func.functional_call(self.base_model, (params, buffers), (inputs,))
+
+
 def calc_accuracy(binary_preds, labels):
     accuracy = (binary_preds == labels).sum() / labels.shape[0]
     return accuracy
@@ -0,0 +1,223 @@
+"""
+    Index of the window files of a chopped dataset folder, such as
+
+        nn01a_20180126_features_12.npy
+        nn01a_20180126_labels_12.npy
+        nn01a_20180126_boundary-masks_12.npy
+        nn01a_20180126_neg-features_3.npy
+        nn01a_20180126_neg-labels_3.npy
+
+    A folder is listed once. Afterwards the label or boundary mask
+    that goes with a feature window is found with a dict lookup,
+    rather than a glob per window.
+
+    The listing can be saved as a manifest (windows_manifest.npz) in the
+    folder, written by the chopping scripts once all windows are saved.
+    Only the dataset output folders get one. The Full_24_hrs folders,
+    which are read as input data, are always listed.
+    The manifest is then read instead of listing the folder, as long as
+    no file was added to or removed from the folder after it was written.
+"""
+import os
+
+import numpy as np
+
+MANIFEST_FILE = 'windows_manifest.npz'
+MANIFEST_VERSION = 1
+
+# Kinds of files per window. Each is stored as a bit in a window's 'kinds'
+KINDS = ['features', 'labels', 'boundary-masks']
+
+class WindowIndex(object):
+    """
+        Window files of one or more folders. Folders are indexed when
+        first needed, so feature paths from other folders (e.g. added
+        adversarial windows) can be paired too.
+    """
+
+    def __init__(self, data_path=None, use_manifest=True):
+        self.use_manifest = use_manifest
+        self.folders = []
+        # (folder, name prefix) of the windows of all indexed folders
+        self.prefixes = []
+        # Per window of all indexed folders: its index into self.prefixes,
+        # its number, and the kinds of files it has
+        self.prefix_idx = np.zeros(0, dtype=np.int32)
+        self.nums = np.zeros(0, dtype=np.int64)
+        self.kinds = np.zeros(0, dtype=np.uint8)
+        # {feature path : window}, built when first needed
+        self.rows = None
+        # {tuple(paths) : windows} for the lists returned by features()
+        self.issued = {}
+        if data_path is not None:
+            self.index_folder(data_path)
+
+    def features(self, data_path, neg=False):
+        """
+            Paths of the positive (or negative) feature windows of a folder,
+            in the order they were listed
+        """
+        folder = self.index_folder(data_path)
+        in_folder = np.array([prefix_folder == folder and prefix.endswith('_neg-') == neg
+                                for prefix_folder, prefix in self.prefixes], dtype=bool)
+        rows = np.flatnonzero(in_folder[self.prefix_idx] & (self.kinds & 1).astype(bool))
+        paths = self._paths(rows, 'features')
+        # Pairing these paths needs no lookups
+        self.issued[tuple(paths)] = rows
+        return paths
+
+    def partners(self, feature_paths, kind):
+        """
+            The 'labels' or 'boundary-masks' path of each feature window,
+            as in:
+
+                nn01a_20180126_neg-features_3.npy --> nn01a_20180126_neg-labels_3.npy
+
+            Raises FileNotFoundError if a partner file does not exist.
+        """
+        # Keyed on the paths themselves, so that lists changed in place
+        # (e.g. by add_neg_features) are looked up
+        rows = self.issued.get(tuple(feature_paths))
+        if rows is None:
+            if self.rows is None:
+                self.rows = {}
+                self._add_rows(np.flatnonzero(self.kinds & 1))
+            rows = np.array([self.rows.get(feature_path, -1) for feature_path in feature_paths],
+                                dtype=np.int64)
+            for i in np.flatnonzero(rows < 0):
+                rows[i] = self._index_feature(feature_paths[i])
+
+        missing = np.flatnonzero((self.kinds[rows] & (1 << KINDS.index(kind))) == 0)
+        if len(missing) > 0:
+            raise FileNotFoundError("No {} file for window {}".format(kind, feature_paths[missing[0]]))
+        return self._paths(rows, kind)
+
+    def index_folder(self, data_path):
+        """
+            Add the windows of a folder, from its manifest or by listing
+            it, unless done already. Returns the folder's name as used
+            in the window paths.
+        """
+        folder = data_path.rstrip('/') or '/'
+        if folder in self.folders:
+            return folder
+
+        windows = read_manifest(folder) if self.use_manifest else None
+        if windows is None:
+            windows = list_windows(folder)
+        prefixes, prefix_idx, nums, kinds = windows
+
+        first_row = len(self.nums)
+        self.prefix_idx = np.concatenate((self.prefix_idx, prefix_idx + len(self.prefixes)))
+        self.prefixes += [(folder, prefix) for prefix in prefixes]
+        self.nums = np.concatenate((self.nums, nums))
+        self.kinds = np.concatenate((self.kinds, kinds))
+        self.folders.append(folder)
+
+        if self.rows is not None:
+            self._add_rows(first_row + np.flatnonzero(kinds & 1))
+        return folder
+
+    def _add_rows(self, rows):
+        # Map each feature path to its window
+        self.rows.update(zip(self._paths(rows, 'features'), rows.tolist()))
+
+    def _index_feature(self, feature_path):
+        folder, name = os.path.split(feature_path)
+        folder = self.index_folder(folder or '.')
+        if self.rows is None:
+            self.rows = {}
+            self._add_rows(np.flatnonzero(self.kinds & 1))
+        try:
+            return self.rows[folder + '/' + name]
+        except KeyError:
+            raise FileNotFoundError("Feature window {} does not exist".format(feature_path))
+
+    def _paths(self, rows, kind):
+        # Folder and prefix strings are shared among windows
+        prefix_paths = [folder + '/' + prefix + kind + '_' for folder, prefix in self.prefixes]
+        return [prefix_paths[p] + str(num) + '.npy'
+                    for p, num in zip(self.prefix_idx[rows].tolist(), self.nums[rows].tolist())]
+
+
+def parse_window_name(name):
+    """
+        Split a window file name into (prefix, kind, num), e.g.
+
+            nn01a_20180126_neg-labels_3.npy --> ('nn01a_20180126_neg-', 'labels', 3)
+
+        Returns None for other files.
+    """
+    if not name.endswith('.npy'):
+        return None
+    head, _, num = name[:-len('.npy')].rpartition('_')
+    if not num.isdigit():
+        return None
+    for kind in KINDS:
+        if head.endswith(kind):
+            prefix = head[:-len(kind)]
+            if prefix.endswith('_') or prefix.endswith('_neg-'):
+                return prefix, kind, int(num)
+    return None
+
+
+def list_windows(data_path):
+    """
+        List the window files of a folder in one pass. Returns the
+        distinct name prefixes (data id and 'neg-' tag), and for each
+        window its prefix index, window number, and a bit mask of the
+        kinds of files it has.
+    """
+    prefixes = {}
+    windows = {}
+    with os.scandir(data_path) as entries:
+        for entry in entries:
+            parsed = parse_window_name(entry.name)
+            if parsed is None:
+                continue
+            prefix, kind, num = parsed
+            prefix_id = prefixes.setdefault(prefix, len(prefixes))
+            key = (prefix_id, num)
+            windows[key] = windows.get(key, 0) | (1 << KINDS.index(kind))
+
+    keys = np.array(list(windows.keys()), dtype=np.int64).reshape(-1, 2)
+    return (list(prefixes),
+            keys[:, 0].astype(np.int32),
+            keys[:, 1],
+            np.array(list(windows.values()), dtype=np.uint8))
+
+
+def write_manifest(data_path):
+    """
+        List the windows of a folder and save them as its manifest.
+        Call once all windows of the folder have been written.
+    """
+    prefixes, prefix_idx, nums, kinds = list_windows(data_path)
+    manifest_path = os.path.join(data_path, MANIFEST_FILE)
+    tmp_path = manifest_path + '.tmp.npz'
+    np.savez(tmp_path, version=MANIFEST_VERSION, prefixes=np.array(prefixes, dtype=str),
+                prefix_idx=prefix_idx, nums=nums, kinds=kinds)
+    os.replace(tmp_path, manifest_path)
+    # Renaming updated the folder's mtime; make the manifest at least
+    # as recent, so that it counts as up to date
+    os.utime(manifest_path)
+    print("Wrote manifest of {} windows to {}".format(len(nums), manifest_path))
+    return manifest_path
+
+
+def read_manifest(data_path):
+    """
+        Return the windows saved in the manifest of a folder, or None if
+        there is no manifest, or if the folder changed since it was written
+    """
+    manifest_path = os.path.join(data_path, MANIFEST_FILE)
+    try:
+        if os.stat(manifest_path).st_mtime_ns < os.stat(data_path).st_mtime_ns:
+            return None
+        with np.load(manifest_path) as manifest:
+            if int(manifest['version']) != MANIFEST_VERSION:
+                return None
+            return (manifest['prefixes'].tolist(), manifest['prefix_idx'],
+                    manifest['nums'], manifest['kinds'])
+    except (OSError, KeyError, ValueError):
+        return None